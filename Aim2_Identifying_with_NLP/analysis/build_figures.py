@@ -0,0 +1,494 @@
+"""Builds the paper figures outside of the notebooks.
+
+Every figure is registered with the function that draws it and the files it
+depends on. Figures whose inputs (data files, figure code and parameters) hash
+the same as the previous build are skipped, independent figures are rendered
+in parallel worker processes on the non-interactive Agg backend, and outputs
+are written as compressed TIFF/PNG.
+
+Usage:
+    python build_figures.py --cohort COHORT_DATA_FILE --out ../figures_out
+"""
+
+from __future__ import annotations
+
+import os
+
+# matplotlib, cv2 and sklearn are imported by the figures that need them, a
+# build with nothing to redraw never imports them
+os.environ["MPLBACKEND"] = "Agg"
+
+import argparse
+import hashlib
+import json
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, List, Tuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from scorers import conf_interval
+from cohort_format import load_cohort, proba_pairs
+from create_treeplots import tree_plot
+from figure_plotting_code import (
+    fig_pr_auc,
+    fig_roc_auc,
+    fig_aequitas_group_metrics,
+    fig_aequitas_fairness,
+    fig_aequitas_disparity,
+)
+
+if TYPE_CHECKING:
+    import matplotlib.pyplot as plt
+
+ANALYSIS_DIR = Path(__file__).resolve().parent
+# Figure code, any change here triggers a rebuild
+CODE_FILES = (
+    ANALYSIS_DIR / "build_figures.py",
+    ANALYSIS_DIR / "figure_plotting_code.py",
+    ANALYSIS_DIR / "create_treeplots.py",
+    ANALYSIS_DIR / "scorers.py",
+    ANALYSIS_DIR / "cohort_format.py",
+    ANALYSIS_DIR / "segments.py",
+)
+MANIFEST_NAME = ".figure_manifest.json"
+SEED = 2556
+
+MODEL_IDS = ("Mayo ATTR-CM Score", "EchoNet-LVH", "EchoGo Amyloidosis")
+# model_id -> (score column, score threshold)
+MODEL_SCORES = {
+    "Mayo ATTR-CM Score": ("mayo_score", 6),
+    "EchoNet-LVH": ("echonet_prediction", 0.8),
+    "EchoGo Amyloidosis": ("ultromics_prediction", 0.06),
+}
+# metric -> range of disparity considered fair
+DISPARITY_RANGES = {
+    "pprev": (0.8, np.inf),
+    "precision": (0.8, np.inf),
+    "fnr": (0, 1.2),
+}
+
+
+@dataclass
+class BuildConfig:
+    cohort_path: Path
+    out_dir: Path
+    formats: Tuple[str] = ("tiff", "png")
+    dpi: int = 300
+    jobs: int | None = None
+    force: bool = False
+
+
+@dataclass
+class FigureSpec:
+    name: str  # output file stem, relative to out_dir
+    render: Callable[[BuildConfig], "plt.Figure | np.ndarray"]
+    inputs: Callable[[BuildConfig], List[Path]] = lambda config: [config.cohort_path]
+    params: dict = field(default_factory=dict)
+    depends_on: Tuple[str] = ()
+    formats: Tuple[str] = ()  # always written, on top of config.formats
+    dpi: int | None = None  # overrides config.dpi
+    # LZW tiffs, False for figures other figures crop (create_treeplots.read_region)
+    compress: bool = True
+
+
+FIGURES: Dict[str, FigureSpec] = {}
+
+
+def register_figure(
+    name: str,
+    inputs: Callable[[BuildConfig], List[Path]] | None = None,
+    depends_on: Tuple[str] = (),
+    formats: Tuple[str] = (),
+    dpi: int | None = None,
+    compress: bool = True,
+    **params,
+) -> Callable:
+    """Decorator that adds a figure render function to FIGURES.
+
+    Args:
+        name (str): Output file stem relative to the build directory
+        inputs (Callable, optional): Returns the files the figure reads. Defaults to the cohort file.
+        depends_on (Tuple[str], optional): Figures that must be built first.
+        formats (Tuple[str], optional): Formats always written, e.g. a figure
+            read by another one. Defaults to config.formats only.
+        dpi (int, optional): Fixed resolution. Defaults to config.dpi.
+        compress (bool, optional): LZW compress tiffs, uncompressed tiffs can
+            be memory mapped by tifffile. Defaults to True.
+        **params: Passed to the render function and included in the input hash.
+    """
+
+    def decorator(render: Callable) -> Callable:
+        spec = FigureSpec(
+            name=name,
+            render=render,
+            params=params,
+            depends_on=depends_on,
+            formats=formats,
+            dpi=dpi,
+            compress=compress,
+        )
+        if inputs is not None:
+            spec.inputs = inputs
+        FIGURES[name] = spec
+        return render
+
+    return decorator
+
+
+@lru_cache(maxsize=None)
+def load_matched_cohort(path: Path) -> pd.DataFrame:
+    """Validation cohort where every model made a (certain) prediction.
+
+    Cached so each worker process reads the cohort file once.
+    """
+    df = load_cohort(path)
+    mask_both = (
+        df["mayo_score"].notna()
+        & df["ultromics_prediction"].notna()
+        & df["echonet_prediction"].notna()
+        & (df["ultromics_classification"] != "Uncertain")
+    )
+    return df.loc[mask_both]
+
+
+def _model_predictions(df: pd.DataFrame) -> List[np.ndarray]:
+    # Same model order as fig_pr_auc / fig_roc_auc
+    return [
+        proba_pairs(df.pfizer_prediction)[:, 1],
+        (df.mayo_score / 10).values,
+        df.echonet_prediction.values,
+        df.ultromics_prediction.values,
+    ]
+
+
+@lru_cache(maxsize=None)
+def aequitas_frames(path: Path) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Crosstab and disparity dataframes used by every aequitas figure.
+
+    Args:
+        path (Path): cohort file
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame]: xtab, bias_df
+    """
+    from aequitas.group import Group
+    from aequitas.bias import Bias
+
+    cohort = load_matched_cohort(path)
+    frames = []
+    for model_id in MODEL_IDS:
+        score_col, _ = MODEL_SCORES[model_id]
+        frame = cohort.rename({score_col: "score", "true_label": "label_value"}, axis=1)
+        frame["model_id"] = model_id
+        frames.append(frame)
+    aequitas_cohort = pd.concat(frames)
+    aequitas_cohort = aequitas_cohort.loc[
+        aequitas_cohort.Sex.notna() & aequitas_cohort.Race.notna()
+    ]
+
+    xtab_raw, _ = Group().get_multimodel_crosstabs(
+        aequitas_cohort,
+        attr_cols=["Sex", "Race"],
+        score_thresholds={
+            "score_val": [MODEL_SCORES[model_id][1] for model_id in MODEL_IDS]
+        },
+    )
+    # Dropping unnecessary (model_id, score_threshold) pairs
+    keep = np.zeros(len(xtab_raw), dtype=bool)
+    for model_id in MODEL_IDS:
+        keep |= (xtab_raw.model_id == model_id).values & (
+            xtab_raw.score_threshold == f"{MODEL_SCORES[model_id][1]}_val"
+        ).values
+    xtab = xtab_raw.loc[keep]
+
+    bias_df = Bias().get_disparity_predefined_groups(
+        xtab,
+        original_df=aequitas_cohort.loc[
+            :, ["score", "label_value", "Sex", "Race", "model_id"]
+        ],
+        ref_groups_dict={"Sex": "male", "Race": "White"},
+        alpha=0.05,
+        check_significance=True,
+        mask_significance=True,
+    )
+    return xtab, bias_df
+
+
+@register_figure("pr_curves_whole_CI")
+def _pr_curves(config: BuildConfig) -> plt.Figure:
+    from sklearn.metrics import average_precision_score
+
+    df = load_matched_cohort(config.cohort_path)
+    y_true = df.true_label.notna().values
+    conf_int = [
+        conf_interval([average_precision_score], y_true, y_pred)[0]
+        for y_pred in _model_predictions(df)
+    ]
+    return fig_pr_auc(df, conf_int=conf_int)
+
+
+@register_figure("roc_curves_whole_CI")
+def _roc_curves(config: BuildConfig) -> plt.Figure:
+    from sklearn.metrics import roc_auc_score
+
+    df = load_matched_cohort(config.cohort_path)
+    y_true = df.true_label.notna().values
+    conf_int = [
+        conf_interval([roc_auc_score], y_true, y_pred)[0]
+        for y_pred in _model_predictions(df)
+    ]
+    return fig_roc_auc(df, conf_int=conf_int)
+
+
+def _register_aequitas_figures() -> None:
+    for model_id in MODEL_IDS:
+        register_figure(
+            f"aequitas/{model_id}_absolute_metrics_full", model_id=model_id
+        )(
+            lambda config, model_id: fig_aequitas_group_metrics(
+                aequitas_frames(config.cohort_path)[0], model_id
+            )
+        )
+
+        def _fairness(config: BuildConfig, model_id: str) -> plt.Figure:
+            from aequitas.fairness import Fairness
+
+            _, bias_df = aequitas_frames(config.cohort_path)
+            return fig_aequitas_fairness(
+                Fairness().get_group_value_fairness(bias_df), model_id
+            )
+
+        register_figure(f"aequitas/{model_id}_fairness", model_id=model_id)(_fairness)
+
+        for metric, fair_range in DISPARITY_RANGES.items():
+            # the disparity treemap crops these tiffs at 300 dpi pixel offsets,
+            # uncompressed so it reads only the rows of the crop
+            register_figure(
+                f"aequitas/{model_id}_{metric}_disparity",
+                formats=("tiff",),
+                dpi=300,
+                compress=False,
+                model_id=model_id,
+                metric=metric,
+                fair_range=fair_range,
+            )(
+                lambda config, model_id, metric, fair_range: fig_aequitas_disparity(
+                    aequitas_frames(config.cohort_path)[1],
+                    model_id,
+                    metric,
+                    fair_range,
+                )
+            )
+
+
+_register_aequitas_figures()
+
+_DISPARITY_FIGURES = tuple(
+    f"aequitas/{model_id}_{metric}_disparity"
+    for model_id in MODEL_IDS
+    for metric in DISPARITY_RANGES
+)
+
+
+@register_figure(
+    "disparity_treemap",
+    inputs=lambda config: [
+        config.out_dir / f"{name}.tiff" for name in _DISPARITY_FIGURES
+    ],
+    depends_on=_DISPARITY_FIGURES,
+)
+def _disparity_treemap(config: BuildConfig) -> np.ndarray:
+    return tree_plot(
+        model_list=MODEL_IDS,
+        src=config.out_dir / "aequitas",
+        dst=None,
+    )
+
+
+def _hash_file(path: Path, h: "hashlib._Hash") -> None:
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+
+
+def input_hash(spec: FigureSpec, config: BuildConfig) -> str:
+    """Hash of everything a figure depends on.
+
+    Args:
+        spec (FigureSpec): Registered figure
+        config (BuildConfig): Build settings
+
+    Returns:
+        str: hex digest, or "" if an input is missing
+    """
+    h = hashlib.sha256()
+    h.update(spec.name.encode())
+    h.update(repr(sorted(spec.params.items())).encode())
+    h.update(repr((_formats(spec, config), _dpi(spec, config), spec.compress)).encode())
+    for path in list(CODE_FILES) + list(spec.inputs(config)):
+        if not Path(path).exists():
+            return ""
+        _hash_file(path, h)
+    return h.hexdigest()
+
+
+def _formats(spec: FigureSpec, config: BuildConfig) -> Tuple[str]:
+    return tuple(dict.fromkeys(config.formats + tuple(spec.formats)))
+
+
+def _dpi(spec: FigureSpec, config: BuildConfig) -> int:
+    return config.dpi if spec.dpi is None else spec.dpi
+
+
+def _save(
+    result: "plt.Figure | np.ndarray",
+    stem: Path,
+    formats: Tuple[str],
+    dpi: int,
+    compress: bool = True,
+) -> None:
+    stem.parent.mkdir(parents=True, exist_ok=True)
+    for fmt in formats:
+        out = stem.parent / f"{stem.name}.{fmt}"
+        if isinstance(result, np.ndarray):
+            import cv2
+
+            params = []
+            if fmt == "tiff":
+                # compression 5 = LZW, 1 = none
+                params = [
+                    cv2.IMWRITE_TIFF_XDPI,
+                    dpi,
+                    cv2.IMWRITE_TIFF_YDPI,
+                    dpi,
+                    cv2.IMWRITE_TIFF_COMPRESSION,
+                    5 if compress else 1,
+                ]
+            cv2.imwrite(str(out), result, params)
+        else:
+            pil_kwargs = {}
+            if fmt == "tiff" and compress:
+                pil_kwargs = {"compression": "tiff_lzw"}
+            result.savefig(out, dpi=dpi, format=fmt, pil_kwargs=pil_kwargs)
+    if not isinstance(result, np.ndarray):
+        import matplotlib.pyplot as plt
+
+        plt.close(result)
+
+
+def _render(name: str, config: BuildConfig) -> str:
+    # Runs in a worker process
+    np.random.seed(SEED)
+    spec = FIGURES[name]
+    result = spec.render(config, **spec.params)
+    _save(
+        result,
+        config.out_dir / name,
+        _formats(spec, config),
+        _dpi(spec, config),
+        spec.compress,
+    )
+    return name
+
+
+def _build_order(names: List[str]) -> List[List[str]]:
+    # Group figures into waves, each wave only depends on earlier waves
+    remaining, done, waves = set(names), set(), []
+    while remaining:
+        wave = sorted(
+            name
+            for name in remaining
+            if all(
+                dep in done or dep not in remaining for dep in FIGURES[name].depends_on
+            )
+        )
+        if not wave:
+            raise Exception(f"Circular figure dependencies: {sorted(remaining)}")
+        waves.append(wave)
+        done.update(wave)
+        remaining.difference_update(wave)
+    return waves
+
+
+def build(config: BuildConfig, names: List[str] | None = None) -> List[str]:
+    """Renders out of date figures.
+
+    Args:
+        config (BuildConfig): Build settings
+        names (List[str], optional): Subset of FIGURES to build. Defaults to all.
+
+    Returns:
+        List[str]: Figures that were rendered
+    """
+    config.out_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = config.out_dir / MANIFEST_NAME
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+
+    names = list(FIGURES) if names is None else list(names)
+    # Always pull in dependencies of the requested figures
+    for name in names:
+        names.extend(dep for dep in FIGURES[name].depends_on if dep not in names)
+
+    rendered, failed = [], set()
+    with ProcessPoolExecutor(max_workers=config.jobs) as pool:
+        for wave in _build_order(names):
+            todo = {}
+            for name in wave:
+                if failed.intersection(FIGURES[name].depends_on):
+                    print(f"skipped {name}, a dependency failed")
+                    failed.add(name)
+                    continue
+                digest = input_hash(FIGURES[name], config)
+                outputs_exist = all(
+                    (config.out_dir / f"{name}.{fmt}").exists()
+                    for fmt in _formats(FIGURES[name], config)
+                )
+                if (
+                    config.force
+                    or not digest
+                    or manifest.get(name) != digest
+                    or not outputs_exist
+                ):
+                    todo[name] = digest
+            futures = {pool.submit(_render, name, config): name for name in todo}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"failed {name}: {e!r}")
+                    failed.add(name)
+                    continue
+                print(f"built {name}")
+                # Hash inputs again for figures whose inputs did not exist before
+                manifest[name] = todo[name] or input_hash(FIGURES[name], config)
+                rendered.append(name)
+            manifest_path.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    return rendered
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cohort", type=Path, required=True, help="COHORT_DATA_FILE")
+    parser.add_argument("--out", type=Path, default=Path("../figures_out"))
+    parser.add_argument("--formats", nargs="+", default=["tiff", "png"])
+    parser.add_argument("--dpi", type=int, default=300)
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("--force", action="store_true", help="Rebuild everything")
+    parser.add_argument("figures", nargs="*", help=f"Subset of: {', '.join(FIGURES)}")
+    args = parser.parse_args()
+
+    build(
+        BuildConfig(
+            cohort_path=args.cohort,
+            out_dir=args.out,
+            formats=tuple(args.formats),
+            dpi=args.dpi,
+            jobs=args.jobs,
+            force=args.force,
+        ),
+        names=args.figures or None,
+    )
@@ -0,0 +1,222 @@
+"""Typed, columnar cohort data file shared by every analysis.
+
+The analysis cohort is kept as one parquet file with the explicit schema
+COHORT_SCHEMA:
+    nullable float64 for the measurements and model scores
+    nullable bool for htn and encounter_gt_50
+    dictionary encoded (categorical) Sex, Race and ultromics_classification
+    list columns for the EchoGo per-clip outputs (see segments.py)
+    a fixed width float32 [1 - p, p] pair for pfizer_prediction(_proba)
+Sex is stored as "male"/"female" whatever the source encoding was (M/F, or
+0.0 = male / 1.0 = female).
+
+write_cohort converts a cohort DataFrame (e.g. the legacy wide CSV) once,
+load_cohort checks the schema and loads the file without parsing anything.
+
+Usage:
+    python cohort_format.py COHORT_DATA_FILE.csv COHORT_DATA_FILE.parquet
+    python cohort_format.py --check COHORT_DATA_FILE.parquet
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pathlib import Path
+
+from segments import ULTROMICS_LIST_COLUMNS, to_list_array
+
+FORMAT_VERSION = "1"
+CATEGORY = pa.dictionary(pa.int8(), pa.string())
+PROBA_PAIR = pa.list_(pa.float32(), 2)
+
+COHORT_SCHEMA = pa.schema(
+    [
+        ("id", pa.int64()),
+        ("true_label", pa.string()),
+        ("Age", pa.float64()),
+        ("Sex", CATEGORY),
+        ("Race", CATEGORY),
+        ("SDI", pa.float64()),
+        ("EF", pa.float64()),
+        ("PWT", pa.float64()),
+        ("IVS_d_2D_calc", pa.float64()),
+        ("RWT", pa.float64()),
+        ("htn", pa.bool_()),
+        ("LVIDD", pa.float64()),
+        ("mayo_score", pa.float64()),
+        ("ultromics_classification", CATEGORY),
+        *ULTROMICS_LIST_COLUMNS.items(),
+        ("ultromics_prediction", pa.float64()),
+        ("echonet_prediction", pa.float64()),
+        ("pfizer_prediction", PROBA_PAIR),
+        ("pfizer_prediction_proba", PROBA_PAIR),
+        ("encounter_gt_50", pa.bool_()),
+    ],
+    metadata={"cohort_format": FORMAT_VERSION},
+)
+
+SEX = {"m": "male", "male": "male", "0.0": "male", "0": "male"}
+SEX.update({"f": "female", "female": "female", "1.0": "female", "1": "female"})
+
+
+def _pair(x):
+    # [1 - p, p] from a pair, its printed form, or a bare probability p
+    if isinstance(x, str):
+        x = [float(v) for v in x.strip().strip("[]").replace(",", " ").split()]
+    if x is None or (np.ndim(x) == 0 and pd.isna(x)):
+        return None
+    if np.ndim(x) == 0:
+        return [1 - float(x), float(x)]
+    return list(x)
+
+
+def _to_arrow(s: pd.Series, type: pa.DataType) -> pa.Array:
+    if pa.types.is_fixed_size_list(type):
+        return pa.array([_pair(x) for x in s], type=type)
+    if pa.types.is_list(type):
+        return to_list_array(s, type)
+    if pa.types.is_dictionary(type):
+        values = s.astype("string").str.strip()
+        if s.name == "Sex":
+            values = values.str.lower().map(SEX)
+        return pa.array(values, type=pa.string()).dictionary_encode().cast(type)
+    if pa.types.is_boolean(type):
+        if not pd.api.types.is_bool_dtype(s):
+            s = pd.to_numeric(s, errors="coerce").astype("Float64") != 0
+        return pa.array(s.astype("boolean"), type=type)
+    if pa.types.is_string(type):
+        return pa.array(s.astype("string"), type=type)
+    return pa.array(pd.to_numeric(s, errors="coerce"), type=type, from_pandas=True)
+
+
+def to_cohort_table(df: pd.DataFrame) -> pa.Table:
+    """Converts a cohort DataFrame to COHORT_SCHEMA.
+
+    Args:
+        df (pd.DataFrame): cohort with (at least) the COHORT_SCHEMA columns.
+            Extra columns are kept after them, unnamed (empty csv) columns dropped.
+
+    Returns:
+        pa.Table: typed cohort
+    """
+    missing = [name for name in COHORT_SCHEMA.names if name not in df]
+    if missing:
+        raise ValueError(f"Cohort is missing columns {missing}")
+    arrays = [_to_arrow(df[field.name], field.type) for field in COHORT_SCHEMA]
+    table = pa.Table.from_arrays(arrays, schema=COHORT_SCHEMA)
+    for column in df.columns.difference(COHORT_SCHEMA.names, sort=False):
+        if not str(column).startswith("Unnamed:"):
+            table = table.append_column(
+                str(column), pa.array(df[column], from_pandas=True)
+            )
+    return table
+
+
+def write_cohort(df: pd.DataFrame, path: Path) -> None:
+    """Writes the cohort in the typed format.
+
+    Args:
+        df (pd.DataFrame): cohort, see to_cohort_table
+        path (Path): output parquet
+    """
+    pq.write_table(to_cohort_table(df), path)
+
+
+def check_schema(schema: pa.Schema) -> None:
+    """Raises ValueError listing every column that does not match COHORT_SCHEMA."""
+    problems = []
+    metadata = schema.metadata or {}
+    version = metadata.get(b"cohort_format", b"").decode()
+    if version != FORMAT_VERSION:
+        problems.append(f"format version is {version or 'missing'}")
+    for field in COHORT_SCHEMA:
+        if field.name not in schema.names:
+            problems.append(f"{field.name} missing")
+        elif not schema.field(field.name).type.equals(field.type):
+            problems.append(
+                f"{field.name} is {schema.field(field.name).type}, expected {field.type}"
+            )
+    if problems:
+        raise ValueError(f"Not a cohort file ({FORMAT_VERSION}): {'; '.join(problems)}")
+
+
+def _types_mapper(arrow_lists: bool):
+    def mapper(type: pa.DataType):
+        if pa.types.is_boolean(type):
+            return pd.BooleanDtype()
+        if arrow_lists and (
+            pa.types.is_list(type) or pa.types.is_fixed_size_list(type)
+        ):
+            return pd.ArrowDtype(type)
+        return None
+
+    return mapper
+
+
+def load_cohort(
+    path: Path, columns: list[str] | None = None, arrow_lists: bool = True
+) -> pd.DataFrame:
+    """Loads the cohort after checking its schema.
+
+    Args:
+        path (Path): typed cohort parquet. A legacy csv is converted in memory.
+        columns (list[str], optional): subset to read. Defaults to all.
+        arrow_lists (bool, optional): keep list and pair columns in Arrow memory
+            (pd.ArrowDtype, see segments.flatten and proba_pairs). False gives
+            one numpy array per row, as older notebook code expects.
+            Defaults to True.
+
+    Returns:
+        pd.DataFrame: typed cohort, categoricals as pd.Categorical, nullable
+            bools as "boolean" and float columns with NaN
+    """
+    path = Path(path)
+    if path.suffix == ".csv":
+        table = to_cohort_table(pd.read_csv(path))
+    else:
+        file = pq.ParquetFile(path)
+        check_schema(file.schema_arrow)
+        table = file.read(columns=columns)
+    if columns is not None:
+        table = table.select(columns)
+    return table.to_pandas(types_mapper=_types_mapper(arrow_lists))
+
+
+def proba_pairs(s: pd.Series) -> np.ndarray:
+    """Probability pairs of a pair column as an (n, 2) array.
+
+    Args:
+        s (pd.Series): pfizer_prediction or pfizer_prediction_proba, in Arrow
+            memory or as one array per row
+
+    Returns:
+        np.ndarray: [1 - p, p] per row, NaN for missing rows
+    """
+    if not isinstance(s.dtype, pd.ArrowDtype):
+        return np.vstack(
+            [np.full(2, np.nan) if _pair(x) is None else _pair(x) for x in s]
+        )
+    pairs = pa.array(s)
+    values = pairs.values.slice(pairs.offset * 2, len(pairs) * 2)
+    values = values.to_numpy(zero_copy_only=False).reshape(-1, 2).astype(float)
+    values[~pairs.is_valid().to_numpy(zero_copy_only=False)] = np.nan
+    return values
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "source", type=Path, help="Cohort csv/parquet to convert or check"
+    )
+    parser.add_argument("out", type=Path, nargs="?", default=None)
+    parser.add_argument("--check", action="store_true", help="Only check the schema")
+    args = parser.parse_args()
+
+    if args.check:
+        check_schema(pq.read_schema(args.source))
+        print(f"{args.source} is a cohort file ({FORMAT_VERSION})")
+    else:
+        read = pd.read_parquet if args.source.suffix == ".parquet" else pd.read_csv
+        write_cohort(read(args.source), args.out or args.source.with_suffix(".parquet"))
@@ -1,14 +1,32 @@
-import cv2
 import numpy as np
-import matplotlib.pyplot as plt
-from typing import Tuple
+from string import ascii_uppercase
+from typing import List, Sequence, Tuple
 from pathlib import Path
 from dataclasses import dataclass
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+
+@lru_cache(maxsize=None)
+def _tifffile():
+    # cv2 and tifffile are imported on first use, not when the module is imported
+    try:
+        import tifffile
+    except ImportError:
+        import warnings
+
+        warnings.warn(
+            "tifffile failed to import!\nTIFF crops will be read with a full cv2 decode."
+        )
+        tifffile = None
+    return tifffile
 
 
 @dataclass
 class TreePlotConfig:
     CROP_SIZE: int = 1564  # square crop dimension
+    CROP_TOP: int = 204  # top of the treemap within each aequitas figure
+    CROP_LEFT: int = 3646  # left side of the treemap within each aequitas figure
     LABEL_SIZE: int = 250  # magenta square behind letter label
     LABEL_COLOR: Tuple[int] = (122, 31, 108)
     LABEL_FONTCOLOR: Tuple[int] = (255.0, 255.0, 255.0)
@@ -21,34 +39,141 @@ class TreePlotConfig:
     _HSPACE: int = 100  # space between adjacent crops
     _VSPACE_AFTER_CROP: int = 60  # v space between bottom of crop and start of next row
 
-    # Top of each "row", 1 row per model
-    row1: int = 0
-    row2: int = (
-        row1 + LABEL_SIZE + _LABEL_TO_CROP_DIST_V + CROP_SIZE + _VSPACE_AFTER_CROP
-    )
-    row3: int = (
-        row2 + LABEL_SIZE + _LABEL_TO_CROP_DIST_V + CROP_SIZE + _VSPACE_AFTER_CROP
-    )
+    TITLE_NUDGE_UP: int = 50  # nudge so that titles sit just above crop
+    TITLE_FONTCOLOR: Tuple[int] = (0.0, 0.0, 0.0)
 
-    # Left side of each column, 1 column per disparity.
-    # Only used by crop artists, not label artists
-    col1: int = 0
-    col2: int = col1 + CROP_SIZE + _HSPACE
-    col3: int = col2 + CROP_SIZE + _HSPACE
 
-    row_offset_list: Tuple[int] = (
-        row1 + LABEL_SIZE + _LABEL_TO_CROP_DIST_V,
-        row2 + LABEL_SIZE + _LABEL_TO_CROP_DIST_V,
-        row3 + LABEL_SIZE + _LABEL_TO_CROP_DIST_V,
+def row_top(config, row: int) -> int:
+    # Top of the label square for a given row
+    return row * (
+        config.LABEL_SIZE
+        + config._LABEL_TO_CROP_DIST_V
+        + config.CROP_SIZE
+        + config._VSPACE_AFTER_CROP
     )
-    col_offset_list: Tuple[int] = (
-        col1 + LABEL_SIZE + _LABEL_TO_CROP_DIST_H,
-        col2 + LABEL_SIZE + _LABEL_TO_CROP_DIST_H,
-        col3 + LABEL_SIZE + _LABEL_TO_CROP_DIST_H,
+
+
+def row_offset(config, row: int) -> int:
+    # Top of the crops for a given row
+    return row_top(config, row) + config.LABEL_SIZE + config._LABEL_TO_CROP_DIST_V
+
+
+def col_offset(config, col: int) -> int:
+    # Left side of the crops for a given column
+    return (
+        col * (config.CROP_SIZE + config._HSPACE)
+        + config.LABEL_SIZE
+        + config._LABEL_TO_CROP_DIST_H
     )
 
-    TITLE_NUDGE_UP: int = 50  # nudge so that titles sit just above crop
-    TITLE_FONTCOLOR: Tuple[int] = (0.0, 0.0, 0.0)
+
+def canvas_shape(config, n_rows: int, n_cols: int) -> Tuple[int, int, int]:
+    """Canvas size for an n_rows x n_cols grid of crops.
+
+    The label column on the left is mirrored by an equal margin on the right,
+        which reproduces the original 5802 x 5512 canvas for a 3 x 3 grid.
+    """
+    height = row_top(config, n_rows)
+    margin = config.LABEL_SIZE + config._LABEL_TO_CROP_DIST_H
+    width = 2 * margin + n_cols * config.CROP_SIZE + (n_cols - 1) * config._HSPACE
+    return height, width, 3
+
+
+def _to_bgr(arr: np.ndarray) -> np.ndarray:
+    # tifffile returns RGB(A)/grayscale, cv2 works in BGR
+    if arr.ndim == 2:
+        arr = np.repeat(arr[..., None], 3, axis=2)
+    arr = arr[..., :3][..., ::-1]
+    if arr.dtype != np.uint8:
+        arr = (arr / np.iinfo(arr.dtype).max * 255).astype(np.uint8)
+    return arr
+
+
+def read_region(path: Path, top: int, left: int, size: int) -> np.ndarray:
+    """Reads a square region of an image without decoding the whole file
+        when possible.
+
+    Uncompressed TIFFs (the matplotlib default) are memory mapped so only
+        the rows of the crop are read from disk. Anything else falls back
+        to a full cv2 decode.
+
+    Args:
+        path (Path): Image file
+        top (int): Top pixel of the region
+        left (int): Left pixel of the region
+        size (int): Side length of the square region
+
+    Returns:
+        np.ndarray: BGR uint8 array of shape (size, size, 3)
+    """
+    path = Path(path)
+    tifffile = _tifffile() if path.suffix.lower() in [".tif", ".tiff"] else None
+    if tifffile is not None:
+        try:
+            page = tifffile.memmap(str(path), mode="r")
+        except ValueError:
+            # compressed or non-contiguous TIFF, decode the first page
+            try:
+                page = tifffile.imread(str(path), key=0)
+            except Exception:
+                # codec not available to tifffile, let cv2 decode it
+                page = None
+        if page is not None:
+            return _to_bgr(np.array(page[top : top + size, left : left + size]))
+
+    import cv2
+
+    raw_img = cv2.imread(str(path))
+    if raw_img is None:
+        raise FileNotFoundError(f"Could not read image: {path}")
+    return raw_img[top : top + size, left : left + size]
+
+
+def load_crops(
+    paths: Sequence[Path],
+    top: int,
+    left: int,
+    size: int,
+    max_workers: int | None = None,
+) -> List[np.ndarray]:
+    """Reads the same region from every image on a thread pool.
+
+    Args:
+        paths (Sequence[Path]): Image files
+        top (int): Top pixel of the region
+        left (int): Left pixel of the region
+        size (int): Side length of the square region
+        max_workers (int, optional): Threads to use. Defaults to None (executor default).
+
+    Returns:
+        List[np.ndarray]: crops in the order of paths
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(lambda p: read_region(p, top, left, size), paths))
+
+
+def compose_grid(
+    crops: Sequence[Sequence[np.ndarray]], config=TreePlotConfig
+) -> np.ndarray:
+    """Lays out an N x M grid of square crops on a white uint8 canvas.
+
+    Args:
+        crops (Sequence[Sequence[np.ndarray]]): crops[row][col] of shape
+            (CROP_SIZE, CROP_SIZE, 3)
+        config (TreePlotConfig, optional): Layout config. Defaults to TreePlotConfig.
+
+    Returns:
+        np.ndarray: Composed BGR image
+    """
+    n_rows, n_cols = len(crops), max(len(row) for row in crops)
+    image = np.full(canvas_shape(config, n_rows, n_cols), 255, np.uint8)
+    for row, row_crops in enumerate(crops):
+        top = row_offset(config, row)
+        for col, crop in enumerate(row_crops):
+            left = col_offset(config, col)
+            h, w = crop.shape[:2]
+            image[top : top + h, left : left + w] = crop
+    return image
 
 
 def tree_plot(
@@ -68,28 +193,38 @@ def tree_plot(
         "Equal Opportunity",
     ),
     src: Path = Path("./aequitas/"),
-    dst: Path = Path("./aequitas/disparity_treemap.tiff"),
+    dst: Path | None = Path("./aequitas/disparity_treemap.tiff"),
     config=TreePlotConfig,
+    max_workers: int | None = None,
 ) -> np.ndarray:
-    image = np.ones((5802, 5512, 3), np.int8) * 255
-    for model, row_offset in zip(model_list, config.row_offset_list):
-        for metric, col_offset in zip(
-            aqp_names,
-            config.col_offset_list,
-        ):
-            raw_img = cv2.imread(str(src / f"{model}{metric}.tiff"))
-            crop = raw_img[204 : 204 + config.CROP_SIZE, 3646 : 3646 + config.CROP_SIZE]
-
-            image[
-                row_offset : row_offset + config.CROP_SIZE,
-                col_offset : col_offset + config.CROP_SIZE,
-            ] = crop
-
-    for top_px, bottom_px, letter in zip(
-        [config.row1, config.row2, config.row3],
-        [config.row2, config.row3, image.shape[0]],
-        ["A", "B", "C"],
-    ):
+    import cv2
+    import matplotlib.pyplot as plt
+
+    # 1 row per model, 1 column per disparity
+    n_rows, n_cols = len(model_list), len(aqp_names)
+    flat_crops = load_crops(
+        [
+            Path(src) / f"{model}{metric}.tiff"
+            for model in model_list
+            for metric in aqp_names
+        ],
+        top=config.CROP_TOP,
+        left=config.CROP_LEFT,
+        size=config.CROP_SIZE,
+        max_workers=max_workers,
+    )
+    image = compose_grid(
+        [flat_crops[row * n_cols : (row + 1) * n_cols] for row in range(n_rows)],
+        config=config,
+    )
+
+    row_tops = [row_top(config, row) for row in range(n_rows)] + [image.shape[0]]
+    for row in range(n_rows):
+        top_px, bottom_px, letter = (
+            row_tops[row],
+            row_tops[row + 1],
+            ascii_uppercase[row],
+        )
         # Place label background, then label, finally outline.
         cv2.rectangle(
             image,
@@ -121,13 +256,13 @@ def tree_plot(
         (width, height), baseline = cv2.getTextSize(
             title, cv2.FONT_HERSHEY_DUPLEX, 5, thickness=10
         )
-        for row in range(3):
+        for row in range(n_rows):
             cv2.putText(
                 image,
                 title,
                 (
-                    config.col_offset_list[col] + config.CROP_SIZE // 2 - width // 2,
-                    config.row_offset_list[row] - config.TITLE_NUDGE_UP,
+                    col_offset(config, col) + config.CROP_SIZE // 2 - width // 2,
+                    row_offset(config, row) - config.TITLE_NUDGE_UP,
                 ),
                 cv2.FONT_HERSHEY_DUPLEX,
                 5,
@@ -136,9 +271,11 @@ def tree_plot(
             )
 
     plt.axis("off")
-    _ = cv2.imwrite(
-        str(dst), image, [cv2.IMWRITE_TIFF_XDPI, 300, cv2.IMWRITE_TIFF_YDPI, 300]
-    )
+    # dst=None leaves saving to the caller (e.g. build_figures)
+    if dst is not None:
+        _ = cv2.imwrite(
+            str(dst), image, [cv2.IMWRITE_TIFF_XDPI, 300, cv2.IMWRITE_TIFF_YDPI, 300]
+        )
 
     return image
 
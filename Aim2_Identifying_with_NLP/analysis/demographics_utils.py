@@ -1,7 +1,6 @@
 from typing import List
 import pandas as pd
 from collections.abc import Callable
-from scipy import stats
 
 
 def _mean_sd_fmt(group: pd.Series) -> str:
@@ -75,6 +74,9 @@ def numerical(
     # We do not compute p-values for the supplemental tables of
     #   demographics for specific models successful models.
     if not missing_pred:
+        # scipy.stats takes most of the import time of this module
+        from scipy import stats
+
         pval = stats.ttest_ind(
             df.loc[df.ttr_ca == 0.0, col],
             df.loc[df.ttr_ca == 1.0, col],
@@ -141,6 +143,8 @@ def categorical_var(col: str, df: pd.DataFrame, missing_pred=None) -> pd.DataFra
             result.append(record)
     _temp = pd.DataFrame(result).set_index(col).T.sort_index()
     if not missing_pred:
+        from scipy import stats
+
         pval = stats.chisquare(
             f_obs=f_obs, f_exp=f_exp / f_exp.sum() * f_obs.sum()
         ).pvalue
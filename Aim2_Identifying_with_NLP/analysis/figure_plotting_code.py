@@ -1,16 +1,31 @@
-from sklearn.metrics import (
-    RocCurveDisplay,
-    PrecisionRecallDisplay,
-    roc_curve,
-    precision_recall_curve,
-)
-import matplotlib.pyplot as plt
+"""Figures of the paper, see build_figures.py.
+
+matplotlib, sklearn.metrics and aequitas are imported by the first figure,
+which also applies the figure style.
+"""
+
+from __future__ import annotations
+
 import numpy as np
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Tuple
+from typing import TYPE_CHECKING, List, Tuple
 import pandas as pd
 
-plt.style.use("seaborn-v0_8-darkgrid")
+from cohort_format import proba_pairs
+
+if TYPE_CHECKING:
+    import matplotlib.pyplot as plt
+
+STYLE = "seaborn-v0_8-darkgrid"
+
+
+@lru_cache(maxsize=None)
+def _pyplot():
+    import matplotlib.pyplot as plt
+
+    plt.style.use(STYLE)
+    return plt
 
 
 def fig_pr_auc(
@@ -26,6 +41,9 @@ def fig_pr_auc(
     Returns:
         plt.Figure: PR_AUC figure object
     """
+    from sklearn.metrics import PrecisionRecallDisplay, precision_recall_curve
+
+    plt = _pyplot()
     fig, ax = plt.subplots(1, 1, figsize=(8, 7), layout="constrained")
     name_map = {
         "Pfizer": "Huda et al.",
@@ -36,7 +54,7 @@ def fig_pr_auc(
 
     # Loop over models and predictions to generate PR_AUC curves
     for name, y_pred in [
-        ("Pfizer", np.vstack(df.pfizer_prediction.values)[:, 1]),
+        ("Pfizer", proba_pairs(df.pfizer_prediction)[:, 1]),
         ("Mayo Score", (df.mayo_score / 10).values),
         ("Echonet-LVH", (df.echonet_prediction).values),
         ("Ultromics", (df.ultromics_prediction).values),
@@ -94,6 +112,9 @@ def fig_roc_auc(
     Returns:
         plt.Figure: ROC_AUC figure object
     """
+    from sklearn.metrics import RocCurveDisplay, roc_curve
+
+    plt = _pyplot()
     fig, ax = plt.subplots(1, 1, figsize=(8, 7), layout="constrained")
     name_map = {
         "Pfizer": "Huda et al.",
@@ -104,7 +125,7 @@ def fig_roc_auc(
 
     # Loop over models and predictions to generate ROC_AUC curves
     for name, y_pred in [
-        ("Pfizer", np.vstack(df.pfizer_prediction.values)[:, 1]),
+        ("Pfizer", proba_pairs(df.pfizer_prediction)[:, 1]),
         ("Mayo Score", (df.mayo_score / 10).values),
         ("Echonet-LVH", (df.echonet_prediction).values),
         ("Ultromics", (df.ultromics_prediction).values),
@@ -144,3 +165,114 @@ def fig_roc_auc(
     if FIGDST:
         fig.savefig(FIGDST / "roc_curves_whole_CI.tiff", dpi=300)
     return fig
+
+
+def fig_aequitas_group_metrics(
+    xtab: pd.DataFrame,
+    model_id: str,
+    metrics: List[str] = (
+        "pprev",
+        "ppr",
+        "fdr",
+        "for",
+        "fpr",
+        "fnr",
+        "tpr",
+        "tnr",
+        "npv",
+        "precision",
+    ),
+    FIGDST: Path | None = None,
+) -> plt.Figure:
+    """Absolute group metrics for a single model (supplemental figures 1-3).
+
+    Args:
+        xtab (pd.DataFrame): aequitas crosstab from Group.get_multimodel_crosstabs
+        model_id (str): Model to plot
+        metrics (List[str], optional): Group metrics to display.
+        FIGDST (Path, optional): If set, saves to FIGDST/{model_id}_absolute_metrics_full.tiff. Defaults to None.
+
+    Returns:
+        plt.Figure: Group metric figure object
+    """
+    from aequitas.plotting import Plot
+
+    _pyplot()
+
+    fig = Plot().plot_group_metric_all(
+        xtab[xtab.model_id == model_id], metrics=list(metrics)
+    )
+    fig.tight_layout()
+    if FIGDST:
+        fig.savefig(FIGDST / f"{model_id}_absolute_metrics_full.tiff", dpi=300)
+    return fig
+
+
+def fig_aequitas_fairness(
+    fairness_df: pd.DataFrame, model_id: str, FIGDST: Path | None = None
+) -> plt.Figure:
+    """Group value fairness for all metrics of a single model.
+
+    Args:
+        fairness_df (pd.DataFrame): output of Fairness.get_group_value_fairness
+        model_id (str): Model to plot
+        FIGDST (Path, optional): If set, saves to FIGDST/{model_id}_fairness.tiff. Defaults to None.
+
+    Returns:
+        plt.Figure: Fairness figure object
+    """
+    from aequitas.plotting import Plot
+
+    _pyplot()
+
+    fig = Plot().plot_fairness_group_all(
+        fairness_df[fairness_df.model_id == model_id], metrics="all", ncols=5
+    )
+    fig.tight_layout()
+    if FIGDST:
+        fig.savefig(FIGDST / f"{model_id}_fairness.tiff", dpi=300)
+    return fig
+
+
+def fig_aequitas_disparity(
+    bias_df: pd.DataFrame,
+    model_id: str,
+    metric: str,
+    fair_range: Tuple[float, float],
+    FIGDST: Path | None = None,
+) -> plt.Figure:
+    """Disparity treemap for a single model and metric (figure 3 panels).
+
+    Args:
+        bias_df (pd.DataFrame): output of Bias.get_disparity_predefined_groups
+        model_id (str): Model to plot
+        metric (str): "pprev", "precision" or "fnr"
+        fair_range (Tuple[float, float]): Disparity values considered fair
+        FIGDST (Path, optional): If set, saves to FIGDST/{model_id}_{metric}_disparity.tiff. Defaults to None.
+
+    Returns:
+        plt.Figure: Disparity figure object
+    """
+    from aequitas.fairness import Fairness
+    from aequitas.plotting import Plot
+
+    _pyplot()
+
+    low, high = fair_range
+    fairness = Fairness(
+        fair_eval=lambda tau: lambda x: (
+            np.nan if np.isnan(x) else (True if low <= x <= high else False)
+        )
+    )
+    fairness_df = fairness.get_group_value_fairness(bias_df)
+    fig = Plot().plot_fairness_disparity_all(
+        fairness_df[fairness_df.model_id == model_id],
+        metrics=[metric],
+        show_figure=False,
+    )
+    for text in fig.axes[1].texts:
+        text.set_text(text.get_text().replace("**", "*"))
+        text.set_fontsize(22)
+    if FIGDST:
+        fig.savefig(FIGDST / f"{model_id}_{metric}_disparity.tiff", dpi=300)
+    return fig
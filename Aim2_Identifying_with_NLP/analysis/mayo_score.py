@@ -0,0 +1,198 @@
+"""Mayo ATTR-CM score computed from the cohort table.
+
+The cohort file comes with a precomputed mayo_score. This recomputes it, with
+every component, for a whole DataFrame at once from the Age, Sex, EF, PWT,
+RWT (or LVIDD) and htn columns, so new pulls and sensitivity analyses don't
+depend on the delivered column.
+
+Points (Davies et al., JAMA Cardiology 2022):
+    Age 60-69: 2, 70-79: 3, >= 80: 4
+    Male sex: 2
+    Hypertension diagnosis: -1
+    Ejection fraction < 60%: 1
+    Posterior wall thickness >= 12 mm: 1
+    Relative wall thickness > 0.57: 2
+The score runs from -1 to 10, >= 6 is high risk (MAYO_THRESHOLD).
+
+Usage:
+    python mayo_score.py --cohort COHORT_DATA_FILE
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+# Age bins, left closed: < 60, 60-69, 70-79, >= 80
+AGE_EDGES = (60, 70, 80)
+AGE_POINTS = (0, 2, 3, 4)
+MALE_POINTS = 2
+HTN_POINTS = -1
+EF_CUTOFF, EF_POINTS = 60, 1
+PWT_CUTOFF_MM, PWT_POINTS = 12, 1
+RWT_CUTOFF, RWT_POINTS = 0.57, 2
+
+MAYO_THRESHOLD = 6
+COMPONENTS = ("age", "sex", "htn", "ef", "pwt", "rwt")
+
+# PWT is recorded in cm in some extracts and in mm in others, no adult posterior
+# wall is thicker than 3 cm or thinner than 3 mm
+PWT_CM_MAX = 3
+
+MALE = {"m", "male", "0", "0.0"}
+FEMALE = {"f", "female", "1", "1.0"}
+TRUE = {"1", "1.0", "true", "yes", "y"}
+FALSE = {"0", "0.0", "false", "no", "n"}
+
+
+def _codes(s: pd.Series, positive: set, negative: set) -> np.ndarray:
+    # Maps a column to 1.0/0.0/NaN through its distinct values only
+    if pd.api.types.is_bool_dtype(s) and positive is TRUE:
+        return s.to_numpy(dtype=float, na_value=np.nan)
+    codes, uniques = pd.factorize(s, use_na_sentinel=True)
+    keys = pd.Index(uniques).astype(str).str.strip().str.lower()
+    lookup = np.where(
+        keys.isin(positive), 1.0, np.where(keys.isin(negative), 0.0, np.nan)
+    )
+    return np.where(codes >= 0, lookup[codes], np.nan)
+
+
+def _numeric(s: pd.Series) -> np.ndarray:
+    return pd.to_numeric(s, errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+
+
+def pwt_in_mm(pwt: np.ndarray, unit: str = "auto") -> np.ndarray:
+    """Converts posterior wall thickness to mm.
+
+    Args:
+        pwt (np.ndarray): posterior wall thickness
+        unit (str, optional): "mm", "cm" or "auto", which takes cm when the
+            median is below PWT_CM_MAX. Defaults to "auto".
+
+    Returns:
+        np.ndarray: PWT in mm
+    """
+    if unit == "auto":
+        present = pwt[~np.isnan(pwt)]
+        unit = "cm" if len(present) and np.median(present) < PWT_CM_MAX else "mm"
+    if unit not in ("mm", "cm"):
+        raise ValueError(f"Unknown PWT unit {unit}")
+    return pwt * 10 if unit == "cm" else pwt
+
+
+def mayo_components(df: pd.DataFrame, pwt_unit: str = "auto") -> pd.DataFrame:
+    """Points of every score component, NaN where the input is missing.
+
+    Sex is taken as M/F, male/female or the 0.0 (male) / 1.0 (female) encoding
+    of the cohort file. RWT falls back to 2 * PWT / LVIDD when it is missing and
+    LVIDD is present.
+
+    Args:
+        df (pd.DataFrame): cohort with Age, Sex, htn, EF, PWT and RWT (or LVIDD)
+        pwt_unit (str, optional): see pwt_in_mm. Defaults to "auto".
+
+    Returns:
+        pd.DataFrame: one float column per COMPONENTS entry, on df's index
+    """
+    age = _numeric(df["Age"])
+    ef = _numeric(df["EF"])
+    pwt = _numeric(df["PWT"])
+    rwt = _numeric(df["RWT"]) if "RWT" in df else np.full(len(df), np.nan)
+    if "LVIDD" in df:
+        # both walls and the diameter share the unit of the echo report
+        rwt = np.where(np.isnan(rwt), 2 * pwt / _numeric(df["LVIDD"]), rwt)
+
+    age_points = np.asarray(AGE_POINTS, dtype=float)[
+        np.searchsorted(AGE_EDGES, np.nan_to_num(age), side="right")
+    ]
+    points = {
+        "age": np.where(np.isnan(age), np.nan, age_points),
+        "sex": _codes(df["Sex"], MALE, FEMALE) * MALE_POINTS,
+        "htn": _codes(df["htn"], TRUE, FALSE) * HTN_POINTS + 0.0,
+        "ef": np.where(np.isnan(ef), np.nan, (ef < EF_CUTOFF) * EF_POINTS),
+        "pwt": np.where(
+            np.isnan(pwt),
+            np.nan,
+            (pwt_in_mm(pwt, pwt_unit) >= PWT_CUTOFF_MM) * PWT_POINTS,
+        ),
+        "rwt": np.where(np.isnan(rwt), np.nan, (rwt > RWT_CUTOFF) * RWT_POINTS),
+    }
+    return pd.DataFrame(points, index=df.index)
+
+
+def mayo_score(
+    df: pd.DataFrame, missing: str = "nan", pwt_unit: str = "auto"
+) -> pd.DataFrame:
+    """Computes the Mayo ATTR-CM score for every row of the cohort.
+
+    Args:
+        df (pd.DataFrame): cohort, see mayo_components
+        missing (str, optional): "nan" leaves the score missing when any input is,
+            "zero" scores missing components as 0 (the score is then a lower
+            bound for those rows). Defaults to "nan".
+        pwt_unit (str, optional): see pwt_in_mm. Defaults to "auto".
+
+    Returns:
+        pd.DataFrame: mayo_<component> points, mayo_n_missing, mayo_score_calc
+            and mayo_high_risk (nullable boolean)
+    """
+    if missing not in ("nan", "zero"):
+        raise ValueError(f"Unknown missing policy {missing}")
+    components = mayo_components(df, pwt_unit)
+    n_missing = components.isna().sum(axis=1)
+    total = components.sum(axis=1, skipna=True)
+    if missing == "nan":
+        total = total.where(n_missing == 0)
+
+    result = components.add_prefix("mayo_")
+    result["mayo_n_missing"] = n_missing.astype("int8")
+    result["mayo_score_calc"] = total
+    result["mayo_high_risk"] = (
+        (total >= MAYO_THRESHOLD).astype("boolean").where(total.notna())
+    )
+    return result
+
+
+def validate(
+    df: pd.DataFrame, column: str = "mayo_score", pwt_unit: str = "auto"
+) -> pd.DataFrame:
+    """Compares the recomputed score with the delivered one.
+
+    Args:
+        df (pd.DataFrame): cohort with the delivered score
+        column (str, optional): delivered score column. Defaults to "mayo_score".
+        pwt_unit (str, optional): see pwt_in_mm. Defaults to "auto".
+
+    Returns:
+        pd.DataFrame: rows where both scores exist and differ, with the inputs,
+            both scores and the components. Agreement is printed.
+    """
+    scored = mayo_score(df, missing="nan", pwt_unit=pwt_unit)
+    both = scored["mayo_score_calc"].notna() & df[column].notna()
+    delivered = pd.to_numeric(df[column], errors="coerce")
+    differ = both & (scored["mayo_score_calc"] != delivered)
+    threshold_agree = (
+        (scored["mayo_score_calc"] >= MAYO_THRESHOLD) == (delivered >= MAYO_THRESHOLD)
+    )[both]
+    print(
+        f"Scored {both.sum()} of {df[column].notna().sum()} delivered scores: "
+        f"{(~differ[both]).mean():.2%} exact, "
+        f"{threshold_agree.mean():.2%} on the >= {MAYO_THRESHOLD} call, "
+        f"{(scored['mayo_n_missing'] > 0).sum()} rows with missing inputs"
+    )
+    inputs = [c for c in ("Age", "Sex", "htn", "EF", "PWT", "RWT", "LVIDD") if c in df]
+    return pd.concat([df.loc[differ, inputs + [column]], scored.loc[differ]], axis=1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cohort", type=Path, required=True, help="csv or parquet")
+    parser.add_argument("--pwt-unit", choices=["auto", "mm", "cm"], default="auto")
+    parser.add_argument("--out", type=Path, default=None, help="Write disagreements")
+    args = parser.parse_args()
+
+    read = pd.read_parquet if args.cohort.suffix == ".parquet" else pd.read_csv
+    mismatches = validate(read(args.cohort), pwt_unit=args.pwt_unit)
+    print(mismatches.head(20).to_string())
+    if args.out:
+        mismatches.to_csv(args.out)
@@ -1,32 +1,33 @@
-from sklearn.metrics import (
-    make_scorer,
-    accuracy_score,
-    balanced_accuracy_score,
-    roc_auc_score,
-    average_precision_score,
-    f1_score,
-    precision_score,
-    recall_score,
-    precision_recall_curve,
-    average_precision_score,
-    auc,
-    confusion_matrix,
-    multilabel_confusion_matrix,
-)
+"""Classification scores with bootstrap confidence intervals.
+
+sklearn.metrics, imblearn and R (for the DeLong test) are imported on first
+use, importing this module only costs numpy.
+"""
+
 import numpy as np
-from functools import partial
+from functools import lru_cache, partial
 from typing import List, Callable, Tuple
 
-try:
-    from imblearn.metrics import geometric_mean_score
-except ImportError:
-    import warnings
 
-    warnings.warn("Imblearn failed to import!\nSome score functions will not be run.")
+def geometric_mean_score(*args, **kwargs):
+    """imblearn.metrics.geometric_mean_score, None when imblearn is missing."""
+    score = _geometric_mean_score()
+    return score(*args, **kwargs) if score is not None else None
+
 
-    def geometric_mean_score(*arg, **kwargs):
+@lru_cache(maxsize=None)
+def _geometric_mean_score():
+    try:
+        from imblearn.metrics import geometric_mean_score
+    except ImportError:
+        import warnings
+
+        warnings.warn(
+            "Imblearn failed to import!\nSome score functions will not be run."
+        )
         # TODO: None or np.nan??
         return None
+    return geometric_mean_score
 
 
 np.random.seed(2556)
@@ -40,6 +41,8 @@ def _score_helper(
     labels: List[str] = None,
     pos_label: None = None,
 ) -> float:
+    from sklearn.metrics import multilabel_confusion_matrix
+
     mlcm = multilabel_confusion_matrix(y_true, y_pred, labels=labels)
     tn, fp, fn, tp = mlcm[:, 0, 0], mlcm[:, 0, 1], mlcm[:, 1, 0], mlcm[:, 1, 1]
 
@@ -121,6 +124,8 @@ def conf_interval(
 
 # Define the PR AUC scorer function
 def pr_auc_score(y_true, y_pred_proba):
+    from sklearn.metrics import auc, average_precision_score, precision_recall_curve
+
     precision, recall, _ = precision_recall_curve(
         average_precision_score, y_true, y_pred_proba
     )
@@ -140,6 +145,16 @@ def compute_scores(
     """
     auc_conf (Union[None, Tuple[float, float]]): None or Tuple of percentages to calculate CI for.
     """
+    from sklearn.metrics import (
+        accuracy_score,
+        average_precision_score,
+        balanced_accuracy_score,
+        confusion_matrix,
+        f1_score,
+        precision_score,
+        recall_score,
+        roc_auc_score,
+    )
 
     # Assume y_true and y_pred are the true labels and predicted labels, respectively
     # You can obtain them using the model.predict() method or any other means
@@ -231,7 +246,64 @@ def compute_scores(
     return scoring
 
 
-# Create the custom scorer using make_scorer
-pr_auc_scorer = make_scorer(pr_auc_score, greater_is_better=True, needs_proba=True)
-f1_score_scorer = make_scorer(f1_score, greater_is_better=True)
-roc_auc_scorer = make_scorer(roc_auc_score, greater_is_better=True, needs_proba=True)
+@lru_cache(maxsize=None)
+def _pROC():
+    # starting R takes seconds, only done for the first DeLong test
+    from rpy2.robjects.packages import importr
+
+    return importr("pROC")
+
+
+def delong_test(y_true1, y_score1, y_true2, y_score2, paired: bool) -> float:
+    """Two-sided DeLong test of the difference of two ROC AUCs (R pROC::roc.test).
+
+    Args:
+        y_true1: 0/1 labels of the first ROC curve
+        y_score1: scores of the first ROC curve
+        y_true2: 0/1 labels of the second ROC curve
+        y_score2: scores of the second ROC curve
+        paired (bool): both scores are of the same patients
+
+    Returns:
+        float: p-value
+    """
+    from rpy2.robjects import FloatVector, IntVector
+
+    pROC = _pROC()
+    roc1 = pROC.roc(
+        IntVector(np.asarray(y_true1, dtype=int)),
+        FloatVector(np.asarray(y_score1, dtype=float)),
+        quiet=True,
+    )
+    roc2 = pROC.roc(
+        IntVector(np.asarray(y_true2, dtype=int)),
+        FloatVector(np.asarray(y_score2, dtype=float)),
+        quiet=True,
+    )
+    result = pROC.roc_test(
+        roc1, roc2, paired=paired, method="delong", alternative="two.sided"
+    )
+    return result.rx2("p.value")[0]
+
+
+def _make_scorers() -> dict:
+    from sklearn.metrics import f1_score, make_scorer, roc_auc_score
+
+    # Create the custom scorer using make_scorer
+    return {
+        "pr_auc_scorer": make_scorer(
+            pr_auc_score, greater_is_better=True, needs_proba=True
+        ),
+        "f1_score_scorer": make_scorer(f1_score, greater_is_better=True),
+        "roc_auc_scorer": make_scorer(
+            roc_auc_score, greater_is_better=True, needs_proba=True
+        ),
+    }
+
+
+def __getattr__(name: str):
+    # pr_auc_scorer, f1_score_scorer and roc_auc_scorer are built on first access
+    if name in ("pr_auc_scorer", "f1_score_scorer", "roc_auc_scorer"):
+        globals().update(_make_scorers())
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,248 @@
+"""Ragged per-study arrays (EchoGo per-clip outputs) as Arrow list columns.
+
+EchoGo returns one classification, probability and uncertainty per clip, so a
+study holds a variable length list of each (ultromics_cls_list,
+ultromics_prob_list, ultromics_uncertainty_list). They are stored as Arrow list
+columns, i.e. one flat values buffer plus offsets, and every per-study
+aggregation is a segment reduction over that buffer instead of a per-row apply.
+
+Segments are given as (values, offsets) like an Arrow ListArray: study i owns
+values[offsets[i]:offsets[i + 1]]. Missing studies are empty segments, and the
+reducers return NaN (or -1 for indices) for them.
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pathlib import Path
+from typing import Tuple
+
+ULTROMICS_LIST_COLUMNS = {
+    "ultromics_cls_list": pa.list_(pa.string()),
+    "ultromics_prob_list": pa.list_(pa.float64()),
+    "ultromics_uncertainty_list": pa.list_(pa.float64()),
+}
+# EchoGo's built in probability cutoff
+ECHOGO_THRESHOLD = 0.06
+UNCERTAIN = "Uncertain"
+DETECTED = "DetectedAmyloidosis"
+NOT_DETECTED = "NotDetectedAmyloidosis"
+
+
+def _parse(x):
+    # a list, an array or its printed form as it comes back from a csv
+    if isinstance(x, str):
+        items = x.strip().strip("[]").replace(",", " ").split()
+        return [item.strip("'\"") for item in items]
+    if x is None or (np.ndim(x) == 0 and pd.isna(x)):
+        return None
+    return list(x)
+
+
+def to_list_array(s: pd.Series, type: pa.DataType) -> pa.ListArray:
+    """Converts an object column of per-row arrays to an Arrow list column.
+
+    Args:
+        s (pd.Series): arrays, lists, their string form or missing values
+        type (pa.DataType): list type, e.g. pa.list_(pa.float64())
+
+    Returns:
+        pa.ListArray: missing rows are null
+    """
+    if isinstance(s.dtype, pd.ArrowDtype):
+        return pa.array(s).cast(type)
+    lists = [_parse(x) for x in s]
+    if any(isinstance(x, str) for x in s):
+        # printed arrays come back as strings of items, cast them after parsing
+        return pa.array(lists, type=pa.list_(pa.string())).cast(type)
+    return pa.array(lists, type=type)
+
+
+def ultromics_to_arrow(df: pd.DataFrame) -> pa.Table:
+    """The cohort as an Arrow table with the EchoGo per-clip columns as lists.
+
+    Args:
+        df (pd.DataFrame): cohort with columns of per-row arrays
+
+    Returns:
+        pa.Table: list columns last, typed as ULTROMICS_LIST_COLUMNS
+    """
+    columns = [c for c in ULTROMICS_LIST_COLUMNS if c in df]
+    table = pa.Table.from_pandas(df.drop(columns=columns), preserve_index=False)
+    # appended outside the pandas metadata, so pd.read_parquet falls back to
+    # its default conversion (numpy arrays per row) for them
+    for column in columns:
+        table = table.append_column(
+            pa.field(column, ULTROMICS_LIST_COLUMNS[column]),
+            to_list_array(df[column], ULTROMICS_LIST_COLUMNS[column]),
+        )
+    return table
+
+
+def write_cohort_parquet(df: pd.DataFrame, path: Path) -> None:
+    """Writes the cohort with the EchoGo per-clip columns as list columns."""
+    pq.write_table(ultromics_to_arrow(df), path)
+
+
+def read_cohort_parquet(path: Path) -> pd.DataFrame:
+    """Reads the cohort keeping list columns in Arrow memory.
+
+    pd.read_parquet works on the same file but builds one numpy array per row.
+
+    Args:
+        path (Path): cohort parquet
+
+    Returns:
+        pd.DataFrame: list columns as pd.ArrowDtype, ready for flatten
+    """
+    return pq.read_table(path).to_pandas(
+        types_mapper=lambda t: pd.ArrowDtype(t) if pa.types.is_list(t) else None
+    )
+
+
+def flatten(lists) -> Tuple[np.ndarray, np.ndarray]:
+    """The flat values buffer and offsets of a list column.
+
+    Args:
+        lists (pd.Series | pa.ListArray | pa.ChunkedArray): list column
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: values and offsets (len(lists) + 1), null
+            rows are empty segments
+    """
+    if isinstance(lists, pd.Series):
+        lists = pa.array(lists)
+    if isinstance(lists, pa.ChunkedArray):
+        lists = lists.combine_chunks()
+    # list_flatten skips the (possibly non-empty) ranges of null rows
+    values = pc.list_flatten(lists).to_numpy(zero_copy_only=False)
+    lengths = pc.list_value_length(lists).fill_null(0).to_numpy()
+    return values, np.concatenate([[0], np.cumsum(lengths)])
+
+
+def segment_ids(offsets: np.ndarray) -> np.ndarray:
+    """Segment of every value."""
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def _reduceat(ufunc, values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    # ufunc.reduceat of every non-empty segment, NaN for empty ones
+    lengths = np.diff(offsets)
+    out = np.full(len(lengths), np.nan)
+    nonempty = lengths > 0
+    if nonempty.any():
+        out[nonempty] = ufunc.reduceat(values, offsets[:-1][nonempty])
+    return out
+
+
+def segment_min(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    return _reduceat(np.minimum, np.asarray(values, dtype=float), offsets)
+
+
+def segment_max(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    return _reduceat(np.maximum, np.asarray(values, dtype=float), offsets)
+
+
+def segment_mean(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return _reduceat(np.add, np.asarray(values, dtype=float), offsets) / np.diff(
+            offsets
+        )
+
+
+def segment_argmin(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Position of the minimum inside every segment, like np.argmin per row.
+
+    Ties go to the first value, as with np.argmin. NaN values are skipped
+    unless the whole segment is NaN.
+
+    Args:
+        values (np.ndarray): flat values
+        offsets (np.ndarray): segment offsets
+
+    Returns:
+        np.ndarray: index within the segment, -1 for empty segments
+    """
+    values = np.asarray(values, dtype=float)
+    segments = segment_ids(offsets)
+    # NaN only wins where nothing else is there, same as np.nanargmin
+    filled = np.where(np.isnan(values), np.inf, values)
+    is_min = filled == np.repeat(segment_min(filled, offsets), np.diff(offsets))
+    found, first = np.unique(segments[is_min], return_index=True)
+    result = np.full(len(offsets) - 1, -1)
+    result[found] = np.flatnonzero(is_min)[first] - offsets[found]
+    return result
+
+
+def segment_argmax(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Position of the maximum inside every segment, see segment_argmin."""
+    return segment_argmin(-np.asarray(values, dtype=float), offsets)
+
+
+def take_at(values: np.ndarray, offsets: np.ndarray, index: np.ndarray, fill=np.nan):
+    """Value at a per-segment index, e.g. the result of segment_argmin.
+
+    Args:
+        values (np.ndarray): flat values
+        offsets (np.ndarray): segment offsets
+        index (np.ndarray): index within every segment, -1 for none
+        fill (optional): result where index is -1 or out of the segment.
+            Defaults to NaN.
+
+    Returns:
+        np.ndarray: one value per segment
+    """
+    index = np.asarray(index)
+    valid = (index >= 0) & (index < np.diff(offsets))
+    result = np.full(
+        len(index), fill, dtype=object if values.dtype == object else float
+    )
+    result[valid] = values[offsets[:-1][valid] + index[valid]]
+    return result
+
+
+def least_uncertain(df: pd.DataFrame, threshold: float | None = None) -> pd.DataFrame:
+    """EchoGo call of the least uncertain clip of every study.
+
+    Args:
+        df (pd.DataFrame): cohort with the ultromics_*_list columns
+        threshold (float, optional): probability cutoff for the clip's class.
+            None keeps the clip's own classification (EchoGo's built in
+            ECHOGO_THRESHOLD). Defaults to None.
+
+    Returns:
+        pd.DataFrame: cls (None for studies without clips or whose clip lists
+            differ in length, Uncertain kept),
+            prob and cls_uncertain (cutoff applied to Uncertain clips too),
+            on df's index
+    """
+    uncertainty, offsets = flatten(
+        to_list_array(df["ultromics_uncertainty_list"], pa.list_(pa.float64()))
+    )
+    probs, prob_offsets = flatten(
+        to_list_array(df["ultromics_prob_list"], pa.list_(pa.float64()))
+    )
+    classes, cls_offsets = flatten(
+        to_list_array(df["ultromics_cls_list"], pa.list_(pa.string()))
+    )
+
+    index = segment_argmin(uncertainty, offsets)
+    # clips are matched by position, a study whose lists differ in length
+    # (or are missing) has no usable clip
+    lengths = np.diff(offsets)
+    aligned = (np.diff(prob_offsets) == lengths) & (np.diff(cls_offsets) == lengths)
+    index = np.where(aligned, index, -1)
+    prob = take_at(probs, prob_offsets, index)
+    cls = take_at(classes.astype(object), cls_offsets, index, fill=None)
+    has_clip = index >= 0
+
+    cutoff = ECHOGO_THRESHOLD if threshold is None else threshold
+    called = np.where(prob >= cutoff, DETECTED, NOT_DETECTED).astype(object)
+    cls_uncertain = np.where(has_clip, called, None)
+    if threshold is not None:
+        cls = np.where(has_clip & (cls != UNCERTAIN), called, cls)
+    return pd.DataFrame(
+        {"cls": cls, "prob": prob, "cls_uncertain": cls_uncertain}, index=df.index
+    )
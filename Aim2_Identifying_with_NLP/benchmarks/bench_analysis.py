@@ -0,0 +1,92 @@
+"""Scoring, the figure bootstraps and the demographics tables on a synthetic cohort."""
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import sklearn.metrics  # imported by scorers on first use, not timed here
+from pathlib import Path
+
+from benchmark import benchmark
+from demographics_utils import categorical_var, numerical
+from figure_plotting_code import fig_pr_auc, fig_roc_auc
+from scorers import compute_scores
+
+SIZES = (1_000, 10_000)
+SEED = 2556
+CONF_INT = [(0.5, 0.6)] * 4
+
+
+def make_predictions(size: int, workdir: Path):
+    rng = np.random.default_rng(SEED)
+    y_true = (rng.random(size) < 0.2).astype(int)
+    p = np.clip(0.3 * y_true + rng.random(size) * 0.7, 0, 1)
+    return y_true, (p > 0.5).astype(int), np.column_stack([1 - p, p])
+
+
+def make_cohort(size: int, workdir: Path) -> pd.DataFrame:
+    rng = np.random.default_rng(SEED)
+    y_true, _, proba = make_predictions(size, workdir)
+    return pd.DataFrame(
+        {
+            "true_label": np.where(y_true == 1, "ATTR", None),
+            "ttr_ca": y_true.astype(float),
+            "pfizer_prediction": list(proba),
+            "mayo_score": np.clip(
+                np.round(10 * proba[:, 1] + rng.normal(0, 1, size)), 0, 10
+            ),
+            "echonet_prediction": np.clip(proba[:, 1] + rng.normal(0, 0.1, size), 0, 1),
+            "ultromics_prediction": np.clip(
+                proba[:, 1] + rng.normal(0, 0.2, size), 0, 1
+            ),
+            "Age": rng.normal(70, 10, size),
+            "Sex": rng.choice(["male", "female"], size),
+            "LVH": rng.choice(["Normal", "Mild", "Moderate", "Severe"], size),
+            "echonet_present": rng.random(size) < 0.8,
+        }
+    )
+
+
+@benchmark(SIZES, make_predictions)
+def compute_scores_point(data):
+    y_true, y_pred, proba = data
+    compute_scores(y_true, y_pred, proba)
+
+
+@benchmark(SIZES, make_predictions, repeat=1)
+def compute_scores_with_cis(data):
+    y_true, y_pred, proba = data
+    compute_scores(
+        y_true,
+        y_pred,
+        proba,
+        ci_conf=(2.5, 97.5),
+        auc_conf=(2.5, 97.5),
+        ap_conf=(2.5, 97.5),
+    )
+
+
+@benchmark(SIZES, make_cohort, repeat=1)
+def pr_auc_figure_bootstrap(df):
+    plt.close(fig_pr_auc(df, CONF_INT))
+
+
+@benchmark(SIZES, make_cohort, repeat=1)
+def roc_auc_figure_bootstrap(df):
+    plt.close(fig_roc_auc(df, CONF_INT))
+
+
+@benchmark(SIZES, make_cohort)
+def demographics_table(df):
+    pd.concat(
+        [
+            numerical("Age", df),
+            categorical_var("Sex", df),
+            categorical_var("LVH", df),
+            numerical("Age", df, missing_pred="echonet_present"),
+            categorical_var("Sex", df, missing_pred="echonet_present"),
+        ]
+    )
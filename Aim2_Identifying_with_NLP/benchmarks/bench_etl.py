@@ -0,0 +1,122 @@
+"""csv_to_parquet and load_* of every EDW extract, on a synthetic pull (synthetic_pull.py)."""
+
+import inspect
+from pathlib import Path
+from typing import Callable, Dict
+
+import note_dedup
+import synthetic_pull
+from benchmark import benchmark
+from file_parsing import (
+    cardiac_MRIs_file,
+    cohort_file,
+    comorbidities_file,
+    datasets,
+    deid_notes_file,
+    demographics_file,
+    echomaster_file,
+    echosyngo_file,
+    hf_subtype_file,
+    icd_codes_file,
+    labeled_cohort_file,
+    outpt_encounters_file,
+)
+
+# patients of the synthetic pull, the tables have ~1 to ~50 rows per patient
+SIZES = (1_000, 10_000)
+SEED = 2556
+
+
+# table -> (parser module, loader name)
+TABLES: Dict[str, tuple] = {
+    "cardiac_mris": (cardiac_MRIs_file, "load_cardiac_mris"),
+    "cohort_entry": (cohort_file, "load_cohort_entry"),
+    "comorbidities": (comorbidities_file, "load_comorbitities"),
+    "deid_notes": (deid_notes_file, "load_notes"),
+    "demographics": (demographics_file, "load_demographics"),
+    "echomaster": (echomaster_file, "load_echomaster"),
+    "echosyngo": (echosyngo_file, "load_echosyngo"),
+    "hf_subtype": (hf_subtype_file, "load_hf_subtype"),
+    "icd_codes": (icd_codes_file, "load_icd_codes"),
+    "labeled_cohort": (labeled_cohort_file, "load_labeled_cohort"),
+    "outpt_encounters": (outpt_encounters_file, "load_outpt_encounters"),
+}
+
+
+def _write_tables(size: int, workdir: Path, tables: list) -> Dict[str, Path]:
+    synthetic_pull.write_pull(workdir, size, SEED, tables)
+    return synthetic_pull.pull_paths(workdir, tables)
+
+
+def _kwargs(func: Callable, path: Path, workdir: Path) -> Dict:
+    # the parsers write category vocabularies, keep them in the scratch directory
+    kwargs = {"path": path}
+    if "vocabulary_dir" in inspect.signature(func).parameters:
+        kwargs["vocabulary_dir"] = workdir / "vocabularies"
+    return kwargs
+
+
+def _csv_setup(table: str) -> Callable[[int, Path], Dict]:
+    module = TABLES[table][0]
+
+    def setup(size: int, workdir: Path) -> Dict:
+        stem = _write_tables(size, workdir, [table])[table].with_suffix("")
+        return _kwargs(module.csv_to_parquet, stem, workdir)
+
+    return setup
+
+
+def _parquet_setup(table: str) -> Callable[[int, Path], Dict]:
+    csv_setup = _csv_setup(table)
+    module, loader = TABLES[table]
+
+    def setup(size: int, workdir: Path) -> Dict:
+        kwargs = csv_setup(size, workdir)
+        module.csv_to_parquet(**kwargs)
+        return _kwargs(getattr(module, loader), kwargs["path"], workdir)
+
+    return setup
+
+
+def _called_with(func: Callable) -> Callable[[Dict], None]:
+    return lambda kwargs: func(**kwargs)
+
+
+for _table, (_module, _loader) in TABLES.items():
+    benchmark(SIZES, _csv_setup(_table), name=f"etl.{_table}.csv_to_parquet", repeat=1)(
+        _called_with(_module.csv_to_parquet)
+    )
+    benchmark(SIZES, _parquet_setup(_table), name=f"etl.{_table}.{_loader}")(
+        _called_with(getattr(_module, _loader))
+    )
+
+
+def _report_dataset_setup(dataset: datasets.Datasets):
+    def setup(size: int, workdir: Path):
+        paths = _write_tables(size, workdir, [dataset.value])
+        datasets.dataset_config_mapping[dataset]["path"] = paths[dataset.value]
+        return dataset
+
+    return setup
+
+
+# reports are written for ~5% of the patients
+@benchmark((10_000, 100_000), _report_dataset_setup(datasets.Datasets.PYP_REPORTS))
+def load_dataset_pyp_reports(dataset):
+    datasets.load_dataset(dataset)
+
+
+@benchmark(
+    (10_000, 100_000), _report_dataset_setup(datasets.Datasets.CARDIAC_PATH_REPORTS)
+)
+def load_dataset_cardiac_path_reports(dataset):
+    datasets.load_dataset(dataset)
+
+
+def _notes_dedup_setup(size: int, workdir: Path):
+    return _parquet_setup("deid_notes")(size, workdir)["path"], workdir / "notes_dedup"
+
+
+@benchmark(SIZES, _notes_dedup_setup, repeat=1)
+def notes_dedup(paths):
+    note_dedup.deduplicate_notes(*paths)
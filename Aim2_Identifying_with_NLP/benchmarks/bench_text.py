@@ -0,0 +1,67 @@
+"""Report cleaning and keyword matching over N synthetic reports."""
+
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+from benchmark import benchmark
+from file_parsing.text_processing import clean_cardiac_path, clean_pyp
+from keyword_utils import AMYLOID_KEYWORDS, find_keywords
+
+SIZES = (1_000, 10_000)
+SEED = 2556
+
+# Fragments with the artifacts the cleaning rules fix: unicode newlines,
+# double dashes, run-together words, missing spaces after periods, ...
+FRAGMENTS = [
+    "FINAL DIAGNOSIS:\x0bHeart, endomyocardial biopsy --",
+    "Positive for AMYLOIDOSIS.See comment.",
+    "Congo red stain is positive with apple-green birefringence",
+    "typing by mass spectrometry: ATTR (transthyretin) type",
+    "CLINICAL HISTORY:rule out amyloid?",
+    "no evidence of AL (lambda) type light chain deposition",
+    "Myocardium with interstitial fibrosisClinical correlation is recommended",
+    "Tc-99m PYP planar and SPECT imaging   heart to contralateral lung ratio 1.6",
+    "Grade 3 myocardial uptake, strongly suggestive of ATTR cardiac amyloidosis",
+    "\n\nImpression:\n\nwild-type vs hereditary cannot be determined",
+]
+
+
+def make_reports(size: int, workdir: Path) -> list:
+    rng = np.random.default_rng(SEED)
+    lengths = rng.integers(5, 40, size)
+    picks = rng.integers(0, len(FRAGMENTS), lengths.sum())
+    splits = np.split(picks, np.cumsum(lengths)[:-1])
+    return [" ".join(FRAGMENTS[i] for i in split) for split in splits]
+
+
+def make_pathological_reports(size: int, workdir: Path) -> list:
+    # long runs of letters, whitespace and punctuation, as in some pasted reports
+    reports = make_reports(size, workdir)
+    runs = ["x" * 20_000, " " * 20_000, "." * 20_000, "-?" * 10_000]
+    return [report + runs[i % len(runs)] for i, report in enumerate(reports)]
+
+
+def make_report_frame(size: int, workdir: Path) -> pd.DataFrame:
+    return pd.DataFrame({"example": make_reports(size, workdir)})
+
+
+@benchmark(SIZES, make_reports)
+def clean_cardiac_path_reports(reports):
+    [clean_cardiac_path(report) for report in reports]
+
+
+@benchmark(SIZES, make_pathological_reports)
+def clean_cardiac_path_pathological_reports(reports):
+    [clean_cardiac_path(report) for report in reports]
+
+
+@benchmark(SIZES, make_reports)
+def clean_pyp_reports(reports):
+    [clean_pyp(report) for report in reports]
+
+
+@benchmark(SIZES, make_report_frame)
+def find_amyloid_keywords(df):
+    for column, keywords in AMYLOID_KEYWORDS.items():
+        find_keywords(df, keywords, column)
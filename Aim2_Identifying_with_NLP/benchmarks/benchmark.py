@@ -0,0 +1,146 @@
+"""Benchmark registry and measurement.
+
+A benchmark is a function timed on the output of its setup, for every size it
+is parameterized with:
+
+    @benchmark(sizes=(1_000, 10_000), setup=make_reports)
+    def clean_pyp(reports):
+        ...
+
+setup(size, workdir) builds the inputs (synthetic data, files in workdir) and
+is not timed. measure runs one (benchmark, size) and returns the best wall time
+of `repeat` runs and the memory the runs add on top of the setup (run_rss, the
+peak RSS of the runs minus the RSS when they start). On Linux the peak is reset
+after the setup, elsewhere it is the peak of the process, so a setup that peaks
+higher than the runs hides them. run_benchmarks.py runs every measurement in
+its own process, so the peak RSS of one benchmark does not include the data of
+another.
+"""
+
+import gc
+import resource
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Tuple
+
+# The etl and analysis scripts import their siblings as top level modules
+ROOT = Path(__file__).resolve().parents[1]
+SOURCE_DIRS = (ROOT / "etl", ROOT / "etl" / "notebooks", ROOT / "analysis")
+for source_dir in reversed(SOURCE_DIRS):
+    if str(source_dir) not in sys.path:
+        sys.path.insert(0, str(source_dir))
+
+
+@dataclass
+class Benchmark:
+    name: str
+    func: Callable[[Any], Any]
+    setup: Callable[[int, Path], Any]
+    sizes: Tuple[int, ...]
+    repeat: int = 3
+
+
+BENCHMARKS: Dict[str, Benchmark] = {}
+
+
+def benchmark(
+    sizes: Tuple[int, ...],
+    setup: Callable[[int, Path], Any],
+    name: str | None = None,
+    repeat: int = 3,
+):
+    """Registers the decorated function as a benchmark.
+
+    Args:
+        sizes (Tuple[int, ...]): data sizes (rows, documents, ...) to run
+        setup (Callable[[int, Path], Any]): builds the function's input from a
+            size and a scratch directory
+        name (str, optional): Defaults to module.function without "bench_".
+        repeat (int, optional): timed runs, the fastest is kept. Defaults to 3.
+    """
+
+    def register(func):
+        module = func.__module__.removeprefix("bench_")
+        key = name or f"{module}.{func.__name__}"
+        if key in BENCHMARKS:
+            raise Exception(f"Benchmark {key} is already registered")
+        BENCHMARKS[key] = Benchmark(key, func, setup, tuple(sizes), repeat)
+        return func
+
+    return register
+
+
+def _status_bytes(field: str) -> int | None:
+    # a "kB" field of /proc/self/status, None where /proc is not available
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss() -> int:
+    """Peak resident set size of this process in bytes, since reset_peak_rss."""
+    peak = _status_bytes("VmHWM")
+    if peak is not None:
+        return peak
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def reset_peak_rss() -> bool:
+    """Resets the peak RSS to the current RSS (Linux only).
+
+    Returns:
+        bool: False where the peak cannot be reset
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def measure(
+    bench: Benchmark, size: int, workdir: Path, repeat: int | None = None
+) -> Dict:
+    """Times a benchmark at one size.
+
+    Args:
+        bench (Benchmark): benchmark
+        size (int): data size
+        workdir (Path): scratch directory for the setup
+        repeat (int, optional): Defaults to bench.repeat.
+
+    Returns:
+        Dict: time (best wall time in s), times (all runs), peak_rss (bytes,
+            peak of the runs, of the whole process where it cannot be reset),
+            setup_rss (peak bytes of the setup) and run_rss (peak_rss minus
+            the RSS when the runs start)
+    """
+    data = bench.setup(size, Path(workdir))
+    gc.collect()
+    setup_rss = peak_rss()
+    start_rss = _status_bytes("VmRSS") if reset_peak_rss() else None
+    start_rss = setup_rss if start_rss is None else start_rss
+    times = []
+    for _ in range(repeat or bench.repeat):
+        start = time.perf_counter()
+        bench.func(data)
+        times.append(time.perf_counter() - start)
+        gc.collect()
+    peak = peak_rss()
+    return {
+        "time": min(times),
+        "times": times,
+        "peak_rss": peak,
+        "setup_rss": setup_rss,
+        "run_rss": max(peak - start_rss, 0),
+    }
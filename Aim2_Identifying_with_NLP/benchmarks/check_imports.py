@@ -0,0 +1,175 @@
+"""Import time budget of the ETL and analysis modules.
+
+Pipeline and figure workers, and one-table conversions, pay the import time of
+their modules before doing any work. Heavy dependencies (sklearn, matplotlib,
+nltk, cv2, scipy, R, ...) are imported where they are used, not at module top.
+This checks it: every module is imported in a fresh process, which must take
+less than --budget seconds (the best of --repeat runs) and must not import a
+HEAVY module. The exit status is 1 when a module is over budget, imports a
+heavy module or fails to import, so the command can gate a change. Modules
+whose dependencies are not installed are reported as skipped.
+
+Usage:
+    python check_imports.py [--budget 0.75] [--repeat 3] [-k PATTERN]
+"""
+
+import argparse
+import json
+import re
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+# The etl and analysis scripts import their siblings as top level modules
+SOURCE_DIRS = (ROOT / "etl", ROOT / "etl" / "notebooks", ROOT / "analysis")
+
+IMPORT_BUDGET = 0.75
+REPEAT = 3
+HEAVY = (
+    "aequitas",
+    "cv2",
+    "imblearn",
+    "matplotlib",
+    "nltk",
+    "rpy2",
+    "scipy",
+    "seaborn",
+    "sklearn",
+    "spacy",
+    "tifffile",
+    "torch",
+    "transformers",
+)
+# heavy modules a module needs at import
+ALLOWED = {
+    "icd_features": ("scipy",),
+}
+
+_WORKER = """
+import importlib, json, sys, time
+sys.path[:0] = {paths!r}
+start = time.perf_counter()
+try:
+    importlib.import_module({module!r})
+except ModuleNotFoundError as e:
+    print(json.dumps({{"missing": e.name}}))
+    sys.exit()
+seconds = time.perf_counter() - start
+heavy = sorted(m for m in {heavy!r} if m in sys.modules)
+print(json.dumps({{"seconds": seconds, "heavy": heavy}}))
+"""
+
+
+def modules() -> List[str]:
+    """Every module of etl, etl/notebooks, etl/file_parsing and analysis."""
+    names = [
+        path.stem
+        for source_dir in SOURCE_DIRS
+        for path in sorted(source_dir.glob("*.py"))
+    ]
+    names += [
+        f"file_parsing.{path.stem}"
+        for path in sorted((ROOT / "etl" / "file_parsing").glob("*.py"))
+    ]
+    return names
+
+
+def measure_import(module: str) -> Dict:
+    """Imports module in a new process.
+
+    Returns:
+        Dict: seconds and the HEAVY modules it imported, the missing
+            dependency, or error
+    """
+    code = _WORKER.format(
+        paths=[str(p) for p in SOURCE_DIRS], module=module, heavy=HEAVY
+    )
+    process = subprocess.run(
+        [sys.executable, "-W", "ignore", "-c", code],
+        capture_output=True,
+        text=True,
+        cwd=ROOT,
+    )
+    if process.returncode != 0:
+        lines = process.stderr.strip().splitlines() or ["failed"]
+        return {"error": lines[-1]}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def check(
+    budget: float = IMPORT_BUDGET,
+    repeat: int = REPEAT,
+    pattern: str | None = None,
+    skipped: List[str] | None = None,
+) -> List[str]:
+    """Prints the import time of every module and returns the failures.
+
+    Args:
+        budget (float, optional): seconds. Defaults to IMPORT_BUDGET.
+        repeat (int, optional): imports per module, the fastest is kept.
+            Defaults to REPEAT.
+        pattern (str, optional): regular expression on the module name.
+            Defaults to all.
+        skipped (List[str], optional): appended with the modules whose
+            dependencies are not installed. Defaults to None.
+
+    Returns:
+        List[str]: modules over budget, importing a heavy module or failing
+            to import
+    """
+    failures = []
+    for module in modules():
+        if pattern and not re.search(pattern, module):
+            continue
+        result = measure_import(module)
+        if "missing" in result:
+            # a missing optional dependency is not an import time regression
+            print(f"{module:45} skipped (missing {result['missing']})")
+            if skipped is not None:
+                skipped.append(module)
+            continue
+        results = [result] + [measure_import(module) for _ in range(repeat - 1)]
+        errors = [r["error"] for r in results if "error" in r]
+        if errors:
+            print(f"{module:45} FAIL ({errors[-1]})")
+            failures.append(module)
+            continue
+        seconds = min(r["seconds"] for r in results)
+        heavy = [
+            m
+            for m in results[0]["heavy"]
+            if m not in ALLOWED.get(module.rsplit(".", 1)[-1], ())
+        ]
+        problems = []
+        if seconds > budget:
+            problems.append(f"over the {budget} s budget")
+        if heavy:
+            problems.append(f"imports {', '.join(heavy)}")
+        print(
+            f"{module:45} {seconds:7.3f} s"
+            + (f"  FAIL ({'; '.join(problems)})" if problems else "")
+        )
+        if problems:
+            failures.append(module)
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget", type=float, default=IMPORT_BUDGET)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("-k", "--pattern", default=None, help="Module name regex")
+    args = parser.parse_args()
+
+    skipped = []
+    failures = check(args.budget, args.repeat, args.pattern, skipped)
+    if skipped:
+        print(
+            f"\n{len(skipped)} module(s) skipped, dependencies not installed: "
+            + ", ".join(skipped)
+        )
+    if failures:
+        print(f"\n{len(failures)} module(s) failed the import check")
+        sys.exit(1)
@@ -0,0 +1,252 @@
+"""Runs the benchmark suite and compares it to a stored baseline.
+
+Every bench_*.py module in this directory registers benchmarks (see
+benchmark.py) for the ETL parsers and loaders, text cleaning, keyword matching,
+scoring, the figure bootstraps and the demographics tables. Every (benchmark,
+size) runs in a fresh process and records its best wall time and the memory
+its runs add on top of the setup (run_rss, see benchmark.measure).
+
+A run is compared to a baseline (a previous run on the same machine) and a
+benchmark is flagged as a regression when it is more than --time-factor times
+slower, or its run_rss more than --memory-factor times higher, so a heavier
+setup (more synthetic data) is not reported as a regression. The exit status
+is 1 when there is a regression, so the command can gate a change.
+
+Usage:
+    python run_benchmarks.py --save-baseline             # on the main branch
+    python run_benchmarks.py                             # on a change, compares
+    python run_benchmarks.py -k text --sizes 1 --repeat 1
+"""
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from benchmark import BENCHMARKS, measure
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+RESULTS_DIR = BENCHMARK_DIR / "results"
+BASELINE_PATH = RESULTS_DIR / "baseline.json"
+
+TIME_FACTOR = 1.2
+MEMORY_FACTOR = 1.1
+# differences below these are noise whatever the ratio
+MIN_TIME_DIFFERENCE = 1e-3
+MIN_MEMORY_DIFFERENCE = 8 << 20
+
+
+def load_benchmarks() -> None:
+    for path in sorted(BENCHMARK_DIR.glob("bench_*.py")):
+        importlib.import_module(path.stem)
+
+
+def _key(name: str, size: int) -> str:
+    return f"{name}[{size}]"
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BENCHMARK_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _run_rss(result: Dict) -> int:
+    # baselines saved before run_rss was recorded
+    if "run_rss" in result:
+        return result["run_rss"]
+    return max(result["peak_rss"] - result["setup_rss"], 0)
+
+
+def run_one(name: str, size: int, repeat: int | None, timeout: float | None) -> Dict:
+    """Measures one benchmark in a new process.
+
+    Returns:
+        Dict: see benchmark.measure, or error with the last line of stderr
+    """
+    command = [sys.executable, __file__, "--worker", name, "--size", str(size)]
+    if repeat is not None:
+        command += ["--repeat", str(repeat)]
+    env = dict(os.environ, MPLBACKEND="Agg")
+    try:
+        process = subprocess.run(
+            command, capture_output=True, text=True, timeout=timeout, env=env
+        )
+    except subprocess.TimeoutExpired:
+        return {"error": f"timed out after {timeout} s"}
+    if process.returncode != 0:
+        # the exception line of the traceback, some messages end with banners
+        lines = process.stderr.strip().splitlines() or ["failed"]
+        errors = [
+            line for line in lines if re.match(r"^[\w.]+(Error|Exception)\b", line)
+        ]
+        return {"error": (errors or lines)[-1]}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def run_suite(
+    pattern: str | None = None,
+    size_levels: int | None = None,
+    repeat: int | None = None,
+    timeout: float | None = None,
+) -> Dict:
+    """Runs the benchmarks whose name matches pattern.
+
+    Args:
+        pattern (str, optional): regular expression on the benchmark name.
+            Defaults to all.
+        size_levels (int, optional): only the first sizes of each benchmark.
+            Defaults to all.
+        repeat (int, optional): timed runs. Defaults to each benchmark's.
+        timeout (float, optional): seconds per measurement. Defaults to None.
+
+    Returns:
+        Dict: machine, commit, date and results by "name[size]"
+    """
+    results = {}
+    for name, bench in BENCHMARKS.items():
+        if pattern and not re.search(pattern, name):
+            continue
+        for size in bench.sizes[:size_levels]:
+            result = run_one(name, size, repeat, timeout)
+            results[_key(name, size)] = result
+            if "error" in result:
+                print(f"{_key(name, size):55} error: {result['error']}", flush=True)
+            else:
+                print(
+                    f"{_key(name, size):55} {result['time']:10.4f} s"
+                    f" {result['run_rss'] / 2**20:9.1f} MiB",
+                    flush=True,
+                )
+    return {
+        "machine": {
+            "node": platform.node(),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "commit": _git_commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "results": results,
+    }
+
+
+def compare(
+    run: Dict,
+    baseline: Dict,
+    time_factor: float = TIME_FACTOR,
+    memory_factor: float = MEMORY_FACTOR,
+) -> List[Tuple[str, str]]:
+    """Prints a run next to the baseline and returns the regressions.
+
+    Args:
+        run (Dict): see run_suite
+        baseline (Dict): a previous run_suite result
+        time_factor (float, optional): Defaults to TIME_FACTOR.
+        memory_factor (float, optional): Defaults to MEMORY_FACTOR.
+
+    Returns:
+        List[Tuple[str, str]]: (benchmark, "time" or "memory") of every regression
+    """
+    if baseline.get("machine", {}).get("node") != run["machine"]["node"]:
+        print("Warning: the baseline was recorded on another machine")
+    regressions = []
+    print(
+        f"\n{'benchmark':55} {'time':>10} {'baseline':>10} {'ratio':>6}  {'rss ratio':>9}"
+    )
+    for key, result in run["results"].items():
+        before = baseline["results"].get(key)
+        if before is None or "error" in result or "error" in before:
+            continue
+        time_ratio = result["time"] / max(before["time"], 1e-12)
+        run_rss, before_rss = _run_rss(result), _run_rss(before)
+        memory_ratio = run_rss / max(before_rss, 1)
+        flags = []
+        if (
+            time_ratio > time_factor
+            and result["time"] - before["time"] > MIN_TIME_DIFFERENCE
+        ):
+            flags.append("time")
+        if (
+            memory_ratio > memory_factor
+            and run_rss - before_rss > MIN_MEMORY_DIFFERENCE
+        ):
+            flags.append("memory")
+        regressions += [(key, flag) for flag in flags]
+        print(
+            f"{key:55} {result['time']:10.4f} {before['time']:10.4f}"
+            f" {time_ratio:6.2f}  {memory_ratio:9.2f}"
+            + (f"  REGRESSION ({', '.join(flags)})" if flags else "")
+        )
+    return regressions
+
+
+def _worker(name: str, size: int, repeat: int | None) -> None:
+    with tempfile.TemporaryDirectory(prefix="benchmark_") as workdir:
+        result = measure(BENCHMARKS[name], size, Path(workdir), repeat)
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-k", "--pattern", default=None, help="Benchmark name regex")
+    parser.add_argument(
+        "--sizes", type=int, default=None, help="Only the first N sizes of each"
+    )
+    parser.add_argument("--repeat", type=int, default=None)
+    parser.add_argument("--timeout", type=float, default=None)
+    parser.add_argument("--out", type=Path, default=None, help="Results json")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="Store this run as the baseline"
+    )
+    parser.add_argument("--time-factor", type=float, default=TIME_FACTOR)
+    parser.add_argument("--memory-factor", type=float, default=MEMORY_FACTOR)
+    parser.add_argument("--list", action="store_true", help="List the benchmarks")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    load_benchmarks()
+    if args.worker is not None:
+        _worker(args.worker, args.size, args.repeat)
+        sys.exit(0)
+    if args.list:
+        for name, bench in BENCHMARKS.items():
+            print(f"{name:45} sizes {', '.join(map(str, bench.sizes))}")
+        sys.exit(0)
+
+    run = run_suite(args.pattern, args.sizes, args.repeat, args.timeout)
+    RESULTS_DIR.mkdir(exist_ok=True)
+    out = args.out or RESULTS_DIR / f"{datetime.now():%Y%m%d_%H%M%S}.json"
+    with open(out, "w") as f:
+        json.dump(run, f, indent=1)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(run, f, indent=1)
+        print(f"\nSaved baseline {args.baseline}")
+    elif args.baseline.exists():
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(run, baseline, args.time_factor, args.memory_factor)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s)")
+            sys.exit(1)
+    else:
+        print(f"\nNo baseline at {args.baseline}, run with --save-baseline first")
@@ -0,0 +1,282 @@
+"""Per-patient trajectories of echo measurements before an anchor date.
+
+For every patient and echo measurement (wall thickness, LVEF, strain, LV mass,
+... any column of the echosyngo dataset) this computes, over the studies before
+the anchor date (e.g. final__amyloid_diagnosis_date):
+    the number of studies and the first/last study relative to the anchor
+    the first and last value and the change from the first study
+    an ordinary least squares slope per year and its value at the anchor
+    the value of the study nearest to fixed offsets before the anchor
+
+Echo dates come from echomaster (joined on study_uid, then accession_num).
+Everything is computed with grouped sums over arrays sorted by (patient,
+measurement, date), no per-patient loops. The echosyngo dataset is partitioned
+by ir_id bucket, so a patient never spans partitions and partitions run in
+parallel worker processes.
+
+Usage:
+    python echo_trajectories.py --anchor final__amyloid_diagnosis_date --out echo_trajectories
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+from file_parsing import echomaster_file, echosyngo_file
+from timelines import load_anchor_dates
+
+# The path to the Amyloid data
+BASE = Path("/data/datasets/Amyloidosis/")
+PULL_2023 = BASE / "2023 pull"
+
+# Values are read at these offsets (years before the anchor), from the nearest
+# study at most OFFSET_TOLERANCE_DAYS away
+OFFSETS_YEARS = (0.5, 1, 2, 3, 5)
+OFFSET_TOLERANCE_DAYS = 180
+DAYS_PER_YEAR = 365.25
+KEYS = ["ir_id", "study_uid", "accession_num"]
+
+
+def _offset_label(years: float) -> str:
+    return f"{round(years * 12)}m" if years < 1 else f"{years:g}y"
+
+
+def grouped_trajectories(
+    ir_id: np.ndarray,
+    measurement: np.ndarray,
+    days: np.ndarray,
+    value: np.ndarray,
+    offsets_years: Sequence[float] = OFFSETS_YEARS,
+    tolerance_days: int = OFFSET_TOLERANCE_DAYS,
+) -> pd.DataFrame:
+    """Trajectory summaries of every (patient, measurement) series.
+
+    Args:
+        ir_id (np.ndarray): patient of every observation
+        measurement (np.ndarray): integer measurement id of every observation
+        days (np.ndarray): days from the anchor, negative before it
+        value (np.ndarray): observed value, no NaN
+        offsets_years (Sequence[float], optional): offsets before the anchor.
+            Defaults to OFFSETS_YEARS.
+        tolerance_days (int, optional): max distance of the study used for an
+            offset. Defaults to OFFSET_TOLERANCE_DAYS.
+
+    Returns:
+        pd.DataFrame: one row per series with ir_id, measurement_id, n_studies,
+            first_days, last_days, first_value, last_value, change_from_first,
+            slope_per_year (NaN without two distinct dates), value_at_anchor and
+            value_<offset> for every offset
+    """
+    ir_id = np.asarray(ir_id, dtype=np.int64)
+    measurement = np.asarray(measurement, dtype=np.int64)
+    days = np.asarray(days, dtype=np.int64)
+    value = np.asarray(value, dtype=np.float64)
+    order = np.lexsort((days, measurement, ir_id))
+    ir_id, measurement, days, value = (
+        ir_id[order],
+        measurement[order],
+        days[order],
+        value[order],
+    )
+
+    new = np.ones(len(ir_id), dtype=bool)
+    if not len(ir_id):
+        # no observations, keep the columns
+        return grouped_trajectories([0], [0], [0], [0.0], offsets_years).iloc[:0]
+    new[1:] = (ir_id[1:] != ir_id[:-1]) | (measurement[1:] != measurement[:-1])
+    starts = np.flatnonzero(new)
+    ends = np.append(starts[1:], len(ir_id)) - 1
+    group = np.cumsum(new) - 1
+
+    # least squares over the sums of each series, t in years
+    t = days / DAYS_PER_YEAR
+    n = np.diff(np.append(starts, len(ir_id))).astype(float)
+    sum_t, sum_y = np.add.reduceat(t, starts), np.add.reduceat(value, starts)
+    sum_tt = np.add.reduceat(t * t, starts)
+    sum_ty = np.add.reduceat(t * value, starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        denominator = n * sum_tt - sum_t**2
+        slope = np.where(
+            denominator > 1e-12, (n * sum_ty - sum_t * sum_y) / denominator, np.nan
+        )
+        intercept = np.where(np.isnan(slope), np.nan, (sum_y - slope * sum_t) / n)
+
+    result = pd.DataFrame(
+        {
+            "ir_id": ir_id[starts],
+            "measurement_id": measurement[starts],
+            "n_studies": n.astype(np.int32),
+            "first_days": days[starts],
+            "last_days": days[ends],
+            "first_value": value[starts],
+            "last_value": value[ends],
+            "change_from_first": value[ends] - value[starts],
+            "slope_per_year": slope,
+            "value_at_anchor": intercept,
+        }
+    )
+
+    # nearest study to every offset: search (series, days) in one sorted key
+    shift = np.int64(1) << 31
+    key = (group.astype(np.int64) << 32) | (days + shift)
+    for years in offsets_years:
+        target = (np.arange(len(starts), dtype=np.int64) << 32) | (
+            -round(years * DAYS_PER_YEAR) + shift
+        )
+        right = np.searchsorted(key, target).clip(starts, ends)
+        left = (right - 1).clip(starts, ends)
+        distance_left = np.abs(key[left] - target)
+        distance_right = np.abs(key[right] - target)
+        nearest = np.where(distance_left <= distance_right, left, right)
+        distance = np.minimum(distance_left, distance_right)
+        result[f"value_{_offset_label(years)}"] = np.where(
+            distance <= tolerance_days, value[nearest], np.nan
+        )
+    return result
+
+
+def partition_trajectories(
+    partition: Path,
+    studies: pd.DataFrame,
+    anchors: pd.DataFrame,
+    measurements: List[str] | None = None,
+    before_anchor_only: bool = True,
+    offsets_years: Sequence[float] = OFFSETS_YEARS,
+    tolerance_days: int = OFFSET_TOLERANCE_DAYS,
+) -> pd.DataFrame:
+    """Trajectories of the patients of one echosyngo partition.
+
+    Args:
+        partition (Path): echosyngo partition directory (bucket=NNN)
+        studies (pd.DataFrame): echomaster study_uid, accession_num and echo_date
+        anchors (pd.DataFrame): ir_id and anchor_date, one per patient
+        measurements (List[str], optional): measurement columns. Defaults to all.
+        before_anchor_only (bool, optional): only use studies on or before the
+            anchor. Defaults to True.
+        offsets_years (Sequence[float], optional): Defaults to OFFSETS_YEARS.
+        tolerance_days (int, optional): Defaults to OFFSET_TOLERANCE_DAYS.
+
+    Returns:
+        pd.DataFrame: see grouped_trajectories, with the measurement name
+            (categorical) in place of measurement_id
+    """
+    columns = None if measurements is None else KEYS + list(measurements)
+    wide = pq.read_table(partition, columns=columns).to_pandas()
+    names = [c for c in wide.columns if c not in KEYS]
+
+    by_uid = studies.dropna(subset=["study_uid"]).drop_duplicates("study_uid")
+    by_accession = studies.dropna(subset=["accession_num"]).drop_duplicates(
+        "accession_num"
+    )
+    echo_date = wide["study_uid"].map(by_uid.set_index("study_uid")["echo_date"])
+    echo_date = echo_date.fillna(
+        wide["accession_num"].map(by_accession.set_index("accession_num")["echo_date"])
+    )
+    anchor_date = wide["ir_id"].map(anchors.set_index("ir_id")["anchor_date"])
+    days = (echo_date - anchor_date).dt.days.to_numpy(dtype=float, na_value=np.nan)
+
+    values = wide[names].to_numpy(dtype=np.float32, na_value=np.nan)
+    keep_study = ~np.isnan(days)
+    if before_anchor_only:
+        keep_study &= days <= 0
+    row, column = np.nonzero(~np.isnan(values) & keep_study[:, None])
+    result = grouped_trajectories(
+        wide["ir_id"].to_numpy()[row],
+        column,
+        days[row],
+        values[row, column],
+        offsets_years,
+        tolerance_days,
+    )
+    result.insert(
+        1,
+        "measurement",
+        pd.Categorical.from_codes(result.pop("measurement_id"), categories=names),
+    )
+    return result
+
+
+def _run_partition(args) -> pd.DataFrame:
+    partition, studies, anchors, kwargs = args
+    return partition_trajectories(partition, studies, anchors, **kwargs)
+
+
+def build_trajectories(
+    anchors: pd.DataFrame,
+    out_path: Path,
+    echosyngo_path: Path = echosyngo_file.echosyngo_path,
+    echomaster_path: Path = echomaster_file.echomaster_path,
+    n_buckets: int = echosyngo_file.N_BUCKETS,
+    jobs: int | None = None,
+    **kwargs,
+) -> None:
+    """Computes the trajectories of every partition in parallel.
+
+    Args:
+        anchors (pd.DataFrame): ir_id and anchor_date, see timelines.load_anchor_dates
+        out_path (Path): output parquet
+        echosyngo_path (Path, optional): Defaults to echosyngo_file.echosyngo_path.
+        echomaster_path (Path, optional): Defaults to echomaster_file.echomaster_path.
+        n_buckets (int, optional): buckets the echosyngo dataset was written with,
+            see echosyngo_file.csv_to_parquet. Defaults to echosyngo_file.N_BUCKETS.
+        jobs (int, optional): worker processes. Defaults to None (executor default).
+        **kwargs: passed to partition_trajectories
+    """
+    studies = pd.read_parquet(
+        Path(echomaster_path).with_suffix(".parquet"),
+        columns=["ir_id", "study_uid", "accession_num", "echo_date"],
+    )
+    # the earliest anchor of a patient, trajectories lead up to the diagnosis
+    anchors = anchors.sort_values("anchor_date").drop_duplicates("ir_id")
+    dataset = Path(echosyngo_path).with_suffix(".parquet")
+    partitions = sorted(dataset.glob("bucket=*"))
+
+    # every worker only gets the studies and anchors of its own bucket
+    def bucket(ir_ids: pd.Series) -> np.ndarray:
+        return (ir_ids.to_numpy() % n_buckets).astype(int)
+
+    studies_by_bucket: Dict[int, pd.DataFrame] = dict(
+        tuple(studies.groupby(bucket(studies.ir_id)))
+    )
+    anchors_by_bucket: Dict[int, pd.DataFrame] = dict(
+        tuple(anchors.groupby(bucket(anchors.ir_id)))
+    )
+    tasks = []
+    for partition in partitions:
+        b = int(partition.name.split("=")[1])
+        if b in anchors_by_bucket:
+            bucket_studies = studies_by_bucket.get(b, studies.iloc[:0])
+            tasks.append((partition, bucket_studies, anchors_by_bucket[b], kwargs))
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        frames = list(pool.map(_run_partition, tasks))
+
+    trajectories = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    if len(trajectories):
+        trajectories["measurement"] = trajectories["measurement"].astype("category")
+    trajectories.to_parquet(out_path, index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--anchor", default="final__amyloid_diagnosis_date")
+    parser.add_argument(
+        "--out", type=Path, default=PULL_2023 / "echo_trajectories.parquet"
+    )
+    parser.add_argument("--n-buckets", type=int, default=echosyngo_file.N_BUCKETS)
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("--include-after-anchor", action="store_true")
+    parser.add_argument("measurements", nargs="*", help="Defaults to all")
+    args = parser.parse_args()
+
+    build_trajectories(
+        load_anchor_dates(args.anchor),
+        args.out,
+        n_buckets=args.n_buckets,
+        jobs=args.jobs,
+        measurements=args.measurements or None,
+        before_anchor_only=not args.include_after_anchor,
+    )
@@ -3,6 +3,12 @@ import pandas as pd
 import numpy as np
 from pathlib import Path
 
+try:
+    from . import categories, instrument
+except ImportError:
+    import categories
+    import instrument
+
 # The path to the Amyloid data
 BASE = Path("/data/datasets/Amyloidosis/")
 PULL_2023 = BASE / "2023 pull"
@@ -10,15 +16,20 @@ PULL_2023 = BASE / "2023 pull"
 cardiac_mri_path = PULL_2023 / "Amyloidosis Patients Cardiac MRI 2023"
 
 
-def csv_to_parquet(path: Path = cardiac_mri_path) -> None:
+@instrument.traced
+def csv_to_parquet(
+    path: Path = cardiac_mri_path, vocabulary_dir: Path = categories.VOCABULARY_DIR
+) -> None:
     """Reads CSV, sets dtypes and converts to parquet
 
     Args:
         path (Path, optional): Cardiac MRIs File Path. Defaults to cardiac_mri_path.
+        vocabulary_dir (Path, optional): category vocabularies, see categories.
+            Defaults to categories.VOCABULARY_DIR.
     """
     # Load Cardiac MRIs
 
-    header = pd.read_csv(path.with_suffix(".csv"), sep="|", nrows=1)
+    header = instrument.read_csv(path.with_suffix(".csv"), sep="|", nrows=1)
     names = [name.strip() for name in list(header.columns)]
     assert names == [
         "ir_id",
@@ -28,7 +39,7 @@ def csv_to_parquet(path: Path = cardiac_mri_path) -> None:
     ], "check header"
 
     # Read notes
-    df = pd.read_csv(
+    df = instrument.read_csv(
         path.with_suffix(".csv"),
         sep="|",
         on_bad_lines="warn",
@@ -37,36 +48,45 @@ def csv_to_parquet(path: Path = cardiac_mri_path) -> None:
         skiprows=1,
         engine="python",
         index_col=False,
-        quoting=3, 
+        quoting=3,
     )
 
     # drop the last 2 rows
     df.drop(df.tail(2).index, inplace=True)
 
     # set column dtypes
-    df.ir_id = df.ir_id.astype(int)
-    df.procedure_name = df.procedure_name.astype("string")
-    df.Cardiac_MRI_date = pd.to_datetime(df.Cardiac_MRI_date).dt.date
-    df.Cardiac_MRI_text = df.Cardiac_MRI_text.astype("string")
+    with instrument.span("set_dtypes"):
+        df.ir_id = df.ir_id.astype(int)
+        df.procedure_name = categories.to_category(df.procedure_name, vocabulary_dir)
+        df.Cardiac_MRI_date = instrument.to_datetime(df.Cardiac_MRI_date).dt.date
+        df.Cardiac_MRI_text = df.Cardiac_MRI_text.astype("string")
 
     # sort chronologically so that the aggregation gives us a list of notes information in chronological order
-    df.sort_values(by=["ir_id", "Cardiac_MRI_date"], inplace=True)
+    with instrument.span("sort"):
+        df.sort_values(by=["ir_id", "Cardiac_MRI_date"], inplace=True)
     # Save as parquet
-    df.to_parquet(path.with_suffix(".parquet"))
+    with instrument.span("write_parquet") as span:
+        df.to_parquet(path.with_suffix(".parquet"))
+        span.frame_in(df)
+        span.file_out(path.with_suffix(".parquet"))
 
 
+@instrument.traced
 def load_cardiac_mris(
-    path: Path = cardiac_mri_path,
+    path: Path = cardiac_mri_path, vocabulary_dir: Path = categories.VOCABULARY_DIR
 ) -> pd.DataFrame:
     """Reads Cardiac MRIs parquet into dataframe
 
     Args:
         path (Path, optional): Cardiac MRIs file path. Defaults to cardiac_mri_path.
+        vocabulary_dir (Path, optional): category vocabularies, see categories.
+            Defaults to categories.VOCABULARY_DIR.
 
     Returns:
         pd.DataFrame: Cardiac MRIs dataframe
     """
-    df = pd.read_parquet(path.with_suffix(".parquet"))
+    df = instrument.read_parquet(path.with_suffix(".parquet"))
+    categories.with_vocabularies(df, directory=vocabulary_dir)
     return df
 
 
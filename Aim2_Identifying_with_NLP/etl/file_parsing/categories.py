@@ -0,0 +1,152 @@
+"""Dictionary-encoded string columns with vocabularies that are stable across pulls.
+
+Low cardinality string columns (ICD code type/source/setting, demographics,
+echo type, ...) are stored as pandas categoricals, which parquet writes as
+dictionary-encoded columns. Every column name has a vocabulary file in
+VOCABULARY_DIR. New values are appended to it and existing values keep their
+position, so a value has the same integer code in every table and every pull.
+Group-bys, joins and filters then work on the integer codes, and concatenating
+tables does not fall back to object columns.
+
+Parsers encode a column with to_category. Loaders call with_vocabularies to put
+the categories of the columns they read back in vocabulary order. Read with
+pyarrow (pq.read_table) instead, the same columns are Arrow dictionary arrays.
+"""
+
+import fcntl
+import json
+import os
+import pandas as pd
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, List
+
+try:
+    from . import instrument
+except ImportError:
+    import instrument
+
+# The path to the Amyloid data, vocabularies are shared by all pulls
+BASE = Path("/data/datasets/Amyloidosis/")
+VOCABULARY_DIR = BASE / "vocabularies"
+
+
+def _vocabulary_path(column: str, directory: Path) -> Path:
+    return Path(directory) / f"{column}.json"
+
+
+@contextmanager
+def _locked(directory: Path):
+    # parsers run in parallel processes and share vocabularies (e.g. Gender_EDW)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def load_vocabulary(column: str, directory: Path = VOCABULARY_DIR) -> List[str]:
+    """Stored vocabulary of a column, in code order.
+
+    Args:
+        column (str): column name
+        directory (Path, optional): Defaults to VOCABULARY_DIR.
+
+    Returns:
+        List[str]: empty if the column has no vocabulary yet
+    """
+    path = _vocabulary_path(column, directory)
+    if not path.exists():
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def update_vocabulary(
+    column: str, values: Iterable[str], directory: Path = VOCABULARY_DIR
+) -> List[str]:
+    """Appends the new values (sorted) to the vocabulary of a column.
+
+    Args:
+        column (str): column name
+        values (Iterable[str]): distinct values of the column
+        directory (Path, optional): Defaults to VOCABULARY_DIR.
+
+    Returns:
+        List[str]: updated vocabulary
+    """
+    with _locked(directory):
+        vocabulary = load_vocabulary(column, directory)
+        known = set(vocabulary)
+        new = sorted({str(value) for value in values} - known)
+        if new:
+            vocabulary += new
+            path = _vocabulary_path(column, directory)
+            tmp = path.with_suffix(".json.tmp")
+            with open(tmp, "w") as f:
+                json.dump(vocabulary, f, indent=1)
+            os.replace(tmp, path)
+    return vocabulary
+
+
+@instrument.traced
+def to_category(s: pd.Series, directory: Path | None = None) -> pd.Series:
+    """Encodes a string column with the vocabulary of its name.
+
+    Args:
+        s (pd.Series): column, values are converted to strings as with
+            astype("string"), missing values stay missing
+        directory (Path, optional): vocabulary directory. Defaults to
+            VOCABULARY_DIR.
+
+    Returns:
+        pd.Series: categorical with the vocabulary as categories
+    """
+    values = s.astype("string")
+    vocabulary = update_vocabulary(
+        str(s.name), values.dropna().unique(), directory or VOCABULARY_DIR
+    )
+    return pd.Series(
+        pd.Categorical(values, categories=vocabulary), index=s.index, name=s.name
+    )
+
+
+@instrument.traced
+def with_vocabularies(
+    df: pd.DataFrame,
+    columns: Iterable[str] | None = None,
+    directory: Path | None = None,
+) -> pd.DataFrame:
+    """Puts categorical columns read from parquet back in vocabulary order.
+
+    Parquet only keeps the values present in a file, this restores the codes
+    shared by all tables. Values missing from the vocabulary (e.g. a file
+    written with another vocabulary directory) are kept after it.
+
+    Args:
+        df (pd.DataFrame): loaded table, changed in place
+        columns (Iterable[str], optional): columns to restore. Defaults to every
+            categorical column.
+        directory (Path, optional): Defaults to VOCABULARY_DIR.
+
+    Returns:
+        pd.DataFrame: df
+    """
+    directory = directory or VOCABULARY_DIR
+    if columns is None:
+        columns = [
+            c for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)
+        ]
+    for column in columns:
+        if column not in df or not isinstance(df[column].dtype, pd.CategoricalDtype):
+            continue
+        vocabulary = load_vocabulary(column, directory)
+        if not vocabulary:
+            continue
+        present = df[column].cat.categories
+        extra = present[~present.isin(vocabulary)]
+        df[column] = df[column].cat.set_categories(vocabulary + extra.tolist())
+    return df
@@ -2,6 +2,13 @@ import pandas as pd
 import numpy as np
 from pathlib import Path
 
+try:
+    from . import categories, flags, instrument
+except ImportError:
+    import categories
+    import flags
+    import instrument
+
 # The path to the Amyloid data
 BASE = Path("/data/datasets/Amyloidosis/")
 PULL_2023 = BASE / "2023 pull"
@@ -9,45 +16,85 @@ PULL_2023 = BASE / "2023 pull"
 comorbitities_path = PULL_2023 / "Amyloidosis Patients Comorbidities 2023"
 
 
-def csv_to_parquet(path: Path = comorbitities_path) -> None:
+@instrument.traced
+def csv_to_parquet(
+    path: Path = comorbitities_path,
+    active_flags: bool = False,
+    vocabulary_dir: Path = categories.VOCABULARY_DIR,
+) -> None:
     """Reads CSV, sets dtypes and converts to parquet
 
+    Comorbidity flags, the columns with a <name>_date column, are stored as
+    booleans.
+
     Args:
         path (Path, optional): comorbitities file path. Defaults to comorbitities_path.
+        active_flags (bool, optional): also store the list of flags set on each row,
+            see flags.active_flags. Defaults to False.
+        vocabulary_dir (Path, optional): category vocabularies, see categories.
+            Defaults to categories.VOCABULARY_DIR.
     """
     # Load comorbitities
-    df = pd.read_csv(path.with_suffix(".csv"), sep="|", low_memory=False)
+    df = instrument.read_csv(path.with_suffix(".csv"), sep="|", low_memory=False)
     # drop last 2 rows because they contain SQL info
     df.drop(df.tail(2).index, inplace=True)
 
     # Set column dtypes
-    df.ir_id = df.ir_id.astype(int)
-    df.smoking_sh = df.smoking_sh.astype("string")
-    
-    remaining_columns = [c for c in df.columns if c not in ["ir_id", "smoking_sh"]]
-    for column in remaining_columns:
-        if "date" in column.lower():
-            df[column] = pd.to_datetime(df[column])
-        else:
-            df[column] = df[column].astype("Int64")
+    with instrument.span("set_dtypes"):
+        df.ir_id = df.ir_id.astype(int)
+        df.smoking_sh = categories.to_category(df.smoking_sh, vocabulary_dir)
+
+        remaining_columns = [c for c in df.columns if c not in ["ir_id", "smoking_sh"]]
+        for column in remaining_columns:
+            if "date" in column.lower():
+                df[column] = instrument.to_datetime(df[column])
+            elif f"{column}_date" in df.columns:
+                df[column] = flags.to_flag(df[column])
+            else:
+                df[column] = df[column].astype("Int64")
 
     # Save as parquet
-    df.to_parquet(comorbitities_path.with_suffix(".parquet"))
+    with instrument.span("write_parquet") as span:
+        flags.to_parquet(df, path.with_suffix(".parquet"), flags_list=active_flags)
+        span.frame_in(df)
+        span.file_out(path.with_suffix(".parquet"))
 
 
-def load_comorbitities(path: Path = comorbitities_path) -> pd.DataFrame:
+@instrument.traced
+def load_comorbitities(
+    path: Path = comorbitities_path, vocabulary_dir: Path = categories.VOCABULARY_DIR
+) -> pd.DataFrame:
     """Reads comorbitities parquet into dataframe
 
     Args:
         path (Path, optional): comorbitities file path. Defaults to comorbitities_path.
+        vocabulary_dir (Path, optional): category vocabularies, see categories.
+            Defaults to categories.VOCABULARY_DIR.
 
     Returns:
         pd.DataFrame: comorbitities dataframe
     """
-    df = pd.read_parquet(path.with_suffix(".parquet"))
+    df = instrument.read_parquet(path.with_suffix(".parquet"))
+    categories.with_vocabularies(df, directory=vocabulary_dir)
     return df
 
 
+@instrument.traced
+def load_comorbitities_flags(
+    path: Path = comorbitities_path, columns: list[str] | None = None
+) -> flags.FlagMatrix:
+    """Reads the comorbidity flags as a bit-packed matrix
+
+    Args:
+        path (Path, optional): comorbitities file path. Defaults to comorbitities_path.
+        columns (list[str], optional): flags to read. Defaults to all.
+
+    Returns:
+        flags.FlagMatrix: flags in the row order of load_comorbitities
+    """
+    return flags.load_flag_matrix(path.with_suffix(".parquet"), columns)
+
+
 if __name__ == "__main__":
     # Load comorbitities csv and save as parquet
     csv_to_parquet(comorbitities_path)
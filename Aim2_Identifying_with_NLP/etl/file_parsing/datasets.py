@@ -1,8 +1,15 @@
 from enum import Enum
 from pathlib import Path
+from typing import List
 import pandas as pd
 
-from text_processing import clean_cardiac_path, clean_pyp
+try:
+    from . import instrument, sections as section_index
+    from .text_processing import clean_cardiac_path, clean_pyp
+except ImportError:
+    import instrument
+    import sections as section_index
+    from text_processing import clean_cardiac_path, clean_pyp
 
 DATASET_PATH = Path("/data/datasets/Amyloidosis/datasets/")
 ANNOTATIONS_PATH = Path("/data/datasets/Amyloidosis/annotations/")
@@ -62,11 +69,15 @@ dataset_config_mapping = {
 }
 
 
-def load_dataset(dataset: Datasets) -> pd.DataFrame:
+@instrument.traced
+def load_dataset(dataset: Datasets, sections: List[str] | None = None) -> pd.DataFrame:
     """Reads dataset csv and outputs dataframe
 
     Args:
         dataset (Datasets): "cardiac_path_reports", "pyp_reports", "mayo_labs", or "hf_subtype"
+        sections (List[str], optional): only keep these sections of the documents
+            (see sections.SECTION_LABELS), read from the section index of the
+            dataset. Defaults to None (whole documents).
 
     Returns:
         pd.DataFrame: dataframe of the dataset
@@ -84,15 +95,29 @@ def load_dataset(dataset: Datasets) -> pd.DataFrame:
     document = dataset_config_mapping[dataset]["document"]
     date = dataset_config_mapping[dataset]["date"]
 
-    df = pd.read_csv(dataset_config_mapping[dataset]["path"])
+    df = instrument.read_csv(dataset_config_mapping[dataset]["path"])
     df["document_ID"] = pd.to_numeric(df["document_ID"])
     df["ir_id"] = pd.to_numeric(df["ir_id"])
-    df[date] = pd.to_datetime(df[date])
+    df[date] = instrument.to_datetime(df[date])
 
-    if dataset == Datasets.CARDIAC_PATH_REPORTS:
-        df["text"] = df[document].apply(lambda x: clean_cardiac_path(x))
-    elif dataset == Datasets.PYP_REPORTS:
-        df["text"] = df[document].apply(lambda x: clean_pyp(x))
+    if sections is not None:
+        index = section_index.load_sections(dataset_config_mapping[dataset]["path"])
+        df[document] = section_index.select_sections(
+            df[document], df["document_ID"], index, sections
+        )
+
+    with instrument.span("clean_text") as span:
+        # documents over the cleaning budget are flagged with their document_ID
+        if dataset == Datasets.CARDIAC_PATH_REPORTS:
+            df["text"] = [
+                clean_cardiac_path(x, doc_id=i)
+                for x, i in zip(df[document], df["document_ID"])
+            ]
+        elif dataset == Datasets.PYP_REPORTS:
+            df["text"] = [
+                clean_pyp(x, doc_id=i) for x, i in zip(df[document], df["document_ID"])
+            ]
+        span.frame_in(df)
 
     """ 
     # this code is for mayo_labs but will change when they have been preprocessed
@@ -112,6 +137,7 @@ def load_dataset(dataset: Datasets) -> pd.DataFrame:
     return df
 
 
+@instrument.traced
 def load_annotations(dataset: Datasets) -> pd.DataFrame:
     """loads annotations for a dataset
 
@@ -135,14 +161,15 @@ def load_annotations(dataset: Datasets) -> pd.DataFrame:
     # read entries, keep relevant columns, change column types
     date = dataset_config_mapping[dataset]["date"]
 
-    df = pd.read_csv(dataset_config_mapping[dataset]["annotations"])
+    df = instrument.read_csv(dataset_config_mapping[dataset]["annotations"])
     df["ir_id"] = pd.to_numeric(df["ir_id"])
     df["document_ID"] = pd.to_numeric(df["document_ID"])
-    df[date] = pd.to_datetime(df[date])
+    df[date] = instrument.to_datetime(df[date])
 
     return df
 
 
+@instrument.traced
 def load_patient_diagnosis(dataset: Datasets) -> pd.DataFrame:
     """loads patient level diagnosis for a dataset
 
@@ -165,9 +192,9 @@ def load_patient_diagnosis(dataset: Datasets) -> pd.DataFrame:
     diagnosis = f"{dataset_prefix}__amyloid_diagnosis"
     diagnosis_date = f"{dataset_prefix}__amyloid_diagnosis_date"
 
-    df = pd.read_csv(dataset_config_mapping[dataset]["patient_diagnosis"])
+    df = instrument.read_csv(dataset_config_mapping[dataset]["patient_diagnosis"])
     df["ir_id"] = pd.to_numeric(df["ir_id"])
     df[diagnosis] = pd.to_numeric(df[diagnosis])
-    df[diagnosis_date] = pd.to_datetime(df[diagnosis_date])
+    df[diagnosis_date] = instrument.to_datetime(df[diagnosis_date])
 
     return df
@@ -2,6 +2,11 @@ import pandas as pd
 import numpy as np
 from pathlib import Path
 
+try:
+    from . import instrument
+except ImportError:
+    import instrument
+
 # The path to the Amyloid data
 DATASET_PATH = Path("/data/datasets/Amyloidosis/")
 
@@ -9,6 +14,7 @@ DATASET_PATH = Path("/data/datasets/Amyloidosis/")
 notes_path = DATASET_PATH / "Amyloidosis Patients OutpatientNotesDeid"
 
 
+@instrument.traced
 def csv_to_parquet(path: Path = notes_path) -> None:
     """Reads CSV, sets dtypes and converts to parquet
 
@@ -16,15 +22,20 @@ def csv_to_parquet(path: Path = notes_path) -> None:
         path (Path, optional): Clinical Notes File Path. Defaults to notes_path.
     """
     # Load DEID Notes
-    df = pd.read_csv(path.with_suffix(".csv"))
-    df.created_date_key = pd.to_datetime(df.created_date_key)
+    df = instrument.read_csv(path.with_suffix(".csv"))
+    df.created_date_key = instrument.to_datetime(df.created_date_key)
     df.deid_note_text = df.deid_note_text.astype("string")
     # sort chronologically so that the aggregation gives us a list of notes information in chronological order
-    df.sort_values(by=["ir_id", "created_date_key"], inplace=True)
+    with instrument.span("sort"):
+        df.sort_values(by=["ir_id", "created_date_key"], inplace=True)
     # Save as parquet
-    df.to_parquet(path.with_suffix(".parquet"))
+    with instrument.span("write_parquet") as span:
+        df.to_parquet(path.with_suffix(".parquet"))
+        span.frame_in(df)
+        span.file_out(path.with_suffix(".parquet"))
 
 
+@instrument.traced
 def load_notes(path: Path = notes_path) -> pd.DataFrame:
     """Reads clinical notes parquet into dataframe
 
@@ -34,7 +45,7 @@ def load_notes(path: Path = notes_path) -> pd.DataFrame:
     Returns:
         pd.DataFrame: Clinical notes dataframe
     """
-    df = pd.read_parquet(path.with_suffix(".parquet"))
+    df = instrument.read_parquet(path.with_suffix(".parquet"))
     return df
 
 
@@ -2,6 +2,12 @@ import pandas as pd
 import numpy as np
 from pathlib import Path
 
+try:
+    from . import categories, instrument
+except ImportError:
+    import categories
+    import instrument
+
 # The path to the Amyloid data
 BASE = Path("/data/datasets/Amyloidosis/")
 PULL_2023 = BASE / "2023 pull"
@@ -9,42 +15,63 @@ PULL_2023 = BASE / "2023 pull"
 demographics_path = PULL_2023 / "Amyloidosis Patients Demographics 2023"
 
 
-def csv_to_parquet(path: Path = demographics_path) -> None:
+@instrument.traced
+def csv_to_parquet(
+    path: Path = demographics_path, vocabulary_dir: Path = categories.VOCABULARY_DIR
+) -> None:
     """Reads CSV, sets dtypes and converts to parquet
 
     Args:
         path (Path, optional): demographics file path. Defaults to demographics_path.
+        vocabulary_dir (Path, optional): category vocabularies, see categories.
+            Defaults to categories.VOCABULARY_DIR.
     """
     # Load demographics
-    df = pd.read_csv(path.with_suffix(".csv"), sep="|", low_memory=False)
+    df = instrument.read_csv(path.with_suffix(".csv"), sep="|", low_memory=False)
     # drop last 2 rows because they contain SQL info
     df.drop(df.tail(2).index, inplace=True)
 
     # Set column dtypes
-    df.ir_id = df.ir_id.astype(int)
-    df.Age_cohort = df.Age_cohort.astype(int)
-    df.Gender_EDW = df.Gender_EDW.astype("string")
-    df.Race_EDW = df.Race_EDW.astype("string")
-    if "Ethnicity_EDW" in df.columns:
-        df.Ethnicity_EDW = df.Ethnicity_EDW.astype("string")
-    df.race_ethncty_combined = df.race_ethncty_combined.astype("string")
-    df.Insurance_EDW_cohort = df.Insurance_EDW_cohort.astype("string")
-    df.Insurance_Mapped_cohort = df.Insurance_Mapped_cohort.astype("string")
+    with instrument.span("set_dtypes"):
+        df.ir_id = df.ir_id.astype(int)
+        df.Age_cohort = df.Age_cohort.astype(int)
+        df.Gender_EDW = categories.to_category(df.Gender_EDW, vocabulary_dir)
+        df.Race_EDW = categories.to_category(df.Race_EDW, vocabulary_dir)
+        if "Ethnicity_EDW" in df.columns:
+            df.Ethnicity_EDW = categories.to_category(df.Ethnicity_EDW, vocabulary_dir)
+        df.race_ethncty_combined = categories.to_category(
+            df.race_ethncty_combined, vocabulary_dir
+        )
+        df.Insurance_EDW_cohort = categories.to_category(
+            df.Insurance_EDW_cohort, vocabulary_dir
+        )
+        df.Insurance_Mapped_cohort = categories.to_category(
+            df.Insurance_Mapped_cohort, vocabulary_dir
+        )
 
     # Save as parquet
-    df.to_parquet(demographics_path.with_suffix(".parquet"))
+    with instrument.span("write_parquet") as span:
+        df.to_parquet(path.with_suffix(".parquet"))
+        span.frame_in(df)
+        span.file_out(path.with_suffix(".parquet"))
 
 
-def load_demographics(path: Path = demographics_path) -> pd.DataFrame:
+@instrument.traced
+def load_demographics(
+    path: Path = demographics_path, vocabulary_dir: Path = categories.VOCABULARY_DIR
+) -> pd.DataFrame:
     """Reads demographics parquet into dataframe
 
     Args:
         path (Path, optional): demographics file path. Defaults to demographics_path.
+        vocabulary_dir (Path, optional): category vocabularies, see categories.
+            Defaults to categories.VOCABULARY_DIR.
 
     Returns:
         pd.DataFrame: demographics dataframe
     """
-    df = pd.read_parquet(path.with_suffix(".parquet"))
+    df = instrument.read_parquet(path.with_suffix(".parquet"))
+    categories.with_vocabularies(df, directory=vocabulary_dir)
     return df
 
 
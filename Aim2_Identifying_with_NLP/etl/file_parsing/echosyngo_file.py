@@ -1,6 +1,18 @@
+import shutil
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 from pathlib import Path
+from typing import Dict, List
+
+try:
+    from . import instrument
+except ImportError:
+    import instrument
 
 # The path to the Amyloid data
 BASE = Path("/data/datasets/Amyloidosis/")
@@ -8,35 +20,291 @@ PULL_2023 = BASE / "2023 pull"
 
 echosyngo_path = PULL_2023 / "Amyloidosis Patients EchoSyngo 2023"
 
+# The extract is long, one row per measurement of a study. A study is joined to
+# echomaster on study_uid/accession_num.
+KEY_COLUMNS = ["patient_ir_id", "study_uid", "accession_num"]
+NAME_COLUMN = "measurement_name"
+VALUE_COLUMN = "measurement_value"
+UNIT_COLUMN = "measurement_unit"
+
+# Written inside the dataset directory, the leading _ hides it from the dataset
+MEASUREMENTS_NAME = "_measurements.parquet"
+# Patients are hashed into buckets, one bucket is pivoted in memory at a time
+N_BUCKETS = 64
+BLOCK_SIZE = 64 << 20
+
+SPILL_SCHEMA = pa.schema(
+    [
+        ("ir_id", pa.int64()),
+        ("study_uid", pa.string()),
+        ("accession_num", pa.string()),
+        ("measurement_id", pa.int16()),
+        ("value", pa.float32()),
+    ]
+)
+
+
+class MeasurementDictionary:
+    """Measurement name -> measurement_id, in order of first appearance."""
+
+    def __init__(self):
+        self.names = pd.Index([], dtype=object)
+        self.units: List[Dict[str, int]] = []
+        self.n_values = np.zeros(0, dtype=np.int64)
+
+    def encode(self, names: pa.Array, units: pa.Array | None) -> np.ndarray:
+        if isinstance(names, pa.ChunkedArray):
+            names = names.combine_chunks()
+        encoded = pc.dictionary_encode(names)
+        batch_names = pd.Index(encoded.dictionary.to_pylist(), dtype=object)
+        new = batch_names[self.names.get_indexer(batch_names) < 0]
+        if len(self.names) + len(new) > np.iinfo(np.int16).max:
+            raise Exception("Too many measurement names for an int16 id")
+        self.names = self.names.append(new)
+        self.units += [{} for _ in new]
+        self.n_values = np.concatenate([self.n_values, np.zeros(len(new), np.int64)])
+
+        ids = self.names.get_indexer(batch_names)[encoded.indices.to_numpy()]
+        self.n_values += np.bincount(ids, minlength=len(self.names))
+        if units is not None:
+            pairs = pd.DataFrame({"id": ids, "unit": units.to_pandas()}).dropna()
+            for (i, unit), n in pairs.value_counts().items():
+                self.units[i][unit] = self.units[i].get(unit, 0) + n
+        return ids.astype(np.int16)
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(
+            {
+                "measurement_id": np.arange(len(self.names), dtype=np.int16),
+                "measurement_name": pd.Series(self.names, dtype="string"),
+                # most common unit first
+                "units": [
+                    ",".join(sorted(units, key=units.get, reverse=True))
+                    for units in self.units
+                ],
+                "n_values": self.n_values,
+            }
+        )
+
+
+def _spill(
+    path: Path, spill_dir: Path, n_buckets: int, block_size: int
+) -> pd.DataFrame:
+    # Pass 1: stream the csv into long per-bucket files with integer measurement ids
+    # the 2 SQL footer rows don't have the columns of the table, skip them
+    parse_options = pv.ParseOptions(
+        delimiter="|", invalid_row_handler=lambda row: "skip"
+    )
+    header = pv.open_csv(path, parse_options=parse_options).schema.names
+    columns = KEY_COLUMNS + [NAME_COLUMN, VALUE_COLUMN]
+    columns += [UNIT_COLUMN] if UNIT_COLUMN in header else []
+    reader = pv.open_csv(
+        path,
+        read_options=pv.ReadOptions(block_size=block_size),
+        parse_options=parse_options,
+        convert_options=pv.ConvertOptions(
+            include_columns=columns,
+            column_types={c: pa.string() for c in columns},
+        ),
+    )
+    dictionary = MeasurementDictionary()
+    writers = {}
+    try:
+        for batch in reader:
+            ir_id = pd.to_numeric(batch["patient_ir_id"].to_pandas(), errors="coerce")
+            value = pd.to_numeric(batch[VALUE_COLUMN].to_pandas(), errors="coerce")
+            keep = (
+                ir_id.notna()
+                & value.notna()
+                & batch[NAME_COLUMN].is_valid().to_numpy(zero_copy_only=False)
+            ).to_numpy()
+            if not keep.any():
+                continue
+            batch = batch.filter(pa.array(keep))
+            ids = dictionary.encode(
+                batch[NAME_COLUMN],
+                batch[UNIT_COLUMN] if UNIT_COLUMN in columns else None,
+            )
+            table = pa.table(
+                [
+                    pa.array(ir_id[keep].to_numpy(np.int64)),
+                    batch["study_uid"],
+                    batch["accession_num"],
+                    pa.array(ids),
+                    pa.array(value[keep].to_numpy(np.float32)),
+                ],
+                schema=SPILL_SCHEMA,
+            )
+            buckets = table["ir_id"].to_numpy() % n_buckets
+            order = np.argsort(buckets, kind="stable")
+            bounds = np.searchsorted(buckets[order], np.arange(n_buckets + 1))
+            table = table.take(order)
+            for bucket in np.flatnonzero(np.diff(bounds)):
+                if bucket not in writers:
+                    writers[bucket] = pq.ParquetWriter(
+                        spill_dir / f"{bucket:03d}.parquet", SPILL_SCHEMA
+                    )
+                writers[bucket].write_table(
+                    table.slice(bounds[bucket], bounds[bucket + 1] - bounds[bucket])
+                )
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return dictionary.to_frame()
+
+
+def pivot_studies(long: pa.Table, n_measurements: int) -> pa.Table:
+    """Pivots long measurements to one row per study.
+
+    Repeated measurements of a study are averaged.
+
+    Args:
+        long (pa.Table): SPILL_SCHEMA rows
+        n_measurements (int): size of the measurement dictionary
+
+    Returns:
+        pa.Table: ir_id, study_uid, accession_num and one float32 column per
+            measurement_id (named by position), sorted by the keys
+    """
+    keys = ["ir_id", "study_uid", "accession_num"]
+    long = long.sort_by([(key, "ascending") for key in keys])
+    new_study = np.zeros(long.num_rows, dtype=bool)
+    new_study[:1] = True
+    for key in keys:
+        values = long[key].to_numpy(zero_copy_only=False)
+        new_study[1:] |= values[1:] != values[:-1]
+    study = np.cumsum(new_study) - 1
+    n_studies = int(study[-1]) + 1 if long.num_rows else 0
+
+    cell = study * n_measurements + long["measurement_id"].to_numpy().astype(np.int64)
+    size = n_studies * n_measurements
+    counts = np.bincount(cell, minlength=size).reshape(n_studies, n_measurements)
+    sums = np.bincount(cell, weights=long["value"].to_numpy(), minlength=size).reshape(
+        n_studies, n_measurements
+    )
+    with np.errstate(invalid="ignore"):
+        wide = (sums / counts).astype(np.float32)
 
-def csv_to_parquet(path: Path = echosyngo_path) -> None:
-    """Reads CSV, sets dtypes and converts to parquet
+    first = np.flatnonzero(new_study)
+    arrays = [long[key].take(first) for key in keys]
+    arrays += [
+        pa.array(wide[:, j], mask=counts[:, j] == 0) for j in range(n_measurements)
+    ]
+    return pa.table(arrays, names=keys + [str(j) for j in range(n_measurements)])
+
+
+@instrument.traced
+def csv_to_parquet(
+    path: Path = echosyngo_path,
+    n_buckets: int = N_BUCKETS,
+    block_size: int = BLOCK_SIZE,
+) -> None:
+    """Streams the long CSV into a wide, partitioned parquet dataset
+
+    The dataset (path.parquet/) has one row per study with the keys and one
+    float32 column per measurement name, partitioned by ir_id bucket and sorted
+    by ir_id, study_uid, accession_num within each partition. The measurement
+    dictionary (id, name, units, count) is written next to it. Memory is bounded
+    by one csv block and one bucket of studies.
 
     Args:
         path (Path, optional): echosyngo file path. Defaults to echosyngo_path.
+        n_buckets (int, optional): ir_id buckets. Defaults to N_BUCKETS.
+        block_size (int, optional): csv bytes read at a time. Defaults to BLOCK_SIZE.
     """
-    # Load echosyngo
-    df = pd.read_csv(path.with_suffix(".csv"), sep="|", low_memory=False)
-    # drop last 2 rows because they contain SQL info
-    df.drop(df.tail(2).index, inplace=True)
+    out_dir = path.with_suffix(".parquet")
+    tmp_dir = out_dir.with_name(out_dir.name + ".tmp")
+    spill_dir = tmp_dir / "_spill"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    spill_dir.mkdir(parents=True)
+
+    with instrument.span("spill") as span:
+        measurements = _spill(
+            path.with_suffix(".csv"), spill_dir, n_buckets, block_size
+        )
+        span.file_in(path.with_suffix(".csv"))
+        span.set(rows_out=int(measurements.n_values.sum()))
+        span.file_out(spill_dir)
+    names = measurements.measurement_name.tolist()
+    for spill in sorted(spill_dir.glob("*.parquet")):
+        with instrument.span("pivot_studies") as span:
+            long = pq.read_table(spill)
+            wide = pivot_studies(long, len(names))
+            wide = wide.rename_columns(wide.column_names[:3] + names)
+            span.set(rows_in=long.num_rows, rows_out=wide.num_rows)
+        with instrument.span("write_parquet") as span:
+            partition = tmp_dir / f"bucket={spill.stem}"
+            partition.mkdir()
+            pq.write_table(wide, partition / "part-0.parquet")
+            span.set(rows_in=wide.num_rows)
+            span.file_out(partition)
+    shutil.rmtree(spill_dir)
+    measurements.to_parquet(tmp_dir / MEASUREMENTS_NAME, index=False)
 
-    # Save as parquet
-    # df.to_parquet(echosyngo_path.with_suffix(".parquet"))
-    pass
+    # swap in the finished dataset
+    shutil.rmtree(out_dir, ignore_errors=True)
+    tmp_dir.rename(out_dir)
+
+
+@instrument.traced
+def load_measurement_dictionary(path: Path = echosyngo_path) -> pd.DataFrame:
+    """Reads the echosyngo measurement dictionary
+
+    Args:
+        path (Path, optional): echosyngo file path. Defaults to echosyngo_path.
+
+    Returns:
+        pd.DataFrame: measurement_id, measurement_name, units and n_values
+    """
+    return instrument.read_parquet(path.with_suffix(".parquet") / MEASUREMENTS_NAME)
 
 
-def load_echosyngo(path: Path = echosyngo_path) -> pd.DataFrame:
+@instrument.traced
+def load_echosyngo(
+    path: Path = echosyngo_path,
+    measurements: List[str] | None = None,
+    ir_ids: List[int] | None = None,
+    n_buckets: int = N_BUCKETS,
+) -> pd.DataFrame:
     """Reads echosyngo parquet into dataframe
 
     Args:
         path (Path, optional): echosyngo file path. Defaults to echosyngo_path.
+        measurements (List[str], optional): measurement columns to read.
+            Defaults to all.
+        ir_ids (List[int], optional): only these patients, which only reads
+            their buckets. Defaults to all.
+        n_buckets (int, optional): buckets the dataset was written with.
+            Defaults to N_BUCKETS.
 
     Returns:
-        pd.DataFrame: echosyngo dataframe
+        pd.DataFrame: one row per study, ir_id, study_uid, accession_num and
+            float32 measurements
     """
-    df = pd.read_parquet(path.with_suffix(".parquet"))
-    # return df
-    pass
+    columns = None
+    if measurements is not None:
+        columns = ["ir_id", "study_uid", "accession_num"] + list(measurements)
+    filters = None
+    if ir_ids is not None:
+        ir_ids = [int(ir_id) for ir_id in ir_ids]
+        filters = [
+            ("bucket", "in", sorted({f"{ir_id % n_buckets:03d}" for ir_id in ir_ids})),
+            ("ir_id", "in", ir_ids),
+        ]
+    with instrument.span("read_parquet") as span:
+        table = pq.read_table(
+            path.with_suffix(".parquet"),
+            columns=columns,
+            filters=filters,
+            partitioning=ds.partitioning(
+                pa.schema([("bucket", pa.string())]), flavor="hive"
+            ),
+        )
+        if "bucket" in table.column_names:
+            table = table.drop_columns(["bucket"])
+        df = table.to_pandas()
+        span.frame_out(df)
+    return df
 
 
 if __name__ == "__main__":
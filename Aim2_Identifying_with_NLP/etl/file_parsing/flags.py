@@ -0,0 +1,164 @@
+"""Binary flag columns stored as booleans and loaded as a bit-packed matrix.
+
+The EDW extracts carry dozens of 0/1 flag columns (comorbidities, ICD flags of
+the outpatient encounters, cohort entry and label flags). As nullable Int64
+they take 9 bytes a cell. The parsers declare them by name, so the schema does
+not change with the values of a pull, and store them as booleans with to_flag,
+which parquet bit-packs on disk. Optionally a sparse
+active_flags list column holds the names of the flags set on each row.
+
+load_flag_matrix reads the boolean columns straight into a FlagMatrix, one
+bitmap per flag (1 bit per cell, nulls read as False), so cohort filters like
+"any of these comorbidities" are bitwise operations over packed bytes.
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pathlib import Path
+from typing import List, Sequence
+
+try:
+    from . import instrument
+except ImportError:
+    import instrument
+
+ACTIVE_FLAGS_COLUMN = "active_flags"
+
+
+def to_flag(s: pd.Series) -> pd.Series:
+    """Casts a flag column to bool, nullable "boolean" if it has missing values."""
+    values = pd.to_numeric(s, errors="coerce")
+    if values.isna().any():
+        return values.astype("boolean")
+    return values.astype(bool)
+
+
+def active_flags(df: pd.DataFrame, columns: Sequence[str]) -> pa.ListArray:
+    """Sparse per-row list of the flags that are set.
+
+    Args:
+        df (pd.DataFrame): table with boolean flag columns
+        columns (Sequence[str]): flag columns
+
+    Returns:
+        pa.ListArray: list<dictionary<int16, string>> of flag names per row
+    """
+    dense = df[list(columns)].fillna(False).to_numpy(dtype=bool)
+    rows, flags = np.nonzero(dense)
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=len(df)))])
+    names = pa.DictionaryArray.from_arrays(
+        pa.array(flags.astype(np.int16)), pa.array(list(columns), pa.string())
+    )
+    return pa.ListArray.from_arrays(pa.array(offsets, pa.int32()), names)
+
+
+@instrument.traced
+def to_parquet(df: pd.DataFrame, path: Path, flags_list: bool = False) -> None:
+    """Writes a parsed table, optionally with the active_flags list column.
+
+    Args:
+        df (pd.DataFrame): parsed table with boolean flag columns
+        path (Path): parquet path
+        flags_list (bool, optional): add ACTIVE_FLAGS_COLUMN. Defaults to False.
+    """
+    if not flags_list:
+        df.to_parquet(path)
+        return
+    columns = [c for c in df.columns if pd.api.types.is_bool_dtype(df[c])]
+    table = pa.Table.from_pandas(df)
+    # outside the pandas metadata, read_parquet converts it to arrays of names
+    table = table.append_column(ACTIVE_FLAGS_COLUMN, active_flags(df, columns))
+    pq.write_table(table, path)
+
+
+class FlagMatrix:
+    """Bit-packed boolean matrix, one little-endian bitmap per flag."""
+
+    def __init__(self, bits: np.ndarray, names: List[str], n_rows: int):
+        self.bits = bits
+        self.names = list(names)
+        self.n_rows = n_rows
+        self._positions = {name: i for i, name in enumerate(self.names)}
+
+    @classmethod
+    def from_table(cls, table: pa.Table) -> "FlagMatrix":
+        n_bytes = (table.num_rows + 7) // 8
+        bits = np.zeros((table.num_columns, n_bytes), dtype=np.uint8)
+        for i, column in enumerate(table.columns):
+            array = column.combine_chunks()
+            if array.offset % 8 == 0 and len(array):
+                start = array.offset // 8
+                values = np.frombuffer(array.buffers()[1], np.uint8)[
+                    start : start + n_bytes
+                ]
+                if array.null_count:
+                    valid = np.frombuffer(array.buffers()[0], np.uint8)
+                    values = values & valid[start : start + n_bytes]
+                bits[i] = values
+            else:
+                dense = array.fill_null(False).to_numpy(zero_copy_only=False)
+                bits[i] = np.packbits(dense, bitorder="little")
+        # clear the padding bits after the last row
+        if table.num_rows % 8:
+            bits[:, -1] &= np.uint8((1 << (table.num_rows % 8)) - 1)
+        return cls(bits, table.column_names, table.num_rows)
+
+    @property
+    def nbytes(self) -> int:
+        return self.bits.nbytes
+
+    def _unpack(self, bits: np.ndarray) -> np.ndarray:
+        return np.unpackbits(bits, count=self.n_rows, bitorder="little").astype(bool)
+
+    def _select(self, names: Sequence[str] | None) -> np.ndarray:
+        if names is None:
+            return self.bits
+        return self.bits[[self._positions[name] for name in names]]
+
+    def column(self, name: str) -> np.ndarray:
+        """Boolean mask of one flag."""
+        return self._unpack(self.bits[self._positions[name]])
+
+    def any(self, names: Sequence[str] | None = None) -> np.ndarray:
+        """Rows with at least one of the flags set (all flags by default)."""
+        return self._unpack(np.bitwise_or.reduce(self._select(names), axis=0))
+
+    def all(self, names: Sequence[str] | None = None) -> np.ndarray:
+        """Rows with every one of the flags set (all flags by default)."""
+        return self._unpack(np.bitwise_and.reduce(self._select(names), axis=0))
+
+    def count(self, names: Sequence[str] | None = None) -> np.ndarray:
+        """Number of the flags set on every row."""
+        bits = self._select(names)
+        return np.unpackbits(bits, axis=1, count=self.n_rows, bitorder="little").sum(
+            axis=0
+        )
+
+    def to_dense(self) -> np.ndarray:
+        """(n_rows, n_flags) boolean matrix."""
+        return np.unpackbits(
+            self.bits, axis=1, count=self.n_rows, bitorder="little"
+        ).T.astype(bool)
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.to_dense(), columns=self.names)
+
+
+@instrument.traced
+def load_flag_matrix(path: Path, columns: Sequence[str] | None = None) -> FlagMatrix:
+    """Reads the boolean columns of a parsed table into a FlagMatrix.
+
+    Args:
+        path (Path): parquet path
+        columns (Sequence[str], optional): flag columns. Defaults to every
+            boolean column.
+
+    Returns:
+        FlagMatrix: rows in file order
+    """
+    if columns is None:
+        schema = pq.read_schema(path)
+        columns = [f.name for f in schema if pa.types.is_boolean(f.type)]
+    return FlagMatrix.from_table(pq.read_table(path, columns=list(columns)))
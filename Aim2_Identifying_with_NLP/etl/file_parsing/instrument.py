@@ -0,0 +1,376 @@
+"""Timing and memory spans for the ETL parsers and loaders.
+
+Every csv_to_parquet and load_* is a span, and so are its stages (read_csv,
+to_datetime, set_dtypes, sort, write_parquet, read_parquet, ...). A span
+records its wall time, CPU time (all threads of the process), RSS at start and
+end, peak RSS while it was open (sampled by a background thread) and the rows
+and bytes it read and wrote. Finished spans are appended to a JSON-lines file,
+one object per span, from every process that has tracing enabled (pipeline
+steps run in worker processes).
+
+Tracing is off by default, a span is then a shared no-op object. Turn it on
+with enable(path) or with the ETL_TRACE environment variable (a JSON-lines
+path), e.g.
+
+    ETL_TRACE=trace.jsonl python icd_codes_file.py
+
+which prints the summary of its spans when it exits, or
+`python pipeline.py --trace trace.jsonl`, which prints the summary of the trace
+file when the run ends. The summary of any trace file is
+`python -c "import instrument; instrument.print_summary('trace.jsonl')"`. The
+summary groups spans by stage (parent/child names) and gives the self time of
+each stage, the wall time not spent in its child stages.
+"""
+
+import atexit
+import functools
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import pandas as pd
+
+ENV_VAR = "ETL_TRACE"
+# seconds between two RSS samples while a span is open
+SAMPLE_INTERVAL = 0.01
+COUNTS = ("rows_in", "rows_out", "bytes_in", "bytes_out")
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _rss() -> int:
+    """Current resident set size, the peak so far where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _size(path: Path) -> int:
+    path = Path(path)
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+    return path.stat().st_size if path.exists() else 0
+
+
+class _NullSpan:
+    """What span returns when tracing is off."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **counts) -> None:
+        pass
+
+    def add(self, **counts) -> None:
+        pass
+
+    def file_in(self, path: Path) -> None:
+        pass
+
+    def file_out(self, path: Path) -> None:
+        pass
+
+    def frame_in(self, df: pd.DataFrame) -> None:
+        pass
+
+    def frame_out(self, df: pd.DataFrame) -> None:
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span(_NullSpan):
+    """An open span, see span."""
+
+    def __init__(self, tracer: "_Tracer", name: str, attrs: Dict):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.counts = {}
+
+    def __enter__(self):
+        stack = self.tracer.stack
+        self.parent = stack[-1] if stack else None
+        self.stage = f"{self.parent.stage}/{self.name}" if self.parent else self.name
+        self.id = self.tracer.next_id()
+        self.rss_start = self.peak_rss = _rss()
+        stack.append(self)
+        self.tracer.open_spans.append(self)
+        self.start = time.time()
+        self.cpu_start = time.process_time()
+        self.wall_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.wall_start
+        cpu = time.process_time() - self.cpu_start
+        rss_end = _rss()
+        self.tracer.stack.pop()
+        self.tracer.open_spans.remove(self)
+        self.tracer.emit(
+            {
+                "id": self.id,
+                "parent": self.parent.id if self.parent else None,
+                "name": self.name,
+                "stage": self.stage,
+                "pid": os.getpid(),
+                "start": self.start,
+                "wall_s": wall,
+                "cpu_s": cpu,
+                "rss_start": self.rss_start,
+                "rss_end": rss_end,
+                "peak_rss": max(self.peak_rss, rss_end),
+                **{count: self.counts.get(count) for count in COUNTS},
+                "error": exc_type.__name__ if exc_type else None,
+                "attrs": self.attrs,
+            }
+        )
+        return False
+
+    def set(self, **counts) -> None:
+        """Sets rows_in, rows_out, bytes_in and/or bytes_out."""
+        self.counts.update(counts)
+
+    def add(self, **counts) -> None:
+        """Adds to rows_in, rows_out, bytes_in and/or bytes_out."""
+        for count, value in counts.items():
+            self.counts[count] = self.counts.get(count, 0) + int(value)
+
+    def file_in(self, path: Path) -> None:
+        self.add(bytes_in=_size(path))
+
+    def file_out(self, path: Path) -> None:
+        self.add(bytes_out=_size(path))
+
+    def frame_in(self, df: pd.DataFrame) -> None:
+        self.add(rows_in=len(df))
+
+    def frame_out(self, df: pd.DataFrame) -> None:
+        # shallow size, the deep size of object columns costs a pass over the data
+        self.add(rows_out=len(df), bytes_out=df.memory_usage(index=False).sum())
+
+
+class _Tracer:
+    """Open spans, the JSON-lines output and the RSS sampler of this process."""
+
+    def __init__(self, path: Path | None):
+        self.path = Path(path) if path is not None else None
+        self.records: List[Dict] = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.pid = None
+        self.file = None
+        self.counter = 0
+        self.open_spans: List[Span] = []
+
+    @property
+    def stack(self) -> List[Span]:
+        self._check_process()
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def _check_process(self) -> None:
+        # after a fork: new output handle, new sampler thread, no inherited records
+        if self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.records = []
+        self.local = threading.local()
+        self.open_spans = []
+        self.file = None
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.file = open(self.path, "a", buffering=1)
+        threading.Thread(target=self._sample, args=(self.pid,), daemon=True).start()
+
+    def _sample(self, pid: int) -> None:
+        while self.pid == pid and _tracer is self:
+            spans = list(self.open_spans)
+            if spans:
+                rss = _rss()
+                for span in spans:
+                    span.peak_rss = max(span.peak_rss, rss)
+            time.sleep(SAMPLE_INTERVAL)
+
+    def next_id(self) -> str:
+        with self.lock:
+            self.counter += 1
+            return f"{self.pid}-{self.counter}"
+
+    def emit(self, record: Dict) -> None:
+        with self.lock:
+            self.records.append(record)
+            if self.file is not None:
+                self.file.write(json.dumps(record, default=str) + "\n")
+
+
+_tracer: _Tracer | None = None
+
+
+def enable(path: Path | None = None) -> None:
+    """Turns tracing on.
+
+    Args:
+        path (Path, optional): JSON-lines file the spans are appended to, it is
+            also set as ETL_TRACE so that worker processes trace to it.
+            Defaults to None (records are only kept in memory).
+    """
+    global _tracer
+    _tracer = _Tracer(path)
+    if path is not None:
+        os.environ[ENV_VAR] = str(path)
+
+
+def disable() -> None:
+    """Turns tracing off."""
+    global _tracer
+    _tracer = None
+    os.environ.pop(ENV_VAR, None)
+
+
+def enabled() -> bool:
+    return _tracer is not None
+
+
+def span(name: str, **attrs):
+    """A span around a block of code.
+
+        with instrument.span("read_csv", path=str(path)) as span:
+            df = pd.read_csv(path)
+            span.file_in(path)
+            span.frame_out(df)
+
+    Args:
+        name (str): stage name, nested spans are named parent/child
+        **attrs: JSON serializable attributes of the span
+
+    Returns:
+        Span: the no-op NULL_SPAN when tracing is off
+    """
+    if _tracer is None:
+        return NULL_SPAN
+    return Span(_tracer, name, attrs)
+
+
+def traced(func: Callable) -> Callable:
+    """Runs every call of func in a span named module.function.
+
+    The first argument is an attribute of the span when it is a path or a
+    string (e.g. the dataset of datasets.load_dataset).
+    """
+    module = func.__module__.rsplit(".", 1)[-1]
+    name = f"{module}.{func.__name__}"
+    first = func.__code__.co_varnames[0] if func.__code__.co_argcount else None
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _tracer is None:
+            return func(*args, **kwargs)
+        value = kwargs.get(first, args[0] if args else None)
+        attrs = {}
+        if isinstance(value, (str, os.PathLike)):
+            # str.__str__, a str Enum prints as its member name
+            attrs[first] = str.__str__(os.fspath(value))
+        with span(name, **attrs):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def read_csv(path: Path, **kwargs) -> pd.DataFrame:
+    """pd.read_csv in a read_csv span."""
+    with span("read_csv") as s:
+        df = pd.read_csv(path, **kwargs)
+        s.file_in(path)
+        s.frame_out(df)
+    return df
+
+
+def read_parquet(path: Path, **kwargs) -> pd.DataFrame:
+    """pd.read_parquet in a read_parquet span."""
+    with span("read_parquet") as s:
+        df = pd.read_parquet(path, **kwargs)
+        s.file_in(path)
+        s.frame_out(df)
+    return df
+
+
+def to_datetime(s: pd.Series, **kwargs) -> pd.Series:
+    """pd.to_datetime in a to_datetime span."""
+    with span("to_datetime", column=getattr(s, "name", None)) as t:
+        values = pd.to_datetime(s, **kwargs)
+        t.add(rows_in=len(s))
+    return values
+
+
+def load_trace(path: Path) -> List[Dict]:
+    """Reads the spans of a JSON-lines trace."""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(records: List[Dict] | None = None) -> pd.DataFrame:
+    """Totals by stage.
+
+    Args:
+        records (List[Dict], optional): spans, see load_trace. Defaults to the
+            spans of this process.
+
+    Returns:
+        pd.DataFrame: calls, wall, self (wall not in child stages) and CPU
+            seconds, max peak RSS, rows and bytes in and out by stage
+    """
+    if records is None:
+        records = _tracer.records if _tracer is not None else []
+    columns = ["calls", "wall_s", "self_s", "cpu_s", "peak_rss_mib", *COUNTS]
+    if not records:
+        return pd.DataFrame(columns=columns).rename_axis("stage")
+    df = pd.DataFrame.from_records(records)
+    child_wall = df.groupby("parent").wall_s.sum()
+    df["self_s"] = df.wall_s - df.id.map(child_wall).fillna(0)
+    df["peak_rss_mib"] = df.peak_rss / 2**20
+    for count in COUNTS:
+        df[count] = pd.to_numeric(df[count]).astype("Int64")
+    summary = df.groupby("stage").agg(
+        calls=("id", "size"),
+        wall_s=("wall_s", "sum"),
+        self_s=("self_s", "sum"),
+        cpu_s=("cpu_s", "sum"),
+        peak_rss_mib=("peak_rss_mib", "max"),
+        **{count: (count, "sum") for count in COUNTS},
+    )
+    return summary[columns]
+
+
+def print_summary(path: Path | None = None) -> None:
+    """Prints the summary of a trace file, or of this process' spans."""
+    summary = summarize(load_trace(path) if path is not None else None)
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(summary.round(3).to_string())
+
+
+def _print_summary_at_exit() -> None:
+    # worker processes inherit ETL_TRACE, only the main process prints (a
+    # spawned worker imports this module before its parent process is known)
+    if multiprocessing.parent_process() is None and _tracer and _tracer.records:
+        print_summary()
+
+
+if os.environ.get(ENV_VAR):
+    enable(Path(os.environ[ENV_VAR]))
+    atexit.register(_print_summary_at_exit)
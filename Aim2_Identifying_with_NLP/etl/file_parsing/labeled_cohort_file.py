@@ -2,96 +2,153 @@ import pandas as pd
 import numpy as np
 from pathlib import Path
 
+try:
+    from . import categories, flags, instrument
+except ImportError:
+    import categories
+    import flags
+    import instrument
+
 # The path to the Amyloid data
 BASE = Path("/data/datasets/Amyloidosis/")
 PULL_2023 = BASE / "2023 pull"
 
 labeled_cohort_file_path = PULL_2023 / "Amyloidosis Patients Cohort Entry - Labeled"
 
+# label source and chart review flags used by the cohort filters
+FLAG_COLUMNS = [
+    "full_chart_review",
+    "label__chart_review",
+    "pyp_or_tafamidis_only",
+    "label__definitive",
+    "label__missing_diagnosis",
+]
+
 
-def csv_to_parquet(path: Path = labeled_cohort_file_path) -> None:
+@instrument.traced
+def csv_to_parquet(
+    path: Path = labeled_cohort_file_path,
+    sql_footer: bool = True,
+    active_flags: bool = False,
+    vocabulary_dir: Path = categories.VOCABULARY_DIR,
+) -> None:
     """Reads CSV, sets dtypes and converts to parquet
 
+    FLAG_COLUMNS are stored as booleans.
+
     Args:
         path (Path, optional): labeled cohort file path. Defaults to labeled_cohort_file_path.
+        sql_footer (bool, optional): whether the CSV ends with 2 rows of SQL info, False for
+            the CSV written by the ETL pipeline. Defaults to True.
+        active_flags (bool, optional): also store the list of flags set on each row,
+            see flags.active_flags. Defaults to False.
+        vocabulary_dir (Path, optional): category vocabularies, see categories.
+            Defaults to categories.VOCABULARY_DIR.
     """
     # Load labeled cohort file
-    df = pd.read_csv(path.with_suffix(".csv"))
-    # drop last 2 rows because they contain SQL info
-    df.drop(df.tail(2).index, inplace=True)
+    df = instrument.read_csv(path.with_suffix(".csv"))
+    if sql_footer:
+        # drop last 2 rows because they contain SQL info
+        df.drop(df.tail(2).index, inplace=True)
 
     # Set column dtypes
-    df.ir_id = df.ir_id.astype(int)
-    df.Age_cohort = df.Age_cohort.astype(int)
-    df.Gender_EDW = df.Gender_EDW.astype("string")
-    df.Race_EDW = df.Race_EDW.astype("string")
-    df.Ethnicity_EDW = df.Ethnicity_EDW.astype("string")
-    df.race_ethncty_combined = df.race_ethncty_combined.astype("string")
-    df.Insurance_EDW_cohort = df.Insurance_EDW_cohort.astype("string")
-    df.Insurance_Mapped_cohort = df.Insurance_Mapped_cohort.astype("string")
-
-    # columns with improper names (e.g. date not in name if date)
-    df.HFrecEF_followupecho = pd.to_datetime(df.HFrecEF_followupecho)
-    
-    # flags for label sources and chart review status
-    df.full_chart_review = df.full_chart_review.astype(int)
-    df.label__chart_review = df.label__chart_review.astype(int)
-    df.pyp_or_tafamidis_only = df.pyp_or_tafamidis_only.astype(int)
-    df.label__definitive = df.label__definitive.astype(int)
-    df.label__missing_diagnosis = df.label__missing_diagnosis.astype(int)
-    
-    remaining_columns = [
-        c
-        for c in df.columns
-        if c
-        not in [
-            "ir_id",
-            "Age_cohort",
-            "Gender_EDW",
-            "Race_EDW",
-            "Ethnicity_EDW",
-            "race_ethncty_combined",
-            "Insurance_EDW_cohort",
-            "Insurance_Mapped_cohort",
-            "HFrecEF_followupecho",
-            "full_chart_review",
-            "label__chart_review",
-            "pyp_or_tafamidis_only",
-            "label__definitive",
-            "label__missing_diagnosis",
+    with instrument.span("set_dtypes"):
+        df.ir_id = df.ir_id.astype(int)
+        df.Age_cohort = df.Age_cohort.astype(int)
+        df.Gender_EDW = categories.to_category(df.Gender_EDW, vocabulary_dir)
+        df.Race_EDW = categories.to_category(df.Race_EDW, vocabulary_dir)
+        df.Ethnicity_EDW = categories.to_category(df.Ethnicity_EDW, vocabulary_dir)
+        df.race_ethncty_combined = categories.to_category(
+            df.race_ethncty_combined, vocabulary_dir
+        )
+        df.Insurance_EDW_cohort = categories.to_category(
+            df.Insurance_EDW_cohort, vocabulary_dir
+        )
+        df.Insurance_Mapped_cohort = categories.to_category(
+            df.Insurance_Mapped_cohort, vocabulary_dir
+        )
+
+        # columns with improper names (e.g. date not in name if date)
+        df.HFrecEF_followupecho = instrument.to_datetime(df.HFrecEF_followupecho)
+
+        # flags for label sources and chart review status
+        for column in FLAG_COLUMNS:
+            df[column] = flags.to_flag(df[column])
+
+        remaining_columns = [
+            c
+            for c in df.columns
+            if c
+            not in [
+                "ir_id",
+                "Age_cohort",
+                "Gender_EDW",
+                "Race_EDW",
+                "Ethnicity_EDW",
+                "race_ethncty_combined",
+                "Insurance_EDW_cohort",
+                "Insurance_Mapped_cohort",
+                "HFrecEF_followupecho",
+                *FLAG_COLUMNS,
+            ]
         ]
-    ]
-    for column in remaining_columns:
-        if "date" in column.lower():
-            # rounding to microseconds because some of the cols in this file are in nanoseconds,
-            # and this causes an issue with pyarrow
-            df[column] = pd.to_datetime(df[column]).dt.round("us")
-        elif any(word in column.lower() for word in ["code", "label"]):
-            df[column] = df[column].astype("string")
-        elif "cohort_entry" in column.lower():
-            df[column] = df[column].astype("Int64")
-        elif "patient_group" in column.lower():
-            df[column] = df[column].astype(bool)
-        else:
-            df[column] = df[column].astype("Int64")
+        for column in remaining_columns:
+            if "date" in column.lower():
+                # rounding to microseconds because some of the cols in this file are in nanoseconds,
+                # and this causes an issue with pyarrow
+                df[column] = instrument.to_datetime(df[column]).dt.round("us")
+            elif any(word in column.lower() for word in ["code", "label"]):
+                df[column] = df[column].astype("string")
+            elif "cohort_entry" in column.lower():
+                df[column] = df[column].astype("Int64")
+            elif "patient_group" in column.lower():
+                df[column] = df[column].astype(bool)
+            else:
+                df[column] = df[column].astype("Int64")
 
     # Save as parquet
-    df.to_parquet(labeled_cohort_file_path.with_suffix(".parquet"))
+    with instrument.span("write_parquet") as span:
+        flags.to_parquet(df, path.with_suffix(".parquet"), flags_list=active_flags)
+        span.frame_in(df)
+        span.file_out(path.with_suffix(".parquet"))
 
 
-def load_labeled_cohort(path: Path = labeled_cohort_file_path) -> pd.DataFrame:
+@instrument.traced
+def load_labeled_cohort(
+    path: Path = labeled_cohort_file_path,
+    vocabulary_dir: Path = categories.VOCABULARY_DIR,
+) -> pd.DataFrame:
     """Reads labeled cohort file parquet into dataframe
 
     Args:
         path (Path, optional): labeled cohort file path. Defaults to labeled_cohort_file_path.
+        vocabulary_dir (Path, optional): category vocabularies, see categories.
+            Defaults to categories.VOCABULARY_DIR.
 
     Returns:
         pd.DataFrame: labeled cohort file dataframe
     """
-    df = pd.read_parquet(path.with_suffix(".parquet"))
+    df = instrument.read_parquet(path.with_suffix(".parquet"))
+    categories.with_vocabularies(df, directory=vocabulary_dir)
     return df
 
 
+@instrument.traced
+def load_labeled_cohort_flags(
+    path: Path = labeled_cohort_file_path, columns: list[str] | None = None
+) -> flags.FlagMatrix:
+    """Reads the boolean flags of the labeled cohort file as a bit-packed matrix
+
+    Args:
+        path (Path, optional): labeled cohort file path. Defaults to labeled_cohort_file_path.
+        columns (list[str], optional): flags to read. Defaults to all.
+
+    Returns:
+        flags.FlagMatrix: flags in the row order of load_labeled_cohort
+    """
+    return flags.load_flag_matrix(path.with_suffix(".parquet"), columns)
+
+
 if __name__ == "__main__":
     # Load labeled cohort file csv and save as parquet
     csv_to_parquet(labeled_cohort_file_path)
@@ -2,57 +2,81 @@ import pandas as pd
 import numpy as np
 from pathlib import Path
 
+try:
+    from . import flags, instrument
+except ImportError:
+    import flags
+    import instrument
+
 # The path to the Amyloid data
 BASE = Path("/data/datasets/Amyloidosis/")
 PULL_2023 = BASE / "2023 pull"
 
 outpt_encounters_path = PULL_2023 / "Amyloidosis Patients Outpt Clinic Encounters 2023"
 
+# 0/1 columns besides the digit-named ICD flags
+FLAG_COLUMNS = [
+    "Cards_encounter_filter",
+    "PCP_encounter_filter",
+    "pregnancy_flag",
+    "telehealth_flag",
+]
+
 
-def csv_to_parquet(path: Path = outpt_encounters_path) -> None:
+@instrument.traced
+def csv_to_parquet(
+    path: Path = outpt_encounters_path, active_flags: bool = False
+) -> None:
     """Reads CSV, sets dtypes and converts to parquet
 
+    FLAG_COLUMNS and the digit-named ICD flags are stored as booleans.
+
     Args:
         path (Path, optional): outpt encounters file path. Defaults to outpt_encounters_path.
+        active_flags (bool, optional): also store the list of flags set on each row,
+            see flags.active_flags. Defaults to False.
     """
     # Load outpt_encounters
-    df = pd.read_csv(path.with_suffix(".csv"), sep="|", low_memory=False)
+    df = instrument.read_csv(path.with_suffix(".csv"), sep="|", low_memory=False)
     # drop last 2 rows because they contain SQL info
     df.drop(df.tail(2).index, inplace=True)
 
     # Set column dtypes
-    integers = [
-        "ir_id",
-        "enc_type",
-        "enc_id",
-        "encounter_outpatient_key",
-        "Cards_encounter_filter",
-        "PCP_encounter_filter",
-        "pregnancy_flag"
-    ]
-    strings = [
-        "telehealth_reason", "Telehealth_Visit_type"
-    ]
-    floats = ["height", "weight", "bmi"]
-
-    for column in df.columns:
-        # dates as datetime
-        if column in integers:
-            df[column] = df[column].astype(int)
-        elif "date" in column.lower():
-            df[column] = pd.to_datetime(df[column])
-        # ICD codes as string
-        elif "code" in column.lower() or column.isdigit() or column in strings:
-            df[column] = df[column].astype("string")
-        elif column in floats:
-            df[column] = df[column].astype(float)
-        else:
-            df[column] = df[column].astype("Int64")
+    with instrument.span("set_dtypes"):
+        integers = [
+            "ir_id",
+            "enc_type",
+            "enc_id",
+            "encounter_outpatient_key",
+        ]
+        strings = ["telehealth_reason", "Telehealth_Visit_type"]
+        floats = ["height", "weight", "bmi"]
+
+        for column in df.columns:
+            # dates as datetime
+            if column in integers:
+                df[column] = df[column].astype(int)
+            elif "date" in column.lower():
+                df[column] = instrument.to_datetime(df[column])
+            elif column in floats:
+                df[column] = df[column].astype(float)
+            # 0/1 flags as booleans
+            elif column in FLAG_COLUMNS or column.isdigit():
+                df[column] = flags.to_flag(df[column])
+            # ICD codes as string
+            elif "code" in column.lower() or column in strings:
+                df[column] = df[column].astype("string")
+            else:
+                df[column] = df[column].astype("Int64")
 
     # Save as parquet
-    df.to_parquet(outpt_encounters_path.with_suffix(".parquet"))
+    with instrument.span("write_parquet") as span:
+        flags.to_parquet(df, path.with_suffix(".parquet"), flags_list=active_flags)
+        span.frame_in(df)
+        span.file_out(path.with_suffix(".parquet"))
 
 
+@instrument.traced
 def load_outpt_encounters(path: Path = outpt_encounters_path) -> pd.DataFrame:
     """Reads outpt encounters parquet into dataframe
 
@@ -62,10 +86,26 @@ def load_outpt_encounters(path: Path = outpt_encounters_path) -> pd.DataFrame:
     Returns:
         pd.DataFrame: outpt encounters dataframe
     """
-    df = pd.read_parquet(path.with_suffix(".parquet"))
+    df = instrument.read_parquet(path.with_suffix(".parquet"))
     return df
 
 
+@instrument.traced
+def load_outpt_encounters_flags(
+    path: Path = outpt_encounters_path, columns: list[str] | None = None
+) -> flags.FlagMatrix:
+    """Reads the boolean flags of the outpt encounters as a bit-packed matrix
+
+    Args:
+        path (Path, optional): outpt encounters file path. Defaults to outpt_encounters_path.
+        columns (list[str], optional): flags to read. Defaults to all.
+
+    Returns:
+        flags.FlagMatrix: flags in the row order of load_outpt_encounters
+    """
+    return flags.load_flag_matrix(path.with_suffix(".parquet"), columns)
+
+
 if __name__ == "__main__":
     # Load outpt encounters csv and save as parquet
     csv_to_parquet(outpt_encounters_path)
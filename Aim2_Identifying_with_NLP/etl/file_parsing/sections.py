@@ -0,0 +1,337 @@
+"""Section index of the reports and notes, a parquet sidecar of every source.
+
+Cardiac path, PYP and cardiac MRI reports and outpatient notes are made of
+headed sections (CLINICAL HISTORY:, FINAL DIAGNOSIS:, IMPRESSION:, ...).
+build_section_index segments every document of a source once and writes the
+sections as character offsets into the stored text, with a normalized label
+(see SECTION_HEADERS), to sections_path(source):
+
+    doc_id, section, label, header, start, body_start, end, doc_length
+
+doc_id is the document_ID of a report, or the row number of a parquet source
+(the note_index of note_dedup for the notes). Text before the first header is
+a "preamble" section. Keyword matching and inference can then read only the
+sections they need:
+
+    index = sections.load_sections(path)
+    texts = sections.select_sections(df.reg1, df.document_ID, index, ["impression"])
+
+or datasets.load_dataset(dataset, sections=["impression"]). A document without
+any headed section is kept whole.
+
+Usage:
+    python sections.py SOURCE --column TEXT_COLUMN [--id-column document_ID]
+"""
+
+import argparse
+import re
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pathlib import Path
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+try:
+    from . import instrument
+except ImportError:
+    import instrument
+
+SECTIONS_SUFFIX = ".sections.parquet"
+BATCH_SIZE = 1 << 14
+PREAMBLE = "preamble"
+
+# normalized label -> headers, matched case-insensitively and followed by a colon
+SECTION_HEADERS: Dict[str, List[str]] = {
+    "history": [
+        "clinical history",
+        "clinical information",
+        "clinical data",
+        "clinical indication",
+        "history of present illness",
+        "history",
+        "hpi",
+        "indications",
+        "indication",
+        "reason for exam",
+        "subjective",
+    ],
+    "specimen": ["specimens", "specimen", "source"],
+    "technique": ["exam", "procedure", "technique", "comparison"],
+    "findings": [
+        "findings",
+        "physical examination",
+        "physical exam",
+        "gross description",
+        "microscopic description",
+        "microscopic",
+        "results",
+        "result",
+        "objective",
+    ],
+    "review_of_systems": ["review of systems", "ros"],
+    "impression": [
+        "final pathologic diagnosis",
+        "final diagnosis",
+        "pathologic diagnosis",
+        "diagnoses",
+        "diagnosis",
+        "impression",
+        "conclusions",
+        "conclusion",
+        "interpretation",
+        "assessment and plan",
+        "assessment",
+        "summary",
+    ],
+    "plan": ["recommendations", "recommendation", "plan"],
+    # no "note": a Note: qualifies the section it follows (e.g. the amyloid
+    # typing after a final diagnosis)
+    "comment": ["comments", "comment"],
+}
+SECTION_LABELS = [PREAMBLE, *SECTION_HEADERS]
+LABEL_DTYPE = pd.CategoricalDtype(SECTION_LABELS)
+
+_LABEL_OF = {
+    header: label for label, headers in SECTION_HEADERS.items() for header in headers
+}
+
+
+def _alternatives(headers: List[str]) -> str:
+    # longest headers first, so FINAL DIAGNOSIS wins over DIAGNOSIS
+    return "|".join(
+        re.escape(h).replace(r"\ ", r"\s+")
+        for h in sorted(headers, key=len, reverse=True)
+    )
+
+
+_MULTI_WORD = [h for h in _LABEL_OF if " " in h]
+_SINGLE_WORD = [h for h in _LABEL_OF if " " not in h]
+# A multi-word header follows a non letter, or is stuck to the end of the
+# previous sentence ("biopsyCLINICAL HISTORY:", see text_processing._fix_clinical).
+# Single words are common in prose ("Note: BP high", "Source: patient"), they
+# are headers at the start of a line, or anywhere in upper case (IMPRESSION:).
+_HEADER = re.compile(
+    r"(?:"
+    r"(?:(?<![A-Za-z])|(?<=[a-z])(?=[A-Z]))"
+    r"(?i:(?P<multi_word>" + _alternatives(_MULTI_WORD) + r"))"
+    r"|(?m:^)[ \t]*(?i:(?P<line_start>" + _alternatives(_SINGLE_WORD) + r"))"
+    r"|(?:(?<![A-Za-z])|(?<=[a-z]))"
+    r"(?P<upper_case>" + _alternatives([h.upper() for h in _SINGLE_WORD]) + r")"
+    r")[ \t]*:[-\s]*"
+)
+
+SCHEMA = pa.schema(
+    [
+        ("doc_id", pa.int64()),
+        ("section", pa.int16()),
+        ("label", pa.dictionary(pa.int8(), pa.string())),
+        ("header", pa.string()),
+        ("start", pa.int32()),
+        ("body_start", pa.int32()),
+        ("end", pa.int32()),
+        ("doc_length", pa.int32()),
+    ]
+)
+
+
+def sections_path(path: Path) -> Path:
+    """The section index of a source file, next to it."""
+    path = Path(path)
+    return path.with_name(path.with_suffix("").name + SECTIONS_SUFFIX)
+
+
+def segment(text: str) -> List[Tuple[str, str, int, int, int]]:
+    """Sections of a document.
+
+    Args:
+        text (str): raw document
+
+    Returns:
+        List[Tuple[str, str, int, int, int]]: label, header, start (of the
+            header), body_start and end of every section, in order. Sections
+            are trimmed and empty preambles are dropped.
+    """
+    sections = []
+    previous = None
+    for m in _HEADER.finditer(text):
+        # the one header group that matched, without the indentation of a line
+        start = m.start(m.lastgroup)
+        if previous is not None:
+            sections.append((*previous, start))
+        header = " ".join(m.group(m.lastgroup).lower().split())
+        previous = (_LABEL_OF[header], header, start, m.end())
+    if previous is not None:
+        sections.append((*previous, len(text)))
+    first = sections[0][2] if sections else len(text)
+    if text[:first].strip():
+        sections.insert(0, (PREAMBLE, "", 0, 0, first))
+    trimmed = []
+    for label, header, start, body_start, end in sections:
+        body = text[body_start:end]
+        stripped = body.lstrip()
+        body_start += len(body) - len(stripped)
+        end = body_start + len(stripped.rstrip())
+        if label == PREAMBLE:
+            start = body_start
+        trimmed.append((label, header, start, body_start, end))
+    return trimmed
+
+
+def _iter_documents(
+    path: Path, column: str, id_column: str | None
+) -> Iterator[Tuple[np.ndarray, List[str]]]:
+    # (doc ids, texts) of a csv or parquet source, a batch at a time
+    path = Path(path)
+    if path.suffix == ".csv":
+        usecols = [column] + ([id_column] if id_column else [])
+        start = 0
+        for df in pd.read_csv(path, usecols=usecols, chunksize=BATCH_SIZE):
+            ids = (
+                pd.to_numeric(df[id_column]).to_numpy()
+                if id_column
+                else np.arange(start, start + len(df))
+            )
+            start += len(df)
+            yield ids, df[column].fillna("").astype(str).tolist()
+    else:
+        file = pq.ParquetFile(path.with_suffix(".parquet"))
+        columns = [column] + ([id_column] if id_column else [])
+        start = 0
+        for batch in file.iter_batches(batch_size=BATCH_SIZE, columns=columns):
+            ids = (
+                batch.column(id_column).to_numpy(zero_copy_only=False)
+                if id_column
+                else np.arange(start, start + batch.num_rows)
+            )
+            start += batch.num_rows
+            yield ids, batch.column(column).fill_null("").to_pylist()
+
+
+@instrument.traced
+def build_section_index(
+    path: Path, column: str, id_column: str | None = None, out_path: Path | None = None
+) -> Dict[str, int]:
+    """Segments every document of a source and writes its section index.
+
+    Args:
+        path (Path): csv or parquet source (a path without suffix is read as
+            parquet)
+        column (str): document text column
+        id_column (str, optional): document id column. Defaults to None (row
+            number).
+        out_path (Path, optional): Defaults to sections_path(path).
+
+    Returns:
+        Dict[str, int]: characters of the documents and of each label
+    """
+    out_path = sections_path(path) if out_path is None else Path(out_path)
+    chars = dict.fromkeys(["documents", *SECTION_LABELS], 0)
+    labels = pa.array(SECTION_LABELS)
+    label_code = {label: i for i, label in enumerate(SECTION_LABELS)}
+    with instrument.span("segment") as span, pq.ParquetWriter(
+        out_path, SCHEMA
+    ) as writer:
+        for ids, texts in _iter_documents(path, column, id_column):
+            rows = {name: [] for name in SCHEMA.names}
+            for doc_id, text in zip(ids.tolist(), texts):
+                chars["documents"] += len(text)
+                for i, (label, header, start, body_start, end) in enumerate(
+                    segment(text)
+                ):
+                    rows["doc_id"].append(doc_id)
+                    rows["section"].append(i)
+                    rows["label"].append(label_code[label])
+                    rows["header"].append(header)
+                    rows["start"].append(start)
+                    rows["body_start"].append(body_start)
+                    rows["end"].append(end)
+                    rows["doc_length"].append(len(text))
+                    chars[label] += end - body_start
+            arrays = [
+                (
+                    pa.DictionaryArray.from_arrays(pa.array(values, pa.int8()), labels)
+                    if name == "label"
+                    else pa.array(values, SCHEMA.field(name).type)
+                )
+                for name, values in rows.items()
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=SCHEMA))
+            span.add(rows_in=len(texts), rows_out=len(rows["doc_id"]))
+    return chars
+
+
+@instrument.traced
+def load_sections(path: Path) -> pd.DataFrame:
+    """Reads the section index of a source.
+
+    Args:
+        path (Path): source file path, see sections_path
+
+    Returns:
+        pd.DataFrame: sections, label as a SECTION_LABELS category
+    """
+    df = instrument.read_parquet(sections_path(path))
+    df["label"] = df.label.astype(LABEL_DTYPE)
+    return df
+
+
+def select_sections(
+    texts: Sequence[str],
+    doc_ids: Sequence[int],
+    index: pd.DataFrame,
+    labels: List[str],
+    separator: str = "\n",
+) -> List[str]:
+    """Text of the sections of each document with one of the labels.
+
+    Args:
+        texts (Sequence[str]): raw documents, as segmented
+        doc_ids (Sequence[int]): their doc_id in the index
+        index (pd.DataFrame): see load_sections
+        labels (List[str]): section labels, see SECTION_LABELS
+        separator (str, optional): between two sections. Defaults to "\\n".
+
+    Returns:
+        List[str]: section bodies joined by separator, "" when the document
+            has headed sections but none with the labels, the whole document
+            when it has no headed section
+    """
+    unknown = set(labels) - set(SECTION_LABELS)
+    if unknown:
+        raise ValueError(f"Unknown section labels: {sorted(unknown)}")
+    headed = set(index.doc_id[index.label != PREAMBLE].tolist())
+    selected = index[index.label.isin(labels)]
+    spans: Dict[int, List[Tuple[int, int]]] = {}
+    for doc_id, body_start, end in zip(
+        selected.doc_id.tolist(), selected.body_start.tolist(), selected.end.tolist()
+    ):
+        spans.setdefault(doc_id, []).append((body_start, end))
+    lengths = dict(zip(index.doc_id.tolist(), index.doc_length.tolist()))
+
+    out = []
+    for doc_id, text in zip(doc_ids, texts):
+        text = "" if pd.isna(text) else text
+        if doc_id in lengths and lengths[doc_id] != len(text):
+            raise Exception(
+                f"Section index out of date for document {doc_id}, rebuild it"
+            )
+        if doc_id not in headed:
+            out.append(text)
+        else:
+            out.append(separator.join(text[a:b] for a, b in spans.get(doc_id, ())))
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds the section index of a source")
+    parser.add_argument("path", type=Path, help="csv or parquet source")
+    parser.add_argument("--column", required=True, help="Document text column")
+    parser.add_argument("--id-column", default=None, help="Defaults to the row number")
+    args = parser.parse_args()
+
+    chars = build_section_index(args.path, args.column, args.id_column)
+    total = chars.pop("documents")
+    print(f"{total} characters -> {sections_path(args.path)}")
+    for label, n in sorted(chars.items(), key=lambda item: -item[1]):
+        print(f"{label:20} {n / max(total, 1):6.1%}")
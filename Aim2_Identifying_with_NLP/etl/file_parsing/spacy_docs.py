@@ -0,0 +1,252 @@
+"""spaCy docs of the report datasets, parsed once and cached as DocBins.
+
+parse runs nlp.pipe over the documents that are not in the cache yet and
+stores them in DocBin shards under CACHE_DIR / model_key(nlp), indexed by the
+hash of the document text. The model key holds the model name and version,
+the spaCy version and the enabled components, so a new model or a different
+set of components starts a new cache, and an experiment that parses the same
+texts again only reads the cache. Identical texts are parsed once.
+
+    df, docs = spacy_docs.parse_dataset(Datasets.PYP_REPORTS, SpacyConfig(exclude=("ner",)))
+
+spaCy is imported by the first parse. The cache is not safe for concurrent
+writers, run one parse per cache directory at a time.
+
+Usage:
+    python spacy_docs.py pyp_reports [--model en_core_web_sm] [--batch-size 256]
+        [--n-process 1] [--exclude ner ...] [--sections impression ...]
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Sequence, Tuple
+
+import pandas as pd
+
+try:
+    from . import datasets, instrument
+except ImportError:
+    import datasets
+    import instrument
+
+if TYPE_CHECKING:
+    from spacy.language import Language
+    from spacy.tokens import Doc
+
+CACHE_DIR = Path("/data/datasets/Amyloidosis/spacy_cache/")
+INDEX_NAME = "index.parquet"
+# docs parsed before they are written to a new shard
+SHARD_SIZE = 10_000
+# datasets load_dataset reads, the others raise
+DATASETS = [
+    datasets.Datasets.CARDIAC_PATH_REPORTS,
+    datasets.Datasets.PYP_REPORTS,
+    datasets.Datasets.MAYO_LABS,
+]
+
+
+@dataclass
+class SpacyConfig:
+    model: str = "en_core_web_sm"
+    exclude: Tuple[str, ...] = ()  # components not loaded, e.g. ("ner", "lemmatizer")
+    batch_size: int = 256  # texts per nlp.pipe batch
+    n_process: int = 1  # nlp.pipe worker processes
+
+
+@lru_cache(maxsize=None)
+def load_model(model: str, exclude: Tuple[str, ...] = ()) -> Language:
+    """spacy.load, once per model and excluded components."""
+    import spacy
+
+    return spacy.load(model, exclude=list(exclude))
+
+
+def model_key(nlp: Language) -> str:
+    """Cache directory name of a loaded model and its enabled components."""
+    import spacy
+
+    components = hashlib.blake2b(
+        ",".join(nlp.pipe_names).encode(), digest_size=4
+    ).hexdigest()
+    return (
+        f"{nlp.meta['lang']}_{nlp.meta['name']}-{nlp.meta['version']}"
+        f"-spacy{spacy.__version__}-{components}"
+    )
+
+
+def document_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+class DocCache:
+    """DocBin shards of the docs of a model, with an index hash -> (shard, position)."""
+
+    def __init__(self, nlp: Language, cache_dir: Path = CACHE_DIR):
+        self.nlp = nlp
+        self.dir = Path(cache_dir) / model_key(nlp)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        path = self.dir / INDEX_NAME
+        if path.exists():
+            self.index = pd.read_parquet(path)
+        else:
+            self.index = pd.DataFrame(
+                {
+                    "key": pd.Series(dtype="string"),
+                    "shard": pd.Series(dtype="int32"),
+                    "position": pd.Series(dtype="int32"),
+                }
+            )
+        self.positions: Dict[str, Tuple[int, int]] = dict(
+            zip(
+                self.index.key.tolist(),
+                zip(self.index.shard.tolist(), self.index.position.tolist()),
+            )
+        )
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.positions
+
+    def _shard_path(self, shard: int) -> Path:
+        return self.dir / f"shard-{shard:05d}.spacy"
+
+    def add(self, hashes: List[str], docs: List[Doc]) -> None:
+        """Writes docs to a new shard and adds them to the index."""
+        from spacy.tokens import DocBin
+
+        shard = int(self.index.shard.max()) + 1 if len(self.index) else 0
+        doc_bin = DocBin(store_user_data=False, docs=docs)
+        # the shard is complete before the index references it
+        doc_bin.to_disk(self._shard_path(shard))
+        rows = pd.DataFrame(
+            {
+                "key": pd.Series(hashes, dtype="string"),
+                "shard": pd.Series(shard, index=range(len(hashes)), dtype="int32"),
+                "position": pd.Series(range(len(hashes)), dtype="int32"),
+            }
+        )
+        self.index = pd.concat([self.index, rows], ignore_index=True)
+        self.index.to_parquet(self.dir / INDEX_NAME, index=False)
+        self.positions.update(
+            zip(hashes, ((shard, position) for position in range(len(hashes))))
+        )
+
+    def get(self, hashes: List[str]) -> List[Doc]:
+        """Docs of cached hashes, in order. Each shard is read once."""
+        from spacy.tokens import DocBin
+
+        wanted: Dict[int, List[Tuple[int, int]]] = {}
+        for i, key in enumerate(hashes):
+            shard, position = self.positions[key]
+            wanted.setdefault(shard, []).append((i, position))
+        docs: List[Doc | None] = [None] * len(hashes)
+        for shard, items in wanted.items():
+            shard_docs = list(
+                DocBin().from_disk(self._shard_path(shard)).get_docs(self.nlp.vocab)
+            )
+            for i, position in items:
+                docs[i] = shard_docs[position]
+        return docs
+
+
+@instrument.traced
+def parse(
+    texts: Sequence[str],
+    config: SpacyConfig = SpacyConfig(),
+    cache_dir: Path = CACHE_DIR,
+) -> List[Doc]:
+    """spaCy docs of texts, only the texts missing from the cache are parsed.
+
+    Args:
+        texts (Sequence[str]): documents, missing values are parsed as ""
+        config (SpacyConfig, optional): model, components and nlp.pipe
+            options. Defaults to SpacyConfig().
+        cache_dir (Path, optional): Defaults to CACHE_DIR.
+
+    Returns:
+        List[Doc]: one doc per text
+    """
+    texts = ["" if pd.isna(text) else str(text) for text in texts]
+    nlp = load_model(config.model, tuple(config.exclude))
+    cache = DocCache(nlp, cache_dir)
+    hashes = [document_hash(text) for text in texts]
+    missing = {}
+    for key, text in zip(hashes, texts):
+        if key not in cache and key not in missing:
+            missing[key] = text
+
+    with instrument.span("nlp_pipe", model=model_key(nlp)) as span:
+        span.add(rows_in=len(texts), rows_out=len(missing))
+        todo = list(missing.items())
+        for start in range(0, len(todo), SHARD_SIZE):
+            chunk = todo[start : start + SHARD_SIZE]
+            docs = list(
+                nlp.pipe(
+                    (text for _, text in chunk),
+                    batch_size=config.batch_size,
+                    n_process=config.n_process,
+                )
+            )
+            cache.add([key for key, _ in chunk], docs)
+    with instrument.span("read_cache"):
+        return cache.get(hashes)
+
+
+def parse_dataset(
+    dataset: datasets.Datasets,
+    config: SpacyConfig = SpacyConfig(),
+    sections: List[str] | None = None,
+    cache_dir: Path = CACHE_DIR,
+) -> Tuple[pd.DataFrame, List[Doc]]:
+    """Loads a report dataset and parses its cleaned text.
+
+    Mayo labs are not cleaned, their raw document column is parsed.
+
+    Args:
+        dataset (datasets.Datasets): one of DATASETS
+        config (SpacyConfig, optional): Defaults to SpacyConfig().
+        sections (List[str], optional): see datasets.load_dataset. Defaults to None.
+        cache_dir (Path, optional): Defaults to CACHE_DIR.
+
+    Returns:
+        Tuple[pd.DataFrame, List[Doc]]: the dataset and the doc of each row,
+            join annotations on document_ID
+    """
+    df = datasets.load_dataset(dataset, sections=sections)
+    column = "text"
+    if column not in df.columns:
+        column = datasets.dataset_config_mapping[dataset]["document"]
+    docs = parse(df[column].tolist(), config, cache_dir)
+    return df, docs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parses a report dataset with spaCy")
+    parser.add_argument("dataset", choices=[d.value for d in DATASETS])
+    parser.add_argument("--model", default=SpacyConfig.model)
+    parser.add_argument("--batch-size", type=int, default=SpacyConfig.batch_size)
+    parser.add_argument("--n-process", type=int, default=SpacyConfig.n_process)
+    parser.add_argument(
+        "--exclude", nargs="*", default=[], help="Components not loaded"
+    )
+    parser.add_argument("--sections", nargs="*", default=None)
+    parser.add_argument("--cache-dir", type=Path, default=CACHE_DIR)
+    args = parser.parse_args()
+
+    config = SpacyConfig(
+        args.model, tuple(args.exclude), args.batch_size, args.n_process
+    )
+    start = time.perf_counter()
+    df, docs = parse_dataset(
+        datasets.Datasets(args.dataset), config, args.sections, args.cache_dir
+    )
+    nlp = load_model(config.model, config.exclude)
+    print(
+        f"{len(docs)} docs in {time.perf_counter() - start:.1f} s, "
+        f"cache {Path(args.cache_dir) / model_key(nlp)}"
+    )
@@ -1,5 +1,53 @@
+"""Cleaning rules for the report datasets.
+
+clean_cardiac_path and clean_pyp apply a list of rules (CARDIAC_PATH_RULES,
+PYP_RULES) to a document. A document has a time budget (DOCUMENT_BUDGET
+seconds) for its rules: a document over budget, or longer than
+MAX_DOCUMENT_LENGTH, is flagged with a warning and its remaining rules are
+replaced by degrade, a single linear pass (ascii, newlines to periods, single
+spaces) that cannot stall a load.
+
+Profiling is opt-in. Inside `with text_processing.profile() as p:` every rule
+call is timed, p.rule_summary() gives the time per rule and p.slowest() the
+slowest documents with their slowest rule. From the command line:
+
+    python text_processing.py REPORTS.csv --column reg1 [--pyp]
+"""
+
+import argparse
+import heapq
 import re
-from nltk import sent_tokenize
+import time
+import warnings
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+import pandas as pd
+
+# seconds of cleaning rules per document before the document is degraded
+DOCUMENT_BUDGET = 1.0
+# longer documents are degraded without running the rules
+MAX_DOCUMENT_LENGTH = 1_000_000
+# documents kept by a profile
+N_SLOWEST = 20
+
+_NEWLINES = re.compile("\n{2,}")
+_SPACES = re.compile("\s{2,}")
+_AMYLOID = re.compile("(AMYLOIDOSIS|amyloidosis|AMYLOID|amyloid)([A-Za-z]\.)")
+# a run of letters long enough to end with Clinical and have a letter before it
+_CLINICAL_RUN = re.compile("[A-Za-z]{9,}")
+_CONSECUTIVE_PUNCT = re.compile("([?\.\:\-])([?\.\:\-])")
+_COLONS = re.compile("(:[\.\-])")
+_PERIOD_INITIAL = re.compile("(\.)([A-Z]\.\s)")
+_PERIOD_WORD = re.compile("(\.)([A-Z]{2,}|[A-Z][a-z]{2,})")
+_PERIODS = re.compile("(\.{2,})")
+_DOUBLE_DASHES = re.compile("(-{2,})")
+_PERIOD_QUESTION = re.compile("(\.\?)")
+_QUESTION_WORD = re.compile("(\?)(?=\w)")
+_QUESTION_NEWLINE = re.compile("\?\n|\n\?")
+_PUNCT_WORD = re.compile("([\.,?!:\*])([A-Za-z]{2,})")
+_WORD_QUESTION = re.compile("(?<=\w)\?")
+
 
 def _replace_unicode_newlines(s: str):
     """replace unicode characters for newlines \x0b"""
@@ -10,69 +58,78 @@ def _replace_unicode_newlines(s: str):
 
 def _remove_extra_spaces(s: str):
     """Replace the over spaces"""
-    s = re.sub("\n{2,}", "\n", s)
-    s = re.sub("\s{2,}", " ", s)
+    s = _NEWLINES.sub("\n", s)
+    s = _SPACES.sub(" ", s)
     return s
 
 
 def _fix_amyloid(s: str):
-    s = re.sub("(AMYLOIDOSIS|amyloidosis|AMYLOID|amyloid)([A-Za-z]\.)", r"\1 . \2", s)
+    s = _AMYLOID.sub(r"\1 . \2", s)
     s = s.replace("AMYOIDOSIS", "AMYLOIDOSIS")
     s = s.replace("amyoidosis", "amyloidosis")
     return s
 
 
+def _split_clinical(m: re.Match) -> str:
+    # ([A-Za-z]+)(Clinical|CLINICAL) splits before the last Clinical of a run
+    run = m.group()
+    i = max(run.rfind("Clinical"), run.rfind("CLINICAL"))
+    return f"{run[:i]}. {run[i:]}" if i > 0 else run
+
+
 def _fix_clinical(s: str):
-    s = re.sub("([A-Za-z]+)(Clinical|CLINICAL)", r"\1. \2", s)
+    # ([A-Za-z]+)(Clinical|CLINICAL) backtracks over every start of a letter run
+    s = _CLINICAL_RUN.sub(_split_clinical, s)
     return s
 
 
 def _fix_consecutive_punct(s: str):
     """add space between :- or .?"""
-    s = re.sub("([?\.\:\-])([?\.\:\-])", r"\1 \2", s)
+    s = _CONSECUTIVE_PUNCT.sub(r"\1 \2", s)
     return s
 
 
 def _fix_colons(s: str):
     """replace :- by : """
-    s = re.sub("(:[\.\-])", r": ", s)
+    s = _COLONS.sub(r": ", s)
     return s
 
 
 def _fix_periods(s: str):
-    s = re.sub("(\.)([A-Z]\.\s)", r"\1 \2", s)
-    s = re.sub("(\.)([A-Z]{2,}|[A-Z][a-z]{2,})", r"\1 \2", s)
-    s = re.sub("(\.{2,})", r".", s)
+    s = _PERIOD_INITIAL.sub(r"\1 \2", s)
+    s = _PERIOD_WORD.sub(r"\1 \2", s)
+    s = _PERIODS.sub(r".", s)
     # s = re.sub('(\s\.)', r'.', s)
     return s
 
 
 def _fix_double_dashes(s: str):
     """replace '--' with '\n' because they separate sections"""
-    s = re.sub("(-{2,})", r"\n", s)
+    s = _DOUBLE_DASHES.sub(r"\n", s)
     return s
 
 
 def _fix_question_marks(s: str):
     """replace .? by . """
-    s = re.sub("(\.\?)", r". ", s)
+    s = _PERIOD_QUESTION.sub(r". ", s)
     """replace '\n?' and '?\n' with '\n' because they separate sections"""
-    s = re.sub("(\?)(?=\w)", r"\n", s)
-    s = re.sub("\?\n|\n\?", r"\n", s)
+    s = _QUESTION_WORD.sub(r"\n", s)
+    s = _QUESTION_NEWLINE.sub(r"\n", s)
     return s
 
 
 def _newlines_to_periods(s: str):
     """replace '\n' with '. ' to tokenize sentences"""
-    s = re.sub("\n", r". ", s)
+    s = s.replace("\n", ". ")
     return s
 
 
 def _fix_punctuation(s: str):
     """clean up punctuation"""
     # Pad punctuation
-    s = re.sub("([\.,?!:\*])([A-Za-z]{2,})", r" \1", s)
-    s = re.sub("(\w+)(\?)", r"\1 \2", s)
+    s = _PUNCT_WORD.sub(r" \1", s)
+    # (\w+)(\?) backtracks over every start of a word
+    s = _WORD_QUESTION.sub(r" ?", s)
     return s
 
 
@@ -87,23 +144,169 @@ def _split_camel_case(s: str):
     return " ".join(["".join(word) for word in words])
 
 
-def clean_cardiac_path(s: str):
-    s = _replace_unicode_newlines(s)
-    s = _fix_double_dashes(s)
-    s = _fix_question_marks(s)
-    s = _fix_clinical(s)
-    s = _fix_amyloid(s)
-    s = _remove_extra_spaces(s)
-    s = _newlines_to_periods(s)
-    s = _fix_periods(s)
-    s = _fix_colons(s)
-    s = _remove_extra_spaces(s)
+def _join_sentences(s: str):
+    # nltk takes over a second to import, only paid by the first report
+    from nltk import sent_tokenize
+
     s = " ".join(sent_tokenize(s))
+    return s
+
+
+def degrade(s: str) -> str:
+    """The cleaning of a document over budget, linear in its length."""
+    s = _replace_unicode_newlines(s)
+    s = s.replace("\n", ". ")
+    return " ".join(s.split())
+
+
+CARDIAC_PATH_RULES: List[Callable[[str], str]] = [
+    _replace_unicode_newlines,
+    _fix_double_dashes,
+    _fix_question_marks,
+    _fix_clinical,
+    _fix_amyloid,
+    _remove_extra_spaces,
+    _newlines_to_periods,
+    _fix_periods,
+    _fix_colons,
+    _remove_extra_spaces,
+    _join_sentences,
+]
+PYP_RULES: List[Callable[[str], str]] = [_remove_extra_spaces]
+
+
+class RuleProfile:
+    """Rule and document timings collected by profile."""
+
+    def __init__(self, n_slowest: int = N_SLOWEST):
+        self.n_slowest = n_slowest
+        # rule name -> [calls, seconds, characters in]
+        self.rules: Dict[str, List[float]] = {}
+        # min-heap of (seconds, order, document record)
+        self.documents: List[tuple] = []
+        self.degraded: List[Dict] = []
+        self.n_documents = 0
+
+    def add_document(self, record: Dict) -> None:
+        self.n_documents += 1
+        item = (record["seconds"], self.n_documents, record)
+        if len(self.documents) < self.n_slowest:
+            heapq.heappush(self.documents, item)
+        else:
+            heapq.heappushpop(self.documents, item)
+        if record["degraded"]:
+            self.degraded.append(record)
+
+    def rule_summary(self) -> pd.DataFrame:
+        """Returns:
+        pd.DataFrame: calls, seconds, share of the total and characters per
+            second of every rule, slowest first
+        """
+        df = pd.DataFrame.from_dict(
+            self.rules, orient="index", columns=["calls", "seconds", "chars"]
+        ).rename_axis("rule")
+        df["calls"] = df.calls.astype(int)
+        df["share"] = df.seconds / df.seconds.sum()
+        df["chars_per_s"] = df.chars / df.seconds
+        return df.drop(columns="chars").sort_values("seconds", ascending=False)
+
+    def slowest(self) -> pd.DataFrame:
+        """Returns:
+        pd.DataFrame: doc_id, length, seconds, slowest rule and degraded flag
+            of the n_slowest slowest documents, slowest first
+        """
+        records = [record for _, _, record in sorted(self.documents, reverse=True)]
+        return pd.DataFrame(
+            records, columns=["doc_id", "length", "seconds", "slowest_rule", "degraded"]
+        )
+
+
+_profile: RuleProfile | None = None
+
+
+@contextmanager
+def profile(n_slowest: int = N_SLOWEST):
+    """Times every cleaning rule and document cleaned inside the block.
+
+    Args:
+        n_slowest (int, optional): documents kept. Defaults to N_SLOWEST.
+
+    Yields:
+        RuleProfile: filled as documents are cleaned
+    """
+    global _profile
+    previous, _profile = _profile, RuleProfile(n_slowest)
+    try:
+        yield _profile
+    finally:
+        _profile = previous
+
+
+def apply_rules(
+    s: str,
+    rules: List[Callable[[str], str]],
+    doc_id=None,
+    budget: float | None = None,
+) -> str:
+    """Applies rules in order, degrading the document when it is over budget.
+
+    Args:
+        s (str): document
+        rules (List[Callable[[str], str]]): cleaning rules
+        doc_id (optional): document id for warnings and profiles. Defaults to None.
+        budget (float, optional): seconds. Defaults to DOCUMENT_BUDGET.
+
+    Returns:
+        str: cleaned document
+    """
+    budget = DOCUMENT_BUDGET if budget is None else budget
+    length = len(s)
+    start = now = time.perf_counter()
+    timings = {} if _profile is not None else None
+    degraded = None
+    if length > MAX_DOCUMENT_LENGTH:
+        degraded = f"its length ({length} characters)"
+    else:
+        for i, rule in enumerate(rules):
+            previous, chars = now, len(s)
+            s = rule(s)
+            now = time.perf_counter()
+            if timings is not None:
+                name = rule.__name__.lstrip("_")
+                timings[name] = timings.get(name, 0) + now - previous
+                calls = _profile.rules.setdefault(name, [0, 0.0, 0])
+                calls[0] += 1
+                calls[1] += now - previous
+                calls[2] += chars
+            if now - start > budget and i < len(rules) - 1:
+                degraded = f"{now - start:.2f} s after {rule.__name__.lstrip('_')}"
+                break
+    if degraded is not None:
+        warnings.warn(
+            f"Document {doc_id} degraded to a single cleaning pass, {degraded}"
+        )
+        s = degrade(s)
+        now = time.perf_counter()
+    if timings is not None:
+        _profile.add_document(
+            {
+                "doc_id": doc_id,
+                "length": length,
+                "seconds": now - start,
+                "slowest_rule": max(timings, key=timings.get) if timings else None,
+                "degraded": degraded is not None,
+            }
+        )
+    return s
+
+
+def clean_cardiac_path(s: str, doc_id=None, budget: float | None = None):
+    s = apply_rules(s, CARDIAC_PATH_RULES, doc_id, budget)
     return s.strip()
 
 
-def clean_pyp(s: str):
-    s = _remove_extra_spaces(s)
+def clean_pyp(s: str, doc_id=None, budget: float | None = None):
+    s = apply_rules(s, PYP_RULES, doc_id, budget)
     return s
 
 
@@ -115,3 +318,25 @@ def extract_dates(s: str):
         r"^(1[0-2]|0?[1-9])/(3[01]|[12][0-9]|0?[1-9])/(?:[0-9]{2})?[0-9]{2}$", s
     )
     return dates
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profiles the cleaning rules")
+    parser.add_argument("path", help="Reports csv")
+    parser.add_argument("--column", required=True, help="Report text column")
+    parser.add_argument("--id-column", default="document_ID")
+    parser.add_argument("--pyp", action="store_true", help="Clean as PYP reports")
+    parser.add_argument("--slowest", type=int, default=N_SLOWEST)
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.path)
+    clean = clean_pyp if args.pyp else clean_cardiac_path
+    ids = df[args.id_column] if args.id_column in df else df.index
+    with profile(args.slowest) as p:
+        for text, doc_id in zip(df[args.column].fillna(""), ids):
+            clean(text, doc_id=doc_id)
+    with pd.option_context("display.width", 200, "display.max_rows", None):
+        print(p.rule_summary().round(4).to_string())
+        print()
+        print(p.slowest().round(4).to_string(index=False))
+        print(f"\n{len(p.degraded)} of {p.n_documents} documents degraded")
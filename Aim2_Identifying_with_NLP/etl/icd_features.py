@@ -0,0 +1,333 @@
+"""Sparse patient x ICD code feature matrix.
+
+Streams the ICD codes parquet and turns the long ICD_code / ICD_code_date
+table into a scipy CSR matrix with one row per patient and one column per
+(lookback window, code). Codes are mapped to a stable, sorted vocabulary that
+can be saved and reused so columns line up between builds, optionally truncated
+to their category (e.g. E85.82 -> E85). Each batch is reduced to its distinct
+(patient, column) pairs before it is kept, so memory grows with the number of
+nonzeros rather than patients x codes.
+
+Usage:
+    python icd_features.py --anchor final__amyloid_diagnosis_date --out icd_features
+"""
+
+import argparse
+import json
+import numpy as np
+import pandas as pd
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import scipy.sparse as sp
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import List, Sequence, Tuple
+
+from file_parsing import icd_codes_file
+from timelines import load_anchor_dates
+
+# The path to the Amyloid data
+BASE = Path("/data/datasets/Amyloidosis/")
+PULL_2023 = BASE / "2023 pull"
+
+BATCH_SIZE = 1 << 20
+
+MATRIX_NAME = "icd_features.npz"
+PATIENTS_NAME = "icd_features_ir_id.npy"
+VOCABULARY_NAME = "icd_vocabulary.json"
+
+
+@dataclass
+class ICDFeatureConfig:
+    # characters kept after removing the dot, None keeps the full code
+    prefix_len: int | None = None
+    # (start, end) in days before the index date, end exclusive, None is open ended.
+    # Without index dates every code falls in a single all time window.
+    windows: Tuple[Tuple[int, int | None], ...] = ((0, 365), (365, 730), (730, None))
+    binary: bool = False  # presence instead of counts
+    min_patients: int = 1  # codes seen in fewer patients are left out of the vocabulary
+
+
+def normalize_codes(codes, prefix_len: int | None = None):
+    """Upper cases and strips ICD codes, and truncates them to a prefix.
+
+    Args:
+        codes (pa.Array): ICD codes
+        prefix_len (int, optional): characters kept after removing the dot. Defaults to None.
+
+    Returns:
+        pa.Array: normalized codes
+    """
+    codes = pc.utf8_upper(pc.utf8_trim_whitespace(codes))
+    if prefix_len is not None:
+        codes = pc.utf8_slice_codeunits(
+            pc.replace_substring(codes, ".", ""), 0, prefix_len
+        )
+    return codes
+
+
+def _encode(column, prefix_len: int | None) -> Tuple[pd.Index, np.ndarray]:
+    # Normalizes the distinct codes of a batch only, returns them and the
+    # position of every row's code among them (-1 for missing codes)
+    encoded = pc.dictionary_encode(column)
+    distinct = pd.Index(normalize_codes(encoded.dictionary, prefix_len).to_pandas())
+    indices = pc.fill_null(encoded.indices, -1).to_numpy(zero_copy_only=False)
+    return distinct, indices
+
+
+def _iter_batches(path: Path, columns: List[str], batch_size: int):
+    file = pq.ParquetFile(Path(path).with_suffix(".parquet"))
+    yield from file.iter_batches(batch_size=batch_size, columns=columns)
+
+
+def build_vocabulary(
+    path: Path = icd_codes_file.icd_codes_path,
+    config: ICDFeatureConfig = ICDFeatureConfig(),
+    batch_size: int = BATCH_SIZE,
+) -> List[str]:
+    """Sorted list of the codes in the ICD table.
+
+    Args:
+        path (Path, optional): icd codes file path. Defaults to icd_codes_path.
+        config (ICDFeatureConfig, optional): Defaults to ICDFeatureConfig().
+        batch_size (int, optional): rows read at a time. Defaults to BATCH_SIZE.
+
+    Returns:
+        List[str]: vocabulary
+    """
+    codes, pairs = pd.Index([], dtype=object), []
+    for batch in _iter_batches(path, ["ir_id", "ICD_code"], batch_size):
+        distinct, indices = _encode(batch.column("ICD_code"), config.prefix_len)
+        codes = codes.append(distinct.dropna().unique().difference(codes))
+        code_ids = np.append(codes.get_indexer(distinct), -1)[indices]
+        keep = code_ids >= 0
+        pairs.append(
+            pd.DataFrame(
+                {
+                    "ir_id": batch.column("ir_id").to_numpy()[keep],
+                    "code": code_ids[keep],
+                }
+            ).drop_duplicates()
+        )
+    if not pairs:
+        return []
+    # patients per code, without counting a patient twice across batches
+    n_patients = pd.Series(
+        np.bincount(pd.concat(pairs).drop_duplicates()["code"], minlength=len(codes)),
+        index=codes,
+    )
+    return sorted(n_patients.index[n_patients >= config.min_patients])
+
+
+def _window_index(days: np.ndarray, windows) -> np.ndarray:
+    # -1 outside of every window
+    index = np.full(len(days), -1, dtype=np.int64)
+    for i, (start, end) in reversed(list(enumerate(windows))):
+        inside = days >= start
+        if end is not None:
+            inside &= days < end
+        index[inside] = i
+    return index
+
+
+def build_icd_features(
+    ir_ids: Sequence[int] | None = None,
+    index_dates: pd.DataFrame | None = None,
+    vocabulary: List[str] | None = None,
+    config: ICDFeatureConfig = ICDFeatureConfig(),
+    path: Path = icd_codes_file.icd_codes_path,
+    batch_size: int = BATCH_SIZE,
+) -> Tuple[sp.csr_matrix, np.ndarray, List[str]]:
+    """Builds the patient x (window, code) matrix.
+
+    Args:
+        ir_ids (Sequence[int], optional): patients (rows), defaults to the patients
+            with an index date, or everyone in the ICD table.
+        index_dates (pd.DataFrame, optional): ir_id and anchor_date, one per patient,
+            see timelines.load_anchor_dates. Defaults to None (no lookback windows).
+        vocabulary (List[str], optional): codes (columns) of a previous build.
+            Defaults to a new vocabulary.
+        config (ICDFeatureConfig, optional): Defaults to ICDFeatureConfig().
+        path (Path, optional): icd codes file path. Defaults to icd_codes_path.
+        batch_size (int, optional): rows read at a time. Defaults to BATCH_SIZE.
+
+    Returns:
+        Tuple[sp.csr_matrix, np.ndarray, List[str]]: matrix, ir_id of every row and
+            vocabulary, column j is code j % len(vocabulary) in window j // len(vocabulary)
+    """
+    if vocabulary is None:
+        vocabulary = build_vocabulary(path, config, batch_size)
+    codes = pd.Index(vocabulary)
+
+    windows = config.windows if index_dates is not None else ((None, None),)
+    if index_dates is not None:
+        assert index_dates.ir_id.is_unique, "more than one index date per patient"
+        if ir_ids is None:
+            ir_ids = index_dates.ir_id
+    if ir_ids is None:
+        ir_ids = pd.read_parquet(
+            Path(path).with_suffix(".parquet"), columns=["ir_id"]
+        ).ir_id.unique()
+    patients = np.unique(np.asarray(ir_ids, dtype=np.int64))
+    if index_dates is not None:
+        anchors = (
+            pd.to_datetime(index_dates.set_index("ir_id")["anchor_date"])
+            .reindex(patients)
+            .to_numpy(dtype="datetime64[ns]")
+        )
+
+    n_rows, n_cols = len(patients), len(windows) * len(codes)
+    if not n_rows:
+        # no patient to match the events against
+        return sp.csr_matrix((0, n_cols), dtype=np.float32), patients, list(vocabulary)
+    keys, counts = [], []
+    for batch in _iter_batches(
+        path, ["ir_id", "ICD_code", "ICD_code_date"], batch_size
+    ):
+        batch_ids = batch.column("ir_id").to_numpy()
+        rows = np.searchsorted(patients, batch_ids)
+        rows[rows == n_rows] = 0
+        keep = patients[rows] == batch_ids
+        distinct, indices = _encode(batch.column("ICD_code"), config.prefix_len)
+        cols = np.append(codes.get_indexer(distinct), -1)[indices]
+        keep &= cols >= 0
+        if index_dates is not None:
+            dates = pd.to_datetime(batch.column("ICD_code_date").to_pandas()).to_numpy(
+                dtype="datetime64[ns]"
+            )
+            days = (anchors[rows] - dates) / np.timedelta64(1, "D")
+            window = _window_index(np.floor(days), windows)
+            keep &= window >= 0
+            cols = window * len(codes) + cols
+        # one entry per (patient, column) per batch
+        batch_keys, batch_counts = np.unique(
+            rows[keep] * np.int64(n_cols) + cols[keep], return_counts=True
+        )
+        keys.append(batch_keys)
+        counts.append(batch_counts)
+
+    keys = np.concatenate(keys) if keys else np.empty(0, dtype=np.int64)
+    counts = np.concatenate(counts) if counts else np.empty(0, dtype=np.int64)
+    matrix = sp.csr_matrix(
+        (counts.astype(np.float32), (keys // n_cols, keys % n_cols)),
+        shape=(n_rows, n_cols),
+    )
+    # duplicates across batches are summed by the conversion
+    matrix.sum_duplicates()
+    if config.binary:
+        matrix.data[:] = 1
+
+    return matrix, patients, list(vocabulary)
+
+
+def feature_names(
+    vocabulary: List[str], config: ICDFeatureConfig, windowed: bool = True
+) -> List[str]:
+    """Column names of a feature matrix, "<window>|<code>".
+
+    Args:
+        vocabulary (List[str]): codes
+        config (ICDFeatureConfig): build config
+        windowed (bool, optional): whether the matrix was built with index dates.
+            Defaults to True.
+
+    Returns:
+        List[str]: name of every column, e.g. "0-365|E85" or "all|E85"
+    """
+    windows = config.windows if windowed else ((None, None),)
+    names = []
+    for start, end in windows:
+        if start is None:
+            window = "all"
+        else:
+            window = f"{start}-{'' if end is None else end}"
+        names.extend(f"{window}|{code}" for code in vocabulary)
+    return names
+
+
+def save_icd_features(
+    out_dir: Path,
+    matrix: sp.csr_matrix,
+    ir_ids: np.ndarray,
+    vocabulary: List[str],
+    config: ICDFeatureConfig,
+) -> None:
+    """Writes the matrix, row ir_ids and vocabulary (with the config that built it).
+
+    Args:
+        out_dir (Path): output directory
+        matrix (sp.csr_matrix): feature matrix
+        ir_ids (np.ndarray): ir_id of every row
+        vocabulary (List[str]): codes
+        config (ICDFeatureConfig): build config
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    sp.save_npz(out_dir / MATRIX_NAME, matrix)
+    np.save(out_dir / PATIENTS_NAME, ir_ids)
+    (out_dir / VOCABULARY_NAME).write_text(
+        json.dumps({"config": asdict(config), "codes": list(vocabulary)}, indent=2)
+    )
+
+
+def load_icd_vocabulary(out_dir: Path) -> Tuple[List[str], ICDFeatureConfig]:
+    """Reads a saved vocabulary, to build new matrices with the same columns.
+
+    Args:
+        out_dir (Path): directory written by save_icd_features
+
+    Returns:
+        Tuple[List[str], ICDFeatureConfig]: codes and the config they were built with
+    """
+    saved = json.loads((Path(out_dir) / VOCABULARY_NAME).read_text())
+    config = saved["config"]
+    config["windows"] = tuple(tuple(window) for window in config["windows"])
+    return saved["codes"], ICDFeatureConfig(**config)
+
+
+def load_icd_features(out_dir: Path) -> Tuple[sp.csr_matrix, np.ndarray, List[str]]:
+    """Reads a saved feature matrix.
+
+    Args:
+        out_dir (Path): directory written by save_icd_features
+
+    Returns:
+        Tuple[sp.csr_matrix, np.ndarray, List[str]]: matrix, ir_id of every row, codes
+    """
+    out_dir = Path(out_dir)
+    codes, _ = load_icd_vocabulary(out_dir)
+    return (
+        sp.load_npz(out_dir / MATRIX_NAME).tocsr(),
+        np.load(out_dir / PATIENTS_NAME),
+        codes,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--anchor", default=None, help="Index date column")
+    parser.add_argument("--prefix-len", type=int, default=None)
+    parser.add_argument("--binary", action="store_true")
+    parser.add_argument("--min-patients", type=int, default=1)
+    parser.add_argument(
+        "--vocabulary", type=Path, default=None, help="Reuse the vocabulary in this dir"
+    )
+    parser.add_argument("--out", type=Path, default=PULL_2023 / "icd_features")
+    args = parser.parse_args()
+
+    if args.vocabulary is not None:
+        vocabulary, config = load_icd_vocabulary(args.vocabulary)
+    else:
+        vocabulary, config = None, ICDFeatureConfig(
+            prefix_len=args.prefix_len,
+            binary=args.binary,
+            min_patients=args.min_patients,
+        )
+    index_dates = load_anchor_dates(args.anchor) if args.anchor else None
+    if index_dates is not None:
+        # one index date per patient, the earliest
+        index_dates = index_dates.groupby("ir_id", as_index=False)["anchor_date"].min()
+    matrix, ir_ids, vocabulary = build_icd_features(
+        index_dates=index_dates, vocabulary=vocabulary, config=config
+    )
+    save_icd_features(args.out, matrix, ir_ids, vocabulary, config)
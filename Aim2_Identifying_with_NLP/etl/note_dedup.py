@@ -0,0 +1,623 @@
+"""Exact and near-duplicate notes and paragraphs of the outpatient notes.
+
+Outpatient notes repeat the same history and assessment blocks visit after
+visit (copy-forward). deduplicate_notes streams the notes parquet, which is
+sorted by ir_id and date, one patient at a time and writes a deduplicated view
+to NOTES_DEDUP_DIR:
+
+- NOTES_NAME, one row per note: the earlier note it duplicates
+  (canonical_note, itself when unique), its estimated Jaccard similarity to it
+  and kind (unique, exact or near).
+- PARAGRAPH_TEXT_NAME, one row per unique paragraph of a patient
+  (paragraph_id, ir_id, first note, text). NLP passes (tokenization, keyword
+  matching, inference) run on this table only.
+- PARAGRAPHS_NAME, one row per paragraph of every note that is not an exact
+  duplicate: its character span in deid_note_text and the paragraph_id of its
+  text, the back-reference. expand maps paragraph level results back to
+  every note, exact duplicates included.
+
+Texts are compared after normalization (lower case, words only), so notes
+that only differ in whitespace or punctuation are exact duplicates. Near
+duplicates are found with MinHash signatures of word shingles and LSH banding,
+and a note or paragraph is matched to the most similar earlier unique one of
+the same patient when the estimated Jaccard similarity is at least the
+threshold. Patients are never compared with each other.
+
+Usage:
+    python note_dedup.py [--notes NOTES_PATH] [--out OUT_DIR]
+    python note_dedup.py --check
+"""
+
+import argparse
+import re
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+from file_parsing import deid_notes_file
+
+# The path to the Amyloid data
+BASE = Path("/data/datasets/Amyloidosis/")
+PULL_2023 = BASE / "2023 pull"
+
+NOTES_DEDUP_DIR = PULL_2023 / "notes_dedup"
+NOTES_NAME = "notes.parquet"
+PARAGRAPHS_NAME = "paragraphs.parquet"
+PARAGRAPH_TEXT_NAME = "paragraph_text.parquet"
+
+SEED = 2556
+BATCH_SIZE = 1 << 14
+# rows buffered before they are written
+WRITE_ROWS = 1 << 16
+# shingles hashed at a time, bounds the (shingles, num_perm) hash matrix
+SHINGLE_CHUNK = 1 << 16
+
+_WORD = re.compile(r"[a-z0-9]+")
+# paragraphs are separated by line breaks, \x0b is a line break in the extract
+_PARAGRAPH = re.compile(r"[^\n\x0b]+")
+_KINDS = np.array(["unique", "exact", "near"])
+
+# column name -> values, the rows of one patient (a DataFrame per patient
+# costs more than deduplicating it)
+Columns = Dict[str, np.ndarray | list]
+
+NOTE_SCHEMA = pa.schema(
+    [
+        ("note_index", pa.int64()),
+        ("ir_id", pa.int64()),
+        ("created_date_key", pa.timestamp("ns")),
+        ("canonical_note", pa.int64()),
+        ("similarity", pa.float32()),
+        ("kind", pa.string()),
+        ("n_paragraphs", pa.int32()),
+        ("n_new_paragraphs", pa.int32()),
+    ]
+)
+PARAGRAPH_SCHEMA = pa.schema(
+    [
+        ("note_index", pa.int64()),
+        ("paragraph", pa.int32()),
+        ("start", pa.int32()),
+        ("end", pa.int32()),
+        ("paragraph_id", pa.int64()),
+        ("similarity", pa.float32()),
+    ]
+)
+PARAGRAPH_TEXT_SCHEMA = pa.schema(
+    [
+        ("paragraph_id", pa.int64()),
+        ("ir_id", pa.int64()),
+        ("note_index", pa.int64()),
+        ("text", pa.string()),
+    ]
+)
+
+
+@dataclass
+class DedupConfig:
+    num_perm: int = 64  # MinHash permutations
+    bands: int = 16  # LSH bands, num_perm / bands rows each
+    note_shingle: int = 5  # words per shingle of a note
+    paragraph_shingle: int = 3  # words per shingle of a paragraph
+    note_threshold: float = 0.8  # estimated Jaccard of a near duplicate note
+    paragraph_threshold: float = 0.9  # estimated Jaccard of a near duplicate paragraph
+    # shorter paragraphs are only matched exactly
+    min_paragraph_words: int = 4
+
+
+class MinHasher:
+    """MinHash signatures of word shingles.
+
+    Words are integer ids (consistent within a patient), shingles are hashed
+    with a polynomial hash and every permutation is a multiply-shift hash.
+    """
+
+    def __init__(self, num_perm: int, seed: int = SEED):
+        rng = np.random.default_rng(seed)
+        self.prime = np.uint64(rng.integers(1 << 40, 1 << 62) | 1)
+        self.a = rng.integers(1, 1 << 63, num_perm, dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 1 << 63, num_perm, dtype=np.uint64)
+
+    def _shingles(
+        self, ids: np.ndarray, starts: np.ndarray, widths: np.ndarray, k: int
+    ):
+        h = np.zeros(len(starts), dtype=np.uint64)
+        last = max(len(ids) - 1, 0)
+        for j in range(k):
+            word = ids[np.minimum(starts + j, last)] if len(ids) else h
+            h = np.where(j < widths, h * self.prime + word, h)
+        return h
+
+    def signatures(self, items: List[np.ndarray], k: int) -> np.ndarray:
+        """Signatures of word id sequences.
+
+        Args:
+            items (List[np.ndarray]): uint64 word ids of each item
+            k (int): words per shingle, shorter items are a single shingle
+
+        Returns:
+            np.ndarray: (len(items), num_perm) uint64
+        """
+        signatures = np.empty((len(items), len(self.a)), dtype=np.uint64)
+        lengths = np.array([len(item) for item in items], dtype=np.int64)
+        n_shingles = np.maximum(lengths - k + 1, 1)
+        first = 0
+        while first < len(items):
+            # a chunk of items with at most SHINGLE_CHUNK shingles (at least one item)
+            last = first + max(
+                int(
+                    np.searchsorted(
+                        np.cumsum(n_shingles[first:]), SHINGLE_CHUNK, "right"
+                    )
+                ),
+                1,
+            )
+            chunk = items[first:last]
+            ids = np.concatenate(chunk) if chunk else np.zeros(0, np.uint64)
+            offsets = np.concatenate([[0], np.cumsum(lengths[first:last])[:-1]])
+            counts = n_shingles[first:last]
+            item_of = np.repeat(np.arange(len(chunk)), counts)
+            position = np.arange(counts.sum()) - np.repeat(
+                np.cumsum(counts) - counts, counts
+            )
+            starts = offsets[item_of] + position
+            widths = np.minimum(lengths[first:last], k)[item_of]
+            shingles = self._shingles(ids, starts, widths, k)
+            hashes = (shingles[:, None] * self.a + self.b) >> np.uint64(32)
+            signatures[first:last] = np.minimum.reduceat(
+                hashes, np.concatenate([[0], np.cumsum(counts)[:-1]]), axis=0
+            )
+            first = last
+        return signatures
+
+
+def _normalize(text: str) -> List[str]:
+    return _WORD.findall(text.lower())
+
+
+def _match(
+    keys: List[str],
+    signatures: np.ndarray,
+    threshold: float,
+    bands: int,
+    near: np.ndarray | None = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Matches every item to the most similar earlier unique item.
+
+    Args:
+        keys (List[str]): normalized texts, equal keys are exact duplicates
+        signatures (np.ndarray): MinHash signatures
+        threshold (float): estimated Jaccard of a near duplicate
+        bands (int): LSH bands
+        near (np.ndarray, optional): items that may be near duplicates.
+            Defaults to all.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: canonical item (itself when
+            unique), similarity and kind (0 unique, 1 exact, 2 near). An exact
+            duplicate references the first item with the same key, which can be
+            a near duplicate, canonical[canonical] is always a unique item.
+    """
+    n = len(keys)
+    canonical = np.arange(n)
+    similarity = np.ones(n, dtype=np.float32)
+    kind = np.zeros(n, dtype=np.int8)
+    first: Dict[str, int] = {}
+    rows = signatures.shape[1] // bands
+    buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+    for i in range(n):
+        if keys[i] in first:
+            canonical[i], kind[i] = first[keys[i]], 1
+            continue
+        first[keys[i]] = i
+        if near is not None and not near[i]:
+            continue
+        band_keys = [
+            signatures[i, b * rows : (b + 1) * rows].tobytes() for b in range(bands)
+        ]
+        candidates = sorted(
+            {j for b, key in enumerate(band_keys) for j in buckets[b].get(key, ())}
+        )
+        if candidates:
+            estimates = (signatures[candidates] == signatures[i]).mean(axis=1)
+            best = int(np.argmax(estimates))
+            if estimates[best] >= threshold:
+                canonical[i], similarity[i], kind[i] = (
+                    candidates[best],
+                    estimates[best],
+                    2,
+                )
+                continue
+        for b, key in enumerate(band_keys):
+            buckets[b].setdefault(key, []).append(i)
+    return canonical, similarity, kind
+
+
+class _Writer:
+    """Buffers rows of a table and writes them in row groups."""
+
+    def __init__(self, path: Path, schema: pa.Schema):
+        self.schema = schema
+        self.writer = pq.ParquetWriter(path, schema)
+        self.columns = {name: [] for name in schema.names}
+        self.n_rows = 0
+
+    def extend(self, **columns) -> None:
+        for name, values in columns.items():
+            self.columns[name].append(values)
+        self.n_rows += len(next(iter(columns.values())))
+        if self.n_rows >= WRITE_ROWS:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.n_rows:
+            arrays = [
+                (
+                    pa.array(np.concatenate(self.columns[field.name]), field.type)
+                    if field.type != pa.string()
+                    else pa.array(
+                        [v for values in self.columns[field.name] for v in values],
+                        field.type,
+                    )
+                )
+                for field in self.schema
+            ]
+            self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self.columns = {name: [] for name in self.schema.names}
+        self.n_rows = 0
+
+    def close(self) -> None:
+        self.flush()
+        self.writer.close()
+
+
+def iter_patients(path: Path, batch_size: int = BATCH_SIZE) -> Iterator[Columns]:
+    """Notes of one patient at a time, with their row number as note_index.
+
+    Args:
+        path (Path): notes parquet, sorted by ir_id
+        batch_size (int, optional): rows read at a time. Defaults to BATCH_SIZE.
+
+    Yields:
+        Columns: note_index, ir_id, created_date_key and deid_note_text ("" when
+            missing)
+    """
+    file = pq.ParquetFile(Path(path).with_suffix(".parquet"))
+    columns = ["ir_id", "created_date_key", "deid_note_text"]
+    pending, start = None, 0
+    for batch in file.iter_batches(batch_size=batch_size, columns=columns):
+        rows = {
+            "note_index": np.arange(start, start + batch.num_rows),
+            "ir_id": batch.column("ir_id").to_numpy(zero_copy_only=False),
+            "created_date_key": batch.column("created_date_key")
+            .to_numpy(zero_copy_only=False)
+            .astype("datetime64[ns]"),
+            "deid_note_text": batch.column("deid_note_text").fill_null("").to_pylist(),
+        }
+        start += batch.num_rows
+        if pending is not None:
+            rows = {
+                name: (
+                    np.concatenate([pending[name], values])
+                    if isinstance(values, np.ndarray)
+                    else pending[name] + values
+                )
+                for name, values in rows.items()
+            }
+        ir_id = rows["ir_id"]
+        if (np.diff(ir_id) < 0).any():
+            raise Exception("The notes parquet is not sorted by ir_id")
+        # the last patient of a batch may continue in the next one
+        boundaries = np.flatnonzero(ir_id[1:] != ir_id[:-1]) + 1
+        for lo, hi in zip(np.r_[0, boundaries[:-1]], boundaries):
+            yield {name: values[lo:hi] for name, values in rows.items()}
+        last = boundaries[-1] if len(boundaries) else 0
+        pending = {name: values[last:] for name, values in rows.items()}
+    if pending is not None and len(pending["ir_id"]):
+        yield pending
+
+
+def _paragraph_spans(text: str) -> List[Tuple[int, int]]:
+    spans = []
+    for m in _PARAGRAPH.finditer(text):
+        raw = m.group()
+        start = m.start() + len(raw) - len(raw.lstrip())
+        end = m.end() - len(raw) + len(raw.rstrip())
+        if end > start:
+            spans.append((start, end))
+    return spans
+
+
+def deduplicate_patient(
+    notes: Columns, hasher: MinHasher, config: DedupConfig
+) -> Tuple[Columns, Columns, Columns]:
+    """Duplicate notes and paragraphs of one patient.
+
+    Args:
+        notes (Columns): see iter_patients, in chronological order
+        hasher (MinHasher): MinHash permutations
+        config (DedupConfig): thresholds
+
+    Returns:
+        Tuple[Columns, Columns, Columns]: notes, paragraphs
+            and new paragraph texts (paragraph_id local to the patient)
+    """
+    texts = notes["deid_note_text"]
+    note_words = [_normalize(text) for text in texts]
+
+    # paragraphs of every note, spans in the original text
+    spans = [_paragraph_spans(text) for text in texts]
+    paragraph_note = np.repeat(np.arange(len(texts)), [len(s) for s in spans])
+    paragraph_words = [
+        _normalize(texts[i][start:end])
+        for i, note_spans in enumerate(spans)
+        for start, end in note_spans
+    ]
+
+    # word ids shared by the notes and paragraphs of the patient
+    all_words = [w for words in note_words for w in words]
+    all_words += [w for words in paragraph_words for w in words]
+    codes, _ = pd.factorize(pd.Series(all_words, dtype=object))
+    codes = codes.astype(np.uint64)
+    lengths = [len(words) for words in note_words + paragraph_words]
+    items = np.split(codes, np.cumsum(lengths)[:-1]) if lengths else []
+    note_items, paragraph_items = items[: len(note_words)], items[len(note_words) :]
+
+    note_canonical, note_similarity, note_kind = _match(
+        [" ".join(words) for words in note_words],
+        hasher.signatures(note_items, config.note_shingle),
+        config.note_threshold,
+        config.bands,
+    )
+
+    # exact duplicate notes reference their canonical note's paragraphs
+    keep = note_kind[paragraph_note] != 1
+    kept = np.flatnonzero(keep)
+    paragraph_canonical, paragraph_similarity, paragraph_kind = _match(
+        [" ".join(paragraph_words[i]) for i in kept],
+        hasher.signatures([paragraph_items[i] for i in kept], config.paragraph_shingle),
+        config.paragraph_threshold,
+        config.bands,
+        near=np.array(
+            [len(paragraph_words[i]) >= config.min_paragraph_words for i in kept],
+            dtype=bool,
+        ),
+    )
+    new = paragraph_kind == 0
+    local_id = np.cumsum(new) - 1
+    # an exact duplicate of a near duplicate paragraph resolves to the unique one
+    root = paragraph_canonical[paragraph_canonical]
+    paragraph_id = local_id[root]
+    paragraph_similarity = np.where(
+        paragraph_kind == 1,
+        paragraph_similarity[paragraph_canonical],
+        paragraph_similarity,
+    )
+
+    flat_spans = np.array([span for s in spans for span in s], dtype=np.int64).reshape(
+        -1, 2
+    )
+    position = (
+        np.concatenate([np.arange(len(s)) for s in spans]) if spans else np.zeros(0)
+    )
+    note_index = notes["note_index"]
+    paragraphs = {
+        "note_index": note_index[paragraph_note[kept]],
+        "paragraph": position[kept].astype(np.int32),
+        "start": flat_spans[kept, 0].astype(np.int32),
+        "end": flat_spans[kept, 1].astype(np.int32),
+        "paragraph_id": paragraph_id,
+        "similarity": paragraph_similarity,
+    }
+    new_rows = kept[new]
+    paragraph_text = {
+        "paragraph_id": local_id[new],
+        "ir_id": notes["ir_id"][paragraph_note[new_rows]],
+        "note_index": note_index[paragraph_note[new_rows]],
+        "text": [
+            texts[paragraph_note[i]][flat_spans[i, 0] : flat_spans[i, 1]]
+            for i in new_rows
+        ],
+    }
+
+    n_paragraphs = np.bincount(paragraph_note, minlength=len(texts))
+    n_new = np.bincount(paragraph_note[new_rows], minlength=len(texts))
+    out_notes = {
+        "note_index": note_index,
+        "ir_id": notes["ir_id"],
+        "created_date_key": notes["created_date_key"],
+        "canonical_note": note_index[note_canonical],
+        "similarity": note_similarity,
+        "kind": _KINDS[note_kind].tolist(),
+        "n_paragraphs": n_paragraphs.astype(np.int32),
+        "n_new_paragraphs": n_new.astype(np.int32),
+    }
+    return out_notes, paragraphs, paragraph_text
+
+
+def check_duplicate_chains() -> None:
+    """Asserts an exact copy of a near duplicate paragraph resolves to the unique one.
+
+    Note A has paragraph P, note B has Q and P2 (a near duplicate of P) and
+    note C has P2 again: C's paragraph is an exact duplicate of B's, whose
+    text is P, not Q.
+    """
+    words = [f"word{i}" for i in range(40)]
+    p = " ".join(words)
+    p2 = " ".join(words[:-1] + ["changed"])
+    q = " ".join(f"other{i}" for i in range(40))
+    texts = [p, f"{q}\n{p2}", p2]
+    notes = {
+        "note_index": np.arange(3),
+        "ir_id": np.zeros(3, dtype=np.int64),
+        "created_date_key": np.arange(3)
+        .astype("datetime64[D]")
+        .astype("datetime64[ns]"),
+        "deid_note_text": texts,
+    }
+    config = DedupConfig()
+    _, paragraphs, paragraph_text = deduplicate_patient(
+        notes, MinHasher(config.num_perm), config
+    )
+    text_of = dict(zip(paragraph_text["paragraph_id"].tolist(), paragraph_text["text"]))
+    resolved = [text_of[i] for i in paragraphs["paragraph_id"].tolist()]
+    assert resolved == [p, q, p, p], resolved
+
+
+def deduplicate_notes(
+    notes_path: Path = deid_notes_file.notes_path,
+    out_dir: Path = NOTES_DEDUP_DIR,
+    config: DedupConfig = DedupConfig(),
+) -> Dict[str, int]:
+    """Writes the deduplicated view of the notes, see the module docstring.
+
+    Args:
+        notes_path (Path, optional): notes file path, the parquet written by
+            deid_notes_file.csv_to_parquet. Defaults to deid_notes_file.notes_path.
+        out_dir (Path, optional): Defaults to NOTES_DEDUP_DIR.
+        config (DedupConfig, optional): Defaults to DedupConfig().
+
+    Returns:
+        Dict[str, int]: notes, exact and near duplicate notes, paragraphs, unique
+            paragraphs, and characters of the notes and of the unique paragraphs
+    """
+    if config.num_perm % config.bands:
+        raise ValueError("num_perm must be a multiple of bands")
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    hasher = MinHasher(config.num_perm)
+    writers = {
+        "notes": _Writer(out_dir / NOTES_NAME, NOTE_SCHEMA),
+        "paragraphs": _Writer(out_dir / PARAGRAPHS_NAME, PARAGRAPH_SCHEMA),
+        "paragraph_text": _Writer(out_dir / PARAGRAPH_TEXT_NAME, PARAGRAPH_TEXT_SCHEMA),
+    }
+    stats = dict.fromkeys(
+        [
+            "notes",
+            "exact",
+            "near",
+            "paragraphs",
+            "unique_paragraphs",
+            "chars",
+            "unique_chars",
+        ],
+        0,
+    )
+    next_id = 0
+    try:
+        for patient in iter_patients(notes_path):
+            notes, paragraphs, paragraph_text = deduplicate_patient(
+                patient, hasher, config
+            )
+            paragraphs["paragraph_id"] = paragraphs["paragraph_id"] + next_id
+            paragraph_text["paragraph_id"] = paragraph_text["paragraph_id"] + next_id
+            next_id += len(paragraph_text["paragraph_id"])
+            writers["notes"].extend(**notes)
+            writers["paragraphs"].extend(**paragraphs)
+            writers["paragraph_text"].extend(**paragraph_text)
+            stats["notes"] += len(notes["kind"])
+            stats["exact"] += notes["kind"].count("exact")
+            stats["near"] += notes["kind"].count("near")
+            stats["paragraphs"] += int(notes["n_paragraphs"].sum())
+            stats["unique_paragraphs"] += len(paragraph_text["text"])
+            stats["chars"] += sum(map(len, patient["deid_note_text"]))
+            stats["unique_chars"] += sum(map(len, paragraph_text["text"]))
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return stats
+
+
+def load_dedup_notes(out_dir: Path = NOTES_DEDUP_DIR) -> pd.DataFrame:
+    """Reads the note table of the deduplicated view."""
+    return pd.read_parquet(Path(out_dir) / NOTES_NAME)
+
+
+def load_paragraphs(out_dir: Path = NOTES_DEDUP_DIR) -> pd.DataFrame:
+    """Reads the paragraph back-references of the deduplicated view."""
+    return pd.read_parquet(Path(out_dir) / PARAGRAPHS_NAME)
+
+
+def load_paragraph_text(
+    out_dir: Path = NOTES_DEDUP_DIR, ir_ids: List[int] | None = None
+) -> pd.DataFrame:
+    """Reads the unique paragraphs, the input of the NLP passes.
+
+    Args:
+        out_dir (Path, optional): Defaults to NOTES_DEDUP_DIR.
+        ir_ids (List[int], optional): only these patients. Defaults to all.
+
+    Returns:
+        pd.DataFrame: paragraph_id, ir_id, note_index (first note) and text
+    """
+    filters = (
+        [("ir_id", "in", [int(i) for i in ir_ids])] if ir_ids is not None else None
+    )
+    return pd.read_parquet(Path(out_dir) / PARAGRAPH_TEXT_NAME, filters=filters)
+
+
+def expand(results: pd.DataFrame, out_dir: Path = NOTES_DEDUP_DIR) -> pd.DataFrame:
+    """Maps paragraph level results back to every paragraph of every note.
+
+        paragraphs = load_paragraph_text()
+        paragraphs["amyloid"] = paragraphs.text.str.contains("amyloid", case=False)
+        notes = expand(paragraphs[["paragraph_id", "amyloid"]])
+        notes.groupby("note_index").amyloid.any()
+
+    Args:
+        results (pd.DataFrame): paragraph_id and result columns
+        out_dir (Path, optional): Defaults to NOTES_DEDUP_DIR.
+
+    Returns:
+        pd.DataFrame: note_index, paragraph, start, end, similarity and the
+            result columns, exact duplicate notes included
+    """
+    paragraphs = load_paragraphs(out_dir)
+    notes = load_dedup_notes(out_dir)
+    exact = notes.loc[notes.kind == "exact", ["note_index", "canonical_note"]]
+    copies = exact.merge(
+        paragraphs, left_on="canonical_note", right_on="note_index", suffixes=("", "_")
+    ).drop(columns=["canonical_note", "note_index_"])
+    paragraphs = pd.concat([paragraphs, copies], ignore_index=True)
+    return paragraphs.merge(results, on="paragraph_id", how="left").sort_values(
+        ["note_index", "paragraph"], ignore_index=True
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--notes", type=Path, default=deid_notes_file.notes_path)
+    parser.add_argument("--out", type=Path, default=NOTES_DEDUP_DIR)
+    parser.add_argument(
+        "--note-threshold", type=float, default=DedupConfig.note_threshold
+    )
+    parser.add_argument(
+        "--paragraph-threshold", type=float, default=DedupConfig.paragraph_threshold
+    )
+    parser.add_argument(
+        "--check", action="store_true", help="Only run check_duplicate_chains"
+    )
+    args = parser.parse_args()
+
+    if args.check:
+        check_duplicate_chains()
+        print("duplicate chains resolve to unique paragraphs")
+        raise SystemExit
+
+    stats = deduplicate_notes(
+        args.notes,
+        args.out,
+        DedupConfig(
+            note_threshold=args.note_threshold,
+            paragraph_threshold=args.paragraph_threshold,
+        ),
+    )
+    print(
+        f"{stats['notes']} notes, {stats['exact']} exact and {stats['near']} near duplicates\n"
+        f"{stats['paragraphs']} paragraphs, {stats['unique_paragraphs']} unique\n"
+        f"{stats['unique_chars']} of {stats['chars']} characters left to process"
+    )
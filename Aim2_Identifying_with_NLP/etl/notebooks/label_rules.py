@@ -0,0 +1,629 @@
+"""Vectorized label reconciliation rules for the merge notebooks.
+
+The rules that merge the report diagnoses (cardiac path, PYP, mayo labs) with
+the clinic chart reviews and Tafamidis prescriptions used to run row by row
+through DataFrame.apply(axis=1). Here every rule is a row of a condition table:
+the first matching condition (as in the original if/elif chain) sets the
+consistency code and the merged labels, evaluated with np.select over the whole
+cohort at once.
+
+The original row-wise functions are kept at the bottom of this file as the
+reference implementation, check_equivalence compares the two.
+"""
+
+from typing import List, NamedTuple, Tuple
+import numpy as np
+import pandas as pd
+
+# values of a diagnosis / subtype that do not settle the label
+INCONCLUSIVE = ["INDETERMINATE", "CHART_REVIEW"]
+
+CHART_REVIEW_CONSISTENCY = {
+    0: "total agreement",
+    1: "chart review provides new diagnosis",
+    2: "chart review provides new subtype",
+    3: "chart review provides new ttr subtype",
+    -1: "chart review disagrees on diagnosis",
+    -2: "chart review disagrees on subtype",
+    -3: "chart review disagrees on ttr subtype",
+}
+
+TAFAMIDIS_CONSISTENCY = {
+    0: "total agreement",
+    1: "tafamidis provides new diagnosis",
+    2: "tafamidis provides new TTR subtype",
+    -1: "tafamidis disagrees on diagnosis",
+    -2: "tafamidis disagrees on subtype",
+}
+
+# chart review Amyloid_type -> (diagnosis, subtype, ttr subtype)
+CHART_REVIEW_AMYLOID_TYPES = {
+    "hTTR": ("POSITIVE", "TTR", "HTTR"),
+    "wTTR": ("POSITIVE", "TTR", "INDETERMINATE"),
+    "TTR - w/u pending": ("POSITIVE", "TTR", "TTR - w/u pending"),
+    "AL": ("POSITIVE", "AL", np.nan),
+}
+
+# full chart review amyloid_type -> (diagnosis, subtype, ttr subtype)
+FULL_CHART_REVIEW_AMYLOID_TYPES = {
+    "AL": ("POSITIVE", "AL", np.nan),
+    "negative": ("NEGATIVE", np.nan, np.nan),
+    "hTTR": ("POSITIVE", "TTR", "HTTR"),
+    "wTTR": ("POSITIVE", "TTR", "INDETERMINATE"),
+    "other - unknown": ("INDETERMINATE", np.nan, np.nan),
+    "other": ("INDETERMINATE", np.nan, np.nan),
+    "positive - subtype pending": ("POSITIVE", "INDETERMINATE", np.nan),
+    "TTR - subtype pending": ("POSITIVE", "TTR", "TTR - w/u pending"),
+}
+
+
+class Labels(NamedTuple):
+    diagnosis: pd.Series
+    subtype: pd.Series
+    ttr_subtype: pd.Series
+    date: pd.Series
+
+
+def _labels(df: pd.DataFrame, prefix: str) -> Labels:
+    return Labels(
+        df[f"{prefix}__amyloid_diagnosis"],
+        df[f"{prefix}__amyloid_subtype_diagnosis"],
+        df[f"{prefix}__ttr_amyloid_subtype_diagnosis"],
+        pd.to_datetime(df[f"{prefix}__amyloid_diagnosis_date"]).astype(
+            "datetime64[ns]"
+        ),
+    )
+
+
+def _label_columns(prefix: str) -> List[str]:
+    return [
+        f"{prefix}__amyloid_diagnosis",
+        f"{prefix}__amyloid_subtype_diagnosis",
+        f"{prefix}__ttr_amyloid_subtype_diagnosis",
+        f"{prefix}__amyloid_diagnosis_date",
+    ]
+
+
+def _missing_or_inconclusive(s: pd.Series) -> np.ndarray:
+    return (s.isna() | s.isin(INCONCLUSIVE)).to_numpy()
+
+
+def _as_choice(value, n: int, dtype, cache: dict) -> np.ndarray:
+    # scalars are broadcast, series keep their values.
+    # The same series shows up in many rules, so convert it only once.
+    if isinstance(value, pd.Series):
+        if id(value) not in cache:
+            cache[id(value)] = value.to_numpy(dtype=dtype)
+        return cache[id(value)]
+    if dtype != object:
+        value = np.datetime64("NaT") if pd.isna(value) else pd.Timestamp(value)
+    return np.full(n, value, dtype=dtype)
+
+
+def _select(
+    rules: List[Tuple[np.ndarray, float, tuple]],
+    index: pd.Index,
+    code_name: str,
+    descriptions: dict,
+    label_columns: List[str],
+) -> pd.DataFrame:
+    """Evaluates a condition table, first matching rule wins.
+
+    Args:
+        rules (List[Tuple[np.ndarray, float, tuple]]): (condition, code, labels)
+        index (pd.Index): index of the output
+        code_name (str): name of the consistency code column
+        descriptions (dict): consistency code -> description
+        label_columns (List[str]): names of the 4 label columns
+
+    Returns:
+        pd.DataFrame: consistency code, description and label columns
+    """
+    n, cache = len(index), {}
+    conditions = [condition for condition, _, _ in rules]
+    out = pd.DataFrame(index=index)
+    out[code_name] = np.select(
+        conditions, [np.float64(code) for _, code, _ in rules], default=np.nan
+    )
+    out[f"{code_name}_description"] = out[code_name].map(descriptions)
+    for i, column in enumerate(label_columns):
+        # dates stay datetime64 so they never go through python objects
+        if column.endswith("_date"):
+            dtype, default = "datetime64[ns]", np.datetime64("NaT", "ns")
+        else:
+            dtype, default = object, np.nan
+        out[column] = np.select(
+            conditions,
+            [_as_choice(labels[i], n, dtype, cache) for _, _, labels in rules],
+            default,
+        )
+    return out
+
+
+def chart_review_amyloid_diagnosis(amyloid_type: pd.Series) -> pd.DataFrame:
+    """Maps chart review Amyloid_type to diagnosis, subtype and ttr subtype.
+
+    Args:
+        amyloid_type (pd.Series): chart_reviews__Amyloid_type
+
+    Returns:
+        pd.DataFrame: chart_reviews__ label columns (without date)
+    """
+    table = pd.DataFrame.from_dict(
+        CHART_REVIEW_AMYLOID_TYPES,
+        orient="index",
+        columns=_label_columns("chart_reviews")[:3],
+    )
+    return table.reindex(amyloid_type.to_numpy()).set_index(amyloid_type.index)
+
+
+def merge_chart_reviews(df: pd.DataFrame) -> pd.DataFrame:
+    """Merges final__ report labels with chart_reviews__ labels.
+
+    Args:
+        df (pd.DataFrame): cohort labels with final__ and chart_reviews__ columns
+
+    Returns:
+        pd.DataFrame: merge_chart_reviews_consistency(_description) and label__ columns
+    """
+    label, review = _labels(df, "final"), _labels(df, "chart_reviews")
+
+    review_missing = review.diagnosis.isna().to_numpy()
+    assert (review.diagnosis[~review_missing] == "POSITIVE").all()
+
+    new_diagnosis = ~review_missing & _missing_or_inconclusive(label.diagnosis)
+    negative = ~review_missing & (label.diagnosis == "NEGATIVE").to_numpy()
+    positive = ~(review_missing | new_diagnosis | negative)
+    assert (label.diagnosis[positive] == "POSITIVE").all(), df.loc[
+        positive & (label.diagnosis != "POSITIVE").to_numpy(), "ir_id"
+    ].tolist()
+
+    new_subtype = positive & _missing_or_inconclusive(label.subtype)
+    label_al = positive & ~new_subtype & (label.subtype == "AL").to_numpy()
+    label_ttr = positive & ~new_subtype & (label.subtype == "TTR").to_numpy()
+    review_al = (review.subtype == "AL").to_numpy()
+    review_ttr = (review.subtype == "TTR").to_numpy()
+    assert review_ttr[label_al & ~review_al].all()
+
+    ttr_agree = label_ttr & review_ttr
+    new_ttr_subtype = (
+        ttr_agree
+        & (label.ttr_subtype.isna() | (label.ttr_subtype == "CHART_REVIEW")).to_numpy()
+    )
+    ttr_disagree = (
+        ttr_agree
+        & ~new_ttr_subtype
+        & (label.ttr_subtype != review.ttr_subtype).to_numpy()
+    )
+    review_pending = (review.ttr_subtype == "TTR - w/u pending").to_numpy()
+    ttr_total_agreement = ttr_agree & ~new_ttr_subtype & ~ttr_disagree
+
+    # (condition, consistency code, merged labels)
+    rules = [
+        (review_missing, np.nan, label),
+        (
+            new_diagnosis,
+            1,
+            (
+                review.diagnosis,
+                review.subtype,
+                review.ttr_subtype,
+                review.date.fillna(label.date),
+            ),
+        ),
+        (negative, -1, ("CHART_REVIEW", np.nan, np.nan, pd.NaT)),
+        (
+            new_subtype,
+            2,
+            (label.diagnosis, review.subtype, review.ttr_subtype, review.date),
+        ),
+        (label_al & review_al, 0, label),
+        (
+            label_al | (label_ttr & review_al),
+            -2,
+            (label.diagnosis, "CHART_REVIEW", np.nan, label.date),
+        ),
+        (
+            new_ttr_subtype,
+            3,
+            (label.diagnosis, label.subtype, review.ttr_subtype, label.date),
+        ),
+        # chart review is indeterminate, so keep label. We still flag this as a disagreement.
+        (ttr_disagree & review_pending, -3, label),
+        (
+            ttr_disagree,
+            -3,
+            (label.diagnosis, label.subtype, "CHART_REVIEW", label.date),
+        ),
+        (ttr_total_agreement, 0, label),
+    ]
+    return _select(
+        rules,
+        df.index,
+        "merge_chart_reviews_consistency",
+        CHART_REVIEW_CONSISTENCY,
+        _label_columns("label"),
+    )
+
+
+def merge_tafamidis(df: pd.DataFrame) -> pd.DataFrame:
+    """Merges label__ columns with Tafamidis prescriptions from the cohort entry file.
+
+    Args:
+        df (pd.DataFrame): cohort with label__ and Tafamidis_cohort_entry(_date) columns
+
+    Returns:
+        pd.DataFrame: merge_tafamidis_consistency(_description) and label__ columns
+    """
+    label = _labels(df, "label")
+    tafamidis_date = pd.to_datetime(df["Tafamidis_cohort_entry_date"]).astype(
+        "datetime64[ns]"
+    )
+
+    # TAFAMIDIS 0 or NaN, keep label data
+    no_tafamidis = (df["Tafamidis_cohort_entry"] != 1).to_numpy()
+    new_diagnosis = ~no_tafamidis & _missing_or_inconclusive(label.diagnosis)
+    negative = ~no_tafamidis & (label.diagnosis == "NEGATIVE").to_numpy()
+    positive = ~(no_tafamidis | new_diagnosis | negative)
+    assert (label.diagnosis[positive] == "POSITIVE").all()
+
+    new_subtype = positive & _missing_or_inconclusive(label.subtype)
+    label_al = positive & ~new_subtype & (label.subtype == "AL").to_numpy()
+    agreement = positive & ~new_subtype & ~label_al
+    assert (label.subtype[agreement] == "TTR").all()
+
+    # (condition, consistency code, merged labels)
+    rules = [
+        (no_tafamidis, np.nan, label),
+        (
+            new_diagnosis,
+            1,
+            ("POSITIVE", "TTR", np.nan, tafamidis_date.fillna(label.date)),
+        ),
+        (negative, -1, ("CHART_REVIEW", np.nan, np.nan, pd.NaT)),
+        (new_subtype, 2, (label.diagnosis, "TTR", np.nan, label.date)),
+        (label_al, -2, (label.diagnosis, "CHART_REVIEW", np.nan, label.date)),
+        (agreement, 0, label),
+    ]
+    return _select(
+        rules,
+        df.index,
+        "merge_tafamidis_consistency",
+        TAFAMIDIS_CONSISTENCY,
+        _label_columns("label"),
+    )
+
+
+def cp_pyp_final_diagnosis(df: pd.DataFrame) -> pd.DataFrame:
+    """Combines cardiac path and PYP patient diagnoses.
+
+    The cardiac path diagnosis wins unless it is missing or
+        indeterminate (2) while PYP has a different diagnosis.
+
+    Args:
+        df (pd.DataFrame): cp__ and pyp__ amyloid_diagnosis(_date) columns
+
+    Returns:
+        pd.DataFrame: final_diagnosis, final_diagnosis_date
+    """
+    cp, pyp = df["cp__amyloid_diagnosis"], df["pyp__amyloid_diagnosis"]
+    assert not (cp.isna() & pyp.isna()).any()
+
+    use_pyp = (cp.isna() | ((cp == 2) & pyp.notna() & (pyp != 2))).to_numpy()
+    return pd.DataFrame(
+        {
+            "final_diagnosis": np.where(use_pyp, pyp, cp).astype(int),
+            "final_diagnosis_date": np.where(
+                use_pyp,
+                df["pyp__amyloid_diagnosis_date"].to_numpy(),
+                df["cp__amyloid_diagnosis_date"].to_numpy(),
+            ),
+        },
+        index=df.index,
+    )
+
+
+def relabel_cohort(
+    cohort_labels: pd.DataFrame, cohort_entry: pd.DataFrame
+) -> pd.DataFrame:
+    """Runs every label merge of the merge notebooks in one pass.
+
+    Args:
+        cohort_labels (pd.DataFrame): report diagnoses outer merged with chart reviews,
+            chart_reviews__Date_of_Diagnosis renamed to chart_reviews__amyloid_diagnosis_date
+        cohort_entry (pd.DataFrame): ir_id, Tafamidis_cohort_entry, Tafamidis_cohort_entry_date
+
+    Returns:
+        pd.DataFrame: labeled cohort, rows without a label are dropped
+    """
+    cohort_labels = cohort_labels.copy()
+    cohort_labels[_label_columns("chart_reviews")[:3]] = chart_review_amyloid_diagnosis(
+        cohort_labels["chart_reviews__Amyloid_type"]
+    )
+    merged = merge_chart_reviews(cohort_labels)
+    cohort_labels[merged.columns] = merged
+
+    cohort = cohort_entry.merge(cohort_labels, on="ir_id", how="outer")
+    merged = merge_tafamidis(cohort)
+    cohort[merged.columns] = merged
+    cohort = cohort[cohort["label__amyloid_diagnosis"].notna()]
+
+    label_columns = _label_columns("label")[:3]
+    diagnosis_columns = _label_columns("final")[:3]
+    # add a flag for chart review to the cohort df
+    cohort["label__chart_review"] = (
+        cohort[label_columns + diagnosis_columns] == "CHART_REVIEW"
+    ).any(axis="columns")
+    cohort["diagnosis__chart_review"] = (cohort[label_columns] == "CHART_REVIEW").any(
+        axis="columns"
+    )
+    return cohort
+
+
+def apply_full_chart_review(df: pd.DataFrame) -> pd.DataFrame:
+    """Overrides the label__ columns of fully chart reviewed patients.
+
+    Args:
+        df (pd.DataFrame): cohort labels outer merged with the full chart reviews
+
+    Returns:
+        pd.DataFrame: full_chart_review flag and label__ columns
+    """
+    amyloid_type = df["full_chart_reviews__amyloid_type"]
+    reviewed = amyloid_type.notna()
+    table = pd.DataFrame.from_dict(
+        FULL_CHART_REVIEW_AMYLOID_TYPES,
+        orient="index",
+        columns=_label_columns("label")[:3],
+    )
+    review = table.reindex(amyloid_type.to_numpy()).set_index(df.index)
+
+    out = pd.DataFrame({"full_chart_review": reviewed}, index=df.index)
+    out["label__amyloid_diagnosis_date"] = df["label__amyloid_diagnosis_date"].where(
+        ~reviewed, df["full_chart_reviews__diagnosis_date_norm"]
+    )
+    for column in review.columns:
+        out[column] = df[column].where(~reviewed, review[column])
+    return out
+
+
+def _assert_frame_values_equal(left: pd.DataFrame, right: pd.DataFrame) -> None:
+    # NaN, None and NaT all count as missing
+    for column in left.columns:
+        a, b = left[column], right[column]
+        if column.endswith("_date"):
+            a, b = pd.to_datetime(a), pd.to_datetime(b)
+        missing = a.isna()
+        assert (missing == b.isna()).all(), column
+        assert (a[~missing].astype(object) == b[~missing].astype(object)).all(), column
+
+
+def check_equivalence(
+    cohort_labels: pd.DataFrame,
+    cohort_entry: pd.DataFrame,
+    cp_pyp: pd.DataFrame | None = None,
+) -> None:
+    """Asserts the vectorized rules give the same result as the row-wise notebook functions.
+
+    Args:
+        cohort_labels (pd.DataFrame): see relabel_cohort
+        cohort_entry (pd.DataFrame): see relabel_cohort
+        cp_pyp (pd.DataFrame, optional): cardiac path and PYP diagnoses, see
+            cp_pyp_final_diagnosis. Defaults to None (not checked).
+    """
+    if cp_pyp is not None:
+        expected = cp_pyp.apply(get_final_diagnosis, axis=1, result_type="expand")
+        expected.columns = ["final_diagnosis", "final_diagnosis_date"]
+        _assert_frame_values_equal(expected, cp_pyp_final_diagnosis(cp_pyp))
+
+    labels = cohort_labels.copy()
+    reviews = labels.apply(
+        get_chart_review_amyloid_diagnosis, axis=1, result_type="expand"
+    )
+    reviews.columns = _label_columns("chart_reviews")[:3]
+    _assert_frame_values_equal(
+        reviews, chart_review_amyloid_diagnosis(labels["chart_reviews__Amyloid_type"])
+    )
+    labels[reviews.columns] = reviews
+
+    vectorized = merge_chart_reviews(labels)
+    expected = labels.apply(combine_labels, axis=1, result_type="expand")
+    expected.columns = _label_columns("label")
+    expected["merge_chart_reviews_consistency"] = labels.apply(
+        check_label_consistency, axis=1
+    )
+    _assert_frame_values_equal(expected, vectorized[expected.columns])
+    labels[vectorized.columns] = vectorized
+
+    cohort = cohort_entry.merge(labels, on="ir_id", how="outer")
+    vectorized = merge_tafamidis(cohort)
+    expected = cohort.apply(merge_tafamidis_with_labels, axis=1, result_type="expand")
+    expected.columns = _label_columns("label")
+    expected["merge_tafamidis_consistency"] = cohort.apply(
+        lambda row: merge_tafamidis_with_labels(row, debug=True), axis=1
+    )
+    _assert_frame_values_equal(expected, vectorized[expected.columns])
+
+
+# Reference row-wise implementations, as used in the merge notebooks.
+
+
+def get_chart_review_amyloid_diagnosis(row):
+    amyloid_type = row["chart_reviews__Amyloid_type"]
+    if amyloid_type == "hTTR":
+        return "POSITIVE", "TTR", "HTTR"
+    elif amyloid_type == "wTTR":
+        return "POSITIVE", "TTR", "INDETERMINATE"
+    elif amyloid_type == "TTR - w/u pending":
+        return "POSITIVE", "TTR", "TTR - w/u pending"
+    elif amyloid_type == "AL":
+        return "POSITIVE", "AL", np.nan
+    else:
+        return np.nan, np.nan, np.nan
+
+
+def check_label_consistency(row):
+    label_CA, label_CA_subtype, label_ATTR_subtype = (
+        row["final__amyloid_diagnosis"],
+        row["final__amyloid_subtype_diagnosis"],
+        row["final__ttr_amyloid_subtype_diagnosis"],
+    )
+    chart_review_CA, chart_review_CA_subtype, chart_review_ATTR_subtype = (
+        row["chart_reviews__amyloid_diagnosis"],
+        row["chart_reviews__amyloid_subtype_diagnosis"],
+        row["chart_reviews__ttr_amyloid_subtype_diagnosis"],
+    )
+    if pd.isna(chart_review_CA):
+        return np.nan
+    if pd.isna(label_CA) or label_CA in INCONCLUSIVE:
+        return 1
+    elif label_CA == "NEGATIVE":
+        return -1
+    if pd.isna(label_CA_subtype) or label_CA_subtype in INCONCLUSIVE:
+        return 2
+    if label_CA_subtype == "AL":
+        if chart_review_CA_subtype == "AL":
+            return 0
+        return -2
+    elif label_CA_subtype == "TTR":
+        if chart_review_CA_subtype == "AL":
+            return -2
+        if chart_review_CA_subtype == "TTR":
+            if pd.isna(label_ATTR_subtype) or label_ATTR_subtype == "CHART_REVIEW":
+                return 3
+            elif label_ATTR_subtype != chart_review_ATTR_subtype:
+                return -3
+            else:
+                return 0
+
+
+def combine_labels(row):
+    label_CA, label_CA_subtype, label_ATTR_subtype, label_date = (
+        row["final__amyloid_diagnosis"],
+        row["final__amyloid_subtype_diagnosis"],
+        row["final__ttr_amyloid_subtype_diagnosis"],
+        row["final__amyloid_diagnosis_date"],
+    )
+    (
+        chart_review_CA,
+        chart_review_CA_subtype,
+        chart_review_ATTR_subtype,
+        chart_review_date,
+    ) = (
+        row["chart_reviews__amyloid_diagnosis"],
+        row["chart_reviews__amyloid_subtype_diagnosis"],
+        row["chart_reviews__ttr_amyloid_subtype_diagnosis"],
+        row["chart_reviews__amyloid_diagnosis_date"],
+    )
+    if pd.isna(chart_review_CA):
+        return (label_CA, label_CA_subtype, label_ATTR_subtype, label_date)
+    if pd.isna(label_CA) or label_CA in INCONCLUSIVE:
+        return (
+            chart_review_CA,
+            chart_review_CA_subtype,
+            chart_review_ATTR_subtype,
+            chart_review_date if pd.notna(chart_review_date) else label_date,
+        )
+    elif label_CA == "NEGATIVE":
+        return ("CHART_REVIEW", np.nan, np.nan, pd.NaT)
+    if pd.isna(label_CA_subtype) or label_CA_subtype in INCONCLUSIVE:
+        return (
+            label_CA,
+            chart_review_CA_subtype,
+            chart_review_ATTR_subtype,
+            chart_review_date,
+        )
+    if label_CA_subtype == "AL":
+        if chart_review_CA_subtype == "AL":
+            return (label_CA, label_CA_subtype, label_ATTR_subtype, label_date)
+        return (label_CA, "CHART_REVIEW", np.nan, label_date)
+    elif label_CA_subtype == "TTR":
+        if chart_review_CA_subtype == "AL":
+            return (label_CA, "CHART_REVIEW", np.nan, label_date)
+        if chart_review_CA_subtype == "TTR":
+            if pd.isna(label_ATTR_subtype) or label_ATTR_subtype == "CHART_REVIEW":
+                return (
+                    label_CA,
+                    label_CA_subtype,
+                    chart_review_ATTR_subtype,
+                    label_date,
+                )
+            elif label_ATTR_subtype != chart_review_ATTR_subtype:
+                if chart_review_ATTR_subtype == "TTR - w/u pending":
+                    return (label_CA, label_CA_subtype, label_ATTR_subtype, label_date)
+                return (label_CA, label_CA_subtype, "CHART_REVIEW", label_date)
+            else:
+                return (label_CA, label_CA_subtype, label_ATTR_subtype, label_date)
+
+
+def merge_tafamidis_with_labels(row, debug=False):
+    label_CA, label_CA_subtype, label_ATTR_subtype, label_date = (
+        row["label__amyloid_diagnosis"],
+        row["label__amyloid_subtype_diagnosis"],
+        row["label__ttr_amyloid_subtype_diagnosis"],
+        row["label__amyloid_diagnosis_date"],
+    )
+    tafamidis, tafamidis_date = (
+        row["Tafamidis_cohort_entry"],
+        row["Tafamidis_cohort_entry_date"],
+    )
+    if tafamidis != 1:
+        if debug:
+            return np.nan
+        return (label_CA, label_CA_subtype, label_ATTR_subtype, label_date)
+    if pd.isna(label_CA) or label_CA in INCONCLUSIVE:
+        if debug:
+            return 1
+        return (
+            "POSITIVE",
+            "TTR",
+            np.nan,
+            tafamidis_date if pd.notna(tafamidis_date) else label_date,
+        )
+    elif label_CA == "NEGATIVE":
+        if debug:
+            return -1
+        return ("CHART_REVIEW", np.nan, np.nan, pd.NaT)
+    if pd.isna(label_CA_subtype) or label_CA_subtype in INCONCLUSIVE:
+        if debug:
+            return 2
+        return (label_CA, "TTR", np.nan, label_date)
+    if label_CA_subtype == "AL":
+        if debug:
+            return -2
+        return (label_CA, "CHART_REVIEW", np.nan, label_date)
+    if debug:
+        return 0
+    return (label_CA, label_CA_subtype, label_ATTR_subtype, label_date)
+
+
+def get_final_diagnosis(row):
+    cp_diagnosis = row["cp__amyloid_diagnosis"]
+    pyp_diagnosis = row["pyp__amyloid_diagnosis"]
+    cp_date = row["cp__amyloid_diagnosis_date"]
+    pyp_date = row["pyp__amyloid_diagnosis_date"]
+    if pd.isnull(cp_diagnosis):
+        return int(pyp_diagnosis), pyp_date
+    elif pd.isnull(pyp_diagnosis):
+        return int(cp_diagnosis), cp_date
+    elif int(cp_diagnosis) != int(pyp_diagnosis) and int(cp_diagnosis) == 2:
+        return int(pyp_diagnosis), pyp_date
+    return int(cp_diagnosis), cp_date
+
+
+if __name__ == "__main__":
+    import sys
+    from pathlib import Path
+
+    # python label_rules.py <cohort_labels.csv> <cohort_entry.csv> [<cp_pyp.csv>]
+    cohort_labels = pd.read_csv(Path(sys.argv[1]))
+    cohort_entry = pd.read_csv(Path(sys.argv[2]), sep="|")
+    cohort_entry.drop(cohort_entry.tail(2).index, inplace=True)
+    cohort_entry["ir_id"] = cohort_entry["ir_id"].astype(int)
+    cohort_entry = cohort_entry[
+        ["ir_id", "Tafamidis_cohort_entry", "Tafamidis_cohort_entry_date"]
+    ]
+    # cp__ and pyp__ diagnoses of patients with a cardiac path or PYP report
+    cp_pyp = pd.read_csv(Path(sys.argv[3])) if len(sys.argv) > 3 else None
+    check_equivalence(cohort_labels, cohort_entry, cp_pyp)
+    print("vectorized label rules match the row-wise notebook functions")
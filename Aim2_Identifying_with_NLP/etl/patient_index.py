@@ -0,0 +1,208 @@
+"""Per-patient record index over the EDW tables.
+
+build_patient_index writes a copy of every table sorted by ir_id, with row
+groups small enough that one patient only touches one or two of them, and an
+index with, for each table and patient, the row groups and row offsets of that
+patient's rows. get_patient_record then reads only those slices, so looking up
+one patient takes milliseconds regardless of the size of the cohort.
+
+Usage:
+    python patient_index.py            # build the index
+    python patient_index.py IR_ID      # print a patient's record
+"""
+
+import sys
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+from file_parsing import (
+    cardiac_MRIs_file,
+    comorbidities_file,
+    deid_notes_file,
+    demographics_file,
+    echomaster_file,
+    icd_codes_file,
+    outpt_encounters_file,
+)
+
+# The path to the Amyloid data
+BASE = Path("/data/datasets/Amyloidosis/")
+PULL_2023 = BASE / "2023 pull"
+
+PATIENT_INDEX_DIR = PULL_2023 / "patient_index"
+INDEX_NAME = "index.parquet"
+
+# table name -> ingested file path (parquet)
+PATIENT_TABLES = {
+    "icd_codes": icd_codes_file.icd_codes_path,
+    "outpt_encounters": outpt_encounters_file.outpt_encounters_path,
+    "echomaster": echomaster_file.echomaster_path,
+    "cardiac_mris": cardiac_MRIs_file.cardiac_mri_path,
+    "notes": deid_notes_file.notes_path,
+    "comorbidities": comorbidities_file.comorbitities_path,
+    "demographics": demographics_file.demographics_path,
+}
+
+# Uncompressed size of a row group. Small enough that decoding one is cheap,
+# large enough that the files still compress well.
+ROW_GROUP_BYTES = 4 << 20
+MIN_ROW_GROUP_SIZE = 256
+
+
+def _row_group_size(table: pa.Table) -> int:
+    # notes rows are ~kB, ICD code rows a few bytes
+    row_bytes = max(table.nbytes // max(table.num_rows, 1), 1)
+    return max(MIN_ROW_GROUP_SIZE, ROW_GROUP_BYTES // row_bytes)
+
+
+def index_table(name: str, src: Path, dst: Path) -> pd.DataFrame:
+    """Writes a table sorted by ir_id and returns where each patient's rows are.
+
+    Args:
+        name (str): table name
+        src (Path): ingested table file path (parquet)
+        dst (Path): sorted copy (parquet)
+
+    Returns:
+        pd.DataFrame: table, ir_id, first_row_group, last_row_group, offset
+            (row within the first row group) and n_rows for every patient
+    """
+    table = pq.read_table(Path(src).with_suffix(".parquet"))
+    # stable sort keeps the original order of a patient's rows
+    table = table.take(pc.sort_indices(table, [("ir_id", "ascending")]))
+    row_group_size = _row_group_size(table)
+
+    tmp = dst.with_suffix(".tmp")
+    pq.write_table(table, tmp, row_group_size=row_group_size)
+    tmp.replace(dst)
+
+    ir_ids = table.column("ir_id").to_numpy()
+    patients, starts, n_rows = np.unique(ir_ids, return_index=True, return_counts=True)
+    # all row groups hold row_group_size rows except the last one
+    return pd.DataFrame(
+        {
+            "table": name,
+            "ir_id": patients,
+            "first_row_group": starts // row_group_size,
+            "last_row_group": (starts + n_rows - 1) // row_group_size,
+            "offset": starts % row_group_size,
+            "n_rows": n_rows,
+        }
+    )
+
+
+def build_patient_index(
+    tables: Dict[str, Path] = PATIENT_TABLES, index_dir: Path = PATIENT_INDEX_DIR
+) -> None:
+    """Builds sorted copies of the tables and the per-patient index.
+
+    Args:
+        tables (Dict[str, Path], optional): table name -> table file path.
+            Defaults to PATIENT_TABLES.
+        index_dir (Path, optional): output directory. Defaults to PATIENT_INDEX_DIR.
+    """
+    index_dir = Path(index_dir)
+    index_dir.mkdir(parents=True, exist_ok=True)
+    index = pd.concat(
+        [
+            index_table(name, src, index_dir / f"{name}.parquet")
+            for name, src in tables.items()
+        ],
+        ignore_index=True,
+    )
+    index["table"] = index["table"].astype("category")
+    # written last, a partial build never leaves an index pointing at stale tables
+    index.to_parquet(index_dir / INDEX_NAME, index=False)
+    _load_index.cache_clear()
+
+
+class PatientIndex:
+    def __init__(self, index_dir: Path = PATIENT_INDEX_DIR):
+        self.index_dir = Path(index_dir)
+        index = pd.read_parquet(self.index_dir / INDEX_NAME)
+        self.tables: List[str] = list(index["table"].cat.categories)
+        # hash based ir_id -> position lookup per table
+        self._positions: Dict[str, pd.Index] = {}
+        self._slices: Dict[str, np.ndarray] = {}
+        for name, rows in index.groupby("table", observed=True):
+            self._positions[name] = pd.Index(rows["ir_id"].to_numpy())
+            self._slices[name] = rows[
+                ["first_row_group", "last_row_group", "offset", "n_rows"]
+            ].to_numpy()
+        self._files: Dict[str, pq.ParquetFile] = {}
+
+    def _file(self, name: str) -> pq.ParquetFile:
+        # keep files open so the footer is only parsed once
+        if name not in self._files:
+            self._files[name] = pq.ParquetFile(self.index_dir / f"{name}.parquet")
+        return self._files[name]
+
+    def read(self, name: str, ir_id: int) -> pd.DataFrame:
+        """Reads one patient's rows of one table.
+
+        Args:
+            name (str): table name
+            ir_id (int): patient id
+
+        Returns:
+            pd.DataFrame: the patient's rows, empty if the patient is not in the table
+        """
+        file = self._file(name)
+        positions = self._positions.get(name)
+        if positions is None or ir_id not in positions:
+            return file.schema_arrow.empty_table().to_pandas()
+        first, last, offset, n_rows = self._slices[name][positions.get_loc(ir_id)]
+        rows = file.read_row_groups(range(first, last + 1)).slice(offset, n_rows)
+        return rows.to_pandas()
+
+    def get(
+        self, ir_id: int, tables: Iterable[str] | None = None
+    ) -> Dict[str, pd.DataFrame]:
+        """Reads a patient's rows of every table.
+
+        Args:
+            ir_id (int): patient id
+            tables (Iterable[str], optional): subset of tables. Defaults to all.
+
+        Returns:
+            Dict[str, pd.DataFrame]: table name -> the patient's rows
+        """
+        return {name: self.read(name, ir_id) for name in (tables or self.tables)}
+
+
+@lru_cache(maxsize=None)
+def _load_index(index_dir: Path) -> PatientIndex:
+    return PatientIndex(index_dir)
+
+
+def get_patient_record(
+    ir_id: int,
+    tables: Iterable[str] | None = None,
+    index_dir: Path = PATIENT_INDEX_DIR,
+) -> Dict[str, pd.DataFrame]:
+    """Everything we have on one patient, read from the patient index.
+
+    Args:
+        ir_id (int): patient id
+        tables (Iterable[str], optional): subset of tables. Defaults to all.
+        index_dir (Path, optional): index directory. Defaults to PATIENT_INDEX_DIR.
+
+    Returns:
+        Dict[str, pd.DataFrame]: table name -> the patient's rows
+    """
+    return _load_index(Path(index_dir)).get(int(ir_id), tables)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        for name, rows in get_patient_record(int(sys.argv[1])).items():
+            print(f"{name}: {len(rows)} rows")
+            print(rows)
+    else:
+        build_patient_index()
@@ -0,0 +1,954 @@
+"""Incremental ETL from the raw EDW pull to the labeled cohort.
+
+Every step declares the files it reads and writes, the dependency graph
+follows from which step writes the files another step reads. Inputs are
+fingerprinted (sha256, only re-hashed when the file size or mtime changed) and
+a step only runs again when the fingerprint of its inputs, its code or its
+arguments differs from the last successful run. Steps whose dependencies are
+done run concurrently in worker processes.
+
+A new chart review spreadsheet therefore only re-runs the label merges and
+the labeled cohort build, a new EDW extract only re-runs its own ingestion and
+whatever reads its parquet.
+
+The label steps port the merge notebooks
+(merge__labels_clinical_chart_review_tafamidis_2023,
+merge__cohort_labels_new_chart_review_2023) and cohort_analytics_2023.
+
+Usage:
+    python pipeline.py [--jobs N] [--force] [--dry-run] [--trace PATH] [STEP ...]
+
+--trace writes the timing and memory spans of every step (see
+file_parsing/instrument.py) to a JSON-lines file and prints a summary by stage.
+"""
+
+import argparse
+import ast
+import hashlib
+import inspect
+import json
+import pandas as pd
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from file_parsing import (
+    cardiac_MRIs_file,
+    cohort_file,
+    comorbidities_file,
+    datasets,
+    deid_notes_file,
+    demographics_file,
+    echomaster_file,
+    echosyngo_file,
+    hf_subtype_file,
+    icd_codes_file,
+    instrument,
+    labeled_cohort_file,
+    outpt_encounters_file,
+    sections,
+)
+from notebooks import label_rules
+import patient_index
+import note_dedup
+
+# The path to the Amyloid data
+BASE = Path("/data/datasets/Amyloidosis/")
+PULL_2023 = BASE / "2023 pull"
+
+MANIFEST_PATH = PULL_2023 / ".etl_manifest.json"
+
+# Patient level diagnoses from cardiac path reports, pyp reports, and mayo labs
+amyloid_diagnosis_labels_path = (
+    BASE / "patient_amyloid_diagnosis" / "all_datasets_patient_amyloid_diagnosis.csv"
+)
+# Clinic chart reviews for TTR and AL patients
+clinic_cohort_path = BASE / "Amyloid Clinic cohort.xlsx"
+amyloid_program_al_path = BASE / "Amyloid program AL.xlsx"
+# Full chart reviews
+cohort_chart_reviews_path = (
+    BASE / "patient_amyloid_diagnosis" / "cohort_chart_reviews_simons_copy.xlsx"
+)
+chart_reviews_2023_path = PULL_2023 / "Amyloid_Clinic_Anna.xlsx"
+
+# Diagnoses merged with clinic chart reviews and Tafamidis
+cohort_amyloid_labels_path = (
+    PULL_2023 / "patient_amyloid_diagnosis" / "cohort_amyloid_labels 2023.csv"
+)
+# ... and with the full chart reviews
+chart_reviewed_cohort_amyloid_labels_path = (
+    PULL_2023
+    / "patient_amyloid_diagnosis"
+    / "cohort_amyloid_labels__chart_reviewed_2023.csv"
+)
+
+
+@dataclass
+class Step:
+    name: str
+    func: Callable
+    inputs: Tuple[Path, ...]
+    outputs: Tuple[Path, ...]
+    kwargs: Dict = field(default_factory=dict)
+    # source files besides the one defining func, their local imports included
+    code: Tuple[Path, ...] = ()
+
+
+STEPS: Dict[str, Step] = {}
+
+
+def register_step(step: Step) -> Step:
+    if step.name in STEPS:
+        raise Exception(f"Step {step.name} is already registered")
+    STEPS[step.name] = step
+    return step
+
+
+def build_cohort_labels(
+    diagnoses_path: Path,
+    clinic_cohort_path: Path,
+    amyloid_program_al_path: Path,
+    cohort_entry_path: Path,
+    out_path: Path,
+) -> None:
+    """Merges report diagnoses with the clinic chart reviews and Tafamidis prescriptions.
+
+    Args:
+        diagnoses_path (Path): all datasets patient amyloid diagnosis csv
+        clinic_cohort_path (Path): TTR clinic chart review xlsx
+        amyloid_program_al_path (Path): AL program chart review xlsx
+        cohort_entry_path (Path): cohort entry file path (parquet)
+        out_path (Path): cohort amyloid labels csv
+    """
+    diagnoses = pd.read_csv(diagnoses_path)
+    diagnoses["final__amyloid_diagnosis_date"] = pd.to_datetime(
+        diagnoses["final__amyloid_diagnosis_date"]
+    )
+
+    chart_reviews = pd.read_excel(clinic_cohort_path)
+    # add prefix 'chart_reviews__' to each column except for 'ir_id'
+    chart_reviews = pd.concat(
+        [
+            chart_reviews[chart_reviews.columns[0]],
+            chart_reviews[chart_reviews.columns[1:]].add_prefix("chart_reviews__"),
+        ],
+        axis=1,
+    )
+    amyloid_program_al = pd.read_excel(amyloid_program_al_path).drop_duplicates()
+    amyloid_program_al = amyloid_program_al.rename(
+        columns={"Amyloid_type": "chart_reviews__Amyloid_type"}
+    )
+    chart_reviews = pd.concat(
+        [chart_reviews, amyloid_program_al], axis=0, ignore_index=True
+    )
+    assert (
+        chart_reviews.shape[0] == chart_reviews["ir_id"].nunique()
+    ), "Some patients have more than one record"
+
+    cohort_labels = diagnoses.merge(chart_reviews, on="ir_id", how="outer")
+    cohort_labels = cohort_labels.rename(
+        columns={
+            "chart_reviews__Date_of_Diagnosis": "chart_reviews__amyloid_diagnosis_date"
+        }
+    )
+
+    cohort_entry = cohort_file.load_cohort_entry(cohort_entry_path)[
+        ["ir_id", "Tafamidis_cohort_entry", "Tafamidis_cohort_entry_date"]
+    ]
+    assert (
+        cohort_entry.ir_id.nunique() == cohort_entry.shape[0]
+    ), "cohort entry has more than one record per patient"
+    # the merge rules compare with 1, so missing values must be NaN rather than pd.NA
+    cohort_entry = cohort_entry.astype({"Tafamidis_cohort_entry": float})
+
+    cohort = label_rules.relabel_cohort(cohort_labels, cohort_entry)
+    cohort["pyp_or_tafamidis_only"] = (
+        (cohort.pyp__amyloid_diagnosis == "STRONGLY_SUGGESTIVE")
+        | (cohort.Tafamidis_cohort_entry == 1)
+    ) & (
+        (cohort.chart_reviews__Amyloid_type.isna())
+        & (cohort.mayo__amyloid_diagnosis != "POSITIVE")
+        & (~cohort.cardiac_path__amyloid_diagnosis.isin(["POSITIVE", "NEGATIVE"]))
+    )
+
+    reordered_columns = [
+        "ir_id",
+        "cardiac_path__amyloid_diagnosis",
+        "pyp__amyloid_diagnosis",
+        "mayo__amyloid_diagnosis",
+        "mayo__amyloid_subtype_diagnosis",
+        "mayo__ttr_amyloid_subtype_diagnosis",
+        "final__amyloid_diagnosis",
+        "final__amyloid_diagnosis_date",
+        "final__amyloid_subtype_diagnosis",
+        "final__ttr_amyloid_subtype_diagnosis",
+        "chart_reviews__Amyloid_type",
+        "chart_reviews__Method_of_diagnosis",
+        "chart_reviews__amyloid_diagnosis_date",
+        "chart_reviews__Age_at_Diagnosis",
+        "chart_reviews__amyloid_diagnosis",
+        "chart_reviews__amyloid_subtype_diagnosis",
+        "chart_reviews__ttr_amyloid_subtype_diagnosis",
+        "merge_chart_reviews_consistency",
+        "merge_chart_reviews_consistency_description",
+        "Tafamidis_cohort_entry",
+        "Tafamidis_cohort_entry_date",
+        "merge_tafamidis_consistency",
+        "merge_tafamidis_consistency_description",
+        "label__amyloid_diagnosis",
+        "label__amyloid_subtype_diagnosis",
+        "label__ttr_amyloid_subtype_diagnosis",
+        "label__amyloid_diagnosis_date",
+        "pyp_or_tafamidis_only",
+        "label__chart_review",
+        "diagnosis__chart_review",
+    ]
+    Path(out_path).parent.mkdir(parents=True, exist_ok=True)
+    cohort[reordered_columns].to_csv(out_path, index=False)
+
+
+def _load_full_chart_reviews(
+    cohort_chart_reviews_path: Path, chart_reviews_2023_path: Path
+) -> pd.DataFrame:
+    chart_reviews = pd.read_excel(cohort_chart_reviews_path)
+    chart_reviews = chart_reviews[chart_reviews["amyloid_type"].notna()].copy()
+    chart_reviews.ir_id = chart_reviews.ir_id.astype(int)
+    for column in [
+        "label",
+        "document_description",
+        "diagnosis_method",
+        "AL_cardiac_test",
+        "amyloid_type",
+    ]:
+        chart_reviews[column] = chart_reviews[column].astype("string").str.strip()
+    chart_reviews.priority = chart_reviews.priority.astype(int)
+    chart_reviews.diagnosis_date_norm = pd.to_datetime(
+        chart_reviews.diagnosis_date_norm, errors="coerce"
+    )
+    if "Unnamed: 0" in chart_reviews.columns:
+        chart_reviews = chart_reviews.drop(columns=["Unnamed: 0"])
+    assert (
+        chart_reviews.shape[0] == chart_reviews["ir_id"].nunique()
+    ), "Some patients have more than one record"
+    # add prefix 'full_chart_reviews__' to each column except for 'ir_id'
+    chart_reviews = pd.concat(
+        [
+            chart_reviews[chart_reviews.columns[0]],
+            chart_reviews[chart_reviews.columns[1:]].add_prefix("full_chart_reviews__"),
+        ],
+        axis=1,
+    )
+    chart_reviews = chart_reviews.drop(
+        columns=["full_chart_reviews__diagnosis_date", "full_chart_reviews__label_date"]
+    ).rename(
+        columns={"full_chart_reviews__label": "full_chart_reviews__suggested_label"}
+    )
+
+    chart_reviews_2023 = pd.read_excel(chart_reviews_2023_path)
+    chart_reviews_2023.ir_id = chart_reviews_2023.ir_id.astype(int)
+    chart_reviews_2023 = chart_reviews_2023.drop(
+        columns=["DOB", "Unnamed: 7", "Genetics"]
+    )
+    chart_reviews_2023["Date Of Diagnosis"] = pd.to_datetime(
+        chart_reviews_2023["Date Of Diagnosis"]
+    )
+    chart_reviews_2023 = chart_reviews_2023.astype(
+        {"Label": "string", "Column2": "string", "Column3": "string"}
+    ).rename(
+        columns={
+            "Label": "full_chart_reviews__amyloid_type",
+            "Date Of Diagnosis": "full_chart_reviews__diagnosis_date_norm",
+            "Column2": "full_chart_reviews__diagnosis_method",
+            "Column3": "full_chart_reviews__Notes",
+        }
+    )
+    chart_reviews_2023.full_chart_reviews__amyloid_type = (
+        chart_reviews_2023.full_chart_reviews__amyloid_type.map(
+            {
+                "wtATTR": "wTTR",
+                "hATTR": "hTTR",
+                "wtTTR": "wTTR",
+                "ATTR": "TTR - subtype pending",
+                "AL": "AL",
+            }
+        )
+    )
+    return pd.concat([chart_reviews, chart_reviews_2023])
+
+
+def build_chart_reviewed_labels(
+    cohort_labels_path: Path,
+    cohort_chart_reviews_path: Path,
+    chart_reviews_2023_path: Path,
+    out_path: Path,
+) -> None:
+    """Overrides the cohort amyloid labels with the full chart reviews.
+
+    Args:
+        cohort_labels_path (Path): cohort amyloid labels csv
+        cohort_chart_reviews_path (Path): full chart review xlsx
+        chart_reviews_2023_path (Path): 2023 full chart review xlsx
+        out_path (Path): chart reviewed cohort amyloid labels csv
+    """
+    cohort_labels = pd.read_csv(cohort_labels_path)
+    cohort_labels.label__amyloid_diagnosis_date = pd.to_datetime(
+        cohort_labels.label__amyloid_diagnosis_date
+    )
+    chart_reviews = _load_full_chart_reviews(
+        cohort_chart_reviews_path, chart_reviews_2023_path
+    )
+    cohort_labels = cohort_labels.merge(chart_reviews, on="ir_id", how="outer")
+    reviewed = label_rules.apply_full_chart_review(cohort_labels)
+    cohort_labels[reviewed.columns] = reviewed
+    cohort_labels = cohort_labels.sort_values(by="ir_id", kind="stable").reset_index(
+        drop=True
+    )
+
+    reordered_columns = [
+        "ir_id",
+        "label__amyloid_diagnosis",
+        "label__amyloid_subtype_diagnosis",
+        "label__ttr_amyloid_subtype_diagnosis",
+        "label__amyloid_diagnosis_date",
+        "full_chart_review",
+        "pyp_or_tafamidis_only",
+        "label__chart_review",
+        "diagnosis__chart_review",
+        "cardiac_path__amyloid_diagnosis",
+        "pyp__amyloid_diagnosis",
+        "mayo__amyloid_diagnosis",
+        "mayo__amyloid_subtype_diagnosis",
+        "mayo__ttr_amyloid_subtype_diagnosis",
+        "final__amyloid_diagnosis",
+        "final__amyloid_diagnosis_date",
+        "final__amyloid_subtype_diagnosis",
+        "final__ttr_amyloid_subtype_diagnosis",
+        "chart_reviews__Amyloid_type",
+        "chart_reviews__Method_of_diagnosis",
+        "chart_reviews__amyloid_diagnosis_date",
+        "chart_reviews__Age_at_Diagnosis",
+        "chart_reviews__amyloid_diagnosis",
+        "chart_reviews__amyloid_subtype_diagnosis",
+        "chart_reviews__ttr_amyloid_subtype_diagnosis",
+        "merge_chart_reviews_consistency",
+        "merge_chart_reviews_consistency_description",
+        "Tafamidis_cohort_entry",
+        "Tafamidis_cohort_entry_date",
+        "merge_tafamidis_consistency",
+        "merge_tafamidis_consistency_description",
+        "full_chart_reviews__suggested_label",
+        "full_chart_reviews__document_description",
+        "full_chart_reviews__priority",
+        "full_chart_reviews__amyloid_type",
+        "full_chart_reviews__diagnosis_method",
+        "full_chart_reviews__diagnosis_date_norm",
+        "full_chart_reviews__AL_cardiac_test",
+        "full_chart_reviews__Notes",
+    ]
+    assert sorted(cohort_labels.columns) == sorted(reordered_columns)
+    cohort_labels[reordered_columns].to_csv(out_path, index=False)
+
+
+def build_labeled_cohort(
+    labels_path: Path,
+    cohort_entry_path: Path,
+    hf_subtype_path: Path,
+    demographics_path: Path,
+    echomaster_path: Path,
+    notes_path: Path,
+    out_path: Path,
+) -> None:
+    """Adds labels, ICD codes, demographics and data availability to the cohort entry file.
+
+    Args:
+        labels_path (Path): chart reviewed cohort amyloid labels csv
+        cohort_entry_path (Path): cohort entry file path (parquet)
+        hf_subtype_path (Path): hf subtype file path (parquet)
+        demographics_path (Path): demographics file path (parquet)
+        echomaster_path (Path): echomaster file path (parquet)
+        notes_path (Path): deid notes file path (parquet)
+        out_path (Path): labeled cohort csv
+    """
+    labels = pd.read_csv(labels_path)[
+        [
+            "ir_id",
+            "label__amyloid_diagnosis_date",
+            "label__amyloid_diagnosis",
+            "label__amyloid_subtype_diagnosis",
+            "label__ttr_amyloid_subtype_diagnosis",
+            "full_chart_review",
+            "label__chart_review",
+            "pyp_or_tafamidis_only",
+        ]
+    ]
+    labels["label__amyloid_diagnosis_date"] = pd.to_datetime(
+        labels["label__amyloid_diagnosis_date"]
+    )
+    labels["label__definitive"] = (
+        labels["label__amyloid_diagnosis"].isin(["POSITIVE", "NEGATIVE"]).astype(int)
+    )
+
+    cohort_entry = cohort_file.load_cohort_entry(cohort_entry_path)
+    assert (
+        cohort_entry.ir_id.nunique() == cohort_entry.shape[0]
+    ), "cohort entry has more than one record per patient"
+
+    cohort = cohort_entry.merge(labels, on="ir_id", how="left")
+    cohort = cohort.merge(
+        hf_subtype_file.load_hf_subtype(hf_subtype_path), on="ir_id", how="left"
+    )
+    cohort = cohort.merge(
+        demographics_file.load_demographics(demographics_path), on="ir_id", how="left"
+    )
+
+    # These columns have value 1 if True, 0 if False, or NaN (due to the merge)
+    for column in [
+        "label__definitive",
+        "label__chart_review",
+        "pyp_or_tafamidis_only",
+        "Tafamidis_cohort_entry",
+        "Amyloidosis",
+        "full_chart_review",
+    ]:
+        cohort[column] = cohort[column].fillna(0).astype(int)
+
+    cohort["label__missing_diagnosis"] = (
+        (cohort["label__definitive"] == 0)
+        & (cohort["Amyloidosis"] == 1)
+        & (cohort["full_chart_review"] == 0)
+    ).astype(int)
+
+    # only the columns needed to filter the echos
+    echos = pd.read_parquet(
+        Path(echomaster_path).with_suffix(".parquet"),
+        columns=["ir_id", "echo_type", "limited_echo", "echo_extractor_id"],
+    )
+    keep_echo_types = [
+        "Transthoracic",
+        "Exercise Stress",
+        "Pharmacological Stress",
+        "Stress Type Unknown",
+    ]
+    echos = echos.loc[
+        (echos["echo_type"].isin(keep_echo_types))
+        & (echos["limited_echo"] == 0)
+        & (echos["echo_extractor_id"].isna())
+    ]
+    cohort["echos_cohort_entry"] = cohort.ir_id.isin(echos.ir_id).astype(int)
+
+    notes = pd.read_parquet(Path(notes_path).with_suffix(".parquet"), columns=["ir_id"])
+    cohort["notes_cohort_entry"] = cohort.ir_id.isin(notes.ir_id).astype(int)
+
+    cohort["patient_group__amyloid_cases"] = (
+        cohort["label__amyloid_diagnosis"] == "POSITIVE"
+    ) | (
+        (cohort["Amyloidosis"] == 1)
+        & (cohort["label__amyloid_diagnosis"] != "NEGATIVE")
+    )
+    cohort["patient_group__HF_control"] = (~cohort["patient_group__amyloid_cases"]) & (
+        cohort["HF_cohort_entry"].notna()
+    )
+    cohort["patient_group__non_HF_control"] = (
+        ~cohort["patient_group__amyloid_cases"]
+    ) & (cohort["HF_cohort_entry"].isna())
+
+    cohort.to_csv(out_path, index=False)
+
+
+# One ingestion step per EDW extract
+for name, module, stem in [
+    ("cardiac_mris", cardiac_MRIs_file, cardiac_MRIs_file.cardiac_mri_path),
+    ("cohort_entry", cohort_file, cohort_file.cohort_entry_file_path),
+    ("comorbidities", comorbidities_file, comorbidities_file.comorbitities_path),
+    ("deid_notes", deid_notes_file, deid_notes_file.notes_path),
+    ("demographics", demographics_file, demographics_file.demographics_path),
+    ("echomaster", echomaster_file, echomaster_file.echomaster_path),
+    ("hf_subtype", hf_subtype_file, hf_subtype_file.hf_subtype_path),
+    ("icd_codes", icd_codes_file, icd_codes_file.icd_codes_path),
+    (
+        "outpt_encounters",
+        outpt_encounters_file,
+        outpt_encounters_file.outpt_encounters_path,
+    ),
+]:
+    register_step(
+        Step(
+            name,
+            module.csv_to_parquet,
+            inputs=(stem.with_suffix(".csv"),),
+            outputs=(stem.with_suffix(".parquet"),),
+            kwargs={"path": stem},
+        )
+    )
+
+# echosyngo is written as a partitioned dataset, the measurement dictionary is
+# written last so it marks a finished ingestion
+register_step(
+    Step(
+        "echosyngo",
+        echosyngo_file.csv_to_parquet,
+        inputs=(echosyngo_file.echosyngo_path.with_suffix(".csv"),),
+        outputs=(
+            echosyngo_file.echosyngo_path.with_suffix(".parquet")
+            / echosyngo_file.MEASUREMENTS_NAME,
+        ),
+        kwargs={"path": echosyngo_file.echosyngo_path},
+    )
+)
+
+register_step(
+    Step(
+        "cohort_labels",
+        build_cohort_labels,
+        inputs=(
+            amyloid_diagnosis_labels_path,
+            clinic_cohort_path,
+            amyloid_program_al_path,
+            cohort_file.cohort_entry_file_path.with_suffix(".parquet"),
+        ),
+        outputs=(cohort_amyloid_labels_path,),
+        kwargs={
+            "diagnoses_path": amyloid_diagnosis_labels_path,
+            "clinic_cohort_path": clinic_cohort_path,
+            "amyloid_program_al_path": amyloid_program_al_path,
+            "cohort_entry_path": cohort_file.cohort_entry_file_path,
+            "out_path": cohort_amyloid_labels_path,
+        },
+        code=(Path(label_rules.__file__),),
+    )
+)
+
+register_step(
+    Step(
+        "chart_reviewed_labels",
+        build_chart_reviewed_labels,
+        inputs=(
+            cohort_amyloid_labels_path,
+            cohort_chart_reviews_path,
+            chart_reviews_2023_path,
+        ),
+        outputs=(chart_reviewed_cohort_amyloid_labels_path,),
+        kwargs={
+            "cohort_labels_path": cohort_amyloid_labels_path,
+            "cohort_chart_reviews_path": cohort_chart_reviews_path,
+            "chart_reviews_2023_path": chart_reviews_2023_path,
+            "out_path": chart_reviewed_cohort_amyloid_labels_path,
+        },
+        code=(Path(label_rules.__file__),),
+    )
+)
+
+register_step(
+    Step(
+        "labeled_cohort",
+        build_labeled_cohort,
+        inputs=(
+            chart_reviewed_cohort_amyloid_labels_path,
+            cohort_file.cohort_entry_file_path.with_suffix(".parquet"),
+            hf_subtype_file.hf_subtype_path.with_suffix(".parquet"),
+            demographics_file.demographics_path.with_suffix(".parquet"),
+            echomaster_file.echomaster_path.with_suffix(".parquet"),
+            deid_notes_file.notes_path.with_suffix(".parquet"),
+        ),
+        outputs=(labeled_cohort_file.labeled_cohort_file_path.with_suffix(".csv"),),
+        kwargs={
+            "labels_path": chart_reviewed_cohort_amyloid_labels_path,
+            "cohort_entry_path": cohort_file.cohort_entry_file_path,
+            "hf_subtype_path": hf_subtype_file.hf_subtype_path,
+            "demographics_path": demographics_file.demographics_path,
+            "echomaster_path": echomaster_file.echomaster_path,
+            "notes_path": deid_notes_file.notes_path,
+            "out_path": labeled_cohort_file.labeled_cohort_file_path.with_suffix(
+                ".csv"
+            ),
+        },
+    )
+)
+
+register_step(
+    Step(
+        "labeled_cohort_parquet",
+        labeled_cohort_file.csv_to_parquet,
+        inputs=(labeled_cohort_file.labeled_cohort_file_path.with_suffix(".csv"),),
+        outputs=(labeled_cohort_file.labeled_cohort_file_path.with_suffix(".parquet"),),
+        # written by labeled_cohort, so no SQL footer
+        kwargs={
+            "path": labeled_cohort_file.labeled_cohort_file_path,
+            "sql_footer": False,
+        },
+    )
+)
+
+register_step(
+    Step(
+        "patient_index",
+        patient_index.build_patient_index,
+        inputs=tuple(
+            path.with_suffix(".parquet")
+            for path in patient_index.PATIENT_TABLES.values()
+        ),
+        outputs=tuple(
+            patient_index.PATIENT_INDEX_DIR / f"{name}.parquet"
+            for name in patient_index.PATIENT_TABLES
+        )
+        + (patient_index.PATIENT_INDEX_DIR / patient_index.INDEX_NAME,),
+    )
+)
+
+register_step(
+    Step(
+        "notes_dedup",
+        note_dedup.deduplicate_notes,
+        inputs=(deid_notes_file.notes_path.with_suffix(".parquet"),),
+        outputs=tuple(
+            note_dedup.NOTES_DEDUP_DIR / name
+            for name in (
+                note_dedup.NOTES_NAME,
+                note_dedup.PARAGRAPHS_NAME,
+                note_dedup.PARAGRAPH_TEXT_NAME,
+            )
+        ),
+    )
+)
+
+# source name -> (path, text column, document id column or None for the row number)
+SECTION_SOURCES = {
+    "cardiac_path_reports": (
+        datasets.dataset_config_mapping["cardiac_path_reports"]["path"],
+        "cardiac_path_report",
+        "document_ID",
+    ),
+    "pyp_reports": (
+        datasets.dataset_config_mapping["pyp_reports"]["path"],
+        "reg1",
+        "document_ID",
+    ),
+    "cardiac_mris": (
+        cardiac_MRIs_file.cardiac_mri_path.with_suffix(".parquet"),
+        "Cardiac_MRI_text",
+        None,
+    ),
+    "notes": (
+        deid_notes_file.notes_path.with_suffix(".parquet"),
+        "deid_note_text",
+        None,
+    ),
+}
+for name, (source, column, id_column) in SECTION_SOURCES.items():
+    register_step(
+        Step(
+            f"sections_{name}",
+            sections.build_section_index,
+            inputs=(source,),
+            outputs=(sections.sections_path(source),),
+            kwargs={"path": source, "column": column, "id_column": id_column},
+        )
+    )
+
+
+def upstream_steps(name: str) -> List[str]:
+    """Steps that write one of the inputs of a step.
+
+    Args:
+        name (str): step name
+
+    Returns:
+        List[str]: names of the steps it depends on
+    """
+    inputs = set(STEPS[name].inputs)
+    return [
+        other.name
+        for other in STEPS.values()
+        if other.name != name and inputs.intersection(other.outputs)
+    ]
+
+
+def _with_upstream(names: List[str]) -> List[str]:
+    names = list(names)
+    for name in names:
+        names.extend(dep for dep in upstream_steps(name) if dep not in names)
+    return names
+
+
+def _check_acyclic(names: List[str]) -> None:
+    remaining = set(names)
+    while remaining:
+        ready = {
+            name
+            for name in remaining
+            if not remaining.intersection(upstream_steps(name))
+        }
+        if not ready:
+            raise Exception(f"Circular step dependencies: {sorted(remaining)}")
+        remaining -= ready
+
+
+def file_fingerprint(path: Path, files: Dict[str, dict]) -> str:
+    """sha256 of a file, re-hashed only when its size or mtime changed.
+
+    Args:
+        path (Path): file to fingerprint
+        files (Dict[str, dict]): fingerprint cache from the manifest, updated in place
+
+    Returns:
+        str: hex digest
+    """
+    stat = Path(path).stat()
+    cached = files.get(str(path))
+    if (
+        cached is not None
+        and cached["size"] == stat.st_size
+        and cached["mtime_ns"] == stat.st_mtime_ns
+    ):
+        return cached["sha256"]
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    files[str(path)] = {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": h.hexdigest(),
+    }
+    return h.hexdigest()
+
+
+ETL_DIR = Path(__file__).resolve().parent
+
+
+def _module_file(root: Path, module: str) -> Path | None:
+    path = root.joinpath(*module.split("."))
+    for candidate in (path.with_suffix(".py"), path / "__init__.py"):
+        if candidate.is_file():
+            return candidate
+    return None
+
+
+@lru_cache(maxsize=None)
+def local_imports(path: Path) -> Tuple[Path, ...]:
+    """A source file and the etl modules it imports, recursively.
+
+    Imports are resolved against the directory of the importing file and the
+    etl directory (file_parsing, notebooks and the etl scripts), like the
+    sibling imports of the etl code. Third party modules are left out.
+
+    Args:
+        path (Path): python source file
+
+    Returns:
+        Tuple[Path, ...]: path first, then its local import closure
+    """
+    seen, todo = {}, [Path(path).resolve()]
+    while todo:
+        path = todo.pop()
+        if path in seen:
+            continue
+        seen[path] = None
+        for node in ast.walk(ast.parse(path.read_text(), str(path))):
+            if isinstance(node, ast.Import):
+                modules = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom):
+                base = node.module or ""
+                # "from package import module" imports a module per name
+                modules = [base] * bool(base) + [
+                    f"{base}.{alias.name}".lstrip(".") for alias in node.names
+                ]
+            else:
+                continue
+            for root in {path.parent, ETL_DIR}:
+                for module in modules:
+                    found = _module_file(root, module)
+                    if found is not None:
+                        todo.append(found.resolve())
+    return tuple(seen)
+
+
+def _names(code) -> List[str]:
+    # global and attribute names of a code object and the functions nested in it
+    names = list(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names += _names(const)
+    return names
+
+
+def referenced_modules(func: Callable) -> List[Path]:
+    """Source files of the etl modules a function refers to.
+
+    Follows the functions of the same module it calls, so a step defined in
+    pipeline.py depends on the loaders it (or its helpers) uses, not on every
+    module pipeline.py imports.
+
+    Args:
+        func (Callable): step function
+
+    Returns:
+        List[Path]: local_imports of every referenced etl module
+    """
+    module, seen, todo, paths = func.__module__, set(), [func], {}
+    while todo:
+        func = inspect.unwrap(todo.pop())
+        if func in seen:
+            continue
+        seen.add(func)
+        for name in _names(func.__code__):
+            value = func.__globals__.get(name)
+            if inspect.isfunction(value) and value.__module__ == module:
+                todo.append(value)
+            elif inspect.ismodule(value) and getattr(value, "__file__", None):
+                path = Path(value.__file__).resolve()
+                if path.is_relative_to(ETL_DIR):
+                    paths.update(dict.fromkeys(local_imports(path)))
+    return list(paths)
+
+
+def step_fingerprint(step: Step, files: Dict[str, dict]) -> str:
+    """Hash of everything a step depends on.
+
+    Args:
+        step (Step): registered step
+        files (Dict[str, dict]): fingerprint cache from the manifest
+
+    Returns:
+        str: hex digest, or "" if an input is missing
+    """
+    h = hashlib.sha256()
+    h.update(step.name.encode())
+    h.update(repr(sorted((k, str(v)) for k, v in step.kwargs.items())).encode())
+    # instrument.traced wraps the parsers, hash the module defining them
+    source = Path(inspect.getsourcefile(inspect.unwrap(step.func))).resolve()
+    # pipeline.py imports every parser, its own steps hash the modules they use
+    if source == Path(__file__).resolve():
+        code = [source]
+        code += [p for p in referenced_modules(step.func) if p not in code]
+    else:
+        code = list(local_imports(source))
+    for path in step.code:
+        code += [p for p in local_imports(Path(path)) if p not in code]
+    for path in list(code) + list(step.inputs):
+        if not Path(path).exists():
+            return ""
+        h.update(file_fingerprint(path, files).encode())
+    return h.hexdigest()
+
+
+def _run(name: str) -> str:
+    # Runs in a worker process
+    step = STEPS[name]
+    with instrument.span(name):
+        step.func(**step.kwargs)
+    return name
+
+
+def run(
+    names: List[str] | None = None,
+    jobs: int | None = None,
+    force: bool = False,
+    dry_run: bool = False,
+    manifest_path: Path = MANIFEST_PATH,
+) -> List[str]:
+    """Runs out of date steps, each as soon as the steps it depends on are done.
+
+    Args:
+        names (List[str], optional): Subset of STEPS to bring up to date, their
+            upstream steps are always included. Defaults to all.
+        jobs (int, optional): Worker processes. Defaults to None (executor default).
+        force (bool, optional): Run every selected step. Defaults to False.
+        dry_run (bool, optional): Only print the steps that would run. Defaults to False.
+        manifest_path (Path, optional): Fingerprints of the last successful runs.
+            Defaults to MANIFEST_PATH.
+
+    Returns:
+        List[str]: Steps that ran (or would run, for a dry run)
+    """
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+    files, fingerprints = manifest.setdefault("files", {}), manifest.setdefault(
+        "steps", {}
+    )
+
+    names = _with_upstream(list(STEPS) if names is None else names)
+    _check_acyclic(names)
+    upstream = {name: upstream_steps(name) for name in names}
+
+    pending, running = set(names), {}
+    done, failed, ran = set(), set(), []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            for name in sorted(pending):
+                if not all(dep in done or dep in failed for dep in upstream[name]):
+                    continue
+                pending.discard(name)
+                if failed.intersection(upstream[name]):
+                    print(f"skipped {name}, a dependency failed")
+                    failed.add(name)
+                    continue
+
+                step = STEPS[name]
+                fingerprint = step_fingerprint(step, files)
+                up_to_date = (
+                    fingerprint
+                    and fingerprints.get(name) == fingerprint
+                    and all(Path(p).exists() for p in step.outputs)
+                    # in a dry run upstream steps do not write their outputs
+                    and not (dry_run and set(ran).intersection(upstream[name]))
+                )
+                if up_to_date and not force:
+                    done.add(name)
+                elif dry_run:
+                    print(f"would run {name}")
+                    ran.append(name)
+                    done.add(name)
+                else:
+                    running[pool.submit(_run, name)] = name
+
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"failed {name}: {e!r}")
+                    failed.add(name)
+                    continue
+                print(f"ran {name}")
+                # inputs cannot change while a step runs, its upstream steps are done
+                fingerprints[name] = step_fingerprint(STEPS[name], files)
+                ran.append(name)
+                done.add(name)
+            if not dry_run:
+                manifest_path.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    return ran
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("--force", action="store_true", help="Run every step")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Only list out of date steps"
+    )
+    parser.add_argument("--manifest", type=Path, default=MANIFEST_PATH)
+    parser.add_argument(
+        "--trace", type=Path, default=None, help="JSON-lines file for the step spans"
+    )
+    parser.add_argument("steps", nargs="*", help=f"Subset of: {', '.join(STEPS)}")
+    args = parser.parse_args()
+
+    if args.trace is not None:
+        # worker processes inherit the tracer, every process appends its spans
+        args.trace.unlink(missing_ok=True)
+        instrument.enable(args.trace)
+    run(
+        names=args.steps or None,
+        jobs=args.jobs,
+        force=args.force,
+        dry_run=args.dry_run,
+        manifest_path=args.manifest,
+    )
+    if args.trace is not None and args.trace.exists():
+        instrument.print_summary(args.trace)
@@ -0,0 +1,1420 @@
+"""Synthetic EDW pull with the exact file formats the parsers read.
+
+Writes a directory laid out like /data/datasets/Amyloidosis/ (same relative
+paths as the *_path constants of the file_parsing modules) with synthetic
+versions of every extract:
+
+    cohort entry, labeled cohort, demographics, comorbidities, ICD codes,
+    outpatient encounters, echomaster, echosyngo, HF subtype, cardiac MRIs,
+    deidentified notes, cardiac path / PYP / Mayo lab reports with their
+    annotations and patient level diagnoses, the merged patient diagnoses and
+    the analysis cohort file (COHORT_DATA_FILE.csv)
+
+in the format of the pull: pipe separated EDW extracts ending with the 2 SQL
+footer rows, comma separated notes, reports and labels, the cardiac MRIs
+unquoted. Report text has the artifacts the cleaning rules fix (\\x0b newlines,
+-- and ? section separators, run-together camelCase words, missing spaces after
+periods, ...). Patients are consistent across tables: cases have amyloid ICD
+codes, thicker walls on echo, positive reports, ...
+
+Patients are generated in blocks of block_patients and every table is appended
+block by block, so memory does not grow with the number of patients. Every
+(block, table) has its own random stream, a table is the same whatever other
+tables are written with it.
+
+Point the parsers at the output with their path argument, e.g.
+    icd_codes_file.csv_to_parquet(out / "2023 pull" / "Amyloidosis Patients ICD Codes 2023")
+or get the paths from pull_paths(out).
+
+Usage:
+    python synthetic_pull.py OUT_DIR --patients 1000000
+    python synthetic_pull.py OUT_DIR --patients 10000 --tables icd_codes echosyngo
+"""
+
+import argparse
+import csv
+import zlib
+from functools import cached_property
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Sequence
+
+import numpy as np
+import pandas as pd
+
+from file_parsing import (
+    cardiac_MRIs_file,
+    cohort_file,
+    comorbidities_file,
+    datasets,
+    deid_notes_file,
+    demographics_file,
+    echomaster_file,
+    echosyngo_file,
+    hf_subtype_file,
+    icd_codes_file,
+    labeled_cohort_file,
+    outpt_encounters_file,
+)
+
+# The layout of the pull is relative to the real data directory
+BASE = Path("/data/datasets/Amyloidosis/")
+
+SEED = 2556
+BLOCK_PATIENTS = 50_000
+IR_ID_OFFSET = 1_000_000
+
+# pull period and footer
+DATE_START = np.datetime64("2010-01-01")
+DATE_DAYS = 13 * 365
+ICD10_START = np.datetime64("2015-10-01")
+COMPLETION_TIME = "2023-06-01T09:41:27.5218423-04:00"
+
+# patient mix
+AMYLOID_PREVALENCE = 0.05
+TTR_FRACTION = 0.7
+HEREDITARY_TTR_FRACTION = 0.2
+HF_PREVALENCE = 0.4
+
+# mean rows per patient
+ICD_CODES_PER_PATIENT = 25
+ENCOUNTERS_PER_PATIENT = 12
+ECHOS_PER_PATIENT = 1.5
+MEASUREMENTS_PER_ECHO = 30
+NOTES_PER_PATIENT = 3
+# reports per patient (controls, cases)
+REPORT_RATES = {
+    "cardiac_path_reports": (0.02, 0.6),
+    "pyp_reports": (0.05, 0.8),
+    "mayo_labs": (0.01, 0.5),
+}
+CARDIAC_MRI_RATES = (0.03, 0.4)
+
+# separators between report fragments, "" makes run-on words
+SEPARATORS = np.array(
+    [" ", " ", " ", "  ", "\x0b", "\x0b\x0b", " -- ", "--", "?", ". ", ""]
+)
+# the MRI extract is read unquoted, its text has no line breaks
+MRI_SEPARATORS = np.array([" ", " ", " ", "  ", "\x0b", " -- ", "--", "?", ". ", ""])
+NOTE_SEPARATORS = np.array([" ", " ", "\n", "\n\n", "\x0b", " -- ", "?", ". ", ""])
+
+# document level diagnosis codes of the annotations (0 negative, 1 positive, 2 indeterminate)
+DIAGNOSIS_NAMES = {
+    "cardiac_path_reports": ["NEGATIVE", "POSITIVE", "INDETERMINATE"],
+    "pyp_reports": ["NOT_SUGGESTIVE", "STRONGLY_SUGGESTIVE", "EQUIVOCAL"],
+    "mayo_labs": ["NEGATIVE", "POSITIVE", "INDETERMINATE"],
+}
+# P(negative, positive, indeterminate) of a document (controls, cases)
+DIAGNOSIS_P = {
+    "cardiac_path_reports": ([0.9, 0.0, 0.1], [0.05, 0.9, 0.05]),
+    "pyp_reports": ([0.85, 0.03, 0.12], [0.05, 0.85, 0.1]),
+    "mayo_labs": ([0.9, 0.0, 0.1], [0.05, 0.9, 0.05]),
+}
+
+RACES = ["White", "Black or African American", "Asian", "Other", "Unknown"]
+RACE_P = [0.62, 0.22, 0.05, 0.08, 0.03]
+ETHNICITIES = ["Not Hispanic or Latino", "Hispanic or Latino", "Unknown"]
+ETHNICITY_P = [0.85, 0.1, 0.05]
+INSURANCE = {
+    "MEDICARE": "Medicare",
+    "MEDICARE ADVANTAGE": "Medicare",
+    "MEDICAID": "Medicaid",
+    "BLUE CROSS BLUE SHIELD": "Commercial",
+    "AETNA": "Commercial",
+    "UNITED HEALTHCARE": "Commercial",
+    "SELF PAY": "Self-pay",
+}
+INSURANCE_P = [0.35, 0.15, 0.15, 0.15, 0.08, 0.08, 0.04]
+
+# comorbidity -> (prevalence in controls, in cases)
+COMORBIDITIES = {
+    "htn": (0.45, 0.7),
+    "dm": (0.2, 0.25),
+    "hld": (0.35, 0.45),
+    "ckd": (0.12, 0.35),
+    "afib": (0.1, 0.4),
+    "cad": (0.15, 0.25),
+    "copd": (0.08, 0.1),
+    "stroke": (0.04, 0.08),
+    "obesity": (0.3, 0.2),
+    "osa": (0.1, 0.12),
+    "carpal_tunnel": (0.03, 0.3),
+    "spinal_stenosis": (0.04, 0.2),
+    "neuropathy": (0.05, 0.25),
+    "aortic_stenosis": (0.03, 0.12),
+    "pacemaker": (0.03, 0.15),
+}
+
+AMYLOID_ICD10 = {
+    "TTR": ["E85.82", "E85.1", "E85.4", "E85.89"],
+    "AL": ["E85.81", "E85.89", "E85.9"],
+}
+AMYLOID_ICD9 = {"TTR": ["277.30", "277.39"], "AL": ["277.30", "277.39"]}
+HF_ICD10 = [
+    "I50.9",
+    "I50.30",
+    "I50.32",
+    "I50.20",
+    "I50.22",
+    "I50.42",
+    "I42.9",
+    "I42.0",
+    "I43",
+]
+HF_ICD9 = ["428.0", "428.30", "428.32", "428.20", "425.4"]
+COMMON_ICD10 = [
+    "I10",
+    "E11.9",
+    "E78.5",
+    "N18.3",
+    "I48.91",
+    "Z79.01",
+    "I25.10",
+    "J44.9",
+    "G56.00",
+    "M48.06",
+    "G62.9",
+    "Z00.00",
+    "R06.02",
+    "R00.2",
+    "E66.9",
+    "G47.33",
+]
+COMMON_ICD9 = [
+    "401.9",
+    "250.00",
+    "272.4",
+    "585.3",
+    "427.31",
+    "V58.61",
+    "414.01",
+    "496",
+    "354.0",
+    "724.02",
+    "356.9",
+    "V70.0",
+    "786.05",
+    "785.1",
+    "278.00",
+    "327.23",
+]
+# long tail of codes, so the code columns have a realistic cardinality
+TAIL_ICD10 = [
+    f"{letter}{i:02d}.{j}"
+    for letter in "ACDFHJKLMNRSZ"
+    for i in range(100)
+    for j in range(0, 10, 3)
+]
+TAIL_ICD9 = [f"{i:03d}.{j}" for i in range(1, 1000, 2) for j in range(0, 10, 4)]
+ICD_SOURCES = ["Problem List", "Encounter Diagnosis", "Billing", "Medical History"]
+ICD_SETTINGS = ["Outpatient", "Inpatient", "Emergency"]
+
+ECHO_DESCRIPTIONS = [
+    "TTE COMPLETE",
+    "TTE LIMITED",
+    "TTE W CONTRAST",
+    "TEE",
+    "STRESS ECHO",
+]
+# echo_type as extracted, with the double spaces and padding the parser removes
+ECHO_TYPES = [
+    "Transthoracic",
+    "Transthoracic ",
+    "Exercise  Stress",
+    "Dobutamine  Stress",
+    "Transesophageal",
+]
+ECHO_DEPARTMENTS = [
+    "CARDIOLOGY",
+    "ECHO LAB",
+    "HEART VASCULAR CENTER",
+    "EMERGENCY",
+    "ICU",
+]
+
+# measurement -> (unit, mean, sd, mean shift in cases)
+MEASUREMENTS = {
+    "IVSd": ("cm", 1.0, 0.15, 0.5),
+    "LVPWd": ("cm", 0.95, 0.15, 0.45),
+    "LVIDd": ("cm", 4.8, 0.6, -0.5),
+    "LVIDs": ("cm", 3.1, 0.6, -0.2),
+    "LVEF": ("%", 58.0, 9.0, -8.0),
+    "LV mass": ("g", 170.0, 45.0, 80.0),
+    "LA dimension": ("cm", 3.9, 0.6, 0.5),
+    "LA volume index": ("ml/m2", 32.0, 9.0, 15.0),
+    "MV E velocity": ("m/s", 0.8, 0.2, 0.15),
+    "MV A velocity": ("m/s", 0.75, 0.2, -0.25),
+    "MV E/A": ("", 1.1, 0.4, 0.8),
+    "MV DecT": ("ms", 210.0, 45.0, -60.0),
+    "e' septal": ("m/s", 0.07, 0.02, -0.03),
+    "e' lateral": ("m/s", 0.09, 0.025, -0.035),
+    "E/e' average": ("", 9.5, 3.5, 8.0),
+    "TAPSE": ("cm", 2.2, 0.4, -0.6),
+    "RVSP": ("mmHg", 32.0, 9.0, 10.0),
+    "GLS": ("%", -19.0, 2.5, 6.0),
+    "Ao root diameter": ("cm", 3.2, 0.4, 0.0),
+    "AV peak velocity": ("m/s", 1.4, 0.5, 0.3),
+    "LVOT diameter": ("cm", 2.1, 0.2, 0.0),
+    "LVOT VTI": ("cm", 20.0, 4.0, -4.0),
+    "TR peak velocity": ("m/s", 2.6, 0.4, 0.4),
+    "IVC diameter": ("cm", 1.8, 0.5, 0.4),
+    **{f"Measurement {i}": ("cm", 5.0 + i % 7, 1.0, 0.0) for i in range(60)},
+}
+
+# report fragments, by document diagnosis (0, 1, 2) where it matters
+CARDIAC_PATH_FRAGMENTS = {
+    "header": ["FINAL DIAGNOSIS:", "FINAL PATHOLOGIC DIAGNOSIS:", "DIAGNOSIS:-"],
+    "specimen": [
+        "Heart, endomyocardial biopsy",
+        "HEART, RIGHT VENTRICLE, ENDOMYOCARDIAL BIOPSY:",
+        "Heart, explant:",
+        "Fat pad, abdominal, aspirate",
+    ],
+    "finding": {
+        0: [
+            "Negative for amyloid.",
+            "Congo red stain is negative for amyloid deposition",
+            "No evidence of AMYLOIDOSIS.No significant pathologic abnormality",
+            "Myocyte hypertrophy and interstitial fibrosisClinical correlation is recommended",
+        ],
+        1: [
+            "Positive for AMYLOIDOSIS.See comment.",
+            "AMYLOIDOSIS, see note.",
+            "Congo red stain is positive with apple-green birefringence under polarized light",
+            "Cardiac amyloidosisClinical correlation is recommended",
+        ],
+        2: [
+            "Equivocal congo red staining?see comment",
+            "Rare congo red positive deposits, amyloid cannot be excluded",
+            "Indeterminate for amyloid.Recommend repeat biopsy",
+        ],
+    },
+    "history": [
+        "CLINICAL HISTORY:rule out amyloid?",
+        "CLINICAL HISTORY:HFpEF, thick walls on echo?amyloid",
+        "Clinical information:-heart failure",
+        "",
+    ],
+    "comment": [
+        "COMMENT:The findings were discussed with the clinical team..",
+        "Electron microscopy to follow.",
+        "GROSS DESCRIPTION:Received in formalin are 5 tan-pink tissue fragments",
+        "",
+    ],
+}
+PYP_FRAGMENTS = {
+    "header": [
+        "EXAM: NM PYP CARDIAC AMYLOID SPECT",
+        "Tc-99m PYP planar and SPECT imaging",
+        "NM CARDIAC AMYLOID PYP",
+    ],
+    "indication": [
+        "INDICATION:evaluate for ATTR?",
+        "HISTORY: HFpEF, rule out cardiac amyloid",
+        "Indication:-thick LV walls",
+    ],
+    "ratio": [f"heart to contralateral lung ratio 1.{d}" for d in range(10)],
+    "finding": {
+        0: [
+            "Grade 0 myocardial uptake.Not suggestive of ATTR cardiac amyloidosis",
+            "No myocardial uptake, H/CL ratio 1.0",
+        ],
+        1: [
+            "Grade 3 myocardial uptake, strongly suggestive of ATTR cardiac amyloidosis",
+            "Grade 2 uptake; H/CL ratio 1.7.Strongly suggestive of transthyretin amyloidosis",
+        ],
+        2: [
+            "Grade 1 uptake, equivocal for ATTR amyloidosis?correlate clinically",
+            "Equivocal study, blood pool activity cannot be excluded",
+        ],
+    },
+    "impression": ["IMPRESSION:", "\n\nImpression:\n\n", "Impression:-", ""],
+}
+MAYO_FRAGMENTS = {
+    "header": [
+        "MAYO CLINIC LABORATORIES -- Amyloid Typing, LC-MS/MS, Tissue",
+        "Amyloid Typing by Mass Spec",
+    ],
+    "finding": {
+        0: [
+            "No amyloid detected.Congo red negative",
+            "Negative for amyloid deposition",
+        ],
+        1: [
+            "Amyloid typing: TTR peptide detected by LC-MS/MS",
+            "AL (lambda) type amyloid detected",
+        ],
+        2: ["Insufficient amyloid for typing?repeat", "Indeterminate, see comment"],
+    },
+    "comment": [
+        "Interpretation by the Mayo Clinic Renal Pathology Laboratory.",
+        "Result called to the ordering provider",
+        "",
+    ],
+}
+MRI_FRAGMENTS = {
+    "header": [
+        "CARDIAC MRI WITH AND WITHOUT CONTRAST",
+        "MR HEART MORPHOLOGY FUNCTION W WO CONTRAST",
+    ],
+    "indication": [
+        "INDICATION:evaluate for infiltrative cardiomyopathy?amyloid",
+        "HISTORY: LVH, heart failure",
+        "",
+    ],
+    "finding": {
+        0: [
+            "No late gadolinium enhancement.",
+            "Normal LV size and systolic function, LVEF 60%",
+            "Mild concentric LVHClinical correlation advised",
+        ],
+        1: [
+            "Diffuse subendocardial late gadolinium enhancement with abnormal myocardial nulling, findings are suggestive of cardiac amyloidosis",
+            "Elevated native T1 and extracellular volume 45%.Consistent with infiltrative cardiomyopathy",
+        ],
+    },
+}
+NOTE_FRAGMENTS = {
+    "header": ["PROGRESS NOTE", "Cardiology Clinic Note", "HPI:", "Subjective:"],
+    "body": [
+        "Patient presents for follow up of heart failure.",
+        "Denies chest pain, reports dyspnea on exertion",
+        "BP well controlledContinue current regimen",
+        "Bilateral carpal tunnel syndrome s/p release",
+        "Plan:-continue furosemide 40 mg daily",
+        "ROS: negative except as noted in HPI",
+        "Echo reviewed, LVEF 55%, concentric remodeling",
+    ],
+    "finding": {
+        0: ["No history of amyloidosis", "", ""],
+        1: [
+            "Known ATTR cardiac amyloidosis on tafamidis",
+            "Discussed PYP scan results, strongly suggestive of ATTR",
+            "AL amyloidosis followed by heme/onc",
+        ],
+    },
+}
+
+# analysis cohort
+ULTROMICS_CLASSES = ["DetectedAmyloidosis", "NotDetectedAmyloidosis", "Uncertain"]
+
+
+def _relative(path: Path) -> Path:
+    return Path(path).relative_to(BASE)
+
+
+def _stream(name: str) -> int:
+    return zlib.crc32(name.encode())
+
+
+def _dates(rng: np.random.Generator, n: int) -> np.ndarray:
+    days = rng.integers(0, DATE_DAYS, n).astype("timedelta64[D]")
+    return DATE_START + days
+
+
+def _timestamps(rng: np.random.Generator, n: int) -> np.ndarray:
+    seconds = rng.integers(0, DATE_DAYS * 86_400, n).astype("timedelta64[s]")
+    return (DATE_START + seconds).astype("datetime64[ns]") + rng.integers(
+        0, 10**9, n
+    ).astype("timedelta64[ns]")
+
+
+def _missing(dates: np.ndarray, present: np.ndarray) -> np.ndarray:
+    return np.where(present, dates, np.datetime64("NaT"))
+
+
+def _format_dates(dates: np.ndarray, edw_timestamp: bool = False) -> np.ndarray:
+    """Formats dates as yyyy-mm-dd or as EDW datetime2 (7 fractional digits), NaT as ""."""
+    if edw_timestamp:
+        # nanoseconds cut to the 100 ns resolution of datetime2
+        text = np.char.replace(
+            np.datetime_as_string(dates.astype("datetime64[ns]"), unit="ns"), "T", " "
+        ).astype("<U27")
+    else:
+        text = np.datetime_as_string(dates.astype("datetime64[D]"), unit="D")
+    return np.where(np.isnat(dates), "", text)
+
+
+def _nullable(values: np.ndarray, present: np.ndarray) -> pd.arrays.IntegerArray:
+    return pd.arrays.IntegerArray(
+        np.asarray(values, dtype=np.int64), ~np.asarray(present)
+    )
+
+
+def _flags(rng: np.random.Generator, p: np.ndarray | float, n: int) -> np.ndarray:
+    return (rng.random(n) < p).astype(np.int64)
+
+
+def _choice(rng: np.random.Generator, values: Sequence, n: int, p=None) -> np.ndarray:
+    return np.asarray(values, dtype=object)[rng.choice(len(values), n, p=p)]
+
+
+def _pick(rng: np.random.Generator, pools: Dict, labels: np.ndarray) -> np.ndarray:
+    """One fragment per document from the pool of its label."""
+    out = np.empty(len(labels), dtype=object)
+    out[:] = ""
+    for label, pool in pools.items():
+        index = np.flatnonzero(labels == label)
+        out[index] = _choice(rng, pool, len(index))
+    return out
+
+
+def _documents(
+    rng: np.random.Generator, parts: List[np.ndarray], separators: np.ndarray
+) -> List[str]:
+    """Joins fragments with random separators, the quirks of the extracted reports."""
+    n = len(parts[0])
+    columns = []
+    for part in parts:
+        columns += [part, separators[rng.integers(0, len(separators), n)]]
+    return ["".join(row).strip(" ") for row in zip(*columns[:-1])]
+
+
+def _ordinal(counts: np.ndarray) -> np.ndarray:
+    """0, 1, ... within each run of np.repeat(x, counts)."""
+    return np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+
+def _per_patient(
+    rng: np.random.Generator, ir_id: np.ndarray, mean: np.ndarray | float
+) -> np.ndarray:
+    """Repeats each ir_id a Poisson number of times."""
+    return np.repeat(ir_id, rng.poisson(mean, len(ir_id)))
+
+
+class Block:
+    """Patients [start, start + size) and the rows shared by several tables.
+
+    Args:
+        seed (int): seed of the pull
+        index (int): block number
+        start (int): first patient
+        size (int): patients in the block
+    """
+
+    def __init__(self, seed: int, index: int, start: int, size: int):
+        self.seed = seed
+        self.index = index
+        self.start = start
+        self.size = size
+
+    def rng(self, name: str) -> np.random.Generator:
+        return np.random.default_rng([self.seed, self.index, _stream(name)])
+
+    @cached_property
+    def patients(self) -> pd.DataFrame:
+        rng = self.rng("patients")
+        n = self.size
+        case = rng.random(n) < AMYLOID_PREVALENCE
+        subtype = np.where(rng.random(n) < TTR_FRACTION, "TTR", "AL")
+        hereditary = (
+            case & (subtype == "TTR") & (rng.random(n) < HEREDITARY_TTR_FRACTION)
+        )
+        hispanic = rng.random(n) < ETHNICITY_P[1]
+        ethnicity = np.where(
+            hispanic, ETHNICITIES[1], _choice(rng, ETHNICITIES[::2], n, p=[0.95, 0.05])
+        )
+        race = _choice(rng, RACES, n, p=RACE_P)
+        insurance = _choice(rng, list(INSURANCE), n, p=INSURANCE_P)
+        hf = case | (rng.random(n) < HF_PREVALENCE)
+        return pd.DataFrame(
+            {
+                "ir_id": IR_ID_OFFSET + self.start + np.arange(n, dtype=np.int64),
+                # cases are older
+                "age": np.clip(rng.normal(62 + 12 * case, 14, n), 18, 100).astype(int),
+                "sex": np.where(rng.random(n) < 0.5 + 0.3 * case, "Male", "Female"),
+                "race": race,
+                "ethnicity": ethnicity,
+                "race_ethnicity": np.where(hispanic, "Hispanic", race),
+                "insurance": insurance,
+                "insurance_mapped": pd.Series(insurance).map(INSURANCE).to_numpy(),
+                "case": case,
+                "subtype": np.where(case, subtype, None),
+                "ttr_subtype": np.where(
+                    case & (subtype == "TTR"),
+                    np.where(hereditary, "HTTR", "INDETERMINATE"),
+                    None,
+                ),
+                "diagnosis_date": _missing(_dates(rng, n), case),
+                "hf": hf,
+                "hf_date": _missing(_dates(rng, n), hf),
+                "tafamidis": case & (subtype == "TTR") & (rng.random(n) < 0.5),
+            }
+        )
+
+    @cached_property
+    def echos(self) -> pd.DataFrame:
+        rng = self.rng("echos")
+        p = self.patients
+        counts = rng.poisson(ECHOS_PER_PATIENT * (1 + p.case.to_numpy()), self.size)
+        ir_id = np.repeat(p.ir_id.to_numpy(), counts)
+        echo_id = ir_id * 100 + _ordinal(counts)
+        return pd.DataFrame(
+            {
+                "ir_id": ir_id,
+                "master_echo_id": echo_id,
+                "echo_date": _dates(rng, len(ir_id)),
+                "accession_num": np.char.add("E", echo_id.astype(str)),
+                "study_uid": np.char.add("1.2.840.113619.2.55.3.", echo_id.astype(str)),
+                "case": np.repeat(p.case.to_numpy(), counts),
+            }
+        )
+
+    @cached_property
+    def cohort_entry(self) -> pd.DataFrame:
+        rng = self.rng("cohort_entry")
+        p = self.patients
+        n = self.size
+        case = p.case.to_numpy()
+        has_pyp = np.isin(p.ir_id, self.reports("pyp_reports").ir_id)
+        has_mri = np.isin(p.ir_id, self.cardiac_mris.ir_id)
+        entries = {
+            "HF": (p.hf.to_numpy(), p.hf_date.to_numpy()),
+            "CA": (case | (rng.random(n) < 0.01), p.diagnosis_date.to_numpy()),
+            "CM": (case | (rng.random(n) < 0.1), None),
+            "PYP": (has_pyp, None),
+            "Tafamidis": (p.tafamidis.to_numpy(), p.diagnosis_date.to_numpy()),
+            "cMRI": (has_mri, None),
+        }
+        df = pd.DataFrame({"ir_id": p.ir_id})
+        for name, (entry, dates) in entries.items():
+            random_dates = _dates(rng, n)
+            if dates is not None:
+                dates = np.where(np.isnat(dates), random_dates, dates)
+            else:
+                dates = random_dates
+            df[f"{name}_cohort_entry"] = _nullable(np.ones(n), entry)
+            df[f"{name}_cohort_entry_date"] = _missing(dates, entry)
+        df["HF_stricter_definition_date"] = _missing(
+            p.hf_date.to_numpy(), p.hf.to_numpy() & (rng.random(n) < 0.6)
+        )
+        return df
+
+    @cached_property
+    def cardiac_mris(self) -> pd.DataFrame:
+        rng = self.rng("cardiac_mris")
+        p = self.patients
+        case = p.case.to_numpy()
+        ir_id = _per_patient(
+            rng, p.ir_id.to_numpy(), np.where(case, *CARDIAC_MRI_RATES[::-1])
+        )
+        is_case = np.isin(ir_id, p.ir_id[case])
+        label = (is_case & (rng.random(len(ir_id)) < 0.85)).astype(int)
+        parts = [
+            _choice(rng, MRI_FRAGMENTS["header"], len(ir_id)),
+            _choice(rng, MRI_FRAGMENTS["indication"], len(ir_id)),
+            _pick(rng, MRI_FRAGMENTS["finding"], label),
+        ]
+        return pd.DataFrame(
+            {
+                "ir_id": ir_id,
+                "procedure_name": _choice(
+                    rng,
+                    [
+                        "MRI CARDIAC W WO CONTRAST",
+                        "MRI CARDIAC MORPHOLOGY",
+                        "MRI CARDIAC STRESS",
+                    ],
+                    len(ir_id),
+                ),
+                "Cardiac_MRI_date": _format_dates(_dates(rng, len(ir_id))),
+                "Cardiac_MRI_text": _documents(rng, parts, MRI_SEPARATORS),
+            }
+        )
+
+    def reports(self, dataset: str) -> pd.DataFrame:
+        """Reports of a dataset with their document level diagnosis (0, 1, 2)."""
+        cache = self.__dict__.setdefault("_report_cache", {})
+        if dataset not in cache:
+            cache[dataset] = self._reports(dataset)
+        return cache[dataset]
+
+    def _reports(self, dataset: str) -> pd.DataFrame:
+        rng = self.rng(dataset)
+        p = self.patients
+        case = p.case.to_numpy()
+        control_rate, case_rate = REPORT_RATES[dataset]
+        counts = rng.poisson(np.where(case, case_rate, control_rate))
+        ir_id = np.repeat(p.ir_id.to_numpy(), counts)
+        n = len(ir_id)
+        is_case = np.repeat(case, counts)
+        subtype = np.repeat(p.subtype.to_numpy(), counts)
+        control_p, case_p = DIAGNOSIS_P[dataset]
+        diagnosis = np.where(
+            is_case, rng.choice(3, n, p=case_p), rng.choice(3, n, p=control_p)
+        )
+        if dataset == "cardiac_path_reports":
+            fragments = CARDIAC_PATH_FRAGMENTS
+            typing = np.where(
+                diagnosis == 1,
+                np.where(
+                    subtype == "AL",
+                    "typing by mass spectrometry: AL (lambda) type",
+                    "typing by mass spectrometry: ATTR (transthyretin) type",
+                ),
+                "",
+            )
+            parts = [
+                _choice(rng, fragments["header"], n),
+                _choice(rng, fragments["specimen"], n),
+                _pick(rng, fragments["finding"], diagnosis),
+                typing,
+                _choice(rng, fragments["history"], n),
+                _choice(rng, fragments["comment"], n),
+            ]
+        elif dataset == "pyp_reports":
+            fragments = PYP_FRAGMENTS
+            parts = [
+                _choice(rng, fragments["header"], n),
+                _choice(rng, fragments["indication"], n),
+                _choice(rng, fragments["ratio"], n),
+                _choice(rng, fragments["impression"], n),
+                _pick(rng, fragments["finding"], diagnosis),
+            ]
+        else:
+            fragments = MAYO_FRAGMENTS
+            finding = _pick(rng, fragments["finding"], diagnosis)
+            # positive typing follows the subtype
+            finding[(diagnosis == 1) & (subtype == "AL")] = fragments["finding"][1][1]
+            finding[(diagnosis == 1) & (subtype != "AL")] = fragments["finding"][1][0]
+            parts = [
+                _choice(rng, fragments["header"], n),
+                finding,
+                _choice(rng, fragments["comment"], n),
+            ]
+        config = datasets.dataset_config_mapping[dataset]
+        return pd.DataFrame(
+            {
+                "document_ID": ir_id * 100 + _ordinal(counts),
+                "ir_id": ir_id,
+                config["date"]: _dates(rng, n),
+                config["document"]: _documents(rng, parts, SEPARATORS),
+                "diagnosis": diagnosis,
+            }
+        )
+
+    def patient_diagnosis(self, dataset: str) -> pd.DataFrame:
+        """Patient level diagnosis: positive if any report is, then indeterminate, then negative."""
+        date = datasets.dataset_config_mapping[dataset]["date"]
+        reports = self.reports(dataset)
+        # rank positive > indeterminate > negative, earliest report first
+        rank = reports.diagnosis.map({1: 0, 2: 1, 0: 2})
+        first = (
+            reports.assign(rank=rank)
+            .sort_values(["ir_id", "rank", date])
+            .drop_duplicates("ir_id")
+        )
+        return pd.DataFrame(
+            {
+                "ir_id": first.ir_id.to_numpy(),
+                "document_ID": first.document_ID.to_numpy(),
+                "diagnosis": first.diagnosis.to_numpy(),
+                "date": first[date].to_numpy(),
+            }
+        )
+
+
+def _format_date_columns(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    for column in df.columns:
+        if column.endswith("date"):
+            df[column] = _format_dates(df[column].to_numpy())
+    return df
+
+
+def cohort_entry(block: Block) -> pd.DataFrame:
+    return _format_date_columns(block.cohort_entry)
+
+
+def demographics(block: Block) -> pd.DataFrame:
+    p = block.patients
+    return pd.DataFrame(
+        {
+            "ir_id": p.ir_id,
+            "Age_cohort": p.age,
+            "Gender_EDW": p.sex,
+            "Race_EDW": p.race,
+            "Ethnicity_EDW": p.ethnicity,
+            "race_ethncty_combined": p.race_ethnicity,
+            "Insurance_EDW_cohort": p.insurance,
+            "Insurance_Mapped_cohort": p.insurance_mapped,
+        }
+    )
+
+
+def comorbidities(block: Block) -> pd.DataFrame:
+    rng = block.rng("comorbidities")
+    p = block.patients
+    n = block.size
+    case = p.case.to_numpy()
+    df = pd.DataFrame(
+        {
+            "ir_id": p.ir_id,
+            "smoking_sh": _choice(
+                rng,
+                ["Never", "Former", "Current Every Day", "Current Some Day", "Unknown"],
+                n,
+                p=[0.5, 0.3, 0.1, 0.04, 0.06],
+            ),
+        }
+    )
+    for name, (control_p, case_p) in COMORBIDITIES.items():
+        flag = _flags(rng, np.where(case, case_p, control_p), n)
+        df[name] = flag
+        df[f"{name}_date"] = _format_dates(_missing(_dates(rng, n), flag == 1))
+    return df
+
+
+def icd_codes(block: Block) -> pd.DataFrame:
+    rng = block.rng("icd_codes")
+    p = block.patients
+    ir_id = _per_patient(rng, p.ir_id.to_numpy(), ICD_CODES_PER_PATIENT)
+    n = len(ir_id)
+    dates = _dates(rng, n)
+    icd10 = dates >= ICD10_START
+    # a long tailed mix: frequent codes, hf codes, then the tail
+    kind = rng.choice(3, n, p=[0.5, 0.1, 0.4])
+    tail10 = np.asarray(TAIL_ICD10, dtype=object)
+    tail9 = np.asarray(TAIL_ICD9, dtype=object)
+    zipf10 = np.minimum(rng.zipf(1.3, n), len(tail10)) - 1
+    zipf9 = np.minimum(rng.zipf(1.3, n), len(tail9)) - 1
+    code = np.where(
+        icd10,
+        np.select(
+            [kind == 0, kind == 1],
+            [_choice(rng, COMMON_ICD10, n), _choice(rng, HF_ICD10, n)],
+            tail10[zipf10],
+        ),
+        np.select(
+            [kind == 0, kind == 1],
+            [_choice(rng, COMMON_ICD9, n), _choice(rng, HF_ICD9, n)],
+            tail9[zipf9],
+        ),
+    )
+    # cases carry amyloid codes
+    subtype = pd.Series(p.subtype.to_numpy(), index=p.ir_id).reindex(ir_id).to_numpy()
+    amyloid = pd.notna(subtype) & (rng.random(n) < 0.15)
+    for name in ("TTR", "AL"):
+        rows = amyloid & (subtype == name)
+        code[rows & icd10] = _choice(rng, AMYLOID_ICD10[name], (rows & icd10).sum())
+        code[rows & ~icd10] = _choice(rng, AMYLOID_ICD9[name], (rows & ~icd10).sum())
+    source = _choice(rng, ICD_SOURCES, n, p=[0.2, 0.5, 0.25, 0.05])
+    encounter = source != "Problem List"
+    return pd.DataFrame(
+        {
+            "ir_id": ir_id,
+            "ICD_code": code,
+            "ICD_code_type": np.where(icd10, "ICD10", "ICD9"),
+            "ICD_code_source": source,
+            "consolidated_encounter_key": _nullable(
+                rng.integers(10**9, 10**10, n), encounter
+            ),
+            "ICD_code_date": _format_dates(dates),
+            "ICD_code_setting": _choice(rng, ICD_SETTINGS, n, p=[0.75, 0.2, 0.05]),
+        }
+    )
+
+
+def outpt_encounters(block: Block) -> pd.DataFrame:
+    rng = block.rng("outpt_encounters")
+    p = block.patients
+    counts = rng.poisson(ENCOUNTERS_PER_PATIENT, block.size)
+    ir_id = np.repeat(p.ir_id.to_numpy(), counts)
+    n = len(ir_id)
+    case = np.repeat(p.case.to_numpy(), counts)
+    telehealth = rng.random(n) < 0.15
+    measured = rng.random(n) < 0.7
+    height = np.round(rng.normal(170, 10, n), 1)
+    weight = np.round(rng.normal(82, 18, n), 1)
+    df = pd.DataFrame(
+        {
+            "ir_id": ir_id,
+            "enc_id": ir_id * 1000 + _ordinal(counts),
+            "enc_type": rng.integers(1, 6, n),
+            "encounter_outpatient_key": rng.integers(10**10, 10**11, n),
+            "enc_date": _format_dates(_dates(rng, n)),
+            "primary_dx_code": _choice(rng, COMMON_ICD10 + HF_ICD10, n),
+            "Cards_encounter_filter": _flags(rng, np.where(case, 0.5, 0.2), n),
+            "PCP_encounter_filter": _flags(rng, 0.4, n),
+            "pregnancy_flag": _flags(rng, 0.005, n),
+            "telehealth_flag": telehealth.astype(np.int64),
+            "telehealth_reason": np.where(
+                telehealth,
+                _choice(rng, ["COVID-19", "Patient preference", "Follow up"], n),
+                "",
+            ),
+            "Telehealth_Visit_type": np.where(
+                telehealth, _choice(rng, ["Video Visit", "Telephone Visit"], n), ""
+            ),
+            "height": np.where(measured, height, np.nan),
+            "weight": np.where(measured, weight, np.nan),
+            "bmi": np.where(
+                measured, np.round(weight / (height / 100) ** 2, 1), np.nan
+            ),
+            "sbp": _nullable(rng.normal(130, 18, n).round(), measured),
+            "dbp": _nullable(rng.normal(76, 11, n).round(), measured),
+        }
+    )
+    # ICD-9 prefixed flags of the encounter diagnoses
+    for code, (control_p, case_p) in {
+        "4251": (0.002, 0.02),
+        "4254": (0.01, 0.2),
+        "4280": (0.05, 0.3),
+        "42731": (0.05, 0.2),
+        "2773": (0.0, 0.4),
+    }.items():
+        df[code] = _flags(rng, np.where(case, case_p, control_p), n)
+    return df
+
+
+def echomaster(block: Block) -> pd.DataFrame:
+    rng = block.rng("echomaster")
+    echos = block.echos
+    n = len(echos)
+    limited = rng.random(n) < 0.15
+    return pd.DataFrame(
+        {
+            "patient_ir_id": echos.ir_id,
+            "master_echo_id": echos.master_echo_id,
+            "echo_date": _format_dates(echos.echo_date.to_numpy()),
+            "echo_description": np.where(
+                limited,
+                "TTE LIMITED",
+                _choice(rng, ECHO_DESCRIPTIONS, n, p=[0.7, 0.0, 0.15, 0.1, 0.05]),
+            ),
+            "echo_type": _choice(rng, ECHO_TYPES, n, p=[0.6, 0.2, 0.08, 0.04, 0.08]),
+            "accession_num": echos.accession_num,
+            "study_uid": echos.study_uid,
+            "department": _choice(
+                rng, ECHO_DEPARTMENTS, n, p=[0.4, 0.4, 0.1, 0.05, 0.05]
+            ),
+            "doppler": _nullable(_flags(rng, 0.9, n), rng.random(n) < 0.95),
+            "limited_echo": limited.astype(np.int64),
+            "echo_extractor_id": _nullable(rng.integers(1, 20, n), rng.random(n) < 0.1),
+        }
+    )
+
+
+def echosyngo(block: Block) -> pd.DataFrame:
+    rng = block.rng("echosyngo")
+    echos = block.echos
+    counts = rng.poisson(MEASUREMENTS_PER_ECHO, len(echos))
+    n = counts.sum()
+    study = np.repeat(np.arange(len(echos)), counts)
+    names = np.asarray(list(MEASUREMENTS), dtype=object)
+    # the named measurements are taken far more often than the generic ones
+    weights = np.where(np.char.startswith(names.astype(str), "Measurement"), 1.0, 20.0)
+    measurement = rng.choice(len(names), n, p=weights / weights.sum())
+    unit, mean, sd, shift = (np.asarray(v) for v in zip(*MEASUREMENTS.values()))
+    case = echos.case.to_numpy()[study]
+    value = rng.normal(mean[measurement] + case * shift[measurement], sd[measurement])
+    return pd.DataFrame(
+        {
+            "patient_ir_id": echos.ir_id.to_numpy()[study],
+            "study_uid": echos.study_uid.to_numpy()[study],
+            "accession_num": echos.accession_num.to_numpy()[study],
+            "measurement_name": names[measurement],
+            "measurement_value": np.round(value, 2),
+            "measurement_unit": unit[measurement],
+        }
+    )
+
+
+def hf_subtype(block: Block) -> pd.DataFrame:
+    rng = block.rng("hf_subtype")
+    p = block.patients[block.patients.hf]
+    n = len(p)
+    # one subtype per patient, HFpEF more often in cases
+    subtype = np.where(
+        p.case.to_numpy(),
+        rng.choice(4, n, p=[0.7, 0.15, 0.1, 0.05]),
+        rng.choice(4, n, p=[0.5, 0.3, 0.15, 0.05]),
+    )
+    recovered = subtype == 3
+    df = pd.DataFrame(
+        {
+            "ir_id": p.ir_id,
+            "HFrecEF_followupecho": _format_dates(_missing(_dates(rng, n), recovered)),
+        }
+    )
+    for i, name in enumerate(["HFpEF", "HFrEF", "HFmrEF", "HFrecEF"]):
+        df[name] = (subtype == i).astype(np.int64)
+    df["HF_first_date"] = _format_dates(
+        p.hf_date.to_numpy().astype("datetime64[ns]")
+        + rng.integers(0, 86_400 * 10**9, n).astype("timedelta64[ns]"),
+        edw_timestamp=True,
+    )
+    df["HF_ICD_code"] = _choice(rng, HF_ICD10, n)
+    return df
+
+
+def cardiac_mris(block: Block) -> pd.DataFrame:
+    return block.cardiac_mris
+
+
+def deid_notes(block: Block) -> pd.DataFrame:
+    rng = block.rng("deid_notes")
+    p = block.patients
+    counts = rng.poisson(NOTES_PER_PATIENT, block.size)
+    ir_id = np.repeat(p.ir_id.to_numpy(), counts)
+    n = len(ir_id)
+    case = np.repeat(p.case.to_numpy(), counts).astype(int)
+    parts = [_choice(rng, NOTE_FRAGMENTS["header"], n)]
+    parts += [_choice(rng, NOTE_FRAGMENTS["body"], n) for _ in range(6)]
+    parts.insert(3, _pick(rng, NOTE_FRAGMENTS["finding"], case))
+    return pd.DataFrame(
+        {
+            "ir_id": ir_id,
+            "created_date_key": _format_dates(_dates(rng, n)),
+            "deid_note_text": _documents(rng, parts, NOTE_SEPARATORS),
+        }
+    )
+
+
+def _report_table(dataset: str) -> Callable[[Block], pd.DataFrame]:
+    def generate(block: Block) -> pd.DataFrame:
+        reports = block.reports(dataset).drop(columns="diagnosis")
+        date = datasets.dataset_config_mapping[dataset]["date"]
+        reports[date] = _format_dates(reports[date].to_numpy())
+        return reports
+
+    return generate
+
+
+def _annotation_table(dataset: str) -> Callable[[Block], pd.DataFrame]:
+    def generate(block: Block) -> pd.DataFrame:
+        config = datasets.dataset_config_mapping[dataset]
+        reports = block.reports(dataset)
+        return pd.DataFrame(
+            {
+                "ir_id": reports.ir_id,
+                "document_ID": reports.document_ID,
+                config["date"]: _format_dates(reports[config["date"]].to_numpy()),
+                f"{config['dataset_prefix']}__amyloid_diagnosis": reports.diagnosis,
+            }
+        )
+
+    return generate
+
+
+def _patient_diagnosis_table(dataset: str) -> Callable[[Block], pd.DataFrame]:
+    def generate(block: Block) -> pd.DataFrame:
+        prefix = datasets.dataset_config_mapping[dataset]["dataset_prefix"]
+        diagnosis = block.patient_diagnosis(dataset)
+        return pd.DataFrame(
+            {
+                "ir_id": diagnosis.ir_id,
+                "document_ID": diagnosis.document_ID,
+                f"{prefix}__amyloid_diagnosis": diagnosis.diagnosis,
+                f"{prefix}__amyloid_diagnosis_date": _format_dates(
+                    diagnosis.date.to_numpy()
+                ),
+            }
+        )
+
+    return generate
+
+
+def _merged_diagnoses(block: Block) -> pd.DataFrame:
+    """The patient diagnoses of the 3 datasets merged as in merge__cp_pyp_mayo."""
+    p = block.patients.set_index("ir_id")
+    merged = None
+    for dataset, prefix in [
+        ("cardiac_path_reports", "cardiac_path"),
+        ("pyp_reports", "pyp"),
+        ("mayo_labs", "mayo"),
+    ]:
+        diagnosis = block.patient_diagnosis(dataset)
+        names = np.asarray(DIAGNOSIS_NAMES[dataset], dtype=object)
+        df = pd.DataFrame(
+            {
+                "ir_id": diagnosis.ir_id,
+                f"{prefix}__amyloid_diagnosis": names[diagnosis.diagnosis.to_numpy()],
+                f"{prefix}__date": diagnosis.date,
+            }
+        )
+        merged = df if merged is None else merged.merge(df, on="ir_id", how="outer")
+    merged = merged.sort_values("ir_id", ignore_index=True)
+    mayo_positive = (merged.mayo__amyloid_diagnosis == "POSITIVE").to_numpy()
+    subtype = p.subtype.reindex(merged.ir_id).to_numpy()
+    ttr_subtype = p.ttr_subtype.reindex(merged.ir_id).to_numpy()
+    merged["mayo__amyloid_subtype_diagnosis"] = np.where(mayo_positive, subtype, None)
+    merged["mayo__ttr_amyloid_subtype_diagnosis"] = np.where(
+        mayo_positive & (subtype == "TTR"), ttr_subtype, None
+    )
+    positive = {
+        "cardiac_path": merged.cardiac_path__amyloid_diagnosis == "POSITIVE",
+        "pyp": merged.pyp__amyloid_diagnosis == "STRONGLY_SUGGESTIVE",
+        "mayo": merged.mayo__amyloid_diagnosis == "POSITIVE",
+    }
+    negative = (merged.cardiac_path__amyloid_diagnosis == "NEGATIVE") | (
+        merged.mayo__amyloid_diagnosis == "NEGATIVE"
+    )
+    any_positive = positive["cardiac_path"] | positive["pyp"] | positive["mayo"]
+    merged["final__amyloid_diagnosis"] = np.select(
+        [any_positive, negative], ["POSITIVE", "NEGATIVE"], "INDETERMINATE"
+    )
+    # earliest positive report, else earliest report
+    positive_dates = pd.concat(
+        [merged[f"{prefix}__date"].where(positive[prefix]) for prefix in positive],
+        axis=1,
+    ).min(axis=1)
+    any_dates = merged[[f"{prefix}__date" for prefix in positive]].min(axis=1)
+    merged["final__amyloid_diagnosis_date"] = positive_dates.where(
+        any_positive, any_dates
+    )
+    merged["final__amyloid_subtype_diagnosis"] = np.select(
+        [mayo_positive, any_positive & positive["pyp"], any_positive],
+        [subtype, "TTR", "INDETERMINATE"],
+        None,
+    )
+    merged["final__ttr_amyloid_subtype_diagnosis"] = merged[
+        "mayo__ttr_amyloid_subtype_diagnosis"
+    ]
+    return merged.drop(columns=[f"{prefix}__date" for prefix in positive])
+
+
+def amyloid_diagnosis_labels(block: Block) -> pd.DataFrame:
+    df = _merged_diagnoses(block)
+    df["final__amyloid_diagnosis_date"] = _format_dates(
+        df.final__amyloid_diagnosis_date.to_numpy().astype("datetime64[D]")
+    )
+    return df
+
+
+def labeled_cohort(block: Block) -> pd.DataFrame:
+    rng = block.rng("labeled_cohort")
+    labels = _merged_diagnoses(block).set_index("ir_id")
+    p = block.patients.set_index("ir_id")
+    # patients with a report diagnosis or on tafamidis
+    ir_id = p.index[p.index.isin(labels.index) | p.tafamidis.to_numpy()]
+    n = len(ir_id)
+    p = p.loc[ir_id]
+    labels = labels.reindex(ir_id)
+    tafamidis = p.tafamidis.to_numpy()
+    diagnosis = labels.final__amyloid_diagnosis.to_numpy(dtype=object)
+    subtype = labels.final__amyloid_subtype_diagnosis.to_numpy(dtype=object)
+    tafamidis_only = tafamidis & pd.isna(diagnosis)
+    diagnosis = np.where(tafamidis_only, "POSITIVE", diagnosis)
+    subtype = np.where(tafamidis_only, "TTR", subtype)
+    date = labels.final__amyloid_diagnosis_date.to_numpy().astype("datetime64[ns]")
+    date = np.where(tafamidis_only, p.diagnosis_date.to_numpy(), date)
+    chart_review = rng.random(n) < 0.1
+    df = pd.DataFrame(
+        {
+            "ir_id": ir_id,
+            "Age_cohort": p.age.to_numpy(),
+            "Gender_EDW": p.sex.to_numpy(),
+            "Race_EDW": p.race.to_numpy(),
+            "Ethnicity_EDW": p.ethnicity.to_numpy(),
+            "race_ethncty_combined": p.race_ethnicity.to_numpy(),
+            "Insurance_EDW_cohort": p.insurance.to_numpy(),
+            "Insurance_Mapped_cohort": p.insurance_mapped.to_numpy(),
+            "HFrecEF_followupecho": _format_dates(
+                _missing(_dates(rng, n), p.hf.to_numpy() & (rng.random(n) < 0.05))
+            ),
+            "full_chart_review": (rng.random(n) < 0.05).astype(np.int64),
+            "label__chart_review": chart_review.astype(np.int64),
+            "pyp_or_tafamidis_only": (
+                tafamidis_only
+                | (
+                    labels.pyp__amyloid_diagnosis.notna()
+                    & labels.cardiac_path__amyloid_diagnosis.isna()
+                ).to_numpy()
+            ).astype(np.int64),
+            "label__definitive": (diagnosis != "INDETERMINATE").astype(np.int64),
+            "label__missing_diagnosis": np.zeros(n, dtype=np.int64),
+            "label__amyloid_diagnosis": diagnosis,
+            "label__amyloid_subtype_diagnosis": subtype,
+            "label__ttr_amyloid_subtype_diagnosis": np.where(
+                subtype == "TTR", p.ttr_subtype.to_numpy(), None
+            ),
+            # the nanosecond timestamps the parser rounds
+            "label__amyloid_diagnosis_date": _format_dates(
+                date + rng.integers(0, 86_400 * 10**9, n).astype("timedelta64[ns]"),
+                edw_timestamp=True,
+            ),
+        }
+    )
+    entries = block.cohort_entry.set_index("ir_id").loc[ir_id]
+    for column in entries.columns:
+        values = entries[column].to_numpy()
+        df[column] = (
+            _format_dates(values) if column.endswith("date") else entries[column].array
+        )
+    df["patient_group__amyloid_cases"] = diagnosis == "POSITIVE"
+    df["patient_group__controls"] = diagnosis == "NEGATIVE"
+    df["Amyloidosis"] = (diagnosis == "POSITIVE").astype(np.int64)
+    return df
+
+
+def _printed_list(values: Iterable) -> str:
+    return "[" + ", ".join(values) + "]"
+
+
+def analysis_cohort(block: Block) -> pd.DataFrame:
+    """One row per HF patient with an echo, the columns of example_COHORT_DATA_FILE.csv."""
+    rng = block.rng("analysis_cohort")
+    p = block.patients
+    p = p[p.hf & p.ir_id.isin(block.echos.ir_id)]
+    n = len(p)
+    case = p.case.to_numpy()
+    subtype = p.subtype.to_numpy()
+    pwt = np.round(rng.normal(1.0 + 0.45 * case, 0.15, n), 2)
+    ivs = np.round(rng.normal(1.05 + 0.5 * case, 0.16, n), 2)
+    lvidd = np.round(rng.normal(4.8 - 0.5 * case, 0.6, n), 2)
+    # model scores are informative but noisy
+    score = np.clip(0.15 + 0.45 * case + rng.normal(0, 0.2, n), 0.001, 0.999)
+    pfizer = np.clip(score + rng.normal(0, 0.1, n), 0.001, 0.999)
+    clips = rng.integers(1, 7, n)
+    cls, prob, uncertainty = [], [], []
+    for i in range(n):
+        probs = np.clip(score[i] + rng.normal(0, 0.15, clips[i]), 0, 1)
+        uncertain = rng.random(clips[i]) < 0.15
+        classes = np.where(
+            uncertain,
+            ULTROMICS_CLASSES[2],
+            np.where(probs > 0.5, *ULTROMICS_CLASSES[:2]),
+        )
+        cls.append(_printed_list(f"'{c}'" for c in classes))
+        prob.append(_printed_list(f"{v:.4f}" for v in probs))
+        uncertainty.append(
+            _printed_list(f"{v:.4f}" for v in rng.random(clips[i]) * 0.3)
+        )
+    echonet_present = rng.random(n) < 0.85
+    return pd.DataFrame(
+        {
+            "id": p.ir_id.to_numpy(),
+            "true_label": np.where(case, np.where(subtype == "AL", "AL", "ATTR"), None),
+            "Age": p.age.to_numpy().astype(float),
+            "Sex": np.char.lower(p.sex.to_numpy().astype(str)),
+            "Race": p.race.to_numpy(),
+            "SDI": np.round(rng.uniform(1, 100, n)),
+            "EF": np.round(rng.normal(57 - 7 * case, 9, n), 1),
+            "PWT": pwt,
+            "IVS_d_2D_calc": ivs,
+            "RWT": np.round(2 * pwt / lvidd, 2),
+            "htn": _flags(rng, np.where(case, 0.7, 0.45), n).astype(float),
+            "LVIDD": lvidd,
+            "mayo_score": np.clip(
+                np.round(2 + 4 * case + rng.normal(0, 1.5, n)), 0, 10
+            ),
+            "ultromics_classification": np.where(
+                score > 0.5, ULTROMICS_CLASSES[0], ULTROMICS_CLASSES[1]
+            ),
+            "ultromics_cls_list": cls,
+            "ultromics_prob_list": prob,
+            "ultromics_uncertainty_list": uncertainty,
+            "ultromics_prediction": np.round(score, 4),
+            "echonet_prediction": np.where(
+                echonet_present,
+                np.round(np.clip(score + rng.normal(0, 0.15, n), 0, 1), 4),
+                np.nan,
+            ),
+            "pfizer_prediction": [f"[{1 - v:.4f} {v:.4f}]" for v in pfizer],
+            "pfizer_prediction_proba": [f"[{1 - v:.4f} {v:.4f}]" for v in pfizer],
+            "encounter_gt_50": _flags(rng, 0.3, n).astype(float),
+            # the file has a trailing comma
+            "": "",
+        }
+    )
+
+
+class Extract:
+    """How a table is written.
+
+    Args:
+        path (Path): relative to the output directory
+        sep (str, optional): Defaults to "|".
+        footer (bool, optional): ends with the 2 SQL rows. Defaults to True.
+        quoting (int, optional): csv quoting. Defaults to csv.QUOTE_MINIMAL.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        sep: str = "|",
+        footer: bool = True,
+        quoting: int = csv.QUOTE_MINIMAL,
+    ):
+        self.path = Path(path)
+        self.sep = sep
+        self.footer = footer
+        self.quoting = quoting
+
+
+def _dataset_tables() -> Dict[str, tuple]:
+    tables = {}
+    for dataset in ["cardiac_path_reports", "pyp_reports", "mayo_labs"]:
+        config = datasets.dataset_config_mapping[dataset]
+        tables[dataset] = (
+            _report_table(dataset),
+            Extract(_relative(config["path"]), ",", False),
+        )
+        tables[f"{dataset}_annotations"] = (
+            _annotation_table(dataset),
+            Extract(_relative(config["annotations"]), ",", False),
+        )
+        # mayo_labs has no patient_diagnosis entry, it sits next to the other two
+        diagnosis_path = (
+            datasets.PATIENT_DIAGNOSIS_PATH / dataset / "patient_amyloid_diagnosis.csv"
+        )
+        tables[f"{dataset}_patient_diagnosis"] = (
+            _patient_diagnosis_table(dataset),
+            Extract(_relative(diagnosis_path), ",", False),
+        )
+    return tables
+
+
+# table -> (generator, how it is written)
+TABLES: Dict[str, tuple] = {
+    "cohort_entry": (
+        cohort_entry,
+        Extract(_relative(cohort_file.cohort_entry_file_path.with_suffix(".csv"))),
+    ),
+    "labeled_cohort": (
+        labeled_cohort,
+        Extract(
+            _relative(labeled_cohort_file.labeled_cohort_file_path.with_suffix(".csv")),
+            ",",
+        ),
+    ),
+    "demographics": (
+        demographics,
+        Extract(_relative(demographics_file.demographics_path.with_suffix(".csv"))),
+    ),
+    "comorbidities": (
+        comorbidities,
+        Extract(_relative(comorbidities_file.comorbitities_path.with_suffix(".csv"))),
+    ),
+    "icd_codes": (
+        icd_codes,
+        Extract(_relative(icd_codes_file.icd_codes_path.with_suffix(".csv"))),
+    ),
+    "outpt_encounters": (
+        outpt_encounters,
+        Extract(
+            _relative(outpt_encounters_file.outpt_encounters_path.with_suffix(".csv"))
+        ),
+    ),
+    "echomaster": (
+        echomaster,
+        Extract(_relative(echomaster_file.echomaster_path.with_suffix(".csv"))),
+    ),
+    "echosyngo": (
+        echosyngo,
+        Extract(_relative(echosyngo_file.echosyngo_path.with_suffix(".csv"))),
+    ),
+    "hf_subtype": (
+        hf_subtype,
+        Extract(_relative(hf_subtype_file.hf_subtype_path.with_suffix(".csv"))),
+    ),
+    "cardiac_mris": (
+        cardiac_mris,
+        Extract(
+            _relative(cardiac_MRIs_file.cardiac_mri_path.with_suffix(".csv")),
+            quoting=csv.QUOTE_NONE,
+        ),
+    ),
+    "deid_notes": (
+        deid_notes,
+        Extract(_relative(deid_notes_file.notes_path.with_suffix(".csv")), ",", False),
+    ),
+    **_dataset_tables(),
+    "amyloid_diagnosis_labels": (
+        amyloid_diagnosis_labels,
+        Extract(
+            Path("patient_amyloid_diagnosis")
+            / "all_datasets_patient_amyloid_diagnosis.csv",
+            ",",
+            False,
+        ),
+    ),
+    "analysis_cohort": (
+        analysis_cohort,
+        Extract(Path("COHORT_DATA_FILE.csv"), ",", False),
+    ),
+}
+
+
+def pull_paths(out_dir: Path, tables: Iterable[str] | None = None) -> Dict[str, Path]:
+    """Paths of the synthetic tables in out_dir.
+
+    Args:
+        out_dir (Path): output directory of write_pull
+        tables (Iterable[str], optional): Defaults to all of TABLES.
+
+    Returns:
+        Dict[str, Path]: table -> csv path
+    """
+    return {name: Path(out_dir) / TABLES[name][1].path for name in (tables or TABLES)}
+
+
+def write_pull(
+    out_dir: Path,
+    n_patients: int,
+    seed: int = SEED,
+    tables: Iterable[str] | None = None,
+    block_patients: int = BLOCK_PATIENTS,
+) -> Dict[str, int]:
+    """Writes a synthetic pull.
+
+    Args:
+        out_dir (Path): output directory, laid out like BASE
+        n_patients (int): patients
+        seed (int, optional): Defaults to SEED.
+        tables (Iterable[str], optional): tables to write. Defaults to all of TABLES.
+        block_patients (int, optional): patients generated at a time. Defaults to BLOCK_PATIENTS.
+
+    Returns:
+        Dict[str, int]: table -> rows written
+    """
+    tables = list(tables or TABLES)
+    unknown = [name for name in tables if name not in TABLES]
+    if unknown:
+        raise ValueError(f"Unknown tables {unknown}, choose from {list(TABLES)}")
+    paths = pull_paths(out_dir, tables)
+    for path in paths.values():
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+    files = {name: open(paths[name], "w", newline="") for name in tables}
+    rows = dict.fromkeys(tables, 0)
+    try:
+        for index, start in enumerate(range(0, n_patients, block_patients)):
+            block = Block(seed, index, start, min(block_patients, n_patients - start))
+            for name in tables:
+                generate, extract = TABLES[name]
+                df = generate(block)
+                df.to_csv(
+                    files[name],
+                    sep=extract.sep,
+                    index=False,
+                    header=index == 0,
+                    quoting=extract.quoting,
+                    lineterminator="\n",
+                )
+                rows[name] += len(df)
+        for name in tables:
+            if TABLES[name][1].footer:
+                files[name].write(
+                    f"({rows[name]} rows affected)\nCompletion time: {COMPLETION_TIME}\n"
+                )
+    finally:
+        for f in files.values():
+            f.close()
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("out_dir", type=Path)
+    parser.add_argument("--patients", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--tables", nargs="+", default=None, choices=list(TABLES))
+    parser.add_argument("--block-patients", type=int, default=BLOCK_PATIENTS)
+    args = parser.parse_args()
+
+    rows = write_pull(
+        args.out_dir, args.patients, args.seed, args.tables, args.block_patients
+    )
+    for name, count in rows.items():
+        print(f"{name:45} {count:>12,} rows")
@@ -0,0 +1,303 @@
+"""Memory and dtype profile of every table, with a lossless downcast schema.
+
+Loads each registered table (the load_* functions of file_parsing and the
+preprocessed datasets of datasets.load_dataset) one at a time and reports, per
+column, its dtype, memory, cardinality, null fraction and value range, and the
+smallest dtype that holds the current data without loss:
+    integers -> the smallest (nullable) integer type holding min and max,
+        0/1 flags -> int8
+    floats -> float32 when every value is exactly a float32 (a height of
+        170.2 is not, it would read back as 170.19999695)
+    strings with few distinct values -> category
+List columns (e.g. active_flags) are counted by value and never downcast.
+
+With --apply the parquet tables, as written by their parser, are profiled and
+rewritten in place with their downcast schema, and the schemas applied are
+recorded in SCHEMA_PATH. The parsers do not read it: the next csv_to_parquet
+(or pipeline run) writes the full width table again, run --apply after it.
+
+Usage:
+    python table_profile.py [--out profile.csv] [--apply] [TABLE ...]
+"""
+
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Callable, Dict, Tuple
+
+from file_parsing import (
+    cardiac_MRIs_file,
+    cohort_file,
+    comorbidities_file,
+    datasets,
+    deid_notes_file,
+    demographics_file,
+    echomaster_file,
+    echosyngo_file,
+    hf_subtype_file,
+    icd_codes_file,
+    labeled_cohort_file,
+    outpt_encounters_file,
+)
+
+# The path to the Amyloid data
+BASE = Path("/data/datasets/Amyloidosis/")
+PULL_2023 = BASE / "2023 pull"
+
+SCHEMA_PATH = PULL_2023 / "table_schemas.json"
+
+# Strings with at most this fraction of distinct values become categories
+CATEGORY_MAX_UNIQUE_FRACTION = 0.5
+
+INTEGER_TYPES = [np.int8, np.int16, np.int32, np.int64]
+
+
+def _parquet(path: Path) -> Path:
+    return Path(path).with_suffix(".parquet")
+
+
+# table name -> (loader, parquet file rewritten by --apply, None for other sources)
+TABLES: Dict[str, Tuple[Callable[[], pd.DataFrame], Path | None]] = {
+    "cardiac_mris": (
+        cardiac_MRIs_file.load_cardiac_mris,
+        _parquet(cardiac_MRIs_file.cardiac_mri_path),
+    ),
+    "cohort_entry": (
+        cohort_file.load_cohort_entry,
+        _parquet(cohort_file.cohort_entry_file_path),
+    ),
+    "comorbidities": (
+        comorbidities_file.load_comorbitities,
+        _parquet(comorbidities_file.comorbitities_path),
+    ),
+    "deid_notes": (deid_notes_file.load_notes, _parquet(deid_notes_file.notes_path)),
+    "demographics": (
+        demographics_file.load_demographics,
+        _parquet(demographics_file.demographics_path),
+    ),
+    "echomaster": (
+        echomaster_file.load_echomaster,
+        _parquet(echomaster_file.echomaster_path),
+    ),
+    # a partitioned dataset, profiled but not rewritten
+    "echosyngo": (echosyngo_file.load_echosyngo, None),
+    "hf_subtype": (
+        hf_subtype_file.load_hf_subtype,
+        _parquet(hf_subtype_file.hf_subtype_path),
+    ),
+    "icd_codes": (
+        icd_codes_file.load_icd_codes,
+        _parquet(icd_codes_file.icd_codes_path),
+    ),
+    "labeled_cohort": (
+        labeled_cohort_file.load_labeled_cohort,
+        _parquet(labeled_cohort_file.labeled_cohort_file_path),
+    ),
+    "outpt_encounters": (
+        outpt_encounters_file.load_outpt_encounters,
+        _parquet(outpt_encounters_file.outpt_encounters_path),
+    ),
+}
+for dataset in [
+    datasets.Datasets.CARDIAC_PATH_REPORTS,
+    datasets.Datasets.PYP_REPORTS,
+    datasets.Datasets.MAYO_LABS,
+]:
+    TABLES[dataset.value] = (
+        lambda dataset=dataset: datasets.load_dataset(dataset),
+        None,
+    )
+
+
+def _smallest_integer(low, high, nullable: bool) -> str:
+    for dtype in INTEGER_TYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            name = np.dtype(dtype).name
+            return name.capitalize() if nullable else name
+    return "Int64" if nullable else "int64"
+
+
+def _float32_lossless(values: np.ndarray) -> bool:
+    # every finite value is a float32, nothing is left to round on load
+    values = values[np.isfinite(values)]
+    return np.array_equal(values.astype(np.float32).astype(np.float64), values)
+
+
+def _n_unique(s: pd.Series) -> int:
+    try:
+        return int(s.nunique())
+    except TypeError:
+        # list columns (arrays per row) are unhashable, count them as tuples
+        return int(s.dropna().map(tuple).nunique())
+
+
+def propose_dtype(s: pd.Series) -> str:
+    """Smallest dtype that holds the values of a column without loss.
+
+    Args:
+        s (pd.Series): column
+
+    Returns:
+        str: pandas dtype name, the current one if nothing smaller fits
+    """
+    dtype = s.dtype
+    if isinstance(dtype, pd.CategoricalDtype) or pd.api.types.is_bool_dtype(dtype):
+        return str(dtype)
+    if pd.api.types.is_integer_dtype(dtype):
+        values = s.dropna()
+        if not len(values):
+            return str(dtype)
+        # nullable columns stay nullable, merges and reindexing add missing values
+        nullable = isinstance(dtype, pd.api.extensions.ExtensionDtype)
+        return _smallest_integer(values.min(), values.max(), nullable)
+    if pd.api.types.is_float_dtype(dtype):
+        if dtype == np.float32 or s.isna().all():
+            return str(dtype)
+        values = s.to_numpy(dtype=np.float64, na_value=np.nan)
+        if np.isinf(values).any():
+            return str(dtype)
+        return "float32" if _float32_lossless(values) else str(dtype)
+    if pd.api.types.is_string_dtype(dtype) or dtype == object:
+        values = s.dropna()
+        if len(values) and not values.map(type).eq(str).all():
+            return str(dtype)
+        if len(values) and s.nunique() <= CATEGORY_MAX_UNIQUE_FRACTION * len(values):
+            return "category"
+    return str(dtype)
+
+
+def profile_table(df: pd.DataFrame) -> pd.DataFrame:
+    """Per column profile of a table.
+
+    Args:
+        df (pd.DataFrame): loaded table
+
+    Returns:
+        pd.DataFrame: column, dtype, bytes, n_unique, null_fraction, min, max,
+            proposed_dtype and proposed_bytes
+    """
+    rows = []
+    memory = df.memory_usage(deep=True, index=False)
+    for column in df.columns:
+        s = df[column]
+        proposed = propose_dtype(s)
+        low = high = None
+        if pd.api.types.is_numeric_dtype(
+            s.dtype
+        ) or pd.api.types.is_datetime64_any_dtype(s.dtype):
+            if s.notna().any() and not pd.api.types.is_bool_dtype(s.dtype):
+                low, high = s.min(), s.max()
+        rows.append(
+            {
+                "column": column,
+                "dtype": str(s.dtype),
+                "bytes": int(memory[column]),
+                "n_unique": _n_unique(s),
+                "null_fraction": float(s.isna().mean()) if len(s) else 0.0,
+                "min": low,
+                "max": high,
+                "proposed_dtype": proposed,
+                "proposed_bytes": int(
+                    s.astype(proposed).memory_usage(deep=True, index=False)
+                    if proposed != str(s.dtype)
+                    else memory[column]
+                ),
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+def downcast_schema(profile: pd.DataFrame) -> Dict[str, str]:
+    """Columns of a profile whose proposed dtype differs from the current one."""
+    changed = profile[profile.proposed_dtype != profile.dtype]
+    return dict(zip(changed.column, changed.proposed_dtype))
+
+
+def apply_schema(df: pd.DataFrame, schema: Dict[str, str]) -> pd.DataFrame:
+    """Casts the columns of a table to a downcast schema.
+
+    Args:
+        df (pd.DataFrame): table
+        schema (Dict[str, str]): column -> dtype, see downcast_schema
+
+    Returns:
+        pd.DataFrame: copy of df with the columns present in the schema cast
+    """
+    return df.astype({c: dtype for c, dtype in schema.items() if c in df.columns})
+
+
+def profile_tables(
+    names=None, apply: bool = False, schema_path: Path = SCHEMA_PATH
+) -> pd.DataFrame:
+    """Profiles the registered tables, one loaded at a time.
+
+    Args:
+        names (List[str], optional): tables to profile. Defaults to all.
+        apply (bool, optional): rewrite the parquet tables with the downcast
+            schema of their stored data and record the schemas in schema_path.
+            Defaults to False.
+        schema_path (Path, optional): Defaults to SCHEMA_PATH.
+
+    Returns:
+        pd.DataFrame: profile_table rows of every table, with a table column
+    """
+    names = list(TABLES) if not names else names
+    unknown = [name for name in names if name not in TABLES]
+    if unknown:
+        raise ValueError(f"Unknown tables {unknown}, choose from {list(TABLES)}")
+
+    profiles, schemas = [], {}
+    for name in names:
+        load, parquet_path = TABLES[name]
+        try:
+            df = load()
+        except Exception as e:
+            print(f"{name}: skipped ({type(e).__name__}: {e})")
+            continue
+        profile = profile_table(df)
+        profile.insert(0, "table", name)
+        profiles.append(profile)
+        print(
+            f"{name}: {len(df)} rows, {profile.bytes.sum() / 2**20:.1f} MiB"
+            f" -> {profile.proposed_bytes.sum() / 2**20:.1f} MiB"
+        )
+        del df
+        if apply and parquet_path is not None:
+            # the file as the parser wrote it, not the loader's output
+            stored = pd.read_parquet(parquet_path)
+            schemas[name] = downcast_schema(profile_table(stored))
+            if schemas[name]:
+                # preserve_index like the parsers' to_parquet
+                tmp = parquet_path.with_suffix(".parquet.tmp")
+                apply_schema(stored, schemas[name]).to_parquet(tmp)
+                os.replace(tmp, parquet_path)
+            del stored
+
+    if apply:
+        saved = {}
+        if Path(schema_path).exists():
+            with open(schema_path) as f:
+                saved = json.load(f)
+        saved.update(schemas)
+        with open(schema_path, "w") as f:
+            json.dump(saved, f, indent=1)
+    return pd.concat(profiles, ignore_index=True) if profiles else pd.DataFrame()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("tables", nargs="*", help=f"Defaults to all: {list(TABLES)}")
+    parser.add_argument("--out", type=Path, default=None, help="Profile csv")
+    parser.add_argument("--apply", action="store_true", help="Rewrite downcast tables")
+    args = parser.parse_args()
+
+    profile = profile_tables(args.tables, apply=args.apply)
+    if args.out is not None:
+        profile.to_csv(args.out, index=False)
+    elif len(profile):
+        with pd.option_context("display.max_rows", None, "display.width", 200):
+            print(profile.drop(columns=["min", "max"]).to_string(index=False))
@@ -0,0 +1,277 @@
+"""Patient timelines relative to a per-patient anchor date.
+
+Every event table (ICD codes, encounters, echos, cardiac MRIs) is joined to an
+anchor date per patient, e.g. final__amyloid_diagnosis_date or one of the
+*_cohort_entry_date columns of the cohort entry file, with a sorted as-of join
+over the whole cohort at once. Each event gets the days between it and the
+anchor and the lookback window it falls in. Tables are streamed batch by batch,
+so memory stays bounded by the batch size rather than the size of the pull.
+
+Usage:
+    python timelines.py --anchor final__amyloid_diagnosis_date --out timelines
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pathlib import Path
+from typing import Dict, Iterator, Sequence, Tuple
+
+from file_parsing import (
+    cardiac_MRIs_file,
+    cohort_file,
+    echomaster_file,
+    icd_codes_file,
+    labeled_cohort_file,
+    outpt_encounters_file,
+)
+
+# The path to the Amyloid data
+BASE = Path("/data/datasets/Amyloidosis/")
+PULL_2023 = BASE / "2023 pull"
+
+# Patient level diagnoses from cardiac path reports, pyp reports, and mayo labs
+amyloid_diagnosis_labels_path = (
+    BASE / "patient_amyloid_diagnosis" / "all_datasets_patient_amyloid_diagnosis.csv"
+)
+
+# table name -> (ingested file path, event date column). None picks the first
+# date column of the table.
+EVENT_TABLES: Dict[str, Tuple[Path, str | None]] = {
+    "icd_codes": (icd_codes_file.icd_codes_path, "ICD_code_date"),
+    "outpt_encounters": (outpt_encounters_file.outpt_encounters_path, None),
+    "echomaster": (echomaster_file.echomaster_path, "echo_date"),
+    "cardiac_mris": (cardiac_MRIs_file.cardiac_mri_path, "Cardiac_MRI_date"),
+}
+
+# Lookback windows in days before the anchor, Aim 1 looks at >= 2 years before diagnosis
+LOOKBACK_EDGES = (0, 180, 365, 730, 1095, 1825)
+LOOKBACK_LABELS = ("0-6m", "6-12m", "1-2y", "2-3y", "3-5y", "5y+")
+AFTER_ANCHOR = "after"
+
+BATCH_SIZE = 1 << 20
+
+
+def load_anchor_dates(column: str = "final__amyloid_diagnosis_date") -> pd.DataFrame:
+    """Reads a per-patient anchor date.
+
+    Args:
+        column (str, optional): a date column of the cohort entry file, the
+            patient amyloid diagnoses or the labeled cohort.
+            Defaults to "final__amyloid_diagnosis_date".
+
+    Returns:
+        pd.DataFrame: ir_id and anchor_date, patients without the date are dropped
+    """
+    cohort_entry_path = cohort_file.cohort_entry_file_path.with_suffix(".parquet")
+    if column in pq.read_schema(cohort_entry_path).names:
+        anchors = pd.read_parquet(cohort_entry_path, columns=["ir_id", column])
+    elif column.startswith("final__"):
+        anchors = pd.read_csv(amyloid_diagnosis_labels_path, usecols=["ir_id", column])
+    else:
+        anchors = pd.read_parquet(
+            labeled_cohort_file.labeled_cohort_file_path.with_suffix(".parquet"),
+            columns=["ir_id", column],
+        )
+    anchors = anchors.rename(columns={column: "anchor_date"})
+    anchors["anchor_date"] = pd.to_datetime(anchors["anchor_date"])
+    return anchors.dropna(subset=["anchor_date"])
+
+
+def lookback_window(
+    days_before_anchor: np.ndarray,
+    edges: Sequence[int] = LOOKBACK_EDGES,
+    labels: Sequence[str] = LOOKBACK_LABELS,
+) -> pd.Categorical:
+    """Buckets days before the anchor into lookback windows.
+
+    Args:
+        days_before_anchor (np.ndarray): days between event and anchor, negative after it
+        edges (Sequence[int], optional): window starts in days. Defaults to LOOKBACK_EDGES.
+        labels (Sequence[str], optional): window names. Defaults to LOOKBACK_LABELS.
+
+    Returns:
+        pd.Categorical: window of every event, AFTER_ANCHOR after the anchor, NaN without one
+    """
+    days = np.asarray(days_before_anchor, dtype=float)
+    categories = [AFTER_ANCHOR] + list(labels)
+    # code 0 is after the anchor, code i the window starting at edges[i - 1]
+    codes = np.searchsorted(np.asarray(edges, dtype=float), days, side="right")
+    codes[np.isnan(days)] = -1
+    return pd.Categorical.from_codes(codes, categories=categories, ordered=True)
+
+
+def align_to_anchor(
+    events: pd.DataFrame,
+    anchors: pd.DataFrame,
+    date_column: str,
+    direction: str = "nearest",
+) -> pd.DataFrame:
+    """As-of joins events to the anchor dates of their patient.
+
+    Args:
+        events (pd.DataFrame): event table with ir_id and date_column
+        anchors (pd.DataFrame): ir_id and anchor_date, sorted by anchor_date.
+            Patients may have more than one anchor.
+        date_column (str): event date column
+        direction (str, optional): "nearest" anchor, or only the next ("forward")
+            or previous ("backward") one. Defaults to "nearest".
+
+    Returns:
+        pd.DataFrame: events of patients with an anchor, sorted by event date, with
+            anchor_date, days_before_anchor and lookback_window
+    """
+    events = events.copy()
+    events[date_column] = pd.to_datetime(events[date_column]).astype(
+        anchors["anchor_date"].dtype
+    )
+    events = events[events[date_column].notna() & events.ir_id.isin(anchors.ir_id)]
+    timeline = pd.merge_asof(
+        events.sort_values(date_column, kind="stable"),
+        anchors,
+        left_on=date_column,
+        right_on="anchor_date",
+        by="ir_id",
+        direction=direction,
+    )
+    timeline["days_before_anchor"] = (
+        timeline["anchor_date"] - timeline[date_column]
+    ).dt.days.astype("Int64")
+    timeline["lookback_window"] = lookback_window(
+        timeline["days_before_anchor"].to_numpy(dtype=float, na_value=np.nan)
+    )
+    return timeline
+
+
+def _date_column(schema: pa.Schema) -> str:
+    for field in schema:
+        if "date" in field.name.lower() and (
+            pa.types.is_timestamp(field.type) or pa.types.is_date(field.type)
+        ):
+            return field.name
+    raise Exception(f"No date column in {schema.names}")
+
+
+def timeline_schema(
+    source: pa.Schema, date_column: str, anchors: pd.DataFrame
+) -> pa.Schema:
+    """Schema of the timeline of an event table, whatever the values of a batch.
+
+    Args:
+        source (pa.Schema): schema of the ingested event table
+        date_column (str): event date column
+        anchors (pd.DataFrame): ir_id and anchor_date, see load_anchor_dates
+
+    Returns:
+        pa.Schema: the event columns (the pandas index of the source dropped),
+            the anchor columns, days_before_anchor and lookback_window
+    """
+    pandas_metadata = source.pandas_metadata or {}
+    index_columns = [
+        c for c in pandas_metadata.get("index_columns", []) if isinstance(c, str)
+    ]
+    anchor_schema = pa.Schema.from_pandas(anchors.head(0), preserve_index=False)
+    anchor_date = anchor_schema.field("anchor_date").type
+    fields = [
+        pa.field(field.name, anchor_date) if field.name == date_column else field
+        for field in source.remove_metadata()
+        if field.name not in index_columns
+    ]
+    fields += [
+        field for field in anchor_schema.remove_metadata() if field.name != "ir_id"
+    ]
+    fields += [
+        pa.field("days_before_anchor", pa.int64()),
+        pa.field(
+            "lookback_window", pa.dictionary(pa.int8(), pa.string(), ordered=True)
+        ),
+    ]
+    return pa.schema(fields)
+
+
+def iter_timeline(
+    table: str,
+    anchors: pd.DataFrame,
+    direction: str = "nearest",
+    batch_size: int = BATCH_SIZE,
+) -> Iterator[pd.DataFrame]:
+    """Streams an event table aligned to the anchor dates.
+
+    Args:
+        table (str): one of EVENT_TABLES
+        anchors (pd.DataFrame): ir_id and anchor_date, see load_anchor_dates
+        direction (str, optional): as-of join direction. Defaults to "nearest".
+        batch_size (int, optional): rows read at a time. Defaults to BATCH_SIZE.
+
+    Yields:
+        pd.DataFrame: aligned events of one batch
+    """
+    path, date_column = EVENT_TABLES[table]
+    file = pq.ParquetFile(Path(path).with_suffix(".parquet"))
+    date_column = date_column or _date_column(file.schema_arrow)
+    anchors = anchors.sort_values("anchor_date", kind="stable")
+    for batch in file.iter_batches(batch_size=batch_size):
+        timeline = align_to_anchor(batch.to_pandas(), anchors, date_column, direction)
+        if len(timeline):
+            yield timeline
+
+
+def build_timelines(
+    anchors: pd.DataFrame,
+    out_dir: Path,
+    tables: Sequence[str] | None = None,
+    direction: str = "nearest",
+    batch_size: int = BATCH_SIZE,
+) -> None:
+    """Writes the timeline of every event table, one row group per batch.
+
+    Args:
+        anchors (pd.DataFrame): ir_id and anchor_date, see load_anchor_dates
+        out_dir (Path): output directory, one parquet per table
+        tables (Sequence[str], optional): subset of EVENT_TABLES. Defaults to all.
+        direction (str, optional): as-of join direction. Defaults to "nearest".
+        batch_size (int, optional): rows read at a time. Defaults to BATCH_SIZE.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for table in tables or EVENT_TABLES:
+        path, date_column = EVENT_TABLES[table]
+        source = pq.read_schema(Path(path).with_suffix(".parquet"))
+        # from the source, a batch where a column is all null would type it null
+        schema = timeline_schema(source, date_column or _date_column(source), anchors)
+        writer = None
+        try:
+            for timeline in iter_timeline(table, anchors, direction, batch_size):
+                batch = pa.Table.from_pandas(
+                    timeline[schema.names], schema=schema, preserve_index=False
+                )
+                if writer is None:
+                    writer = pq.ParquetWriter(out_dir / f"{table}.parquet", schema)
+                writer.write_table(batch)
+        finally:
+            if writer is not None:
+                writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--anchor", default="final__amyloid_diagnosis_date")
+    parser.add_argument(
+        "--direction", choices=["nearest", "forward", "backward"], default="nearest"
+    )
+    parser.add_argument("--out", type=Path, default=PULL_2023 / "timelines")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument(
+        "tables", nargs="*", help=f"Subset of: {', '.join(EVENT_TABLES)}"
+    )
+    args = parser.parse_args()
+
+    build_timelines(
+        load_anchor_dates(args.anchor),
+        args.out,
+        tables=args.tables,
+        direction=args.direction,
+        batch_size=args.batch_size,
+    )
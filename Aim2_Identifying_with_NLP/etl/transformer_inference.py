@@ -0,0 +1,497 @@
+"""Batched transformer inference over the notes and reports on CPU.
+
+Documents are read a chunk at a time (CHUNK_DOCUMENTS) and tokenized once per
+chunk with a fast tokenizer. A document longer than the model is split into
+overlapping windows of at most max_length tokens (stride tokens shared by two
+consecutive windows). The windows of a chunk are sorted by length and grouped
+into batches of at most batch_tokens padded tokens, so a batch pads to a
+similar length. Batches run on a pool of workers, threads sharing one model or
+processes with a model each, with torch.set_num_threads(threads) per worker
+and optional dynamic int8 quantization of the linear layers. The next chunk is
+tokenized while the workers run the current one.
+
+Window outputs are written to parquet as each chunk finishes, one row per
+window:
+
+    doc_id, window, n_windows, token_start, token_end, char_start, char_end,
+    output (mean pooled last hidden state, or the logits of a sequence
+    classification model)
+
+doc_id is the row number of the notes parquet (the note_index of note_dedup),
+the paragraph_id of the unique note paragraphs of note_dedup, or the
+document_ID of a report dataset.
+
+torch and transformers are imported when a model is loaded.
+
+Usage:
+    python transformer_inference.py MODEL --source notes --out notes_windows.parquet
+        [--task embedding|classification] [--max-length 512] [--stride 128]
+        [--batch-tokens 16384] [--executor thread|process] [--workers 1]
+        [--threads 4] [--quantize] [--benchmark N]
+
+--benchmark N runs the first N documents without writing and prints documents,
+windows and tokens per second and the share of padding.
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import note_dedup
+from file_parsing import datasets, deid_notes_file
+
+# documents tokenized and written together
+CHUNK_DOCUMENTS = 1024
+TASKS = ("embedding", "classification")
+EXECUTORS = ("thread", "process")
+
+
+@dataclass
+class InferenceConfig:
+    model: str  # transformers model name or directory
+    task: str = "embedding"  # "embedding" or "classification"
+    max_length: int = 512  # tokens per window, special tokens included
+    stride: int = 128  # tokens shared by two consecutive windows
+    batch_tokens: int = 16384  # padded tokens per batch
+    max_batch_size: int = 64  # windows per batch
+    executor: str = "thread"  # "thread" or "process"
+    workers: int = 1
+    threads: int | None = None  # torch threads per worker, defaults to CPUs / workers
+    quantize: bool = False  # dynamic int8 quantization of the linear layers
+
+
+@dataclass
+class Windows:
+    """The windows of a chunk of documents, see make_windows."""
+
+    doc_id: np.ndarray
+    window: np.ndarray
+    n_windows: np.ndarray
+    token_start: np.ndarray
+    token_end: np.ndarray
+    char_start: np.ndarray
+    char_end: np.ndarray
+    input_ids: List[List[int]]  # special tokens included
+
+
+def window_starts(n_tokens: int, size: int, stride: int) -> List[int]:
+    """Token starts of the windows of a document.
+
+    Args:
+        n_tokens (int): tokens of the document, special tokens excluded
+        size (int): tokens per window, special tokens excluded
+        stride (int): tokens shared by two consecutive windows
+
+    Returns:
+        List[int]: a single window for documents of at most size tokens (and
+            empty ones), the last window ends with the document
+    """
+    if size <= stride:
+        raise ValueError("The window size must be larger than the stride")
+    if n_tokens <= size:
+        return [0]
+    starts = list(range(0, n_tokens - size, size - stride))
+    return starts + [n_tokens - size]
+
+
+def make_windows(
+    tokenizer, doc_ids: np.ndarray, texts: List[str], config: InferenceConfig
+) -> Windows:
+    """Tokenizes documents once and splits them into windows.
+
+    Args:
+        tokenizer: transformers fast tokenizer
+        doc_ids (np.ndarray): id of every document
+        texts (List[str]): documents
+        config (InferenceConfig): max_length and stride
+
+    Returns:
+        Windows: the windows of every document, in document order
+    """
+    size = config.max_length - tokenizer.num_special_tokens_to_add()
+    encoded = tokenizer(
+        texts,
+        add_special_tokens=False,
+        return_offsets_mapping=True,
+        return_attention_mask=False,
+        verbose=False,
+    )
+    rows: Dict[str, list] = {name: [] for name in Windows.__dataclass_fields__}
+    for doc_id, ids, offsets in zip(
+        doc_ids.tolist(), encoded["input_ids"], encoded["offset_mapping"]
+    ):
+        starts = window_starts(len(ids), size, config.stride)
+        for i, start in enumerate(starts):
+            end = min(start + size, len(ids))
+            rows["doc_id"].append(doc_id)
+            rows["window"].append(i)
+            rows["n_windows"].append(len(starts))
+            rows["token_start"].append(start)
+            rows["token_end"].append(end)
+            rows["char_start"].append(offsets[start][0] if end > start else 0)
+            rows["char_end"].append(offsets[end - 1][1] if end > start else 0)
+            rows["input_ids"].append(
+                tokenizer.build_inputs_with_special_tokens(ids[start:end])
+            )
+    return Windows(
+        **{
+            name: values if name == "input_ids" else np.asarray(values, dtype=np.int64)
+            for name, values in rows.items()
+        }
+    )
+
+
+def bucket_batches(
+    lengths: np.ndarray, batch_tokens: int, max_batch_size: int
+) -> List[np.ndarray]:
+    """Batches of windows of similar length.
+
+    Args:
+        lengths (np.ndarray): tokens of every window
+        batch_tokens (int): padded tokens per batch, a window longer than
+            that is a batch on its own
+        max_batch_size (int): windows per batch
+
+    Returns:
+        List[np.ndarray]: window indices of every batch, longest first
+    """
+    order = np.argsort(-lengths, kind="stable")
+    batches, batch = [], []
+    for i in order.tolist():
+        # sorted longest first, so the first window of a batch sets its padding
+        padded = lengths[batch[0]] * (len(batch) + 1) if batch else 0
+        if batch and (padded > batch_tokens or len(batch) == max_batch_size):
+            batches.append(np.array(batch))
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(np.array(batch))
+    return batches
+
+
+def pad(input_ids: List[List[int]], pad_token_id: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Input ids and attention mask of a batch, padded to its longest window."""
+    width = max(len(ids) for ids in input_ids)
+    ids = np.full((len(input_ids), width), pad_token_id, dtype=np.int64)
+    mask = np.zeros((len(input_ids), width), dtype=np.int64)
+    for row, window in enumerate(input_ids):
+        ids[row, : len(window)] = window
+        mask[row, : len(window)] = 1
+    return ids, mask
+
+
+@lru_cache(maxsize=None)
+def load_tokenizer(model: str):
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model, use_fast=True)
+    if not tokenizer.is_fast:
+        raise Exception(f"{model} has no fast tokenizer, offsets are not available")
+    return tokenizer
+
+
+def load_model(config: InferenceConfig):
+    """The model in eval mode, quantized when config.quantize."""
+    import torch
+    from transformers import AutoModel, AutoModelForSequenceClassification
+
+    torch.set_num_threads(
+        config.threads or max((os.cpu_count() or 1) // config.workers, 1)
+    )
+    if config.task == "classification":
+        model = AutoModelForSequenceClassification.from_pretrained(config.model)
+    else:
+        model = AutoModel.from_pretrained(config.model)
+    model.eval()
+    if config.quantize:
+        model = torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    return model
+
+
+def run_batch(
+    model, task: str, input_ids: np.ndarray, attention_mask: np.ndarray
+) -> np.ndarray:
+    """Outputs of a padded batch.
+
+    Returns:
+        np.ndarray: (windows, hidden size) mean pooled embeddings, or
+            (windows, labels) logits
+    """
+    import torch
+
+    with torch.inference_mode():
+        ids = torch.from_numpy(input_ids)
+        mask = torch.from_numpy(attention_mask)
+        out = model(input_ids=ids, attention_mask=mask)
+        if task == "classification":
+            values = out.logits
+        else:
+            weights = mask.unsqueeze(-1).to(out.last_hidden_state.dtype)
+            values = (out.last_hidden_state * weights).sum(1) / weights.sum(1).clamp(
+                min=1
+            )
+    return values.float().numpy()
+
+
+# the model of a worker process
+_worker_model = None
+_worker_task = None
+
+
+def _init_worker(config: InferenceConfig) -> None:
+    global _worker_model, _worker_task
+    _worker_model, _worker_task = load_model(config), config.task
+
+
+def _run_worker_batch(batch: Tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    return run_batch(_worker_model, _worker_task, *batch)
+
+
+def iter_documents(source: str) -> Iterator[Tuple[np.ndarray, List[str]]]:
+    """(doc ids, texts) of a source, CHUNK_DOCUMENTS at a time.
+
+    Args:
+        source (str): "notes", "paragraphs" (the unique note paragraphs of
+            note_dedup) or a report dataset of datasets.Datasets
+    """
+    if source in ("notes", "paragraphs"):
+        if source == "notes":
+            path, column = (
+                deid_notes_file.notes_path.with_suffix(".parquet"),
+                "deid_note_text",
+            )
+        else:
+            path, column = (
+                note_dedup.NOTES_DEDUP_DIR / note_dedup.PARAGRAPH_TEXT_NAME,
+                "text",
+            )
+        file = pq.ParquetFile(path)
+        start = 0
+        columns = [column] if source == "notes" else ["paragraph_id", column]
+        for batch in file.iter_batches(batch_size=CHUNK_DOCUMENTS, columns=columns):
+            if source == "notes":
+                ids = np.arange(start, start + batch.num_rows)
+            else:
+                ids = batch.column("paragraph_id").to_numpy()
+            start += batch.num_rows
+            yield ids, batch.column(column).fill_null("").to_pylist()
+    else:
+        df = datasets.load_dataset(datasets.Datasets(source))
+        texts = df["text"].fillna("").tolist()
+        ids = df["document_ID"].to_numpy()
+        for start in range(0, len(df), CHUNK_DOCUMENTS):
+            yield ids[start : start + CHUNK_DOCUMENTS], texts[
+                start : start + CHUNK_DOCUMENTS
+            ]
+
+
+WINDOW_SCHEMA = pa.schema(
+    [
+        ("doc_id", pa.int64()),
+        ("window", pa.int32()),
+        ("n_windows", pa.int32()),
+        ("token_start", pa.int32()),
+        ("token_end", pa.int32()),
+        ("char_start", pa.int32()),
+        ("char_end", pa.int32()),
+    ]
+)
+
+
+def _table(windows: Windows, outputs: np.ndarray) -> pa.Table:
+    arrays = [
+        pa.array(getattr(windows, field.name), type=field.type)
+        for field in WINDOW_SCHEMA
+    ]
+    arrays.append(
+        pa.FixedSizeListArray.from_arrays(pa.array(outputs.ravel()), outputs.shape[1])
+    )
+    schema = WINDOW_SCHEMA.append(
+        pa.field("output", pa.list_(pa.float32(), outputs.shape[1]))
+    )
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def run_inference(
+    config: InferenceConfig,
+    source: str = "notes",
+    out_path: Path | None = None,
+    limit: int | None = None,
+) -> Dict[str, float]:
+    """Runs the model over every document of a source.
+
+    Args:
+        config (InferenceConfig): model and execution options
+        source (str, optional): see iter_documents. Defaults to "notes".
+        out_path (Path, optional): window outputs parquet. Defaults to None
+            (not written).
+        limit (int, optional): only the first documents. Defaults to None.
+
+    Returns:
+        Dict[str, float]: documents, windows, tokens, padded tokens and seconds
+    """
+    if config.task not in TASKS:
+        raise ValueError(f"task must be one of {TASKS}")
+    if config.executor not in EXECUTORS:
+        raise ValueError(f"executor must be one of {EXECUTORS}")
+    tokenizer = load_tokenizer(config.model)
+    pad_token_id = tokenizer.pad_token_id or 0
+
+    if config.executor == "process":
+        pool: Executor = ProcessPoolExecutor(
+            max_workers=config.workers, initializer=_init_worker, initargs=(config,)
+        )
+        submit = lambda batch: pool.submit(_run_worker_batch, batch)  # noqa: E731
+    else:
+        # torch releases the GIL, the threads share one model
+        model = load_model(config)
+        pool = ThreadPoolExecutor(max_workers=config.workers)
+        submit = lambda batch: pool.submit(
+            run_batch, model, config.task, *batch
+        )  # noqa: E731
+
+    stats = dict.fromkeys(["documents", "windows", "tokens", "padded_tokens"], 0)
+    writer = None
+    start = time.perf_counter()
+
+    def documents():
+        n = 0
+        for ids, texts in iter_documents(source):
+            if limit is not None:
+                ids, texts = ids[: limit - n], texts[: limit - n]
+            if not len(texts):
+                return
+            n += len(texts)
+            yield ids, texts
+
+    def submit_chunk(ids, texts):
+        windows = make_windows(tokenizer, ids, texts, config)
+        lengths = np.array([len(w) for w in windows.input_ids])
+        batches = bucket_batches(lengths, config.batch_tokens, config.max_batch_size)
+        futures = []
+        for batch in batches:
+            input_ids, mask = pad([windows.input_ids[i] for i in batch], pad_token_id)
+            stats["padded_tokens"] += input_ids.size
+            futures.append(submit((input_ids, mask)))
+        stats["documents"] += len(texts)
+        stats["windows"] += len(lengths)
+        stats["tokens"] += int(lengths.sum())
+        return windows, batches, futures
+
+    try:
+        pending = None
+        for ids, texts in documents():
+            # tokenize this chunk while the workers run the previous one
+            submitted = submit_chunk(ids, texts)
+            if pending is not None:
+                writer = _write_chunk(pending, out_path, writer)
+            pending = submitted
+        if pending is not None:
+            writer = _write_chunk(pending, out_path, writer)
+    finally:
+        pool.shutdown(cancel_futures=True)
+        if writer is not None:
+            writer.close()
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+
+def _write_chunk(chunk, out_path: Path | None, writer: pq.ParquetWriter | None):
+    # waits for the batches of a chunk and writes its windows in document order
+    windows, batches, futures = chunk
+    outputs = None
+    for batch, future in zip(batches, futures):
+        values = future.result()
+        if outputs is None:
+            outputs = np.empty((len(windows.input_ids), values.shape[1]), np.float32)
+        outputs[batch] = values
+    if out_path is None or outputs is None:
+        return writer
+    table = _table(windows, outputs)
+    if writer is None:
+        writer = pq.ParquetWriter(out_path, table.schema)
+    writer.write_table(table)
+    return writer
+
+
+def load_windows(path: Path) -> pd.DataFrame:
+    """Reads window outputs, output as an array column."""
+    return pd.read_parquet(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("model")
+    parser.add_argument(
+        "--source",
+        default="notes",
+        choices=[
+            "notes",
+            "paragraphs",
+            datasets.Datasets.CARDIAC_PATH_REPORTS.value,
+            datasets.Datasets.PYP_REPORTS.value,
+        ],
+    )
+    parser.add_argument("--out", type=Path, default=None)
+    parser.add_argument("--task", choices=TASKS, default="embedding")
+    parser.add_argument("--max-length", type=int, default=InferenceConfig.max_length)
+    parser.add_argument("--stride", type=int, default=InferenceConfig.stride)
+    parser.add_argument(
+        "--batch-tokens", type=int, default=InferenceConfig.batch_tokens
+    )
+    parser.add_argument(
+        "--max-batch-size", type=int, default=InferenceConfig.max_batch_size
+    )
+    parser.add_argument("--executor", choices=EXECUTORS, default="thread")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=InferenceConfig.threads)
+    parser.add_argument("--quantize", action="store_true")
+    parser.add_argument(
+        "--benchmark",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Time the first N documents",
+    )
+    args = parser.parse_args()
+
+    config = InferenceConfig(
+        args.model,
+        task=args.task,
+        max_length=args.max_length,
+        stride=args.stride,
+        batch_tokens=args.batch_tokens,
+        max_batch_size=args.max_batch_size,
+        executor=args.executor,
+        workers=args.workers,
+        threads=args.threads,
+        quantize=args.quantize,
+    )
+    if args.benchmark is None and args.out is None:
+        parser.error("--out is required unless --benchmark is set")
+    stats = run_inference(
+        config,
+        args.source,
+        None if args.benchmark is not None else args.out,
+        limit=args.benchmark,
+    )
+    seconds = stats["seconds"]
+    print(
+        f"{stats['documents']} documents, {stats['windows']} windows in {seconds:.1f} s\n"
+        f"{stats['documents'] / seconds:.1f} documents/s, "
+        f"{stats['windows'] / seconds:.1f} windows/s, "
+        f"{stats['tokens'] / seconds:.0f} tokens/s\n"
+        f"padding {1 - stats['tokens'] / max(stats['padded_tokens'], 1):.1%} of the batch tokens"
+    )
@@ -0,0 +1,243 @@
+"""Load test for the risk scoring service, with a stand-in for the EHR feed.
+
+The EHR feed is simulated by patients "arriving" at a target rate (Poisson
+arrivals) or as fast as the clients allow, each arrival is one score request
+sent by one of a pool of keep-alive client connections. Client side latency
+percentiles and throughput are printed next to the service's own /metrics.
+
+--demo writes a synthetic feature store and model, starts the service on it
+and load tests it, so the whole loop runs on one box without patient data.
+
+Usage:
+    python load_test.py --demo
+    python load_test.py --features FEATURES_DIR --port 8765 --requests 20000 --rate 2000
+"""
+
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import tempfile
+import time
+import joblib
+import numpy as np
+import scipy.sparse as sp
+from pathlib import Path
+from typing import List, Tuple
+
+from risk_service import MATRIX_NAME, PATIENTS_NAME, VOCABULARY_NAME
+
+
+def make_demo(
+    out_dir: Path, n_patients: int = 50_000, n_codes: int = 2_000, seed: int = 2556
+) -> Tuple[Path, Path]:
+    """Writes a random feature store and a logistic regression trained on it.
+
+    Args:
+        out_dir (Path): output directory
+        n_patients (int, optional): Defaults to 50_000.
+        n_codes (int, optional): Defaults to 2_000.
+        seed (int, optional): Defaults to 2556.
+
+    Returns:
+        Tuple[Path, Path]: feature store directory and model file
+    """
+    from sklearn.linear_model import LogisticRegression
+
+    rng = np.random.default_rng(seed)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    matrix = sp.random(
+        n_patients, n_codes, density=0.01, format="csr", dtype=np.float32, rng=rng
+    )
+    matrix.data = np.ceil(matrix.data * 5)
+    signal = np.asarray(matrix[:, :20].sum(axis=1)).ravel()
+    labels = (signal + rng.normal(0, 1, n_patients) > np.percentile(signal, 90)).astype(
+        int
+    )
+
+    sp.save_npz(out_dir / MATRIX_NAME, matrix)
+    np.save(out_dir / PATIENTS_NAME, np.arange(n_patients) + 1_000_000)
+    (out_dir / VOCABULARY_NAME).write_text(
+        json.dumps(
+            {
+                "config": {"windows": [[None, None]]},
+                "codes": [f"C{i:04d}" for i in range(n_codes)],
+            }
+        )
+    )
+    model_path = out_dir / "model.joblib"
+    joblib.dump(LogisticRegression(max_iter=200).fit(matrix, labels), model_path)
+    return out_dir, model_path
+
+
+async def _open(host: str, port: int, unix: Path | None):
+    if unix is not None:
+        return await asyncio.open_unix_connection(str(unix))
+    return await asyncio.open_connection(host, port)
+
+
+async def _request(reader, writer, target: str) -> Tuple[int, dict]:
+    writer.write(f"GET {target} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while (line := await reader.readline()) not in (b"\r\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def ehr_feed(
+    ir_ids: np.ndarray,
+    n_requests: int,
+    rate: float | None,
+    queue: asyncio.Queue,
+    n_clients: int,
+    seed: int = 2556,
+) -> None:
+    """Puts patients on the queue as they "arrive" from the EHR.
+
+    Args:
+        ir_ids (np.ndarray): patients to draw from
+        n_requests (int): arrivals to simulate
+        rate (float, optional): mean arrivals per second, None for as fast as possible
+        queue (asyncio.Queue): queue read by the clients
+        n_clients (int): clients to stop at the end
+        seed (int, optional): Defaults to 2556.
+    """
+    rng = np.random.default_rng(seed)
+    patients = rng.choice(ir_ids, n_requests)
+    start = time.perf_counter()
+    arrivals = np.cumsum(rng.exponential(1 / rate, n_requests)) if rate else None
+    for i, ir_id in enumerate(patients):
+        if arrivals is not None:
+            delay = start + arrivals[i] - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await queue.put((int(ir_id), time.perf_counter()))
+    for _ in range(n_clients):
+        await queue.put(None)
+
+
+async def _client(host, port, unix, queue: asyncio.Queue, latencies: List[float]):
+    reader, writer = await _open(host, port, unix)
+    try:
+        while (item := await queue.get()) is not None:
+            ir_id, arrived = item
+            status, _ = await _request(reader, writer, f"/score?ir_id={ir_id}")
+            # measured from arrival, so queueing on the client side counts too
+            latencies.append(time.perf_counter() - arrived)
+            assert status in (200, 404), status
+    finally:
+        writer.close()
+
+
+async def run_load_test(
+    ir_ids: np.ndarray,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    unix: Path | None = None,
+    n_requests: int = 20_000,
+    concurrency: int = 64,
+    rate: float | None = None,
+) -> dict:
+    """Sends n_requests score requests and measures them.
+
+    Args:
+        ir_ids (np.ndarray): patients to draw from
+        host (str, optional): Defaults to "127.0.0.1".
+        port (int, optional): Defaults to 8765.
+        unix (Path, optional): Unix socket of the service. Defaults to None.
+        n_requests (int, optional): Defaults to 20_000.
+        concurrency (int, optional): client connections. Defaults to 64.
+        rate (float, optional): arrivals per second, None for closed loop. Defaults to None.
+
+    Returns:
+        dict: client side and service side metrics
+    """
+    queue, latencies = asyncio.Queue(maxsize=concurrency * 4), []
+    started = time.perf_counter()
+    await asyncio.gather(
+        ehr_feed(ir_ids, n_requests, rate, queue, concurrency),
+        *[_client(host, port, unix, queue, latencies) for _ in range(concurrency)],
+    )
+    elapsed = time.perf_counter() - started
+
+    reader, writer = await _open(host, port, unix)
+    _, service = await _request(reader, writer, "/metrics")
+    writer.close()
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+    return {
+        "client": {
+            "requests": len(latencies),
+            "throughput_rps": len(latencies) / elapsed,
+            "latency_ms": {"p50": p50, "p95": p95, "p99": p99},
+        },
+        "service": service,
+    }
+
+
+async def _wait_healthy(host, port, unix, timeout: float = 60) -> None:
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            reader, writer = await _open(host, port, unix)
+            await _request(reader, writer, "/health")
+            writer.close()
+            return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--demo", action="store_true", help="Run on synthetic data")
+    parser.add_argument("--features", type=Path, default=None)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", type=Path, default=None)
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--rate", type=float, default=None, help="Arrivals per second")
+    args = parser.parse_args()
+
+    service = None
+    if args.demo:
+        features_dir, model_path = make_demo(Path(tempfile.mkdtemp()))
+        command = [
+            sys.executable,
+            str(Path(__file__).with_name("risk_service.py")),
+            "--features",
+            str(features_dir),
+            "--model",
+            str(model_path),
+        ]
+        command += (
+            ["--unix", str(args.unix)] if args.unix else ["--port", str(args.port)]
+        )
+        service = subprocess.Popen(command)
+    else:
+        features_dir = args.features
+
+    try:
+        asyncio.run(_wait_healthy(args.host, args.port, args.unix))
+        result = asyncio.run(
+            run_load_test(
+                np.load(Path(features_dir) / PATIENTS_NAME),
+                args.host,
+                args.port,
+                args.unix,
+                args.requests,
+                args.concurrency,
+                args.rate,
+            )
+        )
+        print(json.dumps(result, indent=2, default=float))
+    finally:
+        if service is not None:
+            service.terminate()
@@ -0,0 +1,370 @@
+"""Local risk scoring service for the clinical decision tool.
+
+The scoring model and the patient feature store are loaded once at startup.
+Incoming per-patient requests are queued and scored in micro-batches: the
+batcher waits for the first request, then collects more until the batch is
+full or max_wait_ms has passed, and scores the whole batch with one
+vectorized call. Every response carries the risk score, the high risk flag
+and the features that contributed most to the score.
+
+The service speaks a minimal HTTP/1.1 (keep-alive) over TCP or a Unix socket:
+    GET /score?ir_id=123         -> {"ir_id", "score", "flag", "top_features"}
+    POST /score {"ir_id": 123}
+    GET /metrics                 -> latency percentiles, throughput, batch sizes
+    GET /health
+
+The feature store is the patient x ICD code matrix written by Aim 2's
+etl/icd_features.py. The model is any joblib-saved scikit-learn classifier
+trained on those columns, contributions are coef * x for linear models and
+feature_importances * x otherwise.
+
+Usage:
+    python risk_service.py --features FEATURES_DIR --model MODEL_FILE [--port 8765 | --unix PATH]
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import joblib
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+# Files written by Aim 2 etl/icd_features.py
+MATRIX_NAME = "icd_features.npz"
+PATIENTS_NAME = "icd_features_ir_id.npy"
+VOCABULARY_NAME = "icd_vocabulary.json"
+
+
+@dataclass
+class ServiceConfig:
+    max_batch_size: int = 64
+    max_wait_ms: float = 2.0  # how long the first request of a batch waits for company
+    threshold: float = 0.5  # scores at or above are flagged high risk
+    top_k: int = 5  # contributing features returned per patient
+    metrics_window: int = 10_000  # requests kept for latency percentiles
+
+
+def _window_name(start: int | None, end: int | None) -> str:
+    # same names as icd_features.feature_names
+    if start is None:
+        return "all"
+    return f"{start}-{'' if end is None else end}"
+
+
+class FeatureStore:
+    def __init__(self, matrix: sp.csr_matrix, ir_ids: np.ndarray, names: List[str]):
+        self.matrix = matrix.tocsr()
+        self.rows = pd.Index(ir_ids)
+        self.names = np.asarray(names, dtype=object)
+
+    @classmethod
+    def load(cls, features_dir: Path) -> "FeatureStore":
+        """Reads the patient x ICD code feature matrix.
+
+        Args:
+            features_dir (Path): directory written by icd_features.save_icd_features
+
+        Returns:
+            FeatureStore: feature store
+        """
+        features_dir = Path(features_dir)
+        saved = json.loads((features_dir / VOCABULARY_NAME).read_text())
+        matrix = sp.load_npz(features_dir / MATRIX_NAME)
+        codes = saved["codes"]
+        # columns are code j % len(codes) in window j // len(codes)
+        n_windows = matrix.shape[1] // max(len(codes), 1)
+        windows = saved["config"]["windows"] if n_windows > 1 else [[None, None]]
+        names = [
+            f"{_window_name(start, end)}|{code}"
+            for start, end in windows
+            for code in codes
+        ]
+        return cls(matrix, np.load(features_dir / PATIENTS_NAME), names)
+
+    def lookup(self, ir_ids: List[int]) -> Tuple[sp.csr_matrix, np.ndarray]:
+        """Feature rows of a batch of patients.
+
+        Args:
+            ir_ids (List[int]): patient ids
+
+        Returns:
+            Tuple[sp.csr_matrix, np.ndarray]: rows of the known patients and
+                a mask of which ir_ids are known
+        """
+        positions = self.rows.get_indexer(ir_ids)
+        known = positions >= 0
+        return self.matrix[positions[known]], known
+
+
+class Scorer:
+    def __init__(self, model, store: FeatureStore, config: ServiceConfig):
+        self.model, self.store, self.config = model, store, config
+        if hasattr(model, "coef_"):
+            self.weights = np.asarray(model.coef_, dtype=np.float64).ravel()
+        elif hasattr(model, "feature_importances_"):
+            self.weights = np.asarray(model.feature_importances_, dtype=np.float64)
+        else:
+            self.weights = None
+
+    def score(self, ir_ids: List[int]) -> List[dict | None]:
+        """Scores a batch of patients with one vectorized model call.
+
+        Args:
+            ir_ids (List[int]): patient ids
+
+        Returns:
+            List[dict | None]: result per patient, None if the patient is not in the store
+        """
+        rows, known = self.store.lookup(ir_ids)
+        results: List[dict | None] = [None] * len(ir_ids)
+        if rows.shape[0] == 0:
+            return results
+        scores = self.model.predict_proba(rows)[:, 1]
+        top = self._top_features(rows)
+        for i, position in enumerate(np.flatnonzero(known)):
+            results[position] = {
+                "ir_id": int(ir_ids[position]),
+                "score": float(scores[i]),
+                "flag": bool(scores[i] >= self.config.threshold),
+                "top_features": top[i],
+            }
+        return results
+
+    def _top_features(self, rows: sp.csr_matrix) -> List[List[dict]]:
+        if self.weights is None:
+            return [[] for _ in range(rows.shape[0])]
+        # contributions only exist where the patient has the feature
+        contributions = rows.multiply(self.weights).tocsr()
+        top = []
+        for i in range(contributions.shape[0]):
+            start, end = contributions.indptr[i], contributions.indptr[i + 1]
+            values = contributions.data[start:end]
+            columns = contributions.indices[start:end]
+            order = np.argsort(-np.abs(values))[: self.config.top_k]
+            top.append(
+                [
+                    {
+                        "feature": self.store.names[columns[j]],
+                        "contribution": float(values[j]),
+                    }
+                    for j in order
+                ]
+            )
+        return top
+
+
+class Metrics:
+    def __init__(self, window: int):
+        self.started = time.perf_counter()
+        self.requests = self.batches = self.not_found = self.errors = 0
+        self.latencies = deque(maxlen=window)  # (finished at, seconds)
+        self.batch_sizes = deque(maxlen=window)
+
+    def record_batch(self, size: int) -> None:
+        self.batches += 1
+        self.batch_sizes.append(size)
+
+    def record_request(self, seconds: float) -> None:
+        self.requests += 1
+        self.latencies.append((time.perf_counter(), seconds))
+
+    def summary(self) -> dict:
+        now = time.perf_counter()
+        latencies = np.array([seconds for _, seconds in self.latencies]) * 1000
+        finished = np.array([at for at, _ in self.latencies])
+        recent = finished[finished >= now - 10]
+        p50, p95, p99 = (
+            np.percentile(latencies, [50, 95, 99]) if len(latencies) else (0, 0, 0)
+        )
+        return {
+            "uptime_s": now - self.started,
+            "requests": self.requests,
+            "not_found": self.not_found,
+            "errors": self.errors,
+            "batches": self.batches,
+            "mean_batch_size": (
+                float(np.mean(self.batch_sizes)) if self.batches else 0.0
+            ),
+            "latency_ms": {"p50": p50, "p95": p95, "p99": p99},
+            "throughput_rps_10s": len(recent) / min(10, max(now - self.started, 1e-9)),
+        }
+
+
+class MicroBatcher:
+    def __init__(self, scorer: Scorer, config: ServiceConfig, metrics: Metrics):
+        self.scorer, self.config, self.metrics = scorer, config, metrics
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    async def submit(self, ir_id: int) -> dict | None:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((ir_id, future))
+        return await future
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.config.max_wait_ms / 1000
+            while len(batch) < self.config.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # drain whatever else is already waiting, up to the batch size
+            while len(batch) < self.config.max_batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            ir_ids = [ir_id for ir_id, _ in batch]
+            try:
+                # keep the event loop free to accept requests while scoring
+                results = await loop.run_in_executor(None, self.scorer.score, ir_ids)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.metrics.record_batch(len(batch))
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+class RiskService:
+    def __init__(self, scorer: Scorer, config: ServiceConfig = ServiceConfig()):
+        self.config = config
+        self.metrics = Metrics(config.metrics_window)
+        self.batcher = MicroBatcher(scorer, config, self.metrics)
+
+    async def score(self, ir_id: int) -> Tuple[int, dict]:
+        started = time.perf_counter()
+        result = await self.batcher.submit(ir_id)
+        self.metrics.record_request(time.perf_counter() - started)
+        if result is None:
+            self.metrics.not_found += 1
+            return 404, {"error": f"unknown ir_id {ir_id}"}
+        return 200, result
+
+    async def route(self, method: str, target: str, body: bytes) -> Tuple[int, dict]:
+        url = urlsplit(target)
+        if url.path == "/health":
+            return 200, {"status": "ok"}
+        if url.path == "/metrics":
+            return 200, self.metrics.summary()
+        if url.path != "/score":
+            return 404, {"error": f"unknown path {url.path}"}
+        try:
+            if method == "POST":
+                ir_id = int(json.loads(body)["ir_id"])
+            else:
+                ir_id = int(parse_qs(url.query)["ir_id"][0])
+        except (KeyError, ValueError, TypeError):
+            return 400, {"error": "expected an integer ir_id"}
+        return await self.score(ir_id)
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                try:
+                    status, payload = await self.route(method, target, body)
+                except Exception as e:
+                    # a failed batch (Scorer.score) fails its requests, not the connection
+                    self.metrics.errors += 1
+                    status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+                data = json.dumps(payload).encode()
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+                    + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(
+        self, host: str = "127.0.0.1", port: int = 8765, unix: Path | None = None
+    ):
+        batcher = asyncio.create_task(self.batcher.run())
+        if unix is not None:
+            server = await asyncio.start_unix_server(self.handle, path=str(unix))
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+
+def load_service(
+    features_dir: Path, model_path: Path, config: ServiceConfig = ServiceConfig()
+) -> RiskService:
+    """Loads the feature store and model once.
+
+    Args:
+        features_dir (Path): directory written by icd_features.save_icd_features
+        model_path (Path): joblib-saved classifier trained on those features
+        config (ServiceConfig, optional): Defaults to ServiceConfig().
+
+    Returns:
+        RiskService: service ready to serve
+    """
+    store = FeatureStore.load(features_dir)
+    model = joblib.load(model_path)
+    return RiskService(Scorer(model, store, config), config)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--features", type=Path, required=True)
+    parser.add_argument("--model", type=Path, required=True)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--unix", type=Path, default=None, help="Serve on a Unix socket"
+    )
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=2.0)
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+
+    service = load_service(
+        args.features,
+        args.model,
+        ServiceConfig(
+            max_batch_size=args.max_batch_size,
+            max_wait_ms=args.max_wait_ms,
+            threshold=args.threshold,
+            top_k=args.top_k,
+        ),
+    )
+    asyncio.run(service.serve(args.host, args.port, args.unix))